@@ -14,6 +14,115 @@ const RU = {
 
 // Ð˜ÑÐ¿Ð¾Ð»ÑŒÐ·ÑƒÐµÐ¼ Ð¾Ñ‚Ð½Ð¾ÑÐ¸Ñ‚ÐµÐ»ÑŒÐ½Ñ‹Ðµ Ð¿ÑƒÑ‚Ð¸; CRA Ð¿Ñ€Ð¾ÐºÑÐ¸Ñ€ÑƒÐµÑ‚ Ð½Ð° ÐºÐ¾Ð½Ñ‚ÐµÐ¹Ð½ÐµÑ€ `server:5000`
 
+// Decks above this size go through the resumable /uploads API in chunks
+const RESUMABLE_THRESHOLD = 8 * 1024 * 1024;
+const CHUNK_SIZE = 4 * 1024 * 1024;
+
+// A saturated server answers 429 with Retry-After; wait that long and try again
+const MAX_OVERLOAD_RETRIES = 3;
+const retryDelayMs = (headerValue) => Math.min(60, Math.max(1, Number(headerValue) || 5)) * 1000;
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+axios.interceptors.response.use(undefined, async (err) => {
+  const config = err?.config;
+  if (err?.response?.status !== 429 || !config) throw err;
+  config.overloadRetries = (config.overloadRetries || 0) + 1;
+  if (config.overloadRetries > MAX_OVERLOAD_RETRIES) throw err;
+  await sleep(retryDelayMs(err.response.headers?.['retry-after']));
+  return axios(config);
+});
+
+async function uploadDeckResumable(file) {
+  const init = new FormData();
+  init.append('kind', 'deck');
+  init.append('filename', file.name);
+  init.append('length', String(file.size));
+  const { data: created } = await axios.post('/uploads', init);
+  const url = `/uploads/${created.uploadId}`;
+  let offset = 0;
+  let failures = 0;
+  for (;;) {
+    try {
+      const chunk = file.slice(offset, offset + CHUNK_SIZE);
+      const { data } = await axios.patch(url, chunk, {
+        headers: {
+          'Content-Type': 'application/offset+octet-stream',
+          'Upload-Offset': String(offset),
+        },
+      });
+      if (data.complete) return data;
+      offset = data.offset;
+      failures = 0;
+    } catch (err) {
+      const status = err?.response?.status;
+      // 4xx other than an offset mismatch will not succeed on retry
+      if ((status && status !== 409 && status < 500) || failures >= 5) throw err;
+      failures += 1;
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+      // Ask the server how much it already has and continue from there
+      const { data } = await axios.get(url);
+      offset = data.offset;
+    }
+  }
+}
+
+// Reads a Server-Sent Events response from fetch and calls onEvent(event, data) per message
+async function streamEvents(url, options, onEvent) {
+  let res;
+  for (let attempt = 0; ; attempt += 1) {
+    res = await fetch(url, { ...options, headers: { Accept: 'text/event-stream', ...(options?.headers || {}) } });
+    if (res.status !== 429 || attempt >= MAX_OVERLOAD_RETRIES) break;
+    await sleep(retryDelayMs(res.headers.get('Retry-After')));
+  }
+  if (!res.ok) {
+    let detail = '';
+    try { detail = (await res.json())?.detail; } catch (_) { /* not JSON */ }
+    const err = new Error(detail || `HTTP ${res.status}`);
+    err.response = { status: res.status, data: { detail } };
+    throw err;
+  }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) >= 0) {
+      const message = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of message.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      const parsed = data ? JSON.parse(data) : null;
+      if (event === 'error') {
+        const err = new Error(parsed?.detail || 'Ошибка запроса');
+        err.response = { status: parsed?.status, data: { detail: parsed?.detail } };
+        throw err;
+      }
+      onEvent(event, parsed);
+    }
+  }
+}
+
+// Applies one review stream event to the state of a slide or summary card
+function applyReviewEvent(state, event, data) {
+  if (event === 'delta') {
+    return { ...state, loading: false, streaming: true, [data.field]: (state[data.field] || '') + data.text };
+  }
+  if (event === 'field') {
+    return { ...state, loading: false, streaming: true, [data.field]: data.value };
+  }
+  if (event === 'done') {
+    return { ...state, ...data, loading: false, streaming: false, error: null };
+  }
+  return state;
+}
+
 function App() {
   const [file, setFile] = useState(null);
   const fileInputRef = useRef(null);
@@ -73,9 +182,11 @@ function App() {
     const form = new FormData();
     form.append('file', file);
     try {
-      const { data } = await axios.post(`/upload`, form, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-      });
+      const data = file.size > RESUMABLE_THRESHOLD
+        ? await uploadDeckResumable(file)
+        : (await axios.post(`/upload`, form, {
+          headers: { 'Content-Type': 'multipart/form-data' },
+        })).data;
       setSessionId(data.sessionId);
       setSlides(data.slides);
       setCurrentIndex(0);
@@ -168,13 +279,10 @@ function App() {
       const fd = new FormData();
       fd.append('sessionId', sessionId);
       fd.append('slideIndex', String(index));
-      const { data } = await axios.post(`/review/slide`, fd);
-      const feedback = data?.feedback || '';
-      const tips = Array.isArray(data?.tips) ? data.tips : [];
-      const mains = Array.isArray(data?.mains) ? data.mains : [];
-      const negative = Array.isArray(data?.negative) ? data.negative : [];
-      const scores = (data && typeof data.scores === 'object') ? data.scores : null;
-      setSlideAI((m) => ({ ...m, [index]: { loading: false, feedback, tips, mains, negative, scores, error: null } }));
+      // Feedback text appears while the model writes it; other fields as each completes
+      await streamEvents(`/review/slide/stream`, { method: 'POST', body: fd }, (event, data) => {
+        setSlideAI((m) => ({ ...m, [index]: applyReviewEvent({ feedback: '', tips: [], mains: [], negative: [], scores: null, ...(m[index] || {}) }, event, data) }));
+      });
     } catch (e) {
       setSlideAI((m) => ({ ...m, [index]: { loading: false, feedback: '', tips: [], error: e?.response?.data?.detail || 'Ошибка запроса' } }));
     }
@@ -184,12 +292,10 @@ function App() {
     if (!sessionId) return;
     setSummaryAI({ loading: true, feedback: null, tips: null, error: null });
     try {
-      const { data } = await axios.get(`/review/summary`, { params: { sessionId } });
-      const feedback = data?.feedback || '';
-      const tips = Array.isArray(data?.tips) ? data.tips : [];
-      const mains = Array.isArray(data?.mains) ? data.mains : [];
-      const scores = (data && typeof data.scores === 'object') ? data.scores : null;
-      setSummaryAI({ loading: false, feedback, tips, mains, scores, error: null });
+      const params = new URLSearchParams({ sessionId });
+      await streamEvents(`/review/summary/stream?${params}`, { method: 'GET' }, (event, data) => {
+        setSummaryAI((s) => applyReviewEvent({ ...s, feedback: s.feedback || '', tips: s.tips || [], mains: s.mains || [] }, event, data));
+      });
     } catch (e) {
       setSummaryAI({ loading: false, feedback: null, tips: null, mains: null, scores: null, error: e?.response?.data?.detail || 'Ошибка запроса' });
     }
@@ -1,15 +1,64 @@
+import itertools
 import json
-from typing import List, Dict, Any, Optional
-
-from google import genai
+from typing import Callable, Iterator, List, Dict, Any, Optional, Tuple
 
 from utilities.consts import (
     GOOGLE_API_KEY,
+    GEMINI_BASE_URL,
     GeminiModelsEnum,
     SupportedLanguagesCodesEnum,
     MIN_COUNT,
+    GEMINI_DEADLINE_S,
+    REVIEW_REPAIR,
 )
+from AI import ReviewRepair
+from AI.ReviewRepair import REVIEW_FIELDS, SCORE_KEYS
+from AI.LLMScheduler import Priority, estimate_tokens, get_scheduler
+from utilities.json_stream import JsonObjectStream
 from utilities.prompts import PROMPTS, PromptType
+from utilities import timing
+
+
+def _min_negative() -> int:
+    # Negative formulations required by MIN_COUNT, 0..5,
+    # сколько неудачных формулировок требует MIN_COUNT, 0..5
+    try:
+        return max(0, min(5, int(MIN_COUNT)))
+    except Exception:
+        return 1
+
+
+def make_client():
+    """Create a Gemini client from the environment.
+
+    Создать клиента Gemini на основе окружения.
+
+    Returns:
+
+        genai.Client:
+            Client authenticated with ``GOOGLE_API_KEY`` and pointed at
+            ``GEMINI_BASE_URL`` when it is set.
+            Клиент, авторизованный через ``GOOGLE_API_KEY`` и направленный на
+            ``GEMINI_BASE_URL``, если он задан.
+
+    Raises:
+
+        ValueError:
+            Missing API key.
+            Отсутствует API ключ.
+    """
+
+    if not GOOGLE_API_KEY:
+        raise ValueError("GOOGLE_API_KEY is not set in environment")
+    # Imported lazily: google-genai is heavy and not needed at server start,
+    # ленивый импорт: google-genai тяжёлый и не нужен при старте сервера
+    from google import genai
+
+    if GEMINI_BASE_URL:
+        return genai.Client(
+            api_key=GOOGLE_API_KEY, http_options={"base_url": GEMINI_BASE_URL}
+        )
+    return genai.Client(api_key=GOOGLE_API_KEY)
 
 
 class AskGemini:
@@ -60,14 +109,12 @@ class AskGemini:
                 Отсутствует API ключ.
         """
 
-        # Step 1: Ensure API key is available
-        # Шаг 1: Убедиться, что API ключ доступен
-        if not GOOGLE_API_KEY:
-            raise ValueError("GOOGLE_API_KEY is not set in environment")
+        # Step 1: Create client, which ensures the API key is available
+        # Шаг 1: Создать клиента, что проверяет наличие API ключа
+        self.client = make_client()
 
-        # Step 2: Initialize client and store settings
-        # Шаг 2: Инициализировать клиента и сохранить настройки
-        self.client = genai.Client(api_key=GOOGLE_API_KEY)
+        # Step 2: Store settings
+        # Шаг 2: Сохранить настройки
         self.model = str(model)
         self.system_prompt = system_prompt.strip()
         self.user_context = (user_context or "").strip()
@@ -78,7 +125,8 @@ class AskGemini:
              role: str = 'user',
              parts: List[Dict[str, Any]] = None,
              response_schema: Optional[Dict[str, Any]] = None,
-             response_mime_type: Optional[str] = None):
+             response_mime_type: Optional[str] = None,
+             priority: Priority = Priority.INTERACTIVE):
         """Send prompt parts to Gemini model.
 
         Отправить части запроса модели Gemini.
@@ -88,8 +136,8 @@ class AskGemini:
             1. Build request payload.
                Сформировать полезную нагрузку.
 
-            2. Call model and return response.
-               Вызвать модель и вернуть ответ.
+            2. Call model through the rate-limit scheduler and return response.
+               Вызвать модель через планировщик лимитов и вернуть ответ.
 
         Args:
 
@@ -101,6 +149,10 @@ class AskGemini:
                 Content parts for the model.
                 Части контента для модели.
 
+            priority (Priority):
+                Scheduling class of the call.
+                Класс планирования вызова.
+
         Returns:
             Any:
                 Response from Gemini.
@@ -108,9 +160,13 @@ class AskGemini:
 
         Raises:
 
+            LLMUnavailable:
+                Quota or outage outlasted the deadline or retry budget.
+                Квота или сбой не уложились в дедлайн или бюджет повторов.
+
             Exception:
-                Propagated client errors.
-                Ошибки клиента пробрасываются.
+                Propagated non-retryable client errors.
+                Неповторяемые ошибки клиента пробрасываются.
         """
 
         # Step 1: Build payload for the request
@@ -124,112 +180,225 @@ class AskGemini:
             config["response_schema"] = response_schema
             config["response_mime_type"] = response_mime_type or "application/json"
 
-        return self.client.models.generate_content(
-            model=self.model,
-            contents=payload,
-            **({"config": config} if config else {})
+        prompt_chars = sum(len(p.get("text") or "") for p in parts or [])
+        timing.annotate(prompt_chars=prompt_chars)
+        timing.record_model("gemini", self.model)
+
+        def call():
+            with timing.stage("gemini"):
+                return self.client.models.generate_content(
+                    model=self.model,
+                    contents=payload,
+                    **({"config": config} if config else {})
+                )
+
+        return get_scheduler().call(
+            call,
+            priority=priority,
+            est_tokens=estimate_tokens(parts),
+            deadline_s=GEMINI_DEADLINE_S,
         )
 
-    @staticmethod
-    def _validate_review_payload(data: Dict[str, Any], tips_limit: int, slide_text: Optional[str] = None) -> Dict[str, Any]:
-        """Validate strictly the structured JSON payload.
+    def _gen_stream(self,
+                    role: str = 'user',
+                    parts: List[Dict[str, Any]] = None,
+                    response_schema: Optional[Dict[str, Any]] = None,
+                    priority: Priority = Priority.INTERACTIVE) -> Iterator[str]:
+        """Send prompt parts to Gemini and yield the answer text as it arrives.
 
-        Строго валидирует структурированный JSON-ответ.
+        Отправить части запроса Gemini и выдавать текст ответа по мере получения.
 
-        Args:
-            data: Parsed object from structured output.
-            tips_limit: Max tips to keep.
+        The scheduler admits and retries the call until the first chunk arrives
+        and holds its slot until the answer ends; once text has reached the
+        caller an error is raised as is.
+        Планировщик допускает и повторяет вызов до прихода первой части и
+        удерживает его слот до конца ответа; после того как текст ушёл
+        вызывающему, ошибка пробрасывается как есть.
 
-        Returns:
-            Dict[str, Any]: Normalized dict with required keys.
+        Yields:
 
-        Raises:
-            ValueError: If required fields are missing or of wrong type.
+            str:
+                Next fragment of the answer.
+                Следующий фрагмент ответа.
         """
 
-        if not isinstance(data, dict):
-            raise ValueError("Structured output is not an object")
-        if "feedback" not in data or "tips" not in data:
-            raise ValueError("Structured output missing required keys: feedback, tips")
-        feedback = data["feedback"]
-        tips_val = data["tips"]
-        if not isinstance(feedback, str):
-            raise ValueError("Field 'feedback' must be a string")
-        if not isinstance(tips_val, list):
-            raise ValueError("Field 'tips' must be an array")
-        norm_tips: List[Dict[str, str]] = []
-        for t in tips_val:
-            if not isinstance(t, dict):
-                raise ValueError("Each tip must be an object with title and text")
-            title = t.get("title")
-            text = t.get("text")
-            if not isinstance(title, str) or not isinstance(text, str):
-                raise ValueError("Tip fields 'title' and 'text' must be strings")
-            norm_tips.append({"title": title.strip(), "text": text.strip()})
-        # Optional: mains/negative phrases (arrays of strings, up to 5)
-        pos = data.get("mains")
-        neg = data.get("negative")
-        # Required scores block
-        scores_in = data.get("scores")
-        def _norm_phrases(x):
-            if isinstance(x, list):
-                out = []
-                for v in x:
-                    if isinstance(v, str):
-                        s = v.strip()
-                        if s:
-                            out.append(s)
-                return out[:5]
-            return []
-        pos_n = _norm_phrases(pos)
-        neg_n = _norm_phrases(neg)
-        # Ensure minimum counts: mains >= 1 always; negative >= MIN_COUNT when configured
+        payload = [{"role": role, "parts": parts}]
+        config: Dict[str, Any] = {}
+        if response_schema:
+            config["response_schema"] = response_schema
+            config["response_mime_type"] = "application/json"
+
+        timing.annotate(prompt_chars=sum(len(p.get("text") or "") for p in parts or []))
+        timing.record_model("gemini", self.model)
+
+        def open_stream():
+            # Retryable errors (429, 503) surface before the first chunk
+            with timing.stage("gemini_first_chunk"):
+                stream = iter(self.client.models.generate_content_stream(
+                    model=self.model,
+                    contents=payload,
+                    **({"config": config} if config else {})
+                ))
+                first = next(stream, None)
+            if first is not None:
+                yield first
+            yield from stream
+
+        # The slot is held until the answer is complete and its usage is charged
+        chunks = get_scheduler().stream(
+            open_stream,
+            priority=priority,
+            est_tokens=estimate_tokens(parts),
+            deadline_s=GEMINI_DEADLINE_S,
+        )
+        # Queue and first chunk are timed as their own stages
         try:
-            min_required = max(0, min(5, int(MIN_COUNT)))
-        except Exception:
-            min_required = 1
-        if not pos_n:
-            raise ValueError("Model did not return at least one main thought (mains)")
-        if min_required > 0 and len(neg_n) < min_required:
-            raise ValueError("Model returned fewer negative formulations than required")
-        # Validate scores
-        if not isinstance(scores_in, dict):
-            raise ValueError("Missing required 'scores' object")
-        def _to_score(v):
-            if isinstance(v, (int, float)):
-                iv = int(v)
-            else:
+            first = next(chunks, None)
+            with timing.stage("gemini"):
+                for chunk in itertools.chain([first] if first is not None else [],
+                                             chunks):
+                    text = getattr(chunk, "text", None)
+                    if text:
+                        yield text
+        finally:
+            # A reader that stops early releases the slot now, not at GC,
+            # читатель, остановившийся раньше, освобождает слот сразу, а не при GC
+            chunks.close()
+
+    @staticmethod
+    def _stream_fields(chunks: Iterator[str], validate: Callable[[str, Any], Any]):
+        """Turn streamed JSON text into field events; return the parsed object.
+
+        Превращает потоковый текст JSON в события полей; возвращает разобранный
+        объект.
+
+        A field that fails ``validate`` is not sent; the final repair of the
+        whole object asks for it or reports the error. Text that is not clean
+        JSON is parsed leniently and may yield ``None``.
+        Поле, не прошедшее ``validate``, не отправляется; итоговое восстановление
+        всего объекта запросит его или сообщит об ошибке. Текст, не являющийся
+        чистым JSON, разбирается нестрого и может дать ``None``.
+        """
+
+        reader = JsonObjectStream(stream_fields=("feedback",))
+        for chunk in chunks:
+            for kind, key, value in reader.feed(chunk):
+                if kind == "delta":
+                    yield "delta", {"field": key, "text": value}
+                    continue
                 try:
-                    iv = int(str(v))
-                except Exception:
-                    raise ValueError("Score must be integer 0..100")
-            if iv < 0 or iv > 100:
-                raise ValueError("Score must be in 0..100")
-            return iv
-        required_scores = ["overall", "goal", "structure", "clarity", "delivery"]
-        scores: Dict[str, int] = {}
-        for k in required_scores:
-            if k not in scores_in:
-                raise ValueError(f"Missing score: {k}")
-            scores[k] = _to_score(scores_in[k])
-        return {
-            "feedback": feedback.strip(),
-            "tips": norm_tips[:tips_limit],
-            "mains": pos_n,
-            "negative": neg_n,
-            "scores": scores,
-        }
+                    value = validate(key, value)
+                except ValueError:
+                    continue
+                yield "field", {"field": key, "value": value}
+        try:
+            return json.loads(reader.text)
+        except ValueError:
+            return ReviewRepair.parse_lenient(reader.text)
+
+    @staticmethod
+    def _validate_review_field(key: str, value: Any, tips_limit: int = 3) -> Any:
+        """Validate and normalize one field of the structured review.
+
+        Проверяет и нормализует одно поле структурированной оценки.
+
+        Used for each field of a streamed answer as soon as it is complete;
+        formatting slips are coerced, see ``ReviewRepair.coerce_field``.
+        Применяется к каждому полю потокового ответа, как только оно завершено;
+        ошибки оформления исправляются, см. ``ReviewRepair.coerce_field``.
+
+        Raises:
+            ValueError: If the field cannot be repaired without the model.
+        """
+
+        return ReviewRepair.coerce_field(key, value, tips_limit, _min_negative())
+
+    def _finish_review(
+            self,
+            data: Any,
+            slide_index: int,
+            polished_text: str,
+            delivery: Optional[Dict[str, Any]],
+            priority: Priority) -> Dict[str, Any]:
+        """Repair the model's review, asking it only for fields that cannot be derived.
+
+        Восстанавливает оценку модели, запрашивая у неё только невыводимые поля.
+
+        Pipeline:
+
+            1. Coerce and clamp every field; fill tips and derivable scores.
+               Привести и ограничить все поля; заполнить советы и выводимые баллы.
+
+            2. If something is still missing, send one small follow-up request
+               with the partial review and a schema of just those fields.
+               Если чего-то не хватает, отправить один небольшой дополнительный
+               запрос с частичной оценкой и схемой только этих полей.
+
+            3. Merge the answer and validate the result.
+               Объединить ответ и проверить результат.
+
+        Raises:
+
+            ValueError:
+                Fields are still missing after the follow-up (or repair is off).
+                Поля отсутствуют и после дополнительного запроса (или
+                восстановление выключено).
+        """
+
+        # Step 1: Local repair
+        # Шаг 1: Локальное восстановление
+        min_count = _min_negative()
+        measured = {"delivery": (delivery or {}).get("score")}
+        review, missing = ReviewRepair.repair_review(data, 3, min_count, measured)
+        if isinstance(data, dict) and any(data.get(k) != review.get(k)
+                                          for k in REVIEW_FIELDS):
+            ReviewRepair.count("coerced")
+
+        # Step 2: Targeted follow-up
+        # Шаг 2: Точечный дополнительный запрос
+        if missing and REVIEW_REPAIR:
+            ReviewRepair.count("followups")
+            timing.annotate(review_repair_fields=len(missing))
+            parts = [
+                {"text": f"[SYSTEM]\n{self.system_prompt}"},
+                {"text": f"[SLIDE {slide_index}]\n{polished_text}"},
+                {"text": ReviewRepair.followup_prompt(review, missing, min_count)},
+            ]
+            res = self._gen(
+                parts=parts,
+                response_schema=ReviewRepair.followup_schema(missing, min_count),
+                response_mime_type="application/json",
+                priority=priority,
+            )
+            answer = getattr(res, "parsed", None)
+            if answer is None:
+                answer = ReviewRepair.parse_lenient(getattr(res, "text", None))
+
+            # Step 3: Merge and check again
+            # Шаг 3: Объединить и проверить снова
+            merged = ReviewRepair.merge_followup(review, answer)
+            review, missing = ReviewRepair.repair_review(merged, 3, min_count, measured)
+        if missing:
+            ReviewRepair.count("failed")
+            raise ValueError("Structured output missing or invalid fields: "
+                             f"{', '.join(missing)}")
+        return self._apply_delivery(review, delivery)
 
     def review_slide(
-            self, slide_index: int, polished_text: str) -> Dict[str, Any]:
+            self,
+            slide_index: int,
+            polished_text: str,
+            slide_context: Optional[Dict[str, Any]] = None,
+            priority: Priority = Priority.INTERACTIVE,
+            delivery: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Generate feedback for a single slide.
 
         Сгенерировать отзыв для отдельного слайда.
 
         Pipeline:
 
-            1. Attach optional files.
-               Прикрепить необязательные файлы.
+            1. Attach optional files and this slide's own content.
+               Прикрепить необязательные файлы и содержимое только этого слайда.
 
             2. Compose prompt with system data and slide text.
                Сформировать запрос из системных данных и текста слайда.
@@ -237,8 +406,8 @@ class AskGemini:
             3. Call Gemini model.
                Вызвать модель Gemini.
 
-            4. Parse and normalize response.
-               Разобрать и нормализовать ответ.
+            4. Parse and repair the response, asking only for missing fields.
+               Разобрать и восстановить ответ, запрашивая только недостающие поля.
 
         Args:
 
@@ -250,6 +419,22 @@ class AskGemini:
                 Prepared transcription of the slide.
                 Подготовленный текст слайда.
 
+            slide_context (Optional[Dict[str, Any]]):
+                Text extracted from the slide and an optional JPEG thumbnail,
+                ``{"text": str, "image": bytes | None}``.
+                Текст, извлечённый со слайда, и необязательная миниатюра JPEG,
+                ``{"text": str, "image": bytes | None}``.
+
+            priority (Priority):
+                Scheduling class; speculative reviews yield to interactive ones.
+                Класс планирования; упреждающие оценки уступают интерактивным.
+
+            delivery (Optional[Dict[str, Any]]):
+                Measured delivery metrics of the recording; they go into the
+                prompt as facts and their ``score`` replaces ``scores.delivery``.
+                Измеренные метрики подачи записи; попадают в запрос как факты, а
+                их ``score`` заменяет ``scores.delivery``.
+
         Returns:
 
             Dict[str, Any]:
@@ -263,6 +448,128 @@ class AskGemini:
                 Пробрасываемые ошибки клиента Gemini.
         """
 
+        # Step 1: Attach files and compose the prompt
+        # Шаг 1: Прикрепить файлы и сформировать запрос
+        parts, schema = self._review_request(slide_index, polished_text,
+                                             slide_context, delivery)
+
+        # Step 2: Call the model and validate its answer
+        # Шаг 2: Вызвать модель и проверить ответ
+        res_struct = self._gen(parts=parts, response_schema=schema,
+                               response_mime_type="application/json",
+                               priority=priority)
+        parsed = getattr(res_struct, 'parsed', None)
+        if parsed is None:
+            parsed = ReviewRepair.parse_lenient(getattr(res_struct, 'text', None))
+        return self._finish_review(parsed, slide_index, polished_text, delivery,
+                                   priority)
+
+    def review_slide_stream(
+            self,
+            slide_index: int,
+            polished_text: str,
+            slide_context: Optional[Dict[str, Any]] = None,
+            priority: Priority = Priority.INTERACTIVE,
+            delivery: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Any]]:
+        """Stream feedback for a single slide while the model writes it.
+
+        Выдаёт отзыв по отдельному слайду по мере того, как модель его пишет.
+
+        Pipeline:
+
+            1. Build the same request as ``review_slide`` and open a stream.
+               Собрать тот же запрос, что и ``review_slide``, и открыть поток.
+
+            2. Report ``feedback`` text as it grows and every other field once
+               it is complete and valid.
+               Сообщать растущий текст ``feedback`` и каждое другое поле, как
+               только оно завершено и корректно.
+
+            3. Repair the whole answer exactly like ``review_slide``.
+               Восстановить весь ответ так же, как ``review_slide``.
+
+        Args:
+
+            slide_index (int):
+                Position of the slide.
+                Номер слайда.
+
+            polished_text (str):
+                Prepared transcription of the slide.
+                Подготовленный текст слайда.
+
+            slide_context (Optional[Dict[str, Any]]):
+                Text and optional thumbnail of the slide.
+                Текст и необязательная миниатюра слайда.
+
+            priority (Priority):
+                Scheduling class.
+                Класс планирования.
+
+            delivery (Optional[Dict[str, Any]]):
+                Measured delivery metrics, as in ``review_slide``.
+                Измеренные метрики подачи, как в ``review_slide``.
+
+        Yields:
+
+            Tuple[str, Any]:
+                ``("delta", {"field", "text"})``, ``("field", {"field", "value"})``
+                and finally ``("done", review)``.
+                ``("delta", {"field", "text"})``, ``("field", {"field", "value"})``
+                и в конце ``("done", оценка)``.
+
+        Raises:
+
+            ValueError:
+                The complete answer cannot be repaired.
+                Полный ответ не удалось восстановить.
+        """
+
+        # Step 1: Same request, streamed
+        # Шаг 1: Тот же запрос, потоком
+        parts, schema = self._review_request(slide_index, polished_text,
+                                             slide_context, delivery)
+        chunks = self._gen_stream(parts=parts, response_schema=schema,
+                                  priority=priority)
+
+        # Step 2: Fields as they complete
+        # Шаг 2: Поля по мере готовности
+        def validate(key: str, value: Any) -> Any:
+            value = self._validate_review_field(key, value, tips_limit=3)
+            return self._apply_delivery({key: value}, delivery)[key]
+
+        data = yield from self._stream_fields(chunks, validate)
+
+        # Step 3: Whole answer
+        # Шаг 3: Весь ответ
+        yield "done", self._finish_review(data, slide_index, polished_text, delivery,
+                                          priority)
+
+    @staticmethod
+    def _apply_delivery(review: Dict[str, Any],
+                        delivery: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Replace the model's ``scores.delivery`` with the measured score.
+
+        Заменяет ``scores.delivery`` модели измеренным баллом.
+        """
+
+        score = (delivery or {}).get("score")
+        if score is not None and isinstance(review.get("scores"), dict):
+            review["scores"]["delivery"] = int(score)
+        return review
+
+    def _review_request(
+            self,
+            slide_index: int,
+            polished_text: str,
+            slide_context: Optional[Dict[str, Any]],
+            delivery: Optional[Dict[str, Any]] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Build prompt parts and the structured-output schema of a slide review.
+
+        Собирает части запроса и схему структурированного ответа для оценки слайда.
+        """
+
         # Step 1: Attach files if provided
         # Шаг 1: Прикрепить файлы при наличии
         parts = []
@@ -271,18 +578,30 @@ class AskGemini:
             mt = f.get("mime_type")
             if uri and mt:
                 parts.append({"file_data": {"file_uri": uri, "mime_type": mt}})
+        if slide_context and slide_context.get("image"):
+            parts.append({"inline_data": {"mime_type": "image/jpeg",
+                                          "data": slide_context["image"]}})
 
         # Step 2: Add prompt sections
         # Шаг 2: Добавить части запроса
         parts += [
             {"text": f"[SYSTEM]\n{self.system_prompt}"},
             {"text": f"[CONTEXT]\n{self.user_context}"},
+        ]
+        if slide_context and slide_context.get("text"):
+            parts.append({"text": f"[SLIDE_CONTENT {slide_index}]\n"
+                                  f"{slide_context['text']}"})
+        if delivery:
+            facts = {k: v for k, v in delivery.items() if k != "score"}
+            parts.append({"text": f"[DELIVERY_METRICS {slide_index}]\n"
+                                  f"{json.dumps(facts, ensure_ascii=False)}"})
+        parts += [
             {"text": f"[SLIDE {slide_index}]\n{polished_text}"},
             {"text": f"[REQUIREMENTS]\n{PROMPTS[PromptType.REVIEW_SLIDE]}"},
         ]
 
         # Structured output: enforce schema and return strictly
-        min_count = max(0, min(5, int(MIN_COUNT)))
+        min_count = _min_negative()
         schema = {
             "type": "object",
             "properties": {
@@ -325,14 +644,13 @@ class AskGemini:
                 "Не добавляй ничего вне JSON."
             )
         })
-        res_struct = self._gen(parts=parts, response_schema=schema, response_mime_type="application/json")
-        parsed = getattr(res_struct, 'parsed', None)
-        return self._validate_review_payload(parsed, tips_limit=3, slide_text=polished_text)
+        return parts, schema
 
     def summarize(
             self,
             per_slide_findings: List[Dict[str, Any]],
-            transcripts: Optional[List[str]] = None) -> Dict[str, Any]:
+            transcripts: Optional[List[str]] = None,
+            deck_outline: Optional[List[str]] = None) -> Dict[str, Any]:
         """Create overall summary for the presentation.
 
         Сформировать общий обзор презентации.
@@ -364,6 +682,10 @@ class AskGemini:
                 Optional slide transcripts.
                 Необязательные транскрипты слайдов.
 
+            deck_outline (Optional[List[str]]):
+                Beginning of each slide's extracted text.
+                Начало извлечённого текста каждого слайда.
+
         Returns:
 
             Dict[str, Any]:
@@ -377,6 +699,55 @@ class AskGemini:
                 Пробрасываемые ошибки клиента Gemini.
         """
 
+        # Steps 1-3: Snippets, transcripts, files and prompt
+        # Шаги 1-3: Фрагменты, транскрипты, файлы и запрос
+        parts, summary_schema = self._summary_request(per_slide_findings, transcripts,
+                                                      deck_outline)
+
+        # Step 4: Call the model
+        # Шаг 4: Вызвать модель
+        res_struct = self._gen(parts=parts, response_schema=summary_schema,
+                               response_mime_type="application/json",
+                               priority=Priority.SUMMARY)
+
+        # Step 5: Normalize
+        # Шаг 5: Нормализовать
+        parsed = getattr(res_struct, 'parsed', None)
+        return self._normalize_summary(parsed)
+
+    def summarize_stream(
+            self,
+            per_slide_findings: List[Dict[str, Any]],
+            transcripts: Optional[List[str]] = None,
+            deck_outline: Optional[List[str]] = None) -> Iterator[Tuple[str, Any]]:
+        """Stream the overall summary while the model writes it.
+
+        Выдаёт общий обзор презентации по мере того, как модель его пишет.
+
+        Takes the arguments of ``summarize`` and yields the events of
+        ``review_slide_stream``.
+        Принимает аргументы ``summarize`` и выдаёт события
+        ``review_slide_stream``.
+        """
+
+        parts, summary_schema = self._summary_request(per_slide_findings, transcripts,
+                                                      deck_outline)
+        chunks = self._gen_stream(parts=parts, response_schema=summary_schema,
+                                  priority=Priority.SUMMARY)
+        data = yield from self._stream_fields(chunks, self._normalize_summary_field)
+        yield "done", self._normalize_summary(data)
+
+    def _summary_request(
+            self,
+            per_slide_findings: List[Dict[str, Any]],
+            transcripts: Optional[List[str]],
+            deck_outline: Optional[List[str]]
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Build prompt parts and the structured-output schema of the summary.
+
+        Собирает части запроса и схему структурированного ответа для итоговой оценки.
+        """
+
         # Step 1: Build snippets from slide findings
         # Шаг 1: Сформировать фрагменты из данных по слайдам
         slide_snippets = []
@@ -422,6 +793,10 @@ class AskGemini:
             {"text": f"[CONTEXT]\n{self.user_context}"},
             {"text": f"[PER_SLIDE]\n" + "\n".join(slide_snippets)},
             {"text": transcript_note},
+        ]
+        if deck_outline:
+            parts.append({"text": "[DECK_OUTLINE]\n" + "\n".join(deck_outline)})
+        parts += [
             {"text": f"[REQUIREMENTS]\n{PROMPTS[PromptType.SUMMARIZE]}"},
         ]
 
@@ -464,28 +839,58 @@ class AskGemini:
                 "Не добавляй ничего вне JSON."
             )
         })
-        res_struct = self._gen(parts=parts, response_schema=summary_schema, response_mime_type="application/json")
-        parsed = getattr(res_struct, 'parsed', None)
+        return parts, summary_schema
+
+    @staticmethod
+    def _normalize_summary(parsed: Any) -> Dict[str, Any]:
+        """Normalize the structured summary.
+
+        Нормализует структурированную итоговую оценку.
+
+        Raises:
+            ValueError: If the output is not an object or has no main thoughts.
+        """
+
         if not isinstance(parsed, dict):
             raise ValueError("Invalid structured summary output")
-        feedback = str(parsed.get("feedback", "")).strip()
-        mains_list = []
-        for s in (parsed.get("mains") or []):
-            if isinstance(s, str) and s.strip():
-                mains_list.append(s.strip())
-        if not mains_list:
-            raise ValueError("Summary mains missing")
-        tips_norm: List[Dict[str, str]] = []
-        for t in (parsed.get("tips") or []):
-            if isinstance(t, dict):
-                title = str(t.get("title", "")).strip()
-                text = str(t.get("text", "")).strip()
-                if title or text:
-                    tips_norm.append({"title": title, "text": text})
-        tips_norm = tips_norm[:5]
-        sc_in = parsed.get("scores") or {}
-        scores = {k: int(sc_in.get(k)) for k in ["overall", "goal", "structure", "clarity", "delivery"]}
-        return {"feedback": feedback, "mains": mains_list[:5], "scores": scores, "tips": tips_norm}
+        return {
+            key: AskGemini._normalize_summary_field(key, parsed.get(key))
+            for key in ("feedback", "mains", "scores", "tips")
+        }
+
+    @staticmethod
+    def _normalize_summary_field(key: str, value: Any) -> Any:
+        """Normalize one field of the structured summary.
+
+        Нормализует одно поле структурированной итоговой оценки.
+        """
+
+        if key == "feedback":
+            return str(value or "").strip()
+        if key == "mains":
+            mains_list = []
+            for s in (value or []):
+                if isinstance(s, str) and s.strip():
+                    mains_list.append(s.strip())
+            if not mains_list:
+                raise ValueError("Summary mains missing")
+            return mains_list[:5]
+        if key == "tips":
+            tips_norm: List[Dict[str, str]] = []
+            for t in (value or []):
+                if isinstance(t, dict):
+                    title = str(t.get("title", "")).strip()
+                    text = str(t.get("text", "")).strip()
+                    if title or text:
+                        tips_norm.append({"title": title, "text": text})
+            return tips_norm[:5]
+        if key == "scores":
+            sc_in = value or {}
+            try:
+                return {k: int(sc_in.get(k)) for k in SCORE_KEYS}
+            except (TypeError, ValueError):
+                raise ValueError("Summary scores must be integers")
+        return value
 
     def restore_transcribed_text(
             self,
@@ -541,9 +946,7 @@ class AskGemini:
         # Step 1: Ensure client exists
         # Шаг 1: Убедиться, что клиент существует
         if self.client is None:
-            if not GOOGLE_API_KEY:
-                raise ValueError("GOOGLE_API_KEY is not set in environment")
-            self.client = genai.Client(api_key=GOOGLE_API_KEY)
+            self.client = make_client()
 
         # Step 2: Validate input text
         # Шаг 2: Проверить входной текст
@@ -559,7 +962,7 @@ class AskGemini:
 
         # Step 4: Request refinement from Gemini
         # Шаг 4: Запросить улучшение у Gemini
-        response = self._gen(parts=parts)
+        response = self._gen(parts=parts, priority=Priority.BACKGROUND)
 
         # Step 5: Return refined text
         # Шаг 5: Вернуть улучшенный текст
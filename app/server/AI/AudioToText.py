@@ -3,15 +3,258 @@
 Транскрибирует аудио с помощью Whisper и улучшает текст через Gemini.
 """
 
-import whisper
+import ctypes
+import gc
+import threading
+import time
 import warnings
+from typing import Any, Dict, List, Optional
+
 from utilities.consts import (
     WhisperModelsENUM,
     SupportedLanguagesCodesEnum,
     SupportedExtensionsEnum,
     GeminiModelsEnum,
+    WHISPER_WEIGHTS_DIR,
+    DELIVERY_METRICS,
+    WHISPER_CHUNKING,
+    WHISPER_CHUNK_MIN_S,
+    WHISPER_CHUNK_S,
+    WHISPER_CHUNK_OVERLAP_S,
 )
 from AI.AskGemini import AskGemini
+from AI.ChunkedTranscription import (SAMPLE_RATE, chunk_memory_mb, get_pool,
+                                     plan_chunks, shutdown_pool)
+from AI.DeliveryMetrics import compute_delivery_metrics
+from AI.WhisperBatcher import get_batcher
+from AI import WhisperWeights
+from utilities import timing
+from utilities.cpu_budget import get_budget
+from utilities.memory import get_governor
+
+# Process-wide cache of loaded Whisper models keyed by model name,
+# кеш загруженных моделей Whisper на процесс по имени модели
+_WHISPER_MODELS: Dict[str, Any] = {}
+_WHISPER_LOCK = threading.Lock()
+# One decode at a time per model: Whisper hangs its kv-cache and alignment
+# hooks on the shared decoder modules,
+# одно декодирование на модель за раз: Whisper вешает хуки kv-кеша и
+# выравнивания на общие модули декодера
+_DECODE_LOCKS: Dict[str, threading.Lock] = {}
+# Models loaded before fork live in shared pages, unloading them frees nothing,
+# модели, загруженные до fork, лежат в общих страницах, выгрузка ничего не даёт
+_PRELOADED: set = set()
+
+# Resident megabytes of fp32 weights and of one CPU transcription on top of them,
+# резидентные мегабайты весов fp32 и одной транскрибации на CPU сверх них
+WHISPER_WEIGHTS_MB = {
+    "tiny": 150, "base": 290, "small": 970, "medium": 3100, "large": 6200,
+}
+WHISPER_ACTIVATIONS_MB = {
+    "tiny": 200, "base": 250, "small": 400, "medium": 700, "large": 1100,
+}
+
+
+def load_whisper_model(model: WhisperModelsENUM) -> Any:
+    """Return a cached Whisper model, importing ``whisper`` on first use.
+
+    Возвращает закешированную модель Whisper, импортируя ``whisper`` при первом
+    использовании.
+
+    Pipeline:
+
+        1. Return the cached model if present.
+           Возвращаем модель из кеша, если она есть.
+
+        2. Import ``whisper`` (and torch) lazily and load weights once,
+           memory-mapping them from ``WHISPER_WEIGHTS_DIR`` when exported.
+           Лениво импортируем ``whisper`` (и torch) и загружаем веса один раз,
+           отображая их из ``WHISPER_WEIGHTS_DIR``, если они экспортированы.
+
+    Args:
+
+        model (WhisperModelsENUM):
+            Model size to load.
+            Размер загружаемой модели.
+
+    Returns:
+
+        Any:
+            Loaded ``whisper.model.Whisper`` instance.
+            Загруженный экземпляр ``whisper.model.Whisper``.
+    """
+
+    # Step 1: Fast path without locking
+    # Шаг 1: Быстрый путь без блокировки
+    name = str(WhisperModelsENUM(model))
+    cached = _WHISPER_MODELS.get(name)
+    if cached is not None:
+        return cached
+
+    # Step 2: Import and load under the lock
+    # Шаг 2: Импортируем и загружаем под блокировкой
+    with _WHISPER_LOCK:
+        if name not in _WHISPER_MODELS:
+            with timing.stage("whisper_load"):
+                net = None
+                if WHISPER_WEIGHTS_DIR:
+                    net = WhisperWeights.load_mmap(name, WHISPER_WEIGHTS_DIR)
+                if net is None:
+                    import whisper
+
+                    net = whisper.load_model(name)
+                _WHISPER_MODELS[name] = net
+        return _WHISPER_MODELS[name]
+
+
+def whisper_decode_lock(model: WhisperModelsENUM) -> threading.Lock:
+    """Lock to hold around every ``transcribe``/``decode`` on a cached model.
+
+    Блокировка, которую нужно держать вокруг каждого ``transcribe``/``decode``
+    на закешированной модели.
+
+    Args:
+
+        model (WhisperModelsENUM):
+            Model size the lock guards.
+            Размер модели, которую охраняет блокировка.
+
+    Returns:
+
+        threading.Lock:
+            The same lock for every caller of this model in the process.
+            Одна и та же блокировка для всех вызывающих этой модели в процессе.
+    """
+
+    name = str(WhisperModelsENUM(model))
+    with _WHISPER_LOCK:
+        return _DECODE_LOCKS.setdefault(name, threading.Lock())
+
+
+def decode_memory_mb(duration_s: Optional[float]) -> Optional[float]:
+    """Megabytes ``whisper.load_audio`` holds for a clip, ``None`` if length is unknown.
+
+    Сколько мегабайт держит ``whisper.load_audio`` для клипа, ``None``, если его
+    длина неизвестна.
+    """
+
+    if not duration_s:
+        return None
+    # ffmpeg's int16 output plus the float32 copy, вывод ffmpeg int16 и копия float32
+    return float(duration_s) * SAMPLE_RATE * 6 / 2**20
+
+
+def whisper_memory_mb(model: WhisperModelsENUM) -> float:
+    """Megabytes one transcription with ``model`` adds to this process.
+
+    Сколько мегабайт добавит процессу одна транскрибация моделью ``model``.
+
+    Returns:
+
+        float:
+            Activations, plus weights when the model is not loaded yet.
+            Активации, плюс веса, если модель ещё не загружена.
+    """
+
+    name = str(WhisperModelsENUM(model))
+    mb = float(WHISPER_ACTIVATIONS_MB.get(name, 500))
+    if name not in _WHISPER_MODELS:
+        mb += WHISPER_WEIGHTS_MB.get(name, 1000)
+    return mb
+
+
+def unload_whisper_models() -> List[str]:
+    """Drop cached Whisper models (except pre-fork ones) and return their memory.
+
+    Выгружает закешированные модели Whisper (кроме загруженных до fork) и
+    возвращает их память.
+
+    Returns:
+
+        List[str]:
+            Names of the unloaded models.
+            Имена выгруженных моделей.
+    """
+
+    with _WHISPER_LOCK:
+        names = [n for n in _WHISPER_MODELS if n not in _PRELOADED]
+        for name in names:
+            del _WHISPER_MODELS[name]
+    # Pool processes of long clips hold their own models,
+    # процессы пула длинных клипов держат свои модели
+    if shutdown_pool():
+        names.append("chunk-pool")
+    if names:
+        gc.collect()
+        try:
+            # glibc keeps freed arenas mapped, hand them back to the OS,
+            # glibc держит освобождённые арены, возвращаем их ОС
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+    return names
+
+
+def preload_for_fork(model: WhisperModelsENUM) -> Any:
+    """Load a Whisper model in a pre-fork master so workers share it copy-on-write.
+
+    Загружает модель Whisper в мастер-процессе до fork, чтобы воркеры делили её
+    по принципу copy-on-write.
+
+    Pipeline:
+
+        1. Load with a single torch thread so no OpenMP pool exists before fork.
+           Загружаем в одном потоке torch, чтобы до fork не было пула OpenMP.
+
+        2. Collect and freeze the GC so workers do not dirty inherited pages.
+           Собираем и замораживаем GC, чтобы воркеры не пачкали унаследованные
+           страницы.
+
+    Args:
+
+        model (WhisperModelsENUM):
+            Model size to load.
+            Размер загружаемой модели.
+
+    Returns:
+
+        Any:
+            Loaded ``whisper.model.Whisper`` instance.
+            Загруженный экземпляр ``whisper.model.Whisper``.
+    """
+
+    # Step 1: Single-threaded load
+    # Шаг 1: Однопоточная загрузка
+    import torch
+
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        net = load_whisper_model(model)
+    finally:
+        torch.set_num_threads(threads)
+    _PRELOADED.add(str(WhisperModelsENUM(model)))
+
+    # Step 2: Keep refcount/GC writes off the shared pages
+    # Шаг 2: Уводим записи refcount/GC с общих страниц
+    gc.collect()
+    gc.freeze()
+    return net
+
+
+def loaded_whisper_models() -> List[str]:
+    """List Whisper models currently held in memory.
+
+    Перечисляет модели Whisper, находящиеся в памяти.
+
+    Returns:
+
+        List[str]:
+            Names of cached models.
+            Имена закешированных моделей.
+    """
+
+    return sorted(_WHISPER_MODELS)
 
 
 class AudioToText:
@@ -22,6 +265,7 @@ class AudioToText:
         language=SupportedLanguagesCodesEnum.RU,
         whisper_model=WhisperModelsENUM.LARGE,
         gemini_model=GeminiModelsEnum.gemini_2_5_flash,
+        duration_s=None,
     ):
         """Configure audio transcription parameters.
 
@@ -60,6 +304,12 @@ class AudioToText:
                 Gemini model for text restoration.
                 Модель Gemini для восстановления текста.
 
+            duration_s (float | None):
+                Clip length from the container probe, if known; short clips
+                then skip decoding for chunk planning.
+                Длина клипа из заголовка контейнера, если известна; короткие
+                клипы тогда не декодируются для планирования кусков.
+
         Returns:
 
             None
@@ -79,6 +329,7 @@ class AudioToText:
         self.audio_file_path = audio_file_path
         self.audio_content = audio_file_content
         self.gemini_model = gemini_model
+        self.duration_s = duration_s
 
         # Step 2: Validate initial parameters
         # Шаг 2: Проверяем начальные параметры
@@ -92,6 +343,19 @@ class AudioToText:
         # Step 4: Prepare placeholders for runtime objects
         # Шаг 4: Подготавливаем заглушки для объектов выполнения
         self.transcribed_text = self.client = self.whisper = None
+        # Whisper segments and decoded samples kept for delivery metrics,
+        # сегменты Whisper и декодированные отсчёты для метрик подачи
+        self.segments: List[Dict[str, Any]] = []
+        self.samples = None
+        # Threads and batch size of the last Whisper pass,
+        # потоки и размер пакета последнего прохода Whisper
+        self.threads = None
+        self.batch_size = 1
+        # Parallel chunks of a long clip, параллельные куски длинного клипа
+        self.chunks = 1
+        # Seconds spent loading the model in this call, not decoding,
+        # секунды загрузки модели в этом вызове, а не декодирования
+        self.load_s = 0.0
 
     def transcribe_file(self):
         """Transcribe the provided audio file with Whisper.
@@ -100,17 +364,25 @@ class AudioToText:
 
         Pipeline:
 
-            1. Load the Whisper model if not already loaded.
-               Загружаем модель Whisper при необходимости.
+            1. Reserve memory for the pass, then take the Whisper model from
+               the process cache.
+               Резервируем память под проход, затем берём модель Whisper из
+               кеша процесса.
 
-            2. Determine the audio source (path or in-memory).
-               Определяем источник аудио (путь или память).
+            2. Determine the audio source (path or in-memory); decode it
+               once when delivery metrics or batching are on.
+               Определяем источник аудио (путь или память); декодируем его
+               один раз, если включены метрики подачи или пакетирование.
 
-            3. Filter CPU warnings and run transcription.
-               Фильтруем предупреждения CPU и запускаем транскрибацию.
+            3. Clips of one window join a cross-request batch; long ones are
+               cut at pauses and transcribed in parallel by the chunk pool;
+               the rest run alone under a CPU budget lease.
+               Клипы длиной в одно окно входят в общий пакет запросов;
+               длинные режутся по паузам и транскрибируются параллельно пулом
+               кусков; остальные выполняются отдельно под арендой бюджета CPU.
 
-            4. Extract and store the resulting text.
-               Извлекаем и сохраняем полученный текст.
+            4. Extract and store the resulting text and segments.
+               Извлекаем и сохраняем полученный текст и сегменты.
 
         Returns:
 
@@ -125,10 +397,107 @@ class AudioToText:
                 Если отсутствует источник аудио.
         """
 
-        # Step 1: Load Whisper model if needed
-        # Шаг 1: Загружаем модель Whisper при необходимости
+        plan = None
+        if WHISPER_CHUNKING and self.audio_file_path and self._may_chunk():
+            # The whole clip is decoded to find pauses, within the memory budget,
+            # весь клип декодируется для поиска пауз, в бюджете памяти
+            with get_governor().reserve("whisper", decode_memory_mb(self.duration_s)):
+                plan = self._plan_chunks()
+        # Long clips: one reservation for every pool process in flight; the pool
+        # stops with the last one, длинные клипы: один резерв на все работающие
+        # процессы пула; пул останавливается вместе с последним
+        if plan is not None:
+            chunks, workers = plan
+            name = str(WhisperModelsENUM(self.whisper_model))
+            mb = chunk_memory_mb(WHISPER_WEIGHTS_MB.get(name, 1000),
+                                 WHISPER_ACTIVATIONS_MB.get(name, 500))
+            with get_pool().reserve(mb * workers):
+                if self._transcribe_chunked(chunks, workers):
+                    return self.transcribed_text
+
+        # Step 1: Load Whisper model if needed, within the memory budget
+        # Шаг 1: Загружаем модель Whisper при необходимости, в бюджете памяти
+        with get_governor().reserve("whisper", whisper_memory_mb(self.whisper_model)):
+            return self._transcribe()
+
+    def _chunk_workers(self) -> int:
+        # About one chunk per core the clip may use now,
+        # примерно по куску на ядро, доступное клипу сейчас
+        return min(get_pool().max_workers, get_budget().allowance("whisper"))
+
+    def _may_chunk(self) -> bool:
+        """Whether a clip may be long enough to chunk, without decoding it.
+
+        Может ли клип оказаться достаточно длинным для нарезки, без декодирования.
+        """
+
+        if self.duration_s and float(self.duration_s) < WHISPER_CHUNK_MIN_S:
+            return False
+        return self._chunk_workers() >= 2
+
+    def _plan_chunks(self) -> Any:
+        """Chunks and parallelism for a long clip, ``None`` to transcribe it whole.
+
+        Куски и параллелизм для длинного клипа, ``None`` — транскрибировать целиком.
+        """
+
+        import whisper
+
+        with timing.stage("decode"):
+            self.samples = whisper.load_audio(self.audio_file_path)
+        duration = len(self.samples) / SAMPLE_RATE
+        if duration < WHISPER_CHUNK_MIN_S:
+            return None
+        workers = self._chunk_workers()
+        if workers < 2:
+            return None
+        chunks = plan_chunks(self.samples, max(WHISPER_CHUNK_S, duration / workers),
+                             WHISPER_CHUNK_OVERLAP_S)
+        if len(chunks) < 2:
+            return None
+        return chunks, min(workers, len(chunks))
+
+    def _transcribe_chunked(self, chunks: List[Any], workers: int) -> bool:
+        """Transcribe planned chunks in the pool; ``False`` to fall back to one pass.
+
+        Транскрибирует запланированные куски в пуле; ``False`` — откат к одному
+        проходу.
+        """
+
+        timing.record_model("whisper", str(self.whisper_model))
+        warnings.filterwarnings(
+            "ignore", message=r".*FP16 is not supported on CPU.*"
+        )
+        with get_budget().lease("whisper") as threads:
+            workers = min(workers, threads)
+            if workers < 2:
+                return False
+            try:
+                with timing.stage("whisper"):
+                    result = get_pool().transcribe(
+                        str(self.whisper_model), self.samples, chunks,
+                        str(self.language), DELIVERY_METRICS, workers,
+                        max(1, threads // workers),
+                    )
+            except Exception:
+                # Transcribed in this process instead, транскрибируется в этом процессе
+                return False
+            self.threads, self.batch_size, self.chunks = threads, 1, len(chunks)
+        timing.annotate(whisper_chunks=len(chunks))
+        self._store_result(result)
+        return True
+
+    def _transcribe(self) -> str:
+        """Steps 1-5 of ``transcribe_file`` inside the memory reservation.
+
+        Шаги 1-5 ``transcribe_file`` внутри резерва памяти.
+        """
+
         if self.whisper is None:
-            self.whisper = whisper.load_model(str(self.whisper_model))
+            t0 = time.perf_counter()
+            self.whisper = load_whisper_model(self.whisper_model)
+            self.load_s = time.perf_counter() - t0
+        timing.record_model("whisper", str(self.whisper_model))
 
         # Step 2: Determine audio source
         # Шаг 2: Определяем источник аудио
@@ -139,6 +508,18 @@ class AudioToText:
         )
         if source is None:
             raise ValueError("No audio provided for transcription")
+        batcher = get_batcher()
+        if self.samples is not None:
+            # Already decoded while planning chunks, уже декодировано при планировании
+            source = self.samples
+        elif (DELIVERY_METRICS or batcher.enabled) and self.audio_file_path:
+            # Decode once: Whisper, the batcher and loudness share the samples
+            # Декодируем один раз: Whisper, пакетировщик и громкость делят отсчёты
+            import whisper
+
+            with timing.stage("decode"):
+                self.samples = whisper.load_audio(self.audio_file_path)
+            source = self.samples
 
         # Step 3: Suppress FP16 warning on CPU
         # Шаг 3: Подавляем предупреждение FP16 на CPU
@@ -146,17 +527,65 @@ class AudioToText:
             "ignore", message=r".*FP16 is not supported on CPU.*"
         )
 
-        # Step 4: Run transcription
-        # Шаг 4: Запускаем транскрибацию
-        result = self.whisper.transcribe(
-            source, language=str(self.language), fp16=False
-        )
+        # Step 4: Run transcription, batched when the clip fits one window
+        # Шаг 4: Запускаем транскрибацию, пакетно, если клип помещается в окно
+        result = None
+        if batcher.accepts(source):
+            try:
+                result, info = batcher.transcribe(
+                    self.whisper, source, str(self.language), DELIVERY_METRICS,
+                    whisper_decode_lock(self.whisper_model),
+                )
+                self.threads, self.batch_size = info["threads"], info["batch"]
+            except Exception:
+                # Transcribed alone below, транскрибируется отдельно ниже
+                result = None
+        if result is None:
+            # The lock is taken before the lease so a waiting clip holds no cores,
+            # блокировка берётся до аренды, чтобы ожидающий клип не держал ядра
+            with whisper_decode_lock(self.whisper_model), \
+                    get_budget().torch_lease("whisper") as threads:
+                self.threads, self.batch_size = threads, 1
+                with timing.stage("whisper"):
+                    result = self.whisper.transcribe(
+                        source, language=str(self.language), fp16=False,
+                        word_timestamps=DELIVERY_METRICS,
+                    )
+        self._store_result(result)
+        return self.transcribed_text
+
+    def _store_result(self, result: Any) -> None:
+        """Step 5 of ``transcribe_file``: keep the text and segments.
+
+        Шаг 5 ``transcribe_file``: сохраняем текст и сегменты.
+        """
+
+        segments = result.get("segments") if isinstance(result, dict) else None
+        self.segments = list(segments or [])
+        if segments:
+            timing.annotate(transcribed_seconds=float(segments[-1].get("end") or 0))
 
         # Step 5: Extract text and store result
         # Шаг 5: Извлекаем текст и сохраняем результат
         text = result.get('text') if isinstance(result, dict) else None
         self.transcribed_text = text if isinstance(text, str) else str(result)
-        return self.transcribed_text
+
+    def delivery_metrics(self) -> Dict[str, Any]:
+        """Measure delivery of the transcribed clip without calling a model.
+
+        Измеряет подачу транскрибированного клипа без вызова модели.
+
+        Returns:
+
+            Dict[str, Any]:
+                Pace, pauses, fillers, speaking ratio, loudness and ``score``;
+                see ``AI.DeliveryMetrics.compute_delivery_metrics``.
+                Темп, паузы, слова-паразиты, доля речи, громкость и ``score``;
+                см. ``AI.DeliveryMetrics.compute_delivery_metrics``.
+        """
+
+        with timing.stage("delivery_metrics"):
+            return compute_delivery_metrics(self.segments, self.samples)
 
     def restore_transcribed_text_with_gemini(self):
         """Improve transcription text using Gemini.
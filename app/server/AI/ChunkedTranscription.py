@@ -0,0 +1,501 @@
+"""Parallel transcription of long recordings split at pauses.
+
+Параллельная транскрибация длинных записей, разрезанных по паузам.
+
+``whisper.transcribe`` walks a recording one 30-second window after another,
+so a several-minute clip takes several minutes whatever the core count. Long
+clips are instead cut at the quietest point near each chunk boundary, every
+chunk gets a little audio of its neighbours, and the chunks are transcribed at
+once by a pool of worker processes, each with its own model and a share of the
+CPU allowance. Stitching keeps a segment (or, with word timestamps, a word)
+only in the chunk that owns its midpoint, drops words repeated across the
+seam, shifts timestamps to the whole clip and keeps them monotonic.
+
+``whisper.transcribe`` проходит запись окно за окном по 30 секунд, поэтому
+клип в несколько минут занимает минуты при любом числе ядер. Вместо этого
+длинные клипы режутся в самой тихой точке возле каждой границы, каждый кусок
+получает немного звука соседей, и куски транскрибируются одновременно пулом
+процессов, у каждого своя модель и доля допуска CPU. При сшивке сегмент (или,
+с метками слов, слово) остаётся только в куске, которому принадлежит его
+середина, слова, повторённые на стыке, отбрасываются, метки времени
+сдвигаются к началу клипа и остаются монотонными.
+"""
+
+import multiprocessing
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Energy frame and the pause length a cut looks for,
+# кадр энергии и длина паузы, которую ищет разрез
+FRAME_S = 0.02
+PAUSE_S = 0.3
+# Cuts move at most this share of a chunk towards a pause,
+# разрез сдвигается к паузе не дальше этой доли куска
+SEARCH_SHARE = 0.25
+# Interpreter and torch of one pool process on top of the model,
+# интерпретатор и torch одного процесса пула сверх модели
+WORKER_BASE_MB = 250
+# Longest run of words compared at a seam, самая длинная сверяемая на стыке серия слов
+MAX_SEAM_WORDS = 8
+
+_WORD = re.compile(r"\w+")
+
+
+class Chunk:
+    """Audio span of one chunk and the part of the timeline it owns.
+
+    Отрезок звука одного куска и часть шкалы времени, которой он владеет.
+    """
+
+    def __init__(self, start: int, end: int, own_start: int, own_end: int):
+        # Sample indices, индексы отсчётов
+        self.start = start
+        self.end = end
+        self.own_start = own_start
+        self.own_end = own_end
+
+
+def find_cuts(samples: np.ndarray, chunk_s: float) -> List[int]:
+    """Sample indices where the recording is cut, at pauses near each boundary.
+
+    Индексы отсчётов, где режется запись, — паузы возле каждой границы.
+
+    Args:
+
+        samples (np.ndarray):
+            Mono 16 kHz float samples.
+            Моно-отсчёты 16 кГц.
+
+        chunk_s (float):
+            Target chunk length in seconds.
+            Целевая длина куска в секундах.
+
+    Returns:
+
+        List[int]:
+            Inner cut points, ascending; empty when the clip is one chunk.
+            Внутренние точки разреза по возрастанию; пусто, если клип — один кусок.
+    """
+
+    frame = int(SAMPLE_RATE * FRAME_S)
+    count = len(samples) // frame
+    total_s = len(samples) / SAMPLE_RATE
+    if count == 0 or total_s < chunk_s * 1.5:
+        return []
+    # RMS per frame smoothed over a pause, RMS по кадрам, сглаженный по паузе
+    energy = np.sqrt(np.mean(
+        np.square(samples[:count * frame].reshape(count, frame), dtype=np.float64),
+        axis=1,
+    ))
+    width = max(1, int(PAUSE_S / FRAME_S))
+    energy = np.convolve(energy, np.ones(width) / width, mode="same")
+
+    cuts: List[int] = []
+    last = 0.0
+    while total_s - last >= chunk_s * 1.5:
+        target = last + chunk_s
+        lo = int((target - chunk_s * SEARCH_SHARE) / FRAME_S)
+        hi = min(count, int((target + chunk_s * SEARCH_SHARE) / FRAME_S))
+        if hi <= lo:
+            break
+        # The quietest frames, the one nearest the target among near-ties,
+        # самые тихие кадры, среди почти равных — ближайший к цели
+        window = energy[lo:hi]
+        quiet = np.flatnonzero(window <= window.min() * 1.1 + 1e-4)
+        best = lo + int(quiet[np.argmin(np.abs(quiet + lo - target / FRAME_S))])
+        cuts.append(best * frame)
+        last = best * FRAME_S
+    return cuts
+
+
+def plan_chunks(samples: np.ndarray, chunk_s: float,
+                overlap_s: float) -> List[Chunk]:
+    """Chunks of the recording with ``overlap_s`` of audio around each cut.
+
+    Куски записи с ``overlap_s`` звука вокруг каждого разреза.
+    """
+
+    n = len(samples)
+    bounds = [0, *find_cuts(samples, chunk_s), n]
+    pad = int(overlap_s * SAMPLE_RATE)
+    return [
+        Chunk(max(0, a - pad), min(n, b + pad), a, b)
+        for a, b in zip(bounds, bounds[1:])
+    ]
+
+
+def chunk_memory_mb(weights_mb: float, activations_mb: float) -> float:
+    """Megabytes one pool process holds while transcribing a chunk.
+
+    Сколько мегабайт держит один процесс пула, транскрибируя кусок.
+    """
+
+    return weights_mb + activations_mb + WORKER_BASE_MB
+
+
+# Pool worker side, сторона процесса пула
+
+def _transcribe_chunk(model: str, samples: np.ndarray, language: str,
+                      word_timestamps: bool, threads: int) -> Dict[str, Any]:
+    """Transcribe one chunk in a pool process with its cached model.
+
+    Транскрибирует один кусок в процессе пула его закешированной моделью.
+    """
+
+    import warnings
+
+    from AI.AudioToText import load_whisper_model
+    from utilities.consts import WhisperModelsENUM
+    from utilities.cpu_budget import apply_torch_threads
+
+    net = load_whisper_model(WhisperModelsENUM(model))
+    apply_torch_threads(threads)
+    warnings.filterwarnings("ignore", message=r".*FP16 is not supported on CPU.*")
+    result = net.transcribe(samples, language=language, fp16=False,
+                            word_timestamps=word_timestamps)
+    return {
+        "text": result.get("text") or "",
+        "segments": [
+            {k: v for k, v in seg.items() if k != "tokens"}
+            for seg in result.get("segments") or []
+        ],
+    }
+
+
+# Stitching, сшивка
+
+def _words(text: str) -> List[str]:
+    return [w.lower() for w in _WORD.findall(text or "")]
+
+
+def _drop_repeated(previous: str, text: str) -> str:
+    """Cut the words at the start of ``text`` that end ``previous``.
+
+    Убирает слова в начале ``text``, которыми заканчивается ``previous``.
+    """
+
+    tail, head = _words(previous)[-MAX_SEAM_WORDS:], _words(text)
+    for k in range(min(len(tail), len(head), MAX_SEAM_WORDS), 1, -1):
+        if tail[-k:] == head[:k]:
+            # Skip k word matches in the original text,
+            # пропускаем k совпавших слов в исходном тексте
+            matches = list(_WORD.finditer(text))
+            return " " + text[matches[k - 1].end():].lstrip(" ,.;:!?-")
+    return text
+
+
+def stitch(chunks: List[Chunk], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Join per-chunk results into one ``whisper.transcribe``-shaped result.
+
+    Объединяет результаты кусков в один результат в форме
+    ``whisper.transcribe``.
+
+    Pipeline:
+
+        1. Shift each chunk's timestamps by its offset in the clip.
+           Сдвигаем метки времени каждого куска на его смещение в клипе.
+
+        2. Keep words (or whole segments without word timestamps) whose
+           midpoint lies in the part the chunk owns; drop words repeated at the
+           seam.
+           Оставляем слова (или целые сегменты без меток слов), середина
+           которых лежит в части, принадлежащей куску; отбрасываем слова,
+           повторённые на стыке.
+
+        3. Clamp timestamps so they never go back and renumber segments.
+           Ограничиваем метки времени, чтобы они не шли назад, и
+           перенумеровываем сегменты.
+
+    Returns:
+
+        Dict[str, Any]:
+            ``text`` and ``segments`` of the whole clip.
+            ``text`` и ``segments`` всего клипа.
+    """
+
+    merged: List[Dict[str, Any]] = []
+    last_end = 0.0
+    for i, (chunk, result) in enumerate(zip(chunks, results)):
+        # Step 1: Offsets and owned range
+        # Шаг 1: Смещения и принадлежащий отрезок
+        offset = chunk.start / SAMPLE_RATE
+        lo = chunk.own_start / SAMPLE_RATE if i else float("-inf")
+        hi = chunk.own_end / SAMPLE_RATE if i < len(chunks) - 1 else float("inf")
+        shared_until = (2 * chunk.own_start - chunk.start) / SAMPLE_RATE + 1.0
+
+        def owned(item: Dict[str, Any]) -> bool:
+            mid = (float(item.get("start") or 0) + float(item.get("end") or 0)) / 2
+            return lo <= mid + offset < hi
+
+        for raw in result.get("segments") or []:
+            seg = dict(raw)
+            # Step 2: Ownership and seam duplicates
+            # Шаг 2: Принадлежность и повторы на стыке
+            words = seg.get("words")
+            if words:
+                words = [dict(w) for w in words if owned(w)]
+                if not words:
+                    continue
+                for w in words:
+                    w["start"] = float(w.get("start") or 0) + offset
+                    w["end"] = float(w.get("end") or 0) + offset
+                seg["words"] = words
+                seg["text"] = "".join(str(w.get("word") or "") for w in words)
+                seg["start"], seg["end"] = words[0]["start"], words[-1]["end"]
+            else:
+                if not owned(seg):
+                    continue
+                seg["start"] = float(seg.get("start") or 0) + offset
+                seg["end"] = float(seg.get("end") or 0) + offset
+                # Only text that starts in the audio shared with the previous
+                # chunk can repeat it, повторить предыдущий кусок может только
+                # текст, начинающийся в общем с ним звуке
+                if merged and seg["start"] < shared_until:
+                    seg["text"] = _drop_repeated(merged[-1]["text"],
+                                                 seg.get("text") or "")
+                if not _words(seg.get("text") or ""):
+                    continue
+
+            # Step 3: Monotonic timestamps
+            # Шаг 3: Монотонные метки времени
+            seg["start"] = max(float(seg["start"]), last_end)
+            seg["end"] = max(float(seg["end"]), seg["start"])
+            for w in seg.get("words") or []:
+                w["start"] = min(max(w["start"], last_end), seg["end"])
+                w["end"] = min(max(w["end"], w["start"]), seg["end"])
+                last_end = w["end"]
+            last_end = seg["end"]
+            seg["id"] = len(merged)
+            merged.append(seg)
+    return {"text": "".join(seg["text"] for seg in merged), "segments": merged}
+
+
+# Pool, пул
+
+class ChunkPool:
+    """Lazily started process pool that transcribes chunks.
+
+    Лениво запускаемый пул процессов, транскрибирующий куски.
+    """
+
+    def __init__(self, max_workers: int):
+        """Create the pool; processes start with the first chunk.
+
+        Создаёт пул; процессы стартуют с первым куском.
+
+        Args:
+
+            max_workers (int):
+                Most processes, each holding its own Whisper model.
+                Наибольшее число процессов, у каждого своя модель Whisper.
+        """
+
+        self.max_workers = max(1, int(max_workers))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Clips holding a memory reservation for the pool,
+        # клипы, держащие резерв памяти под пул
+        self._users = 0
+        self._stats = {"clips": 0, "chunks": 0, "failures": 0}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Spawned, not forked: the server process has threads and an
+                # OpenMP pool, порождаем, а не форкаем: у сервера есть потоки и
+                # пул OpenMP
+                context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=context)
+            return self._pool
+
+    @contextmanager
+    def reserve(self, mb: float) -> Iterator[float]:
+        """Reserve ``mb`` for the pool's processes while a clip uses them.
+
+        Резервирует ``mb`` под процессы пула, пока их использует клип.
+
+        The processes keep their models after a chunk, so the pool stops when
+        the last reservation ends; memory it holds is never outside the
+        governor's count.
+        Процессы держат свои модели и после куска, поэтому пул
+        останавливается с окончанием последнего резерва; занятая им память
+        всегда учтена регулятором.
+
+        Yields:
+
+            float:
+                The reserved megabytes.
+                Зарезервированные мегабайты.
+        """
+
+        from utilities.memory import get_governor
+
+        with get_governor().reserve("whisper", mb) as held:
+            with self._lock:
+                self._users += 1
+            try:
+                yield held
+            finally:
+                with self._lock:
+                    self._users -= 1
+                    pool = self._pool if self._users == 0 else None
+                    if pool is not None:
+                        self._pool = None
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+
+    def transcribe(self, model: str, samples: np.ndarray, chunks: List[Chunk],
+                   language: str, word_timestamps: bool, workers: int,
+                   threads: int) -> Dict[str, Any]:
+        """Transcribe ``chunks`` with at most ``workers`` of them in flight.
+
+        Транскрибирует ``chunks``, одновременно не более ``workers`` кусков.
+
+        Args:
+
+            model (str):
+                Whisper model name.
+                Имя модели Whisper.
+
+            samples (np.ndarray):
+                Decoded samples of the whole clip.
+                Декодированные отсчёты всего клипа.
+
+            chunks (List[Chunk]):
+                Plan from ``plan_chunks``.
+                План из ``plan_chunks``.
+
+            language (str):
+                Transcription language.
+                Язык транскрибации.
+
+            word_timestamps (bool):
+                Keep word timestamps (delivery metrics).
+                Сохранять метки слов (метрики подачи).
+
+            workers (int):
+                Chunks transcribed at once.
+                Сколько кусков транскрибируется одновременно.
+
+            threads (int):
+                Torch threads of each chunk.
+                Потоков torch у каждого куска.
+
+        Returns:
+
+            Dict[str, Any]:
+                Stitched result, see ``stitch``.
+                Сшитый результат, см. ``stitch``.
+
+        Raises:
+
+            Exception:
+                A chunk failed or the pool broke; a broken pool is restarted
+                on next use.
+                Кусок упал или пул сломался; сломанный пул перезапускается при
+                следующем использовании.
+        """
+
+        pool = self._executor()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(chunks)
+        pending = list(enumerate(chunks))
+        running: Dict[Future, int] = {}
+        try:
+            while pending or running:
+                while pending and len(running) < max(1, workers):
+                    i, chunk = pending.pop(0)
+                    future = pool.submit(
+                        _transcribe_chunk, model, samples[chunk.start:chunk.end],
+                        language, word_timestamps, threads,
+                    )
+                    running[future] = i
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        except Exception as e:
+            for future in running:
+                future.cancel()
+            with self._lock:
+                self._stats["failures"] += 1
+            # Only a dead pool is replaced; other clips keep their chunks in flight,
+            # заменяется только сломанный пул, куски других клипов продолжают работу
+            if isinstance(e, BrokenProcessPool):
+                self._discard(pool)
+            raise
+        with self._lock:
+            self._stats["clips"] += 1
+            self._stats["chunks"] += len(chunks)
+        return stitch(chunks, [r or {} for r in results])
+
+    def _discard(self, pool: ProcessPoolExecutor) -> None:
+        """Drop a broken pool unless another clip has replaced it already.
+
+        Отбрасывает сломанный пул, если его ещё не заменил другой клип.
+        """
+
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> bool:
+        """Stop the processes and free their models; ``True`` if any ran.
+
+        Останавливает процессы и освобождает их модели; ``True``, если они были.
+        """
+
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return False
+        pool.shutdown(wait=False, cancel_futures=True)
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Pool size, whether it runs and clip counters.
+
+        Размер пула, запущен ли он, и счётчики клипов.
+        """
+
+        with self._lock:
+            return {"maxWorkers": self.max_workers, "running": self._pool is not None,
+                    **self._stats}
+
+
+_pool: Optional[ChunkPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ChunkPool:
+    """Return this process's chunk pool sized from ``utilities.consts``.
+
+    Возвращает пул кусков процесса с размером из ``utilities.consts``.
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from utilities.consts import WHISPER_CHUNK_WORKERS
+            from utilities.cpu_budget import get_budget
+
+            _pool = ChunkPool(WHISPER_CHUNK_WORKERS or get_budget().cores)
+        return _pool
+
+
+def shutdown_pool() -> bool:
+    """Stop this process's chunk pool if it was started.
+
+    Останавливает пул кусков процесса, если он запускался.
+    """
+
+    with _pool_lock:
+        pool = _pool
+    return pool.shutdown() if pool is not None else False
@@ -0,0 +1,290 @@
+"""Speech-delivery metrics computed locally from Whisper timestamps and audio.
+
+Метрики подачи речи, вычисляемые локально по меткам времени Whisper и аудио.
+
+Pace, pauses, filler words, speaking time and loudness variation are measured
+with NumPy from the word timestamps Whisper already produces and the decoded
+16 kHz samples, and the review gets them as facts. The ``delivery`` score is
+derived from the same numbers instead of being guessed by the model from text.
+
+Темп, паузы, слова-паразиты, доля времени речи и изменчивость громкости
+измеряются с помощью NumPy по меткам слов, которые Whisper и так выдаёт, и по
+декодированным отсчётам 16 кГц, и передаются в оценку как факты. Балл
+``delivery`` выводится из тех же чисел, а не угадывается моделью по тексту.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Gaps shorter than this are articulation, not pauses,
+# промежутки короче этого — артикуляция, а не паузы
+PAUSE_MIN_S = 0.25
+LONG_PAUSE_S = 1.0
+# RMS frame for loudness, кадр RMS для громкости
+FRAME_S = 0.05
+
+# Single-word and two-word fillers (Russian and English),
+# однословные и двухсловные слова-паразиты (русские и английские)
+FILLERS = {
+    "э", "ээ", "эээ", "эм", "мм", "ммм", "ну", "типа", "короче", "вот",
+    "значит", "собственно", "um", "uh", "er", "erm", "hmm", "like",
+}
+FILLER_PAIRS = {
+    ("как", "бы"), ("это", "самое"), ("так", "сказать"), ("в", "общем"),
+    ("you", "know"), ("i", "mean"),
+}
+
+# Comfortable presentation pace in words per minute,
+# комфортный темп выступления в словах в минуту
+TARGET_WPM = (110.0, 160.0)
+
+_WORD = re.compile(r"[\w'-]+", re.UNICODE)
+
+
+def _tokens(words: Sequence[str]) -> List[str]:
+    out = []
+    for w in words:
+        m = _WORD.search(str(w).lower().replace("ё", "е"))
+        out.append(m.group(0) if m else "")
+    return out
+
+
+def _word_times(segments: List[Dict[str, Any]]):
+    """Flatten Whisper segments into word texts, starts and ends.
+
+    Разворачивает сегменты Whisper в тексты, начала и концы слов.
+
+    Segments without word timestamps spread their words evenly over the segment.
+    Сегменты без меток слов равномерно распределяют слова по сегменту.
+    """
+
+    texts: List[str] = []
+    starts: List[float] = []
+    ends: List[float] = []
+    for seg in segments or []:
+        words = seg.get("words")
+        if words:
+            for w in words:
+                texts.append(str(w.get("word", "")))
+                starts.append(float(w.get("start") or 0.0))
+                ends.append(float(w.get("end") or 0.0))
+            continue
+        split = str(seg.get("text", "")).split()
+        if not split:
+            continue
+        edges = np.linspace(float(seg.get("start") or 0.0),
+                            float(seg.get("end") or 0.0), len(split) + 1)
+        texts += split
+        starts += edges[:-1].tolist()
+        ends += edges[1:].tolist()
+    return texts, np.asarray(starts, dtype=np.float64), \
+        np.asarray(ends, dtype=np.float64)
+
+
+def _speaking_time(starts: np.ndarray, ends: np.ndarray) -> float:
+    # Union of word intervals, объединение интервалов слов
+    if not len(starts):
+        return 0.0
+    order = np.argsort(starts)
+    s, e = starts[order], np.maximum.accumulate(ends[order])
+    gaps = np.clip(s[1:] - e[:-1], 0.0, None)
+    return float(e[-1] - s[0] - gaps.sum())
+
+
+def loudness_profile(samples: np.ndarray,
+                     sample_rate: int = SAMPLE_RATE) -> Dict[str, Optional[float]]:
+    """Loudness statistics of voiced frames in dBFS.
+
+    Статистика громкости озвученных кадров в dBFS.
+
+    Args:
+
+        samples (np.ndarray):
+            Mono float samples in -1..1.
+            Моно-отсчёты с плавающей точкой в диапазоне -1..1.
+
+        sample_rate (int):
+            Samples per second.
+            Отсчётов в секунду.
+
+    Returns:
+
+        Dict[str, Optional[float]]:
+            ``mean_db``, ``std_db`` and ``range_db`` (p95 - p10), ``None`` for
+            silent or too short audio.
+            ``mean_db``, ``std_db`` и ``range_db`` (p95 - p10), ``None`` для
+            тишины или слишком короткого аудио.
+    """
+
+    empty = {"mean_db": None, "std_db": None, "range_db": None}
+    frame = max(1, int(sample_rate * FRAME_S))
+    n = len(samples) // frame
+    if n < 2:
+        return empty
+    frames = np.asarray(samples[:n * frame], dtype=np.float32).reshape(n, frame)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    db = 20.0 * np.log10(rms + 1e-10)
+    # Frames within 30 dB of the loud end count as speech,
+    # кадры в пределах 30 дБ от громкого края считаются речью
+    voiced = db[db > max(-60.0, float(np.percentile(db, 95)) - 30.0)]
+    if len(voiced) < 2:
+        return empty
+    return {
+        "mean_db": round(float(voiced.mean()), 1),
+        "std_db": round(float(voiced.std()), 2),
+        "range_db": round(float(np.percentile(voiced, 95)
+                                - np.percentile(voiced, 10)), 1),
+    }
+
+
+def compute_delivery_metrics(segments: List[Dict[str, Any]],
+                             samples: Optional[np.ndarray] = None,
+                             sample_rate: int = SAMPLE_RATE) -> Dict[str, Any]:
+    """Measure pace, pauses, fillers, speaking time and loudness of one clip.
+
+    Измеряет темп, паузы, слова-паразиты, время речи и громкость одного клипа.
+
+    Pipeline:
+
+        1. Flatten word timestamps and measure speaking time.
+           Разворачиваем метки слов и измеряем время речи.
+
+        2. Pause distribution from gaps between consecutive words.
+           Распределение пауз по промежуткам между соседними словами.
+
+        3. Filler words, single and two-word, by vectorized lookup.
+           Слова-паразиты, одно- и двухсловные, векторным поиском.
+
+        4. Loudness variation of voiced frames and the local delivery score.
+           Изменчивость громкости озвученных кадров и локальный балл подачи.
+
+    Args:
+
+        segments (List[Dict[str, Any]]):
+            Whisper segments, ideally with ``words``.
+            Сегменты Whisper, желательно с ``words``.
+
+        samples (Optional[np.ndarray]):
+            Decoded mono audio; loudness is skipped without it.
+            Декодированное моно-аудио; без него громкость не считается.
+
+        sample_rate (int):
+            Sample rate of ``samples``.
+            Частота дискретизации ``samples``.
+
+    Returns:
+
+        Dict[str, Any]:
+            Metrics plus ``score`` (0..100) for ``scores.delivery``.
+            Метрики и ``score`` (0..100) для ``scores.delivery``.
+    """
+
+    # Step 1: Words and speaking time
+    # Шаг 1: Слова и время речи
+    texts, starts, ends = _word_times(segments)
+    n_words = len(texts)
+    if samples is not None and len(samples):
+        duration = len(samples) / float(sample_rate)
+    else:
+        duration = float(ends.max()) if n_words else 0.0
+    speaking = _speaking_time(starts, ends)
+    minutes = duration / 60.0
+
+    # Step 2: Pauses
+    # Шаг 2: Паузы
+    gaps = starts[1:] - ends[:-1] if n_words > 1 else np.zeros(0)
+    pauses = gaps[gaps >= PAUSE_MIN_S]
+
+    # Step 3: Fillers
+    # Шаг 3: Слова-паразиты
+    tokens = np.asarray(_tokens(texts), dtype=object)
+    single = np.isin(tokens, list(FILLERS)) if n_words else np.zeros(0, bool)
+    pairs = np.zeros(n_words, dtype=bool)
+    for a, b in FILLER_PAIRS:
+        if n_words > 1:
+            hit = (tokens[:-1] == a) & (tokens[1:] == b)
+            pairs[:-1] |= hit
+    filler_count = int(single.sum() + pairs.sum())
+    counts: Dict[str, int] = {}
+    for tok in tokens[single]:
+        counts[tok] = counts.get(tok, 0) + 1
+    for i in np.flatnonzero(pairs):
+        pair = f"{tokens[i]} {tokens[i + 1]}"
+        counts[pair] = counts.get(pair, 0) + 1
+
+    # Step 4: Loudness and score
+    # Шаг 4: Громкость и балл
+    loudness = loudness_profile(samples, sample_rate) \
+        if samples is not None else {"mean_db": None, "std_db": None,
+                                     "range_db": None}
+    metrics: Dict[str, Any] = {
+        "duration_s": round(duration, 2),
+        "words": n_words,
+        "wpm": round(n_words / minutes, 1) if minutes > 0 else None,
+        "articulation_wpm": round(n_words / (speaking / 60.0), 1)
+        if speaking > 0 else None,
+        "speaking_ratio": round(min(1.0, speaking / duration), 3)
+        if duration > 0 else None,
+        "pauses": {
+            "count": int(len(pauses)),
+            "per_min": round(len(pauses) / minutes, 2) if minutes > 0 else None,
+            "mean_s": round(float(pauses.mean()), 2) if len(pauses) else None,
+            "p50_s": round(float(np.percentile(pauses, 50)), 2)
+            if len(pauses) else None,
+            "p90_s": round(float(np.percentile(pauses, 90)), 2)
+            if len(pauses) else None,
+            "max_s": round(float(pauses.max()), 2) if len(pauses) else None,
+            "long": int((pauses >= LONG_PAUSE_S).sum()),
+        },
+        "fillers": {
+            "count": filler_count,
+            "per_100_words": round(100.0 * filler_count / n_words, 2)
+            if n_words else None,
+            "top": dict(sorted(counts.items(), key=lambda kv: -kv[1])[:5]),
+        },
+        "loudness": loudness,
+    }
+    metrics["score"] = delivery_score(metrics)
+    return metrics
+
+
+def delivery_score(metrics: Dict[str, Any]) -> Optional[int]:
+    """Deterministic 0..100 delivery score from the measured metrics.
+
+    Детерминированный балл подачи 0..100 по измеренным метрикам.
+
+    Penalties: pace outside ``TARGET_WPM``, filler rate, long pauses per
+    minute, little speaking time and a monotone voice.
+    Штрафы: темп вне ``TARGET_WPM``, частота слов-паразитов, длинные паузы в
+    минуту, мало времени речи и монотонный голос.
+
+    Returns:
+
+        Optional[int]:
+            Score, ``None`` when there was too little speech to judge.
+            Балл; ``None``, если речи слишком мало для оценки.
+    """
+
+    if (metrics.get("words") or 0) < 5 or not metrics.get("wpm"):
+        return None
+    score = 100.0
+    lo, hi = TARGET_WPM
+    wpm = float(metrics["wpm"])
+    if wpm < lo:
+        score -= min(25.0, (lo - wpm) * 0.5)
+    elif wpm > hi:
+        score -= min(25.0, (wpm - hi) * 0.5)
+    fillers = float(metrics["fillers"].get("per_100_words") or 0.0)
+    score -= min(25.0, fillers * 3.0)
+    duration_min = max(float(metrics.get("duration_s") or 0.0) / 60.0, 1e-6)
+    score -= min(15.0, metrics["pauses"]["long"] / duration_min * 3.0)
+    ratio = metrics.get("speaking_ratio")
+    if ratio is not None and ratio < 0.6:
+        score -= min(15.0, (0.6 - ratio) * 50.0)
+    std_db = metrics["loudness"].get("std_db")
+    if std_db is not None and std_db < 3.0:
+        score -= min(10.0, (3.0 - std_db) * 4.0)
+    return int(round(max(0.0, min(100.0, score))))
@@ -0,0 +1,300 @@
+"""Content-addressed registry of files uploaded to the Gemini Files API.
+
+Реестр файлов, загруженных в Gemini Files API, с адресацией по содержимому.
+
+Maps the SHA-256 of a local file to the remote URI and its expiry, so the same
+deck is uploaded once while the remote copy is valid. Uploads and refreshes run
+on a background pool instead of the request path.
+
+Сопоставляет SHA-256 локального файла с удалённым URI и сроком его жизни, чтобы
+одна и та же презентация загружалась один раз, пока удалённая копия жива.
+Загрузки и обновления выполняются в фоновом пуле, а не в пути запроса.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from AI.AskGemini import make_client
+
+# Gemini keeps uploaded files for 48 hours; used when the API omits the expiry,
+# Gemini хранит загруженные файлы 48 часов; используется, если API не вернул срок
+DEFAULT_TTL_S = 48 * 3600
+# Entries this close to expiry are treated as stale for new requests,
+# записи, настолько близкие к истечению, считаются устаревшими для новых запросов
+SAFETY_MARGIN_S = 3600
+
+
+def file_sha256(path: Path) -> str:
+    """Hash a file in 1 MB blocks.
+
+    Хеширует файл блоками по 1 МБ.
+    """
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class GeminiFileRegistry:
+    """Process-wide map of content hash to Gemini file URI and expiry.
+
+    Общая для процесса карта: хеш содержимого → URI файла Gemini и срок жизни.
+    """
+
+    def __init__(self, store_path: Path, refresh_before_s: float = 6 * 3600,
+                 refresh_interval_s: float = 600, workers: int = 2):
+        """Load persisted entries and prepare the background pool.
+
+        Загружает сохранённые записи и готовит фоновый пул.
+
+        Args:
+
+            store_path (Path):
+                JSON file shared by workers and kept across restarts.
+                JSON-файл, общий для воркеров и сохраняемый между перезапусками.
+
+            refresh_before_s (float):
+                Re-upload files whose remote copy expires within this window.
+                Перезагружать файлы, удалённая копия которых истекает в этом окне.
+
+            refresh_interval_s (float):
+                How often the refresher scans entries.
+                Как часто фоновый обновитель просматривает записи.
+
+            workers (int):
+                Upload threads.
+                Потоки загрузки.
+        """
+
+        self.store_path = Path(store_path)
+        self.refresh_before_s = refresh_before_s
+        self.refresh_interval_s = refresh_interval_s
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = self._read()
+        self._pending: Dict[str, Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._refresher: Optional[threading.Thread] = None
+
+    def lookup(self, sha256: str) -> Optional[Dict[str, Any]]:
+        """Return a still-valid entry for a content hash.
+
+        Возвращает ещё действующую запись для хеша содержимого.
+
+        Args:
+
+            sha256 (str):
+                Content hash.
+                Хеш содержимого.
+
+        Returns:
+
+            Optional[Dict[str, Any]]:
+                ``file_uri``, ``mime_type``, ``name``, ``expires_at`` or ``None``.
+                ``file_uri``, ``mime_type``, ``name``, ``expires_at`` или ``None``.
+        """
+
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is None:
+                # Another worker may have uploaded it, другой воркер мог загрузить
+                entry = self._read().get(sha256)
+                if entry is not None:
+                    self._entries[sha256] = entry
+        if entry is None:
+            return None
+        remaining = float(entry.get("expires_at") or 0) - time.time()
+        return dict(entry) if remaining > SAFETY_MARGIN_S else None
+
+    def ensure(self, path: Path, sha256: Optional[str] = None,
+               mime_type: Optional[str] = None) -> Future:
+        """Schedule an upload unless a valid copy exists or one is in flight.
+
+        Ставит загрузку в очередь, если нет действующей копии и загрузка не идёт.
+
+        Args:
+
+            path (Path):
+                Local file.
+                Локальный файл.
+
+            sha256 (Optional[str]):
+                Known content hash; computed when omitted.
+                Известный хеш содержимого; вычисляется, если не передан.
+
+            mime_type (Optional[str]):
+                MIME type; guessed from the name when omitted.
+                MIME-тип; определяется по имени, если не передан.
+
+        Returns:
+
+            Future:
+                Resolves to the registry entry.
+                Завершается записью реестра.
+        """
+
+        sha256 = sha256 or file_sha256(path)
+        found = self.lookup(sha256)
+        if found is not None:
+            done: Future = Future()
+            done.set_result(found)
+            return done
+        with self._lock:
+            future = self._pending.get(sha256)
+            if future is None:
+                future = self._pool().submit(
+                    self._upload, Path(path), sha256, mime_type
+                )
+                self._pending[sha256] = future
+        self._start_refresher()
+        return future
+
+    def get(self, path: Path, sha256: Optional[str] = None,
+            mime_type: Optional[str] = None,
+            wait_s: float = 0.0) -> Optional[Dict[str, Any]]:
+        """Return a valid entry, waiting up to ``wait_s`` for a background upload.
+
+        Возвращает действующую запись, ожидая фоновую загрузку до ``wait_s``.
+
+        Returns:
+
+            Optional[Dict[str, Any]]:
+                Entry or ``None`` when the upload is not done in time or failed.
+                Запись или ``None``, если загрузка не успела или не удалась.
+        """
+
+        future = self.ensure(path, sha256, mime_type)
+        try:
+            return future.result(timeout=max(0.0, wait_s))
+        except FutureTimeout:
+            return None
+        except Exception:
+            return None
+
+    def _upload(self, path: Path, sha256: str,
+                mime_type: Optional[str]) -> Dict[str, Any]:
+        """Upload one file and record it; runs on the background pool.
+
+        Загружает один файл и записывает его; выполняется в фоновом пуле.
+        """
+
+        try:
+            client = make_client()
+            up = client.files.upload(file=str(path))
+            # Some versions expose uri/mime_type attributes
+            uri = getattr(up, "uri", None) or getattr(up, "file_uri", None)
+            if not uri:
+                raise RuntimeError("Gemini upload returned no file URI")
+            expires = getattr(up, "expiration_time", None)
+            entry = {
+                "file_uri": uri,
+                "name": getattr(up, "name", None),
+                "mime_type": (
+                    getattr(up, "mime_type", None) or mime_type
+                    or guess_type(str(path))[0] or "application/octet-stream"
+                ),
+                "uploaded_at": time.time(),
+                "expires_at": (
+                    expires.timestamp() if hasattr(expires, "timestamp")
+                    else time.time() + DEFAULT_TTL_S
+                ),
+                "source": str(path),
+            }
+            with self._lock:
+                self._entries[sha256] = entry
+                self._write()
+            return dict(entry)
+        finally:
+            with self._lock:
+                self._pending.pop(sha256, None)
+
+    def refresh_stale(self) -> int:
+        """Re-upload entries expiring soon whose source file still exists.
+
+        Перезагружает записи с истекающим сроком, если исходный файл ещё есть.
+
+        Returns:
+
+            int:
+                Number of refreshes scheduled.
+                Количество запланированных обновлений.
+        """
+
+        horizon = time.time() + self.refresh_before_s
+        with self._lock:
+            self._entries.update(self._read())
+            stale = [
+                (sha, e) for sha, e in self._entries.items()
+                if float(e.get("expires_at") or 0) < horizon
+            ]
+        count = 0
+        for sha, entry in stale:
+            source = Path(entry.get("source") or "")
+            with self._lock:
+                if not source.is_file():
+                    # Session deleted; forget it, сессия удалена, забываем
+                    if float(entry.get("expires_at") or 0) < time.time():
+                        self._entries.pop(sha, None)
+                        self._write()
+                    continue
+                if sha in self._pending:
+                    continue
+                self._pending[sha] = self._pool().submit(
+                    self._upload, source, sha, entry.get("mime_type")
+                )
+            count += 1
+        return count
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(self.refresh_interval_s)
+            try:
+                self.refresh_stale()
+            except Exception:
+                # Keep refreshing on transient errors, продолжаем при сбоях
+                pass
+
+    def _start_refresher(self) -> None:
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(
+                    target=self._refresh_loop, name="gemini-files-refresh",
+                    daemon=True,
+                )
+                self._refresher.start()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._workers, thread_name_prefix="gemini-files"
+            )
+        return self._executor
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self) -> None:
+        # Merge with entries written by other workers, then replace atomically,
+        # объединяем с записями других воркеров и атомарно заменяем файл
+        merged = self._read()
+        merged.update(self._entries)
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.store_path.with_name(f".{self.store_path.name}.{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.store_path)
@@ -0,0 +1,471 @@
+"""Rate-limit-aware scheduler for Gemini calls.
+
+Планировщик вызовов Gemini с учётом лимитов квоты.
+
+Every ``AskGemini._gen`` call passes through one process-wide scheduler:
+token buckets hold requests and tokens per minute under quota, a priority queue
+lets interactive slide reviews go before summaries and background punctuation
+restore, and retryable errors are retried with jittered exponential backoff
+inside a per-request deadline and a shared retry budget.
+
+Каждый вызов ``AskGemini._gen`` проходит через общий для процесса планировщик:
+вёдра токенов держат запросы и токены в минуту в пределах квоты, очередь с
+приоритетами пропускает интерактивную оценку слайдов раньше итогов и фонового
+восстановления пунктуации, а повторяемые ошибки повторяются с экспоненциальной
+задержкой со случайным разбросом в пределах дедлайна запроса и общего бюджета
+повторов.
+"""
+
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from enum import IntEnum
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from utilities import timing
+
+# HTTP codes and gRPC statuses worth retrying,
+# HTTP-коды и статусы gRPC, которые имеет смысл повторять
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_STATUSES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED",
+                      "INTERNAL"}
+
+
+class Priority(IntEnum):
+    """Scheduling classes; lower values are served first.
+
+    Классы планирования; меньшие значения обслуживаются раньше.
+    """
+
+    INTERACTIVE = 0
+    SUMMARY = 1
+    BACKGROUND = 2
+    # Reviews computed ahead of the user's request,
+    # оценки, вычисляемые до запроса пользователя
+    SPECULATIVE = 3
+
+
+class LLMUnavailable(RuntimeError):
+    """Raised when a call cannot finish within its deadline or retry budget.
+
+    Возникает, если вызов не укладывается в дедлайн или бюджет повторов.
+    """
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket refilled continuously per minute; not thread-safe by itself.
+
+    Ведро токенов с непрерывным пополнением за минуту; само не потокобезопасно.
+    """
+
+    def __init__(self, per_minute: float):
+        """Create a full bucket; ``0`` disables the limit.
+
+        Создаёт полное ведро; ``0`` отключает лимит.
+        """
+
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        rate = self.capacity / 60.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` tokens are available.
+
+        Секунды до появления ``amount`` токенов.
+        """
+
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.capacity / 60.0)
+
+    def take(self, amount: float) -> None:
+        """Consume tokens; the balance may go negative to record debt.
+
+        Забирает токены; баланс может уйти в минус, фиксируя долг.
+        """
+
+        if self.capacity > 0:
+            self.tokens -= amount
+
+
+class LLMScheduler:
+    """Admission, pacing and retries for model calls.
+
+    Допуск, темп и повторы для вызовов модели.
+    """
+
+    def __init__(self, rpm: float, tpm: float, concurrency: int = 8,
+                 max_retries: int = 4, base_delay_s: float = 1.0,
+                 max_delay_s: float = 30.0, retry_ratio: float = 0.2):
+        """Create the scheduler.
+
+        Создаёт планировщик.
+
+        Args:
+
+            rpm (float):
+                Requests per minute for this process; ``0`` disables the limit.
+                Запросов в минуту на процесс; ``0`` отключает лимит.
+
+            tpm (float):
+                Tokens per minute for this process; ``0`` disables the limit.
+                Токенов в минуту на процесс; ``0`` отключает лимит.
+
+            concurrency (int):
+                Calls in flight at once.
+                Одновременных вызовов.
+
+            max_retries (int):
+                Retries per call.
+                Повторов на вызов.
+
+            base_delay_s (float):
+                First backoff step.
+                Первый шаг задержки.
+
+            max_delay_s (float):
+                Backoff cap.
+                Предел задержки.
+
+            retry_ratio (float):
+                Retries earned per first attempt, so retries stay a fraction
+                of traffic during an outage.
+                Повторы, начисляемые за первую попытку, чтобы во время сбоя
+                повторы оставались долей трафика.
+        """
+
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = max(0, int(max_retries))
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.retry_ratio = retry_ratio
+        self._retry_budget = 10.0
+        self._inflight = 0
+        self._paused_until = 0.0
+        self._waiting: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._rng = random.Random()
+
+    def call(self, fn: Callable[[], Any], priority: Priority = Priority.INTERACTIVE,
+             est_tokens: int = 0, deadline_s: float = 120.0) -> Any:
+        """Run ``fn`` under the limits, retrying retryable errors.
+
+        Выполняет ``fn`` в пределах лимитов, повторяя повторяемые ошибки.
+
+        Pipeline:
+
+            1. Wait for a slot in priority order until the buckets allow it.
+               Ждём слот в порядке приоритета, пока вёдра не позволят вызов.
+
+            2. Call the model and charge the real token usage.
+               Вызываем модель и списываем фактический расход токенов.
+
+            3. On a retryable error back off with full jitter and try again
+               while the deadline and retry budget allow.
+               При повторяемой ошибке ждём со случайным разбросом и пробуем
+               снова, пока позволяют дедлайн и бюджет повторов.
+
+        Args:
+
+            fn (Callable[[], Any]):
+                The model call.
+                Вызов модели.
+
+            priority (Priority):
+                Scheduling class.
+                Класс планирования.
+
+            est_tokens (int):
+                Expected prompt plus output tokens.
+                Ожидаемые токены запроса и ответа.
+
+            deadline_s (float):
+                Time budget for queueing, calls and backoff together.
+                Общий бюджет времени на очередь, вызовы и задержки.
+
+        Returns:
+
+            Any:
+                Result of ``fn``.
+                Результат ``fn``.
+
+        Raises:
+
+            LLMUnavailable:
+                Deadline or retry budget exhausted.
+                Исчерпан дедлайн или бюджет повторов.
+
+            Exception:
+                Non-retryable errors from ``fn``.
+                Неповторяемые ошибки ``fn``.
+        """
+
+        result, attempt = self._run(fn, priority, est_tokens, deadline_s)
+        self._release(est_tokens, _used_tokens(result), first=attempt == 0)
+        return result
+
+    def stream(self, open_stream: Callable[[], Any],
+               priority: Priority = Priority.INTERACTIVE, est_tokens: int = 0,
+               deadline_s: float = 120.0) -> Iterator[Any]:
+        """Run a streaming call under the limits, holding its slot until it ends.
+
+        Выполняет потоковый вызов в пределах лимитов, удерживая слот до его конца.
+
+        Opening the stream and waiting for its first chunk are admitted and
+        retried like ``call``; afterwards errors are raised as is. The slot is
+        released when the stream is exhausted, fails or is closed, and the
+        token usage of its last chunk is charged.
+        Открытие потока и ожидание первой части допускаются и повторяются как
+        в ``call``; дальше ошибки пробрасываются как есть. Слот освобождается,
+        когда поток исчерпан, упал или закрыт, и списывается расход токенов из
+        его последней части.
+
+        Args:
+
+            open_stream (Callable[[], Any]):
+                Starts the model call and returns an iterable of chunks.
+                Запускает вызов модели и возвращает итерируемые части.
+
+            priority (Priority):
+                Scheduling class.
+                Класс планирования.
+
+            est_tokens (int):
+                Expected prompt plus output tokens.
+                Ожидаемые токены запроса и ответа.
+
+            deadline_s (float):
+                Time budget for queueing, opening and backoff together.
+                Общий бюджет времени на очередь, открытие и задержки.
+
+        Yields:
+
+            Any:
+                Chunks of the stream.
+                Части потока.
+
+        Raises:
+
+            LLMUnavailable:
+                Deadline or retry budget exhausted before the first chunk.
+                Дедлайн или бюджет повторов исчерпан до первой части.
+        """
+
+        def first_chunk() -> Tuple[Any, Iterator[Any]]:
+            # Retryable errors (429, 503) surface before the first chunk,
+            # повторяемые ошибки (429, 503) приходят до первой части
+            chunks = iter(open_stream())
+            return next(chunks, None), chunks
+
+        (first, chunks), attempt = self._run(first_chunk, priority, est_tokens,
+                                             deadline_s)
+        last = first
+        try:
+            if first is not None:
+                yield first
+            for chunk in chunks:
+                last = chunk
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            self._release(est_tokens, _used_tokens(last), first=attempt == 0)
+
+    def _run(self, fn: Callable[[], Any], priority: Priority, est_tokens: int,
+             deadline_s: float) -> Tuple[Any, int]:
+        """Steps 1-3 of ``call``; on success the slot is still held.
+
+        Шаги 1-3 ``call``; при успехе слот ещё занят.
+
+        Returns:
+
+            Tuple[Any, int]:
+                Result of ``fn`` and the number of retries it took.
+                Результат ``fn`` и число потребовавшихся повторов.
+        """
+
+        deadline = time.monotonic() + deadline_s
+        attempt = 0
+        while True:
+            # Step 1: Admission
+            # Шаг 1: Допуск
+            with timing.stage("gemini_queue"):
+                self._acquire(priority, est_tokens, deadline)
+
+            # Step 2: Call
+            # Шаг 2: Вызов
+            try:
+                result = fn()
+            except Exception as e:
+                self._release()
+                if not is_retryable(e):
+                    raise
+                error = e
+            else:
+                return result, attempt
+
+            # Step 3: Backoff
+            # Шаг 3: Задержка
+            hint = _retry_after(error)
+            delay = max(hint, self._backoff(attempt))
+            if hint:
+                # Quota pushback applies to every caller, not just this one,
+                # отказ по квоте касается всех вызовов, а не только этого
+                with self._cond:
+                    self._paused_until = max(self._paused_until,
+                                             time.monotonic() + hint)
+            remaining = deadline - time.monotonic()
+            if attempt >= self.max_retries or delay >= remaining:
+                raise LLMUnavailable(f"Gemini unavailable: {error}",
+                                     retry_after=delay) from error
+            with self._cond:
+                if self._retry_budget < 1.0:
+                    raise LLMUnavailable(f"Gemini retry budget exhausted: {error}",
+                                         retry_after=delay) from error
+                self._retry_budget -= 1.0
+            timing.annotate(gemini_retries=1)
+            time.sleep(delay)
+            attempt += 1
+
+    def _backoff(self, attempt: int) -> float:
+        cap = min(self.max_delay_s, self.base_delay_s * (2 ** attempt))
+        return self._rng.uniform(0, cap)
+
+    def _acquire(self, priority: Priority, est_tokens: int, deadline: float) -> None:
+        ticket = (int(priority), next(self._counter))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait: Optional[float] = None
+                    if self._waiting[0] == ticket and self._inflight < self.concurrency:
+                        wait = max(self._paused_until - now,
+                                   self.requests.delay(1, now),
+                                   self.tokens.delay(est_tokens, now))
+                        if wait <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(est_tokens)
+                            self._inflight += 1
+                            return
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise LLMUnavailable("Gemini queue deadline exceeded",
+                                             retry_after=wait or 1.0)
+                    self._cond.wait(min(wait, remaining) if wait else remaining)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def _release(self, est_tokens: int = 0, used_tokens: Optional[int] = None,
+                 first: bool = False) -> None:
+        with self._cond:
+            self._inflight -= 1
+            if used_tokens is not None:
+                # Charge the difference between the estimate and real usage,
+                # списываем разницу между оценкой и фактическим расходом
+                self.tokens.take(used_tokens - est_tokens)
+            if first:
+                self._retry_budget = min(10.0, self._retry_budget + self.retry_ratio)
+            self._cond.notify_all()
+
+
+def is_retryable(error: Exception) -> bool:
+    """Tell quota, overload and transport errors from permanent ones.
+
+    Отличает ошибки квоты, перегрузки и транспорта от постоянных.
+    """
+
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in RETRYABLE_CODES:
+        return True
+    if str(getattr(error, "status", "") or "").upper() in RETRYABLE_STATUSES:
+        return True
+    # httpx transport errors and socket timeouts,
+    # транспортные ошибки httpx и тайм-ауты сокета
+    name = type(error).__name__
+    return isinstance(error, (ConnectionError, TimeoutError)) or name in {
+        "ConnectError", "ReadTimeout", "WriteTimeout", "ConnectTimeout",
+        "RemoteProtocolError", "ReadError",
+    }
+
+
+def _retry_after(error: Exception) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("retry-after") or 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _used_tokens(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None)
+    return int(total) if isinstance(total, int) else None
+
+
+def estimate_tokens(parts: List[dict], output_tokens: int = 1024) -> int:
+    """Rough token estimate: four characters per token plus expected output.
+
+    Грубая оценка токенов: четыре символа на токен плюс ожидаемый ответ.
+    """
+
+    chars = sum(len(p.get("text") or "") for p in parts or [])
+    # Attached files and images are billed at roughly a page's worth each,
+    # прикреплённые файлы и изображения считаются примерно как страница
+    media = sum(1 for p in parts or [] if "file_data" in p or "inline_data" in p)
+    return chars // 4 + media * 258 + output_tokens
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Return the process-wide scheduler configured from the environment.
+
+    Возвращает общий для процесса планировщик, настроенный из окружения.
+
+    Quota is split evenly across gunicorn workers (``WEB_CONCURRENCY``).
+    Квота делится поровну между воркерами gunicorn (``WEB_CONCURRENCY``).
+    """
+
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            from utilities.consts import (
+                GEMINI_CONCURRENCY,
+                GEMINI_MAX_RETRIES,
+                GEMINI_RPM,
+                GEMINI_TPM,
+            )
+
+            workers = max(1, int(os.getenv("WEB_CONCURRENCY") or "1"))
+            _scheduler = LLMScheduler(
+                rpm=GEMINI_RPM / workers,
+                tpm=GEMINI_TPM / workers,
+                concurrency=GEMINI_CONCURRENCY,
+                max_retries=GEMINI_MAX_RETRIES,
+            )
+        return _scheduler
@@ -0,0 +1,354 @@
+"""Schema-aware repair of slide reviews returned by the model.
+
+Восстановление оценок слайдов, возвращённых моделью, с учётом схемы.
+
+Most invalid answers are a formatting slip: a score as ``"85"`` or ``"8/10"``,
+a tip as a bare string, fenced JSON, one missing score. Those are coerced and
+clamped locally. Only fields that cannot be derived (no feedback, no main
+thoughts, too few negative formulations, unknown scores) are reported back, so
+the caller asks the model for just them in a small follow-up request instead
+of failing the whole review.
+
+Большинство некорректных ответов — ошибка оформления: балл в виде ``"85"`` или
+``"8/10"``, совет простой строкой, JSON в ограждении, один недостающий балл.
+Такое приводится к схеме и ограничивается локально. Возвращаются только поля,
+которые нельзя вывести (нет отзыва, нет основных мыслей, мало неудачных
+формулировок, неизвестные баллы), и вызывающий код запрашивает у модели только
+их небольшим дополнительным запросом, а не проваливает всю оценку.
+"""
+
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Fields of a normalized slide review,
+# поля нормализованной оценки слайда
+REVIEW_FIELDS = ("feedback", "tips", "mains", "negative", "scores")
+SCORE_KEYS = ("overall", "goal", "structure", "clarity", "delivery")
+MAX_PHRASES = 5
+
+_NUMBER = re.compile(r"-?\d+(?:[.,]\d+)?")
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+
+_stats = {"coerced": 0, "followups": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+def count(event: str) -> None:
+    """Increment a repair counter: ``coerced``, ``followups`` or ``failed``.
+
+    Увеличивает счётчик: ``coerced``, ``followups`` или ``failed``.
+    """
+
+    with _stats_lock:
+        _stats[event] = _stats.get(event, 0) + 1
+
+
+def stats() -> Dict[str, int]:
+    """Repair counters of this process.
+
+    Счётчики восстановления этого процесса.
+    """
+
+    with _stats_lock:
+        return dict(_stats)
+
+
+def parse_lenient(text: Optional[str]) -> Any:
+    """Parse model text as JSON, tolerating code fences and text around it.
+
+    Разбирает текст модели как JSON, допуская ограждение кода и текст вокруг.
+
+    Returns:
+
+        Any:
+            Parsed value, ``None`` when no JSON object is found.
+            Разобранное значение, ``None``, если объект JSON не найден.
+    """
+
+    if not text:
+        return None
+    text = _FENCE.sub("", text.strip())
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        for key in ("text", "value", "title"):
+            if isinstance(value.get(key), str):
+                return value[key].strip()
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return ""
+
+
+def coerce_score(value: Any) -> Optional[int]:
+    """Read a 0..100 score from a number or text such as ``"85%"`` or ``"8/10"``.
+
+    Читает балл 0..100 из числа или текста вида ``"85%"`` или ``"8/10"``.
+
+    Returns:
+
+        Optional[int]:
+            Clamped score, ``None`` when no number is present.
+            Ограниченный балл, ``None``, если числа нет.
+    """
+
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        found = _NUMBER.findall(str(value or ""))
+        if not found:
+            return None
+        number = float(found[0].replace(",", "."))
+        # "8/10" and "4 из 5" are scales, "8/10" и "4 из 5" — шкалы
+        if len(found) > 1 and re.search(r"/|из|of", str(value)):
+            scale = float(found[1].replace(",", "."))
+            if scale > 0:
+                number = number * 100.0 / scale
+    if number != number:
+        return None
+    return int(round(max(0.0, min(100.0, number))))
+
+
+def coerce_field(key: str, value: Any, tips_limit: int = 3,
+                 min_negative: int = 0) -> Any:
+    """Coerce one review field to the schema or raise when the model is needed.
+
+    Приводит одно поле оценки к схеме или сообщает, что нужна модель.
+
+    Args:
+
+        key (str):
+            One of ``REVIEW_FIELDS``.
+            Одно из ``REVIEW_FIELDS``.
+
+        value (Any):
+            Raw value from the model.
+            Исходное значение от модели.
+
+        tips_limit (int):
+            Max tips to keep.
+            Сколько советов оставить.
+
+        min_negative (int):
+            Required number of negative formulations.
+            Требуемое число неудачных формулировок.
+
+    Returns:
+
+        Any:
+            Normalized value; missing tips become an empty list and missing
+            scores that can be derived are filled.
+            Нормализованное значение; отсутствующие советы становятся пустым
+            списком, выводимые баллы заполняются.
+
+    Raises:
+
+        ValueError:
+            The field cannot be repaired without the model.
+            Поле нельзя восстановить без модели.
+    """
+
+    if key == "feedback":
+        if isinstance(value, list):
+            value = "\n".join(t for t in map(_text, value) if t)
+        text = _text(value)
+        if not text:
+            raise ValueError("Field 'feedback' must be a non-empty string")
+        return text
+    if key == "tips":
+        if isinstance(value, (str, dict)):
+            value = [value]
+        tips: List[Dict[str, str]] = []
+        for t in value if isinstance(value, list) else []:
+            if isinstance(t, dict):
+                title, text = _text(t.get("title")), _text(t.get("text"))
+            else:
+                title, text = "", _text(t)
+            if title or text:
+                tips.append({"title": title, "text": text or title})
+        return tips[:tips_limit]
+    if key in ("mains", "negative"):
+        if isinstance(value, str):
+            value = [line.lstrip("-•* ") for line in value.splitlines()]
+        phrases: List[str] = []
+        for v in value if isinstance(value, list) else []:
+            s = _text(v)
+            if s and s not in phrases:
+                phrases.append(s)
+        phrases = phrases[:MAX_PHRASES]
+        if key == "mains" and not phrases:
+            raise ValueError("Model did not return at least one main thought (mains)")
+        if key == "negative" and len(phrases) < min_negative:
+            raise ValueError("Model returned fewer negative formulations than required")
+        return phrases
+    if key == "scores":
+        scores, missing = coerce_scores(value)
+        if missing:
+            raise ValueError(f"Missing score: {', '.join(missing)}")
+        return scores
+    return value
+
+
+def coerce_scores(value: Any,
+                  measured: Optional[Dict[str, int]] = None
+                  ) -> Tuple[Dict[str, int], List[str]]:
+    """Coerce the scores block and list the scores that are still unknown.
+
+    Приводит блок баллов и перечисляет баллы, которые остаются неизвестными.
+
+    A missing ``overall`` is the mean of at least three known scores; scores in
+    ``measured`` (the measured delivery) fill or replace the model's.
+    Отсутствующий ``overall`` — среднее хотя бы трёх известных баллов; баллы из
+    ``measured`` (измеренная подача) заполняют или заменяют баллы модели.
+    """
+
+    raw = value if isinstance(value, dict) else {}
+    scores: Dict[str, int] = {}
+    for k in SCORE_KEYS:
+        score = coerce_score(raw.get(k)) if k in raw else None
+        if score is not None:
+            scores[k] = score
+    scores.update({k: int(v) for k, v in (measured or {}).items() if v is not None})
+    parts = [scores[k] for k in SCORE_KEYS if k != "overall" and k in scores]
+    if "overall" not in scores and len(parts) >= 3:
+        scores["overall"] = int(round(sum(parts) / len(parts)))
+    missing = [k for k in SCORE_KEYS if k not in scores]
+    return {k: scores[k] for k in SCORE_KEYS if k in scores}, missing
+
+
+def repair_review(data: Any, tips_limit: int = 3, min_negative: int = 0,
+                  measured: Optional[Dict[str, int]] = None
+                  ) -> Tuple[Dict[str, Any], List[str]]:
+    """Repair a whole review and list what only the model can supply.
+
+    Восстанавливает оценку целиком и перечисляет, что может дать только модель.
+
+    Args:
+
+        data (Any):
+            Parsed model output.
+            Разобранный ответ модели.
+
+        tips_limit (int):
+            Max tips to keep.
+            Сколько советов оставить.
+
+        min_negative (int):
+            Required number of negative formulations.
+            Требуемое число неудачных формулировок.
+
+        measured (Optional[Dict[str, int]]):
+            Scores measured locally, e.g. ``{"delivery": 72}``.
+            Баллы, измеренные локально, например ``{"delivery": 72}``.
+
+    Returns:
+
+        Tuple[Dict[str, Any], List[str]]:
+            Repaired fields and missing ones: top-level names, or
+            ``scores.<key>`` for single scores.
+            Восстановленные поля и недостающие: имена верхнего уровня или
+            ``scores.<ключ>`` для отдельных баллов.
+    """
+
+    data = data if isinstance(data, dict) else {}
+    review: Dict[str, Any] = {}
+    missing: List[str] = []
+    for key in REVIEW_FIELDS:
+        if key == "scores":
+            review[key], lost = coerce_scores(data.get(key), measured)
+            missing += [f"scores.{k}" for k in lost]
+            continue
+        try:
+            review[key] = coerce_field(key, data.get(key), tips_limit, min_negative)
+        except ValueError:
+            missing.append(key)
+    return review, missing
+
+
+def merge_followup(review: Dict[str, Any], answer: Any) -> Dict[str, Any]:
+    """Put the follow-up answer's fields into the partial review.
+
+    Вставляет поля дополнительного ответа в частичную оценку.
+    """
+
+    merged = dict(review)
+    if not isinstance(answer, dict):
+        return merged
+    for key, value in answer.items():
+        if key == "scores" and isinstance(value, dict):
+            merged["scores"] = {**value, **(review.get("scores") or {})}
+        elif key in REVIEW_FIELDS:
+            merged[key] = value
+    return merged
+
+
+def followup_schema(missing: List[str], min_negative: int) -> Dict[str, Any]:
+    """Structured-output schema asking only for ``missing`` fields.
+
+    Схема структурированного ответа, запрашивающая только поля ``missing``.
+    """
+
+    props: Dict[str, Any] = {}
+    scores = [m.split(".", 1)[1] for m in missing if m.startswith("scores.")]
+    if "feedback" in missing:
+        props["feedback"] = {"type": "string", "description": "Отзыв по слайду"}
+    if "mains" in missing:
+        props["mains"] = {"type": "array", "items": {"type": "string"}, "minItems": 1}
+    if "negative" in missing:
+        props["negative"] = {"type": "array", "items": {"type": "string"},
+                             "minItems": min_negative}
+    if scores:
+        props["scores"] = {
+            "type": "object",
+            "properties": {k: {"type": "integer", "minimum": 0, "maximum": 100}
+                           for k in scores},
+            "required": scores,
+        }
+    return {"type": "object", "properties": props, "required": list(props)}
+
+
+def followup_prompt(review: Dict[str, Any], missing: List[str],
+                    min_negative: int) -> str:
+    """Instruction of the follow-up request with the review written so far.
+
+    Инструкция дополнительного запроса с уже написанной частью оценки.
+    """
+
+    wanted = []
+    for m in missing:
+        if m == "feedback":
+            wanted.append("feedback — отзыв по слайду (строка)")
+        elif m == "mains":
+            wanted.append("mains — основные мысли (минимум 1)")
+        elif m == "negative":
+            wanted.append(f"negative — неудачные формулировки (минимум {min_negative})")
+        else:
+            wanted.append(f"{m} — целое число 0..100")
+    partial = json.dumps({k: v for k, v in review.items() if v},
+                         ensure_ascii=False)
+    return (
+        "[REPAIR]\n"
+        "Оценка этого слайда уже частично готова:\n"
+        f"{partial}\n"
+        "В ней не хватает полей: " + "; ".join(wanted) + ".\n"
+        "Верни строго JSON только с этими полями, согласованными с уже готовой "
+        "частью, на русском языке. Не добавляй ничего вне JSON."
+    )
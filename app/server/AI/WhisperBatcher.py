@@ -0,0 +1,429 @@
+"""Cross-session micro-batching of short Whisper transcriptions.
+
+Микропакетирование коротких транскрибаций Whisper между сессиями.
+
+Slide clips are usually shorter than Whisper's 30-second window, and
+``model.transcribe`` runs the encoder and decoder for each of them alone. The
+batcher collects clips submitted by any request for a few milliseconds, pads
+each to one mel window and runs a single batched ``whisper.decode`` pass for the
+group, then hands every waiting job its own segments. Clips whose greedy result
+fails Whisper's quality checks fall back to the regular ``transcribe`` with
+temperature fallback, so accuracy matches the unbatched path.
+
+Клипы слайдов обычно короче 30-секундного окна Whisper, а ``model.transcribe``
+запускает энкодер и декодер для каждого из них отдельно. Пакетировщик несколько
+миллисекунд собирает клипы от любых запросов, дополняет каждый до одного окна
+мел-спектрограммы и выполняет для группы один пакетный проход
+``whisper.decode``, после чего возвращает каждой ожидающей задаче её сегменты.
+Клипы, чей жадный результат не прошёл проверки качества Whisper, повторяются
+обычным ``transcribe`` с температурным откатом, поэтому точность совпадает с
+путём без пакетирования.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utilities import timing
+from utilities.cpu_budget import get_budget
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# One Whisper window, одно окно Whisper
+CHUNK_S = 30
+# Seconds per timestamp token, секунд на токен метки времени
+TIME_PRECISION = 0.02
+
+# Quality checks of ``whisper.transcribe``, проверки качества ``whisper.transcribe``
+COMPRESSION_RATIO_MAX = 2.4
+LOGPROB_MIN = -1.0
+NO_SPEECH_PROB = 0.6
+
+# Defaults of ``whisper.transcribe`` for word timestamps,
+# значения ``whisper.transcribe`` по умолчанию для меток слов
+PREPEND_PUNCTUATIONS = "\"'“¿([{-"
+APPEND_PUNCTUATIONS = "\"'.。,，!！?？:：”)]}、"
+
+# (model, clips, language, word_timestamps) -> one result per clip,
+# (модель, клипы, язык, метки слов) -> по результату на клип
+BatchRunner = Callable[[Any, List[np.ndarray], str, bool], List[Dict[str, Any]]]
+
+
+def _segments_from_tokens(tokens: List[int], tokenizer: Any, duration: float,
+                          result: Any) -> List[Dict[str, Any]]:
+    """Split one window's tokens into segments the way ``transcribe`` does.
+
+    Делит токены одного окна на сегменты так же, как ``transcribe``.
+
+    Pairs of consecutive timestamp tokens close a segment; a window without
+    them becomes one segment up to its last timestamp or the clip end.
+    Пары соседних токенов времени закрывают сегмент; окно без них становится
+    одним сегментом до последней метки или конца клипа.
+    """
+
+    begin = tokenizer.timestamp_begin
+    is_ts = [t >= begin for t in tokens]
+
+    def segment(start: float, end: float, part: List[int]) -> Dict[str, Any]:
+        text = tokenizer.decode([t for t in part if t < tokenizer.eot])
+        return {
+            "seek": 0,
+            "start": round(min(start, duration), 3),
+            "end": round(min(max(end, start), duration), 3),
+            "text": text,
+            "tokens": part,
+            "temperature": result.temperature,
+            "avg_logprob": result.avg_logprob,
+            "compression_ratio": result.compression_ratio,
+            "no_speech_prob": result.no_speech_prob,
+        }
+
+    cuts = [i for i in range(1, len(tokens)) if is_ts[i] and is_ts[i - 1]]
+    segments = []
+    if cuts:
+        if len(is_ts) >= 2 and is_ts[-1] and not is_ts[-2]:
+            cuts.append(len(tokens))
+        last = 0
+        for cut in cuts:
+            part = tokens[last:cut]
+            segments.append(segment((part[0] - begin) * TIME_PRECISION,
+                                    (part[-1] - begin) * TIME_PRECISION, part))
+            last = cut
+    else:
+        stamps = [t for t in tokens if t >= begin]
+        end = duration
+        if stamps and stamps[-1] != begin:
+            end = (stamps[-1] - begin) * TIME_PRECISION
+        segments.append(segment(0.0, end, tokens))
+    segments = [s for s in segments if s["text"].strip()]
+    for i, s in enumerate(segments):
+        s["id"] = i
+    return segments
+
+
+def decode_batch(model: Any, clips: List[np.ndarray], language: str,
+                 word_timestamps: bool) -> List[Dict[str, Any]]:
+    """Transcribe clips of at most one window each in one batched pass.
+
+    Транскрибирует клипы длиной не больше окна за один пакетный проход.
+
+    Pipeline:
+
+        1. Log-mel of each clip padded like the first window of ``transcribe``.
+           Лог-мел каждого клипа с дополнением, как в первом окне ``transcribe``.
+
+        2. One greedy ``whisper.decode`` over the stacked windows: a single
+           encoder pass and batched decoder steps.
+           Один жадный ``whisper.decode`` по сложенным окнам: один проход
+           энкодера и пакетные шаги декодера.
+
+        3. Silence is dropped, results failing the quality checks are redone
+           by ``transcribe``, the rest are split into segments (and words).
+           Тишина отбрасывается, не прошедшие проверки результаты
+           пересчитываются ``transcribe``, остальные делятся на сегменты (и
+           слова).
+
+    Args:
+
+        model (Any):
+            Loaded ``whisper.model.Whisper``.
+            Загруженная ``whisper.model.Whisper``.
+
+        clips (List[np.ndarray]):
+            Mono 16 kHz float32 samples, each at most ``CHUNK_S`` long.
+            Моно-отсчёты 16 кГц float32, каждый не длиннее ``CHUNK_S``.
+
+        language (str):
+            Language code.
+            Код языка.
+
+        word_timestamps (bool):
+            Add ``words`` to each segment.
+            Добавлять ``words`` в каждый сегмент.
+
+    Returns:
+
+        List[Dict[str, Any]]:
+            ``{"text", "segments", "language"}`` per clip, like ``transcribe``.
+            ``{"text", "segments", "language"}`` на клип, как у ``transcribe``.
+    """
+
+    import torch
+    from whisper.audio import HOP_LENGTH, N_FRAMES, N_SAMPLES, log_mel_spectrogram
+    from whisper.decoding import DecodingOptions, decode
+    from whisper.timing import add_word_timestamps
+    from whisper.tokenizer import get_tokenizer
+
+    # Step 1: One padded mel window per clip
+    # Шаг 1: По одному дополненному окну мел-спектрограммы на клип
+    tokenizer = get_tokenizer(model.is_multilingual,
+                              num_languages=model.num_languages,
+                              language=language, task="transcribe")
+    mels = [log_mel_spectrogram(clip, model.dims.n_mels,
+                                padding=N_SAMPLES)[:, :N_FRAMES] for clip in clips]
+
+    # Step 2: Batched greedy decode
+    # Шаг 2: Пакетное жадное декодирование
+    options = DecodingOptions(language=language, task="transcribe",
+                              temperature=0.0, fp16=False)
+    with torch.no_grad():
+        results = decode(model, torch.stack(mels).to(model.device), options)
+
+    # Step 3: Per-clip segments, silence and fallback
+    # Шаг 3: Сегменты каждого клипа, тишина и откат
+    out = []
+    for clip, mel, res in zip(clips, mels, results):
+        if res.no_speech_prob > NO_SPEECH_PROB and res.avg_logprob <= LOGPROB_MIN:
+            out.append({"text": "", "segments": [], "language": language})
+            continue
+        if (res.compression_ratio > COMPRESSION_RATIO_MAX
+                or res.avg_logprob < LOGPROB_MIN):
+            out.append(model.transcribe(clip, language=language, fp16=False,
+                                        word_timestamps=word_timestamps))
+            continue
+        segments = _segments_from_tokens(list(res.tokens), tokenizer,
+                                         len(clip) / SAMPLE_RATE, res)
+        if word_timestamps and segments:
+            add_word_timestamps(
+                segments=segments, model=model, tokenizer=tokenizer, mel=mel,
+                num_frames=len(clip) // HOP_LENGTH,
+                prepend_punctuations=PREPEND_PUNCTUATIONS,
+                append_punctuations=APPEND_PUNCTUATIONS,
+                last_speech_timestamp=0.0,
+            )
+        out.append({"text": "".join(s["text"] for s in segments),
+                    "segments": segments, "language": language})
+    return out
+
+
+class _Job:
+    def __init__(self, model: Any, samples: np.ndarray, language: str,
+                 word_timestamps: bool, lock: Any):
+        self.model = model
+        self.lock = lock
+        self.samples = samples
+        self.language = language
+        self.word_timestamps = word_timestamps
+        self.future: Future = Future()
+
+    @property
+    def group(self) -> Tuple[int, str, bool]:
+        return id(self.model), self.language, self.word_timestamps
+
+
+class WhisperBatcher:
+    """Collect short clips from all requests and decode them in batches.
+
+    Собирает короткие клипы всех запросов и декодирует их пакетами.
+    """
+
+    def __init__(self, window_ms: float = 20.0, max_batch: int = 8,
+                 enabled: bool = True, run_batch: BatchRunner = decode_batch):
+        """Create the batcher; its thread starts on the first clip.
+
+        Создаёт пакетировщик; его поток запускается с первым клипом.
+
+        Args:
+
+            window_ms (float):
+                How long the first clip of a batch waits for company.
+                Сколько первый клип пакета ждёт попутчиков.
+
+            max_batch (int):
+                Most clips decoded in one pass.
+                Наибольшее число клипов в одном проходе.
+
+            enabled (bool):
+                When false ``accepts`` is always false.
+                Если false, ``accepts`` всегда ложно.
+
+            run_batch (BatchRunner):
+                Batched decoder, ``decode_batch`` by default.
+                Пакетный декодер, по умолчанию ``decode_batch``.
+        """
+
+        self.enabled = enabled
+        self.window_s = max(0.0, float(window_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.run_batch = run_batch
+        self._queue: Deque[_Job] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"batches": 0, "clips": 0, "largest": 0, "audio_s": 0.0,
+                       "busy_s": 0.0, "failed": 0}
+
+    def accepts(self, samples: Any) -> bool:
+        """Whether a clip fits one window and can join a batch.
+
+        Помещается ли клип в одно окно и может ли войти в пакет.
+        """
+
+        return (self.enabled and isinstance(samples, np.ndarray)
+                and 0 < len(samples) <= CHUNK_S * SAMPLE_RATE)
+
+    def transcribe(self, model: Any, samples: np.ndarray, language: str,
+                   word_timestamps: bool = False, lock: Any = None
+                   ) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        """Queue a clip and block until its batch is decoded.
+
+        Ставит клип в очередь и ждёт, пока его пакет будет декодирован.
+
+        Args:
+
+            model (Any):
+                Loaded Whisper model; clips batch only with the same model.
+                Загруженная модель Whisper; пакет собирается только по одной
+                модели.
+
+            samples (np.ndarray):
+                Mono 16 kHz float32 samples of at most one window.
+                Моно-отсчёты 16 кГц float32 не длиннее одного окна.
+
+            language (str):
+                Language code.
+                Код языка.
+
+            word_timestamps (bool):
+                Add ``words`` to the segments.
+                Добавлять ``words`` в сегменты.
+
+            lock (Any):
+                The model's decode lock (``whisper_decode_lock``), held for the
+                whole batch including its ``transcribe`` fallbacks; ``None``
+                when the caller owns the model.
+                Блокировка декодирования модели (``whisper_decode_lock``),
+                удерживаемая на весь пакет вместе с откатами на ``transcribe``;
+                ``None``, если модель принадлежит только вызывающему.
+
+        Returns:
+
+            Tuple[Dict[str, Any], Dict[str, int]]:
+                ``{"text", "segments", "language"}`` like ``transcribe`` and
+                ``{"batch", "threads"}`` of the pass that decoded it.
+                ``{"text", "segments", "language"}``, как у ``transcribe``, и
+                ``{"batch", "threads"}`` прохода, который его декодировал.
+
+        Raises:
+
+            Exception:
+                Whatever the batched pass raised; the caller may retry alone.
+                Исключение пакетного прохода; вызывающий может повторить
+                клип отдельно.
+        """
+
+        job = _Job(model, np.asarray(samples, dtype=np.float32), language,
+                   word_timestamps, lock)
+        with self._cond:
+            self._queue.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True,
+                                                 name="whisper-batch")
+                self._thread.start()
+            self._cond.notify_all()
+        with timing.stage("whisper"):
+            result, info = job.future.result()
+        timing.annotate(whisper_batch=info["batch"])
+        return result, info
+
+    def _take(self) -> List[_Job]:
+        # Wait for a clip, then up to window_s for more of the same group,
+        # ждём клип, затем до window_s ещё клипов той же группы
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window_s
+            group = self._queue[0].group
+            while True:
+                same = sum(1 for j in self._queue if j.group == group)
+                left = deadline - time.monotonic()
+                if same >= self.max_batch or left <= 0:
+                    break
+                self._cond.wait(left)
+            batch = [j for j in self._queue if j.group == group][:self.max_batch]
+            for job in batch:
+                self._queue.remove(job)
+            return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._take()
+            first = batch[0]
+            t0 = time.perf_counter()
+            try:
+                # One group shares a model and so its lock, taken before the lease,
+                # у группы одна модель и одна блокировка, берётся до аренды
+                with first.lock or nullcontext(), \
+                        get_budget().torch_lease("whisper") as threads:
+                    results = self.run_batch(first.model,
+                                             [j.samples for j in batch],
+                                             first.language, first.word_timestamps)
+                info = {"batch": len(batch), "threads": threads}
+                for job, result in zip(batch, results):
+                    job.future.set_result((result, info))
+                outcome = "ok"
+            except Exception as e:
+                # Each job falls back to its own transcribe call,
+                # каждая задача переходит на собственный вызов transcribe
+                logger.exception("whisper batch of %d failed", len(batch))
+                for job in batch:
+                    job.future.set_exception(e)
+                outcome = "failed"
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["clips"] += len(batch)
+                self._stats["largest"] = max(self._stats["largest"], len(batch))
+                self._stats["audio_s"] += sum(len(j.samples)
+                                              for j in batch) / SAMPLE_RATE
+                self._stats["busy_s"] += time.perf_counter() - t0
+                if outcome == "failed":
+                    self._stats["failed"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Settings, queue length and batch counters for diagnostics.
+
+        Настройки, длина очереди и счётчики пакетов для диагностики.
+        """
+
+        with self._cond:
+            stats = dict(self._stats)
+            pending = len(self._queue)
+        batches = stats["batches"]
+        return {
+            "enabled": self.enabled,
+            "windowMs": round(self.window_s * 1000.0, 1),
+            "maxBatch": self.max_batch,
+            "pending": pending,
+            "meanBatch": round(stats["clips"] / batches, 2) if batches else None,
+            "audioSPerBusyS": round(stats["audio_s"] / stats["busy_s"], 2)
+            if stats["busy_s"] else None,
+            **{k: round(v, 2) if isinstance(v, float) else v
+               for k, v in stats.items()},
+        }
+
+
+_batcher: Optional[WhisperBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> WhisperBatcher:
+    """Return this process's batcher configured from ``utilities.consts``.
+
+    Возвращает пакетировщик процесса с настройками из ``utilities.consts``.
+    """
+
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            from utilities.consts import (WHISPER_BATCHING, WHISPER_BATCH_WINDOW_MS,
+                                          WHISPER_MAX_BATCH)
+
+            _batcher = WhisperBatcher(WHISPER_BATCH_WINDOW_MS, WHISPER_MAX_BATCH,
+                                      WHISPER_BATCHING)
+        return _batcher
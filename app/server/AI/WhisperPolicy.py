@@ -0,0 +1,203 @@
+"""Load-adaptive choice of the Whisper model size per transcription job.
+
+Адаптивный выбор размера модели Whisper для каждой задачи транскрибации.
+
+For each job the policy estimates when it would finish with every allowed model:
+the work already queued in this process plus the clip duration times the
+model's measured realtime factor (plus a load cost for models not yet in
+memory). It picks the largest model that fits the latency budget and falls back
+to the smallest allowed one under peak load.
+
+Для каждой задачи политика оценивает время завершения с каждой разрешённой
+моделью: уже поставленная в процессе работа плюс длительность клипа, умноженная
+на измеренный коэффициент реального времени модели (плюс стоимость загрузки,
+если модели ещё нет в памяти). Выбирается самая крупная модель, укладывающаяся в
+бюджет задержки, а при пиковой нагрузке — самая маленькая из разрешённых.
+"""
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from utilities.consts import WhisperModelsENUM
+
+# Smallest to largest, от меньшей к большей
+LADDER: List[WhisperModelsENUM] = list(WhisperModelsENUM)
+
+# Starting CPU realtime factors (seconds of work per second of audio) and load
+# times; replaced by measurements as jobs complete,
+# начальные коэффициенты реального времени на CPU и время загрузки; заменяются
+# измерениями по мере выполнения задач
+PRIOR_RTF: Dict[str, float] = {
+    "tiny": 0.15, "base": 0.3, "small": 0.9, "medium": 2.5, "large": 5.0,
+}
+PRIOR_LOAD_S: Dict[str, float] = {
+    "tiny": 1.0, "base": 2.0, "small": 6.0, "medium": 20.0, "large": 45.0,
+}
+# Used when the clip duration cannot be probed,
+# используется, если длительность клипа определить не удалось
+DEFAULT_CLIP_S = 60.0
+
+
+class WhisperPolicy:
+    """Pick a model per job from queue depth, clip length and measured speed.
+
+    Выбирает модель для задачи по глубине очереди, длине клипа и измеренной
+    скорости.
+    """
+
+    def __init__(self, min_model: str, max_model: str, budget_s: float,
+                 alpha: float = 0.3):
+        """Create the policy.
+
+        Создаёт политику.
+
+        Args:
+
+            min_model (str):
+                Lowest quality allowed, used under peak load.
+                Минимально допустимое качество, используется при пиковой нагрузке.
+
+            max_model (str):
+                Highest quality allowed, used when the server is quiet.
+                Максимально допустимое качество, используется при низкой нагрузке.
+
+            budget_s (float):
+                Target time from job start to transcript.
+                Целевое время от начала задачи до транскрипта.
+
+            alpha (float):
+                Weight of the newest realtime-factor sample.
+                Вес нового замера коэффициента реального времени.
+        """
+
+        lo = LADDER.index(WhisperModelsENUM(min_model))
+        hi = LADDER.index(WhisperModelsENUM(max_model))
+        self.models = LADDER[min(lo, hi):max(lo, hi) + 1]
+        self.budget_s = budget_s
+        self.alpha = alpha
+        self._rtf: Dict[str, float] = dict(PRIOR_RTF)
+        self._samples: Dict[str, int] = {}
+        self._inflight: Dict[int, float] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def backlog_s(self) -> float:
+        """Estimated seconds of Whisper work already running or queued here.
+
+        Оценка секунд работы Whisper, уже выполняемой или ожидающей здесь.
+        """
+
+        with self._lock:
+            return sum(self._inflight.values())
+
+    def choose(self, clip_s: Optional[float],
+               loaded: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Pick the largest model expected to finish within the budget.
+
+        Выбирает самую крупную модель, которая должна уложиться в бюджет.
+
+        Args:
+
+            clip_s (Optional[float]):
+                Clip duration in seconds, ``None`` when unknown.
+                Длительность клипа в секундах, ``None``, если неизвестна.
+
+            loaded (Optional[List[str]]):
+                Models already in memory; others pay their load time.
+                Модели, уже загруженные в память; остальные платят за загрузку.
+
+        Returns:
+
+            Dict[str, Any]:
+                ``model``, ``estimate_s``, ``backlog_s``, ``queue_depth``,
+                ``clip_s`` and ``reason`` for the transcript record.
+                ``model``, ``estimate_s``, ``backlog_s``, ``queue_depth``,
+                ``clip_s`` и ``reason`` для записи в транскрипт.
+        """
+
+        clip = float(clip_s) if clip_s else DEFAULT_CLIP_S
+        loaded_set = set(loaded or [])
+        with self._lock:
+            backlog = sum(self._inflight.values())
+            depth = len(self._inflight)
+            estimates = {
+                str(m): backlog + clip * self._rtf[str(m)]
+                + (0.0 if str(m) in loaded_set else PRIOR_LOAD_S[str(m)])
+                for m in self.models
+            }
+        fitting = [m for m in self.models if estimates[str(m)] <= self.budget_s]
+        model = fitting[-1] if fitting else self.models[0]
+        return {
+            "model": str(model),
+            "estimate_s": round(estimates[str(model)], 2),
+            "backlog_s": round(backlog, 2),
+            "queue_depth": depth,
+            "clip_s": round(clip, 2) if clip_s else None,
+            "budget_s": self.budget_s,
+            "reason": "fits_budget" if fitting else "over_budget_min_model",
+        }
+
+    @contextmanager
+    def job(self, model: str, clip_s: Optional[float]) -> Iterator[Dict[str, Any]]:
+        """Count a job in the backlog while it runs and learn its realtime factor.
+
+        Учитывает задачу в очереди на время выполнения и запоминает её
+        коэффициент реального времени.
+
+        Yields a dict that receives ``elapsed_s`` and ``rtf`` on success. Model
+        load time the job stores in it as ``load_s`` is left out of both.
+        Отдаёт словарь, в который при успехе записываются ``elapsed_s`` и ``rtf``.
+        Время загрузки модели, записанное задачей в него как ``load_s``, в них
+        не входит.
+        """
+
+        clip = float(clip_s) if clip_s else DEFAULT_CLIP_S
+        with self._lock:
+            job_id = next(self._ids)
+            self._inflight[job_id] = clip * self._rtf[str(model)]
+        started = time.monotonic()
+        record: Dict[str, Any] = {}
+        try:
+            yield record
+            elapsed = time.monotonic() - started - float(record.get("load_s") or 0)
+            record["elapsed_s"] = round(elapsed, 2)
+            if clip_s:
+                rtf = elapsed / float(clip_s)
+                record["rtf"] = round(rtf, 3)
+                self.observe(str(model), rtf)
+        finally:
+            with self._lock:
+                self._inflight.pop(job_id, None)
+
+    def observe(self, model: str, rtf: float) -> None:
+        """Blend a measured realtime factor into the model's estimate.
+
+        Учитывает измеренный коэффициент реального времени в оценке модели.
+        """
+
+        with self._lock:
+            n = self._samples.get(model, 0)
+            # The first sample replaces the prior outright,
+            # первый замер полностью заменяет начальную оценку
+            weight = 1.0 if n == 0 else self.alpha
+            self._rtf[model] = (1 - weight) * self._rtf[model] + weight * rtf
+            self._samples[model] = n + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current bounds, realtime factors and backlog for diagnostics.
+
+        Текущие границы, коэффициенты реального времени и очередь для диагностики.
+        """
+
+        with self._lock:
+            return {
+                "models": [str(m) for m in self.models],
+                "budget_s": self.budget_s,
+                "rtf": {str(m): round(self._rtf[str(m)], 3) for m in self.models},
+                "samples": dict(self._samples),
+                "queue_depth": len(self._inflight),
+                "backlog_s": round(sum(self._inflight.values()), 2),
+            }
@@ -0,0 +1,181 @@
+"""Export and memory-map Whisper weights so processes share one copy.
+
+Экспорт и отображение весов Whisper в память, чтобы процессы делили одну копию.
+
+Whisper checkpoints ship in FP16 and ``whisper.load_model`` copies them into an
+FP32 model, so every process owns private weight pages. An FP32 checkpoint
+loaded with ``torch.load(mmap=True)`` and ``load_state_dict(assign=True)``
+keeps parameters backed by the page cache of one file, shared by all workers.
+
+Чекпойнты Whisper хранятся в FP16, и ``whisper.load_model`` копирует их в
+FP32-модель, поэтому у каждого процесса свои страницы весов. FP32-чекпойнт,
+загруженный через ``torch.load(mmap=True)`` и ``load_state_dict(assign=True)``,
+оставляет параметры в страничном кеше одного файла, общем для всех воркеров.
+
+Usage / Использование (from ``app/server``):
+
+    python -m AI.WhisperWeights tiny /models/whisper
+"""
+
+import sys
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Optional
+
+from utilities.consts import WhisperModelsENUM
+
+
+def weights_path(weights_dir: str, model: WhisperModelsENUM) -> Path:
+    """Return the FP32 checkpoint path for a model inside a directory.
+
+    Возвращает путь к FP32-чекпойнту модели внутри каталога.
+
+    Args:
+
+        weights_dir (str):
+            Directory with exported checkpoints.
+            Каталог с экспортированными чекпойнтами.
+
+        model (WhisperModelsENUM):
+            Model size.
+            Размер модели.
+
+    Returns:
+
+        Path:
+            ``<weights_dir>/<model>-fp32.pt``.
+            ``<weights_dir>/<model>-fp32.pt``.
+    """
+
+    return Path(weights_dir) / f"{WhisperModelsENUM(model)}-fp32.pt"
+
+
+def export_fp32(model: WhisperModelsENUM, weights_dir: str) -> Path:
+    """Download a Whisper model and save it as an mmap-friendly FP32 checkpoint.
+
+    Загружает модель Whisper и сохраняет её как FP32-чекпойнт для mmap.
+
+    Pipeline:
+
+        1. Load the model through ``whisper.load_model``.
+           Загружаем модель через ``whisper.load_model``.
+
+        2. Save dims and the FP32 state dict in the zip format.
+           Сохраняем размеры и FP32 state dict в zip-формате.
+
+    Args:
+
+        model (WhisperModelsENUM):
+            Model size.
+            Размер модели.
+
+        weights_dir (str):
+            Output directory.
+            Каталог для результата.
+
+    Returns:
+
+        Path:
+            Written checkpoint.
+            Записанный чекпойнт.
+    """
+
+    import torch
+    import whisper
+
+    # Step 1: Load through the regular path
+    # Шаг 1: Загружаем обычным способом
+    name = str(WhisperModelsENUM(model))
+    loaded = whisper.load_model(name, device="cpu").float()
+
+    # Step 2: Persist FP32 weights
+    # Шаг 2: Сохраняем FP32-веса
+    out = weights_path(weights_dir, model)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(
+        {"dims": asdict(loaded.dims), "model_state_dict": loaded.state_dict()},
+        str(out),
+    )
+    return out
+
+
+def load_mmap(model: WhisperModelsENUM, weights_dir: str) -> Optional[Any]:
+    """Build a Whisper model whose parameters are memory-mapped from disk.
+
+    Строит модель Whisper, параметры которой отображены в память с диска.
+
+    Pipeline:
+
+        1. Skip if the exported checkpoint does not exist.
+           Пропускаем, если экспортированного чекпойнта нет.
+
+        2. ``torch.load`` with ``mmap=True`` and assign tensors in place.
+           ``torch.load`` с ``mmap=True`` и присваиваем тензоры без копий.
+
+        3. Restore alignment heads used for word timestamps.
+           Восстанавливаем головы выравнивания для меток слов.
+
+    Args:
+
+        model (WhisperModelsENUM):
+            Model size.
+            Размер модели.
+
+        weights_dir (str):
+            Directory with exported checkpoints.
+            Каталог с экспортированными чекпойнтами.
+
+    Returns:
+
+        Optional[Any]:
+            ``whisper.model.Whisper`` or ``None`` if no checkpoint exists.
+            ``whisper.model.Whisper`` или ``None``, если чекпойнта нет.
+    """
+
+    # Step 1: Locate checkpoint
+    # Шаг 1: Ищем чекпойнт
+    path = weights_path(weights_dir, model)
+    if not path.exists():
+        return None
+
+    import torch
+    import whisper
+    from whisper.model import ModelDimensions, Whisper
+
+    # Step 2: Map weights without copying
+    # Шаг 2: Отображаем веса без копирования
+    ckpt = torch.load(str(path), map_location="cpu", mmap=True, weights_only=True)
+    with torch.device("meta"):
+        net = Whisper(ModelDimensions(**ckpt["dims"]))
+    net.load_state_dict(ckpt["model_state_dict"], assign=True)
+    net.eval()
+
+    # Step 3: Alignment heads
+    # Шаг 3: Головы выравнивания
+    name = str(WhisperModelsENUM(model))
+    heads = getattr(whisper, "_ALIGNMENT_HEADS", {}).get(name)
+    if heads:
+        net.set_alignment_heads(heads)
+    return net
+
+
+def main(argv: Optional[list] = None) -> int:
+    """Export FP32 checkpoints: ``python -m AI.WhisperWeights <model> <dir>``.
+
+    Экспортирует FP32-чекпойнты: ``python -m AI.WhisperWeights <model> <dir>``.
+    """
+
+    args = argv if argv is not None else sys.argv[1:]
+    if len(args) != 2:
+        print("usage: python -m AI.WhisperWeights <model|all> <dir>",
+              file=sys.stderr)
+        return 2
+    models = (list(WhisperModelsENUM) if args[0] == "all"
+              else [WhisperModelsENUM(args[0])])
+    for m in models:
+        print(export_fp32(m, args[1]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,112 @@
+import hashlib
 import os
+import re
 import shutil
+import sys
+import threading
 import uuid
+from urllib.parse import quote
 import subprocess
 from pathlib import Path
-from typing import List, Any
+from typing import List, Any, AsyncIterator, Dict, Iterator, Optional, Tuple
 import time
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+import anyio
+from fastapi import FastAPI, HTTPException, Form, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pdf2image import convert_from_path
 
-from AI.AudioToText import AudioToText
-from utilities.consts import SupportedLanguagesCodesEnum, WhisperModelsENUM, GeminiModelsEnum, ANALIZE_PDF, DISABLE_TRANSCRIPTION, DEV_MODE
+from AI.AudioToText import (
+    AudioToText,
+    load_whisper_model,
+    loaded_whisper_models,
+    unload_whisper_models,
+)
+from AI.WhisperBatcher import get_batcher
+from AI.ChunkedTranscription import get_pool as get_chunk_pool
+from utilities.consts import (
+    SupportedLanguagesCodesEnum,
+    SupportedExtensionsEnum,
+    WhisperModelsENUM,
+    GeminiModelsEnum,
+    ANALIZE_PDF,
+    DISABLE_TRANSCRIPTION,
+    DEV_MODE,
+    PRELOAD_MODELS,
+    WHISPER_PRELOAD_MODEL,
+    MAX_DECK_BYTES,
+    MAX_AUDIO_BYTES,
+    UPLOAD_TTL_HOURS,
+    LAZY_RENDER,
+    RENDER_AHEAD,
+    RENDER_DPI,
+    RENDER_WORKERS,
+    PDF_CONTEXT_MODE,
+    SLIDE_THUMBNAILS,
+    GEMINI_FILE_WAIT_S,
+    GEMINI_FILE_REFRESH_HOURS,
+    WHISPER_MIN_MODEL,
+    WHISPER_MAX_MODEL,
+    WHISPER_LATENCY_BUDGET_S,
+    AUDIO_REMUX,
+    AUDIO_REMUX_CODECS,
+    SPECULATIVE_REVIEW,
+    SPECULATIVE_REVIEW_WORKERS,
+    DELIVERY_METRICS,
+    ADMISSION_CONTROL,
+    ADMISSION_LIMITS,
+    ADMISSION_RETRY_MAX_S,
+    MEMORY_HIGH_WATERMARK,
+    MEMORY_CRITICAL_WATERMARK,
+    ACCEL_REDIRECT_PREFIX,
+    RENDER_MEMORY_MB,
+    PIPELINE_WORKERS,
+)
 from AI.AskGemini import AskGemini
+from AI import ReviewRepair
+from AI.GeminiFiles import GeminiFileRegistry, file_sha256
+from AI.LLMScheduler import LLMUnavailable, Priority
+from AI.WhisperPolicy import WhisperPolicy
+from utilities import pages as page_cache
+from utilities.admission import (AdmissionController, AdmissionMiddleware, Overloaded,
+                                 overloaded_body, parse_limits)
+from utilities import singleflight
+from utilities.cpu_budget import get_budget
+from utilities.memory import get_governor
+from utilities.pipeline import ArtifactGraph, Node
+from utilities import slide_context
+from utilities.speculation import Speculator
+from utilities import timing
+from utilities.timing import ServerTimingMiddleware
+from utilities.uploads import (
+    ResumableStore,
+    UploadError,
+    append_stream,
+    check_content_length,
+    receive_multipart,
+)
 import json
 
 BASE_DIR = Path(__file__).parent.resolve()
-DATA_DIR = BASE_DIR / "data"
+DATA_DIR = Path(os.getenv("DATA_DIR") or BASE_DIR / "data").resolve()
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 app = FastAPI(title="API конвертации слайдов")
 
+# Per-stage concurrency, bounded queues and memory watermarks; overload is answered
+# with 429 + Retry-After. Registered first so it runs innermost and its rejections
+# still carry CORS and Server-Timing headers
+admission = AdmissionController(
+    parse_limits(ADMISSION_LIMITS),
+    high_watermark=MEMORY_HIGH_WATERMARK,
+    critical_watermark=MEMORY_CRITICAL_WATERMARK,
+    retry_cap_s=ADMISSION_RETRY_MAX_S,
+    enabled=ADMISSION_CONTROL,
+)
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # CORS for local dev
 origins = [
     "http://localhost:3000",
@@ -34,15 +118,171 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
 
+# Per-request stage breakdown and per-session timing ledger
+app.add_middleware(ServerTimingMiddleware, data_dir=DATA_DIR)
+
 # Serve generated images
-app.mount("/images", StaticFiles(directory=str(DATA_DIR)), name="images")
+images_static = StaticFiles(directory=str(DATA_DIR))
+
+
+def _artifact_path(session_id: str, rel: str) -> Optional[Path]:
+    """Resolve a session artifact, or None if it is outside the session or missing.
+
+    Находит артефакт сессии или возвращает None, если он вне сессии или отсутствует.
+    """
+    parts = rel.split("/")
+    if not session_id.isalnum() or any(not p or p.startswith(".") for p in parts):
+        return None
+    path = DATA_DIR / session_id / rel
+    return path if path.is_file() else None
+
+
+async def _serve_artifact(session_id: str, rel: str, request: Request):
+    """Send a session file: an X-Accel-Redirect for nginx if enabled, else from Python.
+
+    Отдаёт файл сессии: X-Accel-Redirect для nginx, если включено, иначе из Python.
+    """
+    # Also keeps _uploads, _gemini and .locks out of reach of direct hits on :5000
+    if _artifact_path(session_id, rel) is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Only nginx announces it can follow the redirect; direct hits on :5000 get bytes
+    sendfile = request.headers.get("x-sendfile-type", "").lower()
+    if not ACCEL_REDIRECT_PREFIX or sendfile != "x-accel-redirect":
+        return await images_static.get_response(f"{session_id}/{rel}", request.scope)
+    # nginx sends the file from the shared volume; its mime.types sets Content-Type
+    target = ACCEL_REDIRECT_PREFIX + quote(f"{session_id}/{rel}")
+    return Response(headers={"X-Accel-Redirect": target})
+
+
+# Registered before the generic /images route so slide PNGs of lazily rendered decks
+# are produced on first request; afterwards this is a plain static file serve
+@app.api_route("/images/{session_id}/slides/{name}", methods=["GET", "HEAD"])
+async def slide_image(session_id: str, name: str, request: Request):
+    m = re.fullmatch(r"slide-(\d+)\.png", name)
+    if not session_id.isalnum() or not m:
+        return await _serve_artifact(session_id, f"slides/{name}", request)
+    slides_dir = DATA_DIR / session_id / "slides"
+    page = int(m.group(1))
+    if not page_cache.slide_path(slides_dir, page).exists():
+        timing.annotate(session_id=session_id)
+        try:
+            await run_in_threadpool(page_cache.render_page, slides_dir, page)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Not Found")
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Ошибка рендеринга слайда: {e}"
+            )
+    page_cache.render_ahead(slides_dir, page, RENDER_AHEAD, RENDER_WORKERS)
+    return await _serve_artifact(session_id, f"slides/{name}", request)
+
+
+@app.api_route("/images/{session_id}/{path:path}", methods=["GET", "HEAD"])
+async def session_artifact(session_id: str, path: str, request: Request):
+    return await _serve_artifact(session_id, path, request)
+
+# Heavy dependencies are imported on first use; PRELOAD_MODELS warms them up in the
+# background. State: "off" | "running" | "done" | "failed"
+_preload_state = {"state": "off", "error": None, "seconds": None}
+
+
+def _preload() -> None:
+    """Import heavy modules and load the Whisper model off the request path.
+
+    Импортирует тяжёлые модули и загружает модель Whisper вне пути запроса.
+    """
+    t0 = time.perf_counter()
+    try:
+        import pdf2image  # noqa: F401
+        from google import genai  # noqa: F401
+        if not DISABLE_TRANSCRIPTION:
+            load_whisper_model(WhisperModelsENUM(WHISPER_PRELOAD_MODEL))
+        _preload_state["state"] = "done"
+    except Exception as e:
+        _preload_state.update(state="failed", error=str(e))
+    _preload_state["seconds"] = round(time.perf_counter() - t0, 3)
+
+
+@app.on_event("startup")
+async def _start_preload() -> None:
+    if PRELOAD_MODELS:
+        _preload_state["state"] = "running"
+        threading.Thread(target=_preload, name="preload", daemon=True).start()
+    # Drops Whisper after WHISPER_IDLE_UNLOAD_S without transcriptions (no-op when 0)
+    get_governor().start_reaper(unload_whisper_models)
+
+
+@app.get("/ready")
+async def ready():
+    """Report readiness and which heavy dependencies are loaded.
+
+    Сообщает о готовности и о том, какие тяжёлые зависимости загружены.
+    """
+    modules = {
+        name: name in sys.modules
+        for name in ("pdf2image", "google.genai", "whisper", "torch")
+    }
+    is_ready = _preload_state["state"] != "running"
+    body = {
+        "ready": is_ready,
+        "preload": dict(_preload_state),
+        "transcription": "disabled" if DISABLE_TRANSCRIPTION else "enabled",
+        "whisperModels": loaded_whisper_models(),
+        "whisperPolicy": whisper_policy.snapshot(),
+        "whisperBatch": get_batcher().snapshot(),
+        "whisperChunks": get_chunk_pool().snapshot(),
+        "cpuBudget": get_budget().snapshot(),
+        "speculation": speculator.snapshot(),
+        "reviewRepair": ReviewRepair.stats(),
+        "admission": admission.snapshot(),
+        "memory": get_governor().snapshot(),
+        "modules": modules,
+    }
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness: the worker's event loop answers.
+
+    Живость: цикл событий воркера отвечает.
+    """
+    return {"alive": True, "pid": os.getpid()}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness for a load balancer: 503 while preloading or saturated.
+
+    Готовность для балансировщика: 503 во время прогрева или при насыщении.
+    """
+    saturated = admission.saturation()
+    preloading = _preload_state["state"] == "running"
+    body = {
+        "ready": not (saturated or preloading),
+        "preloading": preloading,
+        "saturated": saturated,
+        "admission": admission.snapshot(),
+    }
+    if body["ready"]:
+        return JSONResponse(body)
+    return JSONResponse(
+        body, status_code=503, headers={"Retry-After": str(admission.retry_after())}
+    )
 
 
 def _convert_pdf_to_pngs(pdf_path: Path, out_dir: Path) -> List[Path]:
+    from pdf2image import convert_from_path
+
     out_dir.mkdir(parents=True, exist_ok=True)
-    images = convert_from_path(str(pdf_path))
+    if RENDER_MEMORY_MB > 0:
+        return _convert_pdf_to_pngs_capped(pdf_path, out_dir)
+    # pdf2image splits the pages across this many pdftoppm processes
+    with get_budget().lease("render") as threads:
+        images = convert_from_path(str(pdf_path), thread_count=threads)
     paths: List[Path] = []
     for idx, img in enumerate(images, start=1):
         out_path = out_dir / f"slide-{idx}.png"
@@ -51,6 +291,160 @@ def _convert_pdf_to_pngs(pdf_path: Path, out_dir: Path) -> List[Path]:
     return paths
 
 
+def _convert_pdf_to_pngs_capped(pdf_path: Path, out_dir: Path) -> List[Path]:
+    """Render the deck with pdftoppm writing PNGs to disk.
+
+    At most RENDER_MEMORY_MB of pages are decoded at once.
+
+    Рендерит презентацию, записывая PNG сразу на диск через pdftoppm.
+
+    Одновременно декодируется не более RENDER_MEMORY_MB страниц.
+    """
+    from pdf2image import convert_from_path
+
+    page_mb = page_cache.page_memory_mb(pdf_path, 200)
+    # Each pdftoppm process holds one page bitmap; no page is decoded into Python.
+    # Memory is reserved before the CPU lease so a waiting render holds no cores
+    processes = max(
+        1, min(get_budget().allowance("render"), int(RENDER_MEMORY_MB // page_mb))
+    )
+    with (
+        get_governor().reserve("render", page_mb * processes),
+        get_budget().lease("render", want=processes) as threads,
+    ):
+        rendered = convert_from_path(
+            str(pdf_path), thread_count=threads, output_folder=str(out_dir),
+            output_file=f".render-{uuid.uuid4().hex}", fmt="png", paths_only=True,
+        )
+    paths: List[Path] = []
+    for idx, tmp in enumerate(rendered, start=1):
+        out_path = out_dir / f"slide-{idx}.png"
+        os.replace(tmp, out_path)
+        paths.append(out_path)
+    return paths
+
+
+def _parse_ffmpeg_duration(stderr: bytes) -> Optional[float]:
+    """Extract media duration in seconds from ffmpeg stderr.
+
+    Извлекает длительность медиа в секундах из stderr ffmpeg.
+    """
+    text = stderr.decode(errors="ignore")
+    # MediaRecorder WebM often has "Duration: N/A"; fall back to last progress time
+    found = re.findall(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", text)
+    found = found or re.findall(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)", text)[-1:]
+    if not found:
+        return None
+    h, m, sec = found[0]
+    return int(h) * 3600 + int(m) * 60 + float(sec)
+
+
+def _probe_audio(audio_path: Path) -> Dict[str, Any]:
+    """Read container, audio codec and duration from ffmpeg's input info.
+
+    Читает контейнер, аудиокодек и длительность из сведений ffmpeg о входе.
+    """
+    try:
+        # Without an output ffmpeg only prints the input info (and exits non-zero)
+        proc = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-i", str(audio_path)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except OSError:
+        return {"container": None, "codec": None, "duration": None}
+    text = proc.stderr.decode(errors="ignore")
+    container = re.search(r"Input #0, ([^ ]+), from", text)
+    codec = re.search(r"Audio: ([A-Za-z0-9_]+)", text)
+    return {
+        "container": container.group(1) if container else None,
+        "codec": codec.group(1).lower() if codec else None,
+        "duration": _parse_ffmpeg_duration(proc.stderr),
+    }
+
+
+def _probe_duration(audio_path: Path) -> Optional[float]:
+    """Read a clip's duration from the container header, or None when it cannot tell.
+
+    Читает длительность клипа из заголовка контейнера или возвращает None.
+    """
+    return _probe_audio(audio_path)["duration"]
+
+
+def _remux_target(probe: Dict[str, Any], raw_ext: str) -> Optional[str]:
+    """Extension to stream-copy a browser-playable codec into, or None to transcode.
+
+    Расширение для копирования потока с кодеком, который играет браузер, или None.
+    """
+    codec = probe.get("codec")
+    if not AUDIO_REMUX or codec not in AUDIO_REMUX_CODECS:
+        return None
+    if codec in {"opus", "vorbis"}:
+        # Keep Ogg as Ogg; everything else (WebM, Matroska, MP4) goes to WebM
+        return ".ogg" if "ogg" in (probe.get("container") or "") else ".webm"
+    return {"aac": ".m4a", "mp3": ".mp3"}.get(codec) or raw_ext
+
+
+def _remux_audio(raw_path: Path, out_path: Path) -> Optional[float]:
+    """Copy the audio stream into a clean container without re-encoding.
+
+    Копирует аудиопоток в чистый контейнер без перекодирования.
+
+    Rewriting the container also adds the duration and seek index that
+    MediaRecorder files lack. Returns the duration and raises
+    ``subprocess.CalledProcessError`` on failure.
+    Перезапись контейнера также добавляет длительность и индекс перемотки,
+    которых нет в файлах MediaRecorder. Возвращает длительность и выбрасывает
+    ``subprocess.CalledProcessError`` при ошибке.
+    """
+    tmp = out_path.with_name(f".{out_path.stem}.{os.getpid()}.tmp{out_path.suffix}")
+    faststart = ["-movflags", "+faststart"] if out_path.suffix == ".m4a" else []
+    try:
+        # Stream copy is I/O bound; one thread is enough
+        with get_budget().lease("ffmpeg", want=1):
+            proc = subprocess.run(
+                [
+                    "ffmpeg",
+                    "-y",
+                    "-i",
+                    str(raw_path),
+                    "-vn",
+                    "-map",
+                    "0:a:0",
+                    "-c:a",
+                    "copy",
+                    *faststart,
+                    str(tmp),
+                ],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        os.replace(tmp, out_path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return _parse_ffmpeg_duration(proc.stderr)
+
+
+AUDIO_EXTENSIONS = {str(e) for e in SupportedExtensionsEnum}
+
+
+def _slide_audio(audio_dir: Path, slide_index: int) -> Optional[Path]:
+    """Return the slide's playable recording: MP3 if transcoded, else the stored audio.
+
+    Возвращает воспроизводимую запись слайда: MP3 после транскодирования, иначе
+    сохранённое аудио.
+    """
+    mp3_path = audio_dir / f"slide-{int(slide_index)}.mp3"
+    if mp3_path.exists():
+        return mp3_path
+    # Only audio files; slide-N.json next to them is the transcript
+    for cand in sorted(audio_dir.glob(f"slide-{int(slide_index)}.*")):
+        if cand.suffix.lower() in AUDIO_EXTENSIONS:
+            return cand
+    return None
+
+
 def _convert_pptx_to_pdf(pptx_path: Path, out_dir: Path) -> Path:
     out_dir.mkdir(parents=True, exist_ok=True)
     # Use LibreOffice to convert PPTX -> PDF
@@ -78,22 +472,30 @@ def _convert_pptx_to_pdf(pptx_path: Path, out_dir: Path) -> Path:
     last_err = None
     for cmd in commands:
         try:
-            subprocess.run(
-                cmd,
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
+            # LibreOffice has no thread knob; the lease only keeps it from piling up
+            with get_governor().reserve("office"), get_budget().lease("office"):
+                subprocess.run(
+                    cmd,
+                    check=True,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
             last_err = None
             break
         except FileNotFoundError as e:
             last_err = e
             continue
         except subprocess.CalledProcessError as e:
-            raise HTTPException(status_code=500, detail=f"Ошибка конвертации LibreOffice: {e.stderr.decode(errors='ignore')}")
+            stderr = e.stderr.decode(errors="ignore")
+            raise HTTPException(
+                status_code=500, detail=f"Ошибка конвертации LibreOffice: {stderr}"
+            )
 
     if last_err:
-        raise HTTPException(status_code=500, detail="LibreOffice (libreoffice/soffice) не установлен в контейнере")
+        raise HTTPException(
+            status_code=500,
+            detail="LibreOffice (libreoffice/soffice) не установлен в контейнере",
+        )
 
     # Find resulting PDF (LibreOffice names it with same basename)
     pdf_path = out_dir / (pptx_path.stem + ".pdf")
@@ -107,40 +509,65 @@ def _convert_pptx_to_pdf(pptx_path: Path, out_dir: Path) -> Path:
     return pdf_path
 
 
-@app.post("/upload")
-async def upload(file: UploadFile = File(...)):
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Файл не передан")
+def _transcode_to_mp3(raw_path: Path, mp3_path: Path) -> Optional[float]:
+    """Transcode an uploaded recording to mono 16 kHz MP3 via ffmpeg.
 
-    ext = Path(file.filename).suffix.lower()
-    if ext not in {".pdf", ".pptx"}:
-        raise HTTPException(status_code=400, detail="Поддерживаются только файлы .pdf и .pptx")
+    Транскодирует загруженную запись в моно MP3 16 кГц через ffmpeg.
 
-    session_id = uuid.uuid4().hex
-    session_dir = DATA_DIR / session_id
-    upload_dir = session_dir / "upload"
-    output_dir = session_dir / "slides"
-    upload_dir.mkdir(parents=True, exist_ok=True)
+    Returns the input duration in seconds when ffmpeg reports it and raises
+    ``subprocess.CalledProcessError`` on failure.
+    Возвращает длительность входа в секундах, если ffmpeg её сообщил, и
+    выбрасывает ``subprocess.CalledProcessError`` при ошибке.
+    """
+    # -y overwrite, -i input, -codec:a libmp3lame, 64k bitrate
+    with get_budget().lease("ffmpeg") as threads:
+        proc = subprocess.run(
+            [
+                "ffmpeg",
+                "-y",
+                "-threads", str(threads),
+                "-i",
+                str(raw_path),
+                # downmix + downsample to reduce size and RAM for Whisper
+                "-ac", "1",
+                "-ar", "16000",
+                "-codec:a", "libmp3lame",
+                "-b:a", "64k",
+                str(mp3_path),
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    return _parse_ffmpeg_duration(proc.stderr)
 
-    saved_path = upload_dir / file.filename
-    # Save uploaded file
-    with open(saved_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
 
-    try:
-        if ext == ".pdf":
-            _convert_pdf_to_pngs(saved_path, output_dir)
-        else:
-            # .pptx -> .pdf -> .png
-            pdf_path = _convert_pptx_to_pdf(saved_path, upload_dir)
-            _convert_pdf_to_pngs(pdf_path, output_dir)
-    except HTTPException:
-        # Bubble up known errors
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка конвертации: {e}")
+DECK_SUFFIXES = {".pdf", ".pptx"}
+# Partial resumable uploads and audio staging; same filesystem as sessions so the
+# finished file is renamed into place instead of copied
+UPLOADS_DIR = DATA_DIR / "_uploads"
+_resumable = ResumableStore(UPLOADS_DIR, UPLOAD_TTL_HOURS * 3600)
+# Whisper size per job from this worker's queue, clip length and measured
+# realtime factor
+whisper_policy = WhisperPolicy(
+    WHISPER_MIN_MODEL, WHISPER_MAX_MODEL, WHISPER_LATENCY_BUDGET_S
+)
+# Decks uploaded to Gemini, keyed by content hash and shared by all sessions and workers
+gemini_files = GeminiFileRegistry(
+    DATA_DIR / "_gemini" / "files.json",
+    refresh_before_s=GEMINI_FILE_REFRESH_HOURS * 3600,
+)
+speculator = Speculator(SPECULATIVE_REVIEW_WORKERS, enabled=SPECULATIVE_REVIEW)
+
 
-    # Build URLs
+def _slide_urls(session_id: str, output_dir: Path) -> List[str]:
+    manifest = page_cache.load_manifest(output_dir)
+    if manifest is not None:
+        # Lazily rendered deck: pages may not exist on disk yet
+        return [
+            f"/images/{session_id}/slides/slide-{n}.png"
+            for n in range(1, int(manifest["pages"]) + 1)
+        ]
     # Ensure natural numeric order: slide-1.png, slide-2.png, ... slide-10.png
     def _num_key(name: str) -> int:
         try:
@@ -151,14 +578,190 @@ async def upload(file: UploadFile = File(...)):
         except Exception:
             return 0
     slides = sorted([p.name for p in output_dir.glob("slide-*.png")], key=_num_key)
-    slide_urls = [f"/images/{session_id}/slides/{name}" for name in slides]
+    return [f"/images/{session_id}/slides/{name}" for name in slides]
 
-    return JSONResponse(
-        {
-            "sessionId": session_id,
-            "slides": slide_urls,
-        }
+
+def _process_deck(session_id: str, saved_path: Path, size: int, sha256: str) -> dict:
+    """Render a stored deck into slide PNGs and build the upload response.
+
+    Рендерит сохранённую презентацию в PNG-слайды и формирует ответ загрузки.
+    """
+    upload_dir = saved_path.parent
+    output_dir = DATA_DIR / session_id / "slides"
+    # Content hash of the original upload, used to recognise repeated decks
+    with open(upload_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(
+            {"filename": saved_path.name, "bytes": size, "sha256": sha256},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    timing.annotate(upload_bytes=size)
+
+    try:
+        pdf_path = saved_path
+        if saved_path.suffix.lower() != ".pdf":
+            # .pptx -> .pdf -> .png
+            with timing.stage("pptx_to_pdf"):
+                pdf_path = _convert_pptx_to_pdf(saved_path, upload_dir)
+        if LAZY_RENDER:
+            # Only count pages; PNGs are rendered by slide_image on first request
+            with timing.stage("count_pages"):
+                page_count = page_cache.count_pages(pdf_path)
+            page_mb = page_cache.page_memory_mb(pdf_path, RENDER_DPI)
+            page_cache.write_manifest(
+                output_dir, pdf_path, page_count, RENDER_DPI, page_mb
+            )
+            page_cache.render_ahead(output_dir, 0, RENDER_AHEAD + 1, RENDER_WORKERS)
+        else:
+            with timing.stage("pdf_to_png"):
+                page_count = len(_convert_pdf_to_pngs(pdf_path, output_dir))
+        timing.annotate(pages=page_count)
+        _build_slide_context(pdf_path, output_dir)
+        _record_node(session_id, "slides")
+    except HTTPException:
+        # Bubble up known errors
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка конвертации: {e}")
+
+    return {
+        "sessionId": session_id,
+        "slides": _slide_urls(session_id, output_dir),
+        "sha256": sha256,
+    }
+
+
+def _build_slide_context(pdf_path: Path, slides_dir: Path) -> bool:
+    """Index per-slide text (and thumbnails) once so reviews send only their slide.
+
+    Один раз индексирует текст (и миниатюры) слайдов, чтобы рецензия отправляла
+    только свой слайд.
+    """
+    try:
+        with timing.stage("pdf_text"):
+            slide_context.build_context(
+                pdf_path, slides_dir, thumbnails=SLIDE_THUMBNAILS
+            )
+        return True
+    except Exception:
+        # Context is an optimisation; reviews still work from the transcript alone
+        return False
+
+
+def _ingest_audio(
+    session_id: str, slide_index: int, src: Path, filename: str, sha256: str
+) -> dict:
+    """Move a received recording into the session, remux or transcode and transcribe it.
+
+    Перемещает полученную запись в сессию, перепаковывает или транскодирует и
+    транскрибирует её.
+    """
+    # Save audio per slide: data/<sessionId>/audio/slide-<index>.<ext>
+    audio_dir = DATA_DIR / session_id / "audio"
+    audio_dir.mkdir(parents=True, exist_ok=True)
+
+    ext = Path(filename or "").suffix or ".webm"
+    safe_ext = ext if len(ext) <= 5 else ".webm"
+    raw_path = audio_dir / f"slide-{int(slide_index)}{safe_ext}"
+    # A previous take in another format must not shadow the new one
+    for old in audio_dir.glob(f"slide-{int(slide_index)}.*"):
+        if old.suffix.lower() in AUDIO_EXTENSIONS and old != raw_path:
+            old.unlink(missing_ok=True)
+    try:
+        os.replace(src, raw_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Не удалось сохранить аудио: {e}")
+    # A new recording invalidates the previous transcript and any review still
+    # being guessed
+    (audio_dir / f"slide-{int(slide_index)}.json").unlink(missing_ok=True)
+    (audio_dir / f"slide-{int(slide_index)}.delivery.json").unlink(missing_ok=True)
+    speculator.cancel(_review_job_key(session_id, slide_index))
+
+    # Browser codecs (Opus, AAC, MP3) play natively: rewrite the container only
+    with timing.stage("probe"):
+        probe = _probe_audio(raw_path)
+    target = _remux_target(probe, safe_ext)
+    out_path = None
+    if target:
+        remuxed = audio_dir / f"slide-{int(slide_index)}{target}"
+        try:
+            with timing.stage("remux"):
+                duration = _remux_audio(raw_path, remuxed) or probe["duration"]
+            if remuxed != raw_path:
+                raw_path.unlink(missing_ok=True)
+            out_path, ingest = remuxed, "remux"
+        except subprocess.CalledProcessError:
+            # Odd streams the copy cannot handle still get a full transcode
+            pass
+    if out_path is None:
+        # Transcode to MP3 via ffmpeg to ensure broad compatibility
+        mp3_path = audio_dir / f"slide-{int(slide_index)}.mp3"
+        try:
+            with timing.stage("transcode"):
+                duration = _transcode_to_mp3(raw_path, mp3_path)
+        except subprocess.CalledProcessError as e:
+            # If conversion fails, still expose the raw format like before
+            return {
+                "ok": True,
+                "path": f"/images/{session_id}/audio/{raw_path.name}",
+                "format": safe_ext.lstrip("."),
+                "sha256": sha256,
+                "ingest": "raw",
+                "codec": probe["codec"],
+            }
+        out_path, ingest = mp3_path, "transcode"
+    timing.annotate(audio_seconds=duration)
+
+    # Only if the audio is playable, optionally attempt transcription
+    if not DISABLE_TRANSCRIPTION:
+        try:
+            _ensure_transcript(session_id, slide_index, out_path, clip_s=duration)
+            _speculate_review(session_id, slide_index)
+        except Exception:
+            # Do not fail the audio upload on transcription error
+            pass
+
+    return {
+        "ok": True,
+        "path": f"/images/{session_id}/audio/{out_path.name}",
+        "format": out_path.suffix.lstrip("."),
+        "sha256": sha256,
+        "ingest": ingest,
+        "codec": probe["codec"],
+    }
+
+
+@app.post("/upload")
+async def upload(request: Request):
+    # The body is streamed straight into the session's upload dir (no spooled copy)
+    session_id = uuid.uuid4().hex
+    session_dir = DATA_DIR / session_id
+    upload_dir = session_dir / "upload"
+    timing.annotate(session_id=session_id)
+    try:
+        check_content_length(request.headers, MAX_DECK_BYTES)
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        with timing.stage("save"):
+            _, streamed = await receive_multipart(
+                request, upload_dir, MAX_DECK_BYTES, suffixes=DECK_SUFFIXES
+            )
+        if streamed is None:
+            raise UploadError(400, "Файл не передан")
+    except UploadError as e:
+        shutil.rmtree(session_dir, ignore_errors=True)
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except BaseException:
+        shutil.rmtree(session_dir, ignore_errors=True)
+        raise
+
+    saved_path = upload_dir / streamed.filename
+    os.replace(streamed.path, saved_path)
+    # Off the event loop: rendering may wait for cores and memory
+    result = await run_in_threadpool(
+        _process_deck, session_id, saved_path, streamed.size, streamed.sha256
     )
+    return JSONResponse(result)
 
 
 @app.get("/slides/{session_id}")
@@ -166,84 +769,225 @@ async def list_slides(session_id: str):
     output_dir = DATA_DIR / session_id / "slides"
     if not output_dir.exists():
         raise HTTPException(status_code=404, detail="Сессия не найдена")
-    slides = sorted([p.name for p in output_dir.glob("slide-*.png")], key=lambda n: int(n.split("-")[-1].split(".")[0]))
-    slide_urls = [f"/images/{session_id}/slides/{name}" for name in slides]
-    return {"sessionId": session_id, "slides": slide_urls}
+    return {"sessionId": session_id, "slides": _slide_urls(session_id, output_dir)}
 
 
 @app.post("/audio")
-async def upload_audio(
-    sessionId: str = Form(...),
-    slideIndex: int = Form(...),
-    file: UploadFile = File(...),
+async def upload_audio(request: Request):
+    # Form fields: sessionId, slideIndex, file. The frontend sends the fields first,
+    # so an unknown session is rejected before any audio bytes are written.
+    def _check_session(fields: Dict[str, str]) -> None:
+        sid = fields.get("sessionId")
+        if sid is not None and not (sid.isalnum() and (DATA_DIR / sid).is_dir()):
+            raise UploadError(404, "Сессия не найдена")
+
+    try:
+        check_content_length(request.headers, MAX_AUDIO_BYTES)
+        with timing.stage("save"):
+            fields, streamed = await receive_multipart(
+                request, UPLOADS_DIR, MAX_AUDIO_BYTES, before_file=_check_session
+            )
+        _check_session(fields)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    sessionId = fields.get("sessionId") or ""
+    slideIndex = (fields.get("slideIndex") or "").strip()
+    if streamed is None or not sessionId or not slideIndex.isdigit():
+        if streamed is not None:
+            streamed.path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=422, detail="Ожидаются поля sessionId, slideIndex и file"
+        )
+    timing.annotate(session_id=sessionId, upload_bytes=streamed.size)
+    return await run_in_threadpool(
+        _ingest_audio,
+        sessionId,
+        int(slideIndex),
+        streamed.path,
+        streamed.filename,
+        streamed.sha256,
+    )
+
+
+# ---- Resumable uploads (tus-like: create, query offset, PATCH chunks) ----
+
+@app.post("/uploads")
+async def create_upload(
+    kind: str = Form(...),
+    filename: str = Form(...),
+    length: int = Form(...),
+    sessionId: str = Form(""),
+    slideIndex: Optional[int] = Form(None),
+    sha256: str = Form(""),
 ):
-    # Save audio per slide: data/<sessionId>/audio/slide-<index>.<ext>
-    session_dir = DATA_DIR / sessionId
-    if not session_dir.exists():
-        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    """Register a resumable deck or audio upload of a known length.
 
-    audio_dir = session_dir / "audio"
-    audio_dir.mkdir(parents=True, exist_ok=True)
+    Регистрирует возобновляемую загрузку презентации или аудио известной длины.
+    """
+    if kind == "deck":
+        limit = MAX_DECK_BYTES
+        if Path(filename).suffix.lower() not in DECK_SUFFIXES:
+            raise HTTPException(
+                status_code=400, detail="Поддерживаются только файлы .pdf и .pptx"
+            )
+    elif kind == "audio":
+        limit = MAX_AUDIO_BYTES
+        if not (sessionId.isalnum() and (DATA_DIR / sessionId).is_dir()):
+            raise HTTPException(status_code=404, detail="Сессия не найдена")
+        if slideIndex is None:
+            raise HTTPException(status_code=422, detail="Для аудио нужен slideIndex")
+        timing.annotate(session_id=sessionId)
+    else:
+        raise HTTPException(status_code=400, detail="kind должен быть deck или audio")
+    if length <= 0:
+        raise HTTPException(status_code=400, detail="Пустой файл")
+    if length > limit:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Файл слишком большой (лимит {limit // (1024 * 1024)} МБ)",
+        )
+
+    manifest = _resumable.create({
+        "kind": kind,
+        "filename": Path(filename).name,
+        "length": length,
+        "sessionId": sessionId or None,
+        "slideIndex": slideIndex,
+        "sha256": sha256.strip().lower() or None,
+    })
+    upload_id = manifest["uploadId"]
+    return JSONResponse(
+        {"uploadId": upload_id, "offset": 0, "length": length},
+        status_code=201,
+        headers={"Location": f"/uploads/{upload_id}", "Upload-Offset": "0"},
+    )
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Return how many bytes of a resumable upload the server already has.
+
+    Возвращает, сколько байт возобновляемой загрузки уже есть на сервере.
+    """
+    manifest = _resumable.load(upload_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Загрузка не найдена")
+    offset = _resumable.offset(upload_id)
+    return JSONResponse(
+        {"uploadId": upload_id, "offset": offset, "length": manifest["length"]},
+        headers={
+            "Upload-Offset": str(offset),
+            "Upload-Length": str(manifest["length"]),
+        },
+    )
 
-    ext = Path(file.filename).suffix or ".webm"
-    safe_ext = ext if len(ext) <= 5 else ".webm"
-    raw_path = audio_dir / f"slide-{int(slideIndex)}{safe_ext}"
 
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request):
+    """Append the request body at ``Upload-Offset``; finish the upload when complete.
+
+    Дописывает тело запроса по ``Upload-Offset`` и завершает загрузку при полном
+    получении.
+    """
+    manifest = _resumable.load(upload_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Загрузка не найдена")
+    if manifest.get("sessionId"):
+        timing.annotate(session_id=manifest["sessionId"])
+    # Held through completion so a repeated final PATCH cannot process the file twice
     try:
-        with open(raw_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Не удалось сохранить аудио: {e}")
-    # Transcode to MP3 via ffmpeg to ensure broad compatibility
-    mp3_path = audio_dir / f"slide-{int(slideIndex)}.mp3"
+        with _resumable.lock(upload_id):
+            return await _receive_chunk(upload_id, manifest, request)
+    except UploadError as e:
+        if e.status_code == 409:
+            return _offset_conflict(upload_id, e.detail)
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+def _offset_conflict(upload_id: str, detail: str) -> JSONResponse:
+    """409 carrying the current offset, from which the client resumes.
+
+    409 с текущим смещением, с которого клиент продолжает загрузку.
+    """
+    offset = _resumable.offset(upload_id)
+    return JSONResponse(
+        {"detail": detail, "offset": offset},
+        status_code=409,
+        headers={"Upload-Offset": str(offset)},
+    )
+
+
+async def _receive_chunk(upload_id: str, manifest: Dict[str, Any], request: Request):
+    """Body of upload_chunk, run while the upload's lock is held.
+
+    Тело upload_chunk, выполняется под блокировкой загрузки.
+    """
+    length = int(manifest["length"])
+    # A client that lost its connection asks GET /uploads/{id} and resumes from there
+    offset = _resumable.offset(upload_id)
+    declared = request.headers.get("upload-offset", "")
+    if not declared.isdigit() or int(declared) != offset:
+        return _offset_conflict(upload_id, "Смещение не совпадает")
+    # A chunk handled by another worker last time means rehashing the whole .part
+    hasher = await run_in_threadpool(_resumable.hasher, upload_id)
+    part = _resumable.part_path(upload_id)
+    with timing.stage("save"):
+        offset = await append_stream(request.stream(), part, length, hasher)
+    _resumable.remember(upload_id, offset, hasher)
+    if offset < length:
+        return JSONResponse(
+            {"uploadId": upload_id, "offset": offset, "complete": False},
+            headers={"Upload-Offset": str(offset)},
+        )
+
+    digest = hasher.hexdigest()
+    if manifest.get("sha256") and manifest["sha256"] != digest:
+        _resumable.finish(upload_id)
+        raise HTTPException(
+            status_code=422, detail="Контрольная сумма файла не совпала"
+        )
+
+    # Rendering or transcribing is gated like POST /upload and POST /audio; on 429 the
+    # bytes are kept and a PATCH at the final offset retries the completion
     try:
-        # -y overwrite, -i input, -codec:a libmp3lame high quality, 128k bitrate
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-i",
-                str(raw_path),
-                # downmix + downsample to reduce size and RAM for Whisper
-                "-ac", "1",
-                "-ar", "16000",
-                "-codec:a", "libmp3lame",
-                "-b:a", "64k",
-                str(mp3_path),
-            ],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+        async with admission.hold("deck" if manifest["kind"] == "deck" else "audio"):
+            result = await _complete_upload(upload_id, manifest, part, offset, digest)
+    except Overloaded as e:
+        return JSONResponse(
+            overloaded_body(e),
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after), "Upload-Offset": str(offset)},
         )
-    except subprocess.CalledProcessError as e:
-        # If conversion fails, still expose the raw format like before
-        return {"ok": True, "path": f"/images/{sessionId}/audio/{raw_path.name}", "format": safe_ext.lstrip('.')}
+    result.update(uploadId=upload_id, offset=offset, complete=True)
+    return JSONResponse(result, headers={"Upload-Offset": str(offset)})
 
-    # Only if MP3 conversion succeeded, optionally attempt transcription
-    transcript_json = audio_dir / f"slide-{int(slideIndex)}.json"
-    if not DISABLE_TRANSCRIPTION:
-        try:
-            at = AudioToText(
-                audio_file_path=str(mp3_path),
-                language=SupportedLanguagesCodesEnum.RU,
-                whisper_model=WhisperModelsENUM.TINY,
-                gemini_model=GeminiModelsEnum.gemini_2_5_flash,
-            )
-            raw_text = at.transcribe_file()
-            polished_text = at.restore_transcribed_text_with_gemini()
-            payload = {
-                "raw": raw_text,
-                "polished": polished_text,
-                "lang": str(SupportedLanguagesCodesEnum.RU),
-            }
-            import json
-            with open(transcript_json, "w", encoding="utf-8") as f:
-                json.dump(payload, f, ensure_ascii=False, indent=2)
-        except Exception:
-            # Do not fail the audio upload on transcription error
-            pass
 
-    return {"ok": True, "path": f"/images/{sessionId}/audio/{mp3_path.name}", "format": "mp3"}
+async def _complete_upload(
+    upload_id: str, manifest: Dict[str, Any], part: Path, size: int, digest: str
+) -> dict:
+    """Hand a fully received upload to deck rendering or audio ingest.
+
+    Передаёт полностью полученную загрузку на рендеринг презентации или приём аудио.
+    """
+    if manifest["kind"] == "deck":
+        session_id = uuid.uuid4().hex
+        upload_dir = DATA_DIR / session_id / "upload"
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        timing.annotate(session_id=session_id)
+        saved_path = upload_dir / manifest["filename"]
+        os.replace(part, saved_path)
+        _resumable.finish(upload_id)
+        return await run_in_threadpool(
+            _process_deck, session_id, saved_path, size, digest
+        )
+    try:
+        return await run_in_threadpool(
+            _ingest_audio, manifest["sessionId"], int(manifest["slideIndex"]),
+            part, manifest["filename"], digest,
+        )
+    finally:
+        _resumable.finish(upload_id)
 
 
 # ---- Review API (Gemini) ----
@@ -265,115 +1009,127 @@ async def review_start(
     if not session_dir.exists():
         raise HTTPException(status_code=404, detail="Сессия не найдена")
 
-    review_dir = _review_dir(sessionId)
+    timing.annotate(session_id=sessionId)
     def _to_bool(s: str) -> bool:
         try:
             return str(s or "").strip().lower() in {"1", "true", "yes", "y", "on"}
         except Exception:
             return False
 
-    include_pdf = _to_bool(includePdf)
-    cfg = {
-        "mode": mode,
-        "extraInfo": extraInfo or "",
-        "includePdf": include_pdf,
-    }
+    await run_in_threadpool(
+        _write_review_config, sessionId, mode, extraInfo, _to_bool(includePdf)
+    )
 
-    # Optionally upload session PDF to Gemini and persist a reference
-    if include_pdf:
+    # Slides recorded before review mode started are reviewed ahead of the user
+    for tfile in _slide_files(session_dir / "audio", r"slide-(\d+)\.json"):
+        _speculate_review(sessionId, int(tfile.name[len("slide-"):-len(".json")]))
+    return {"ok": True}
+
+
+def _write_review_config(
+    session_id: str, mode: str, extra_info: str, include_pdf: bool
+) -> Dict[str, Any]:
+    """Write review/config.json for a session.
+
+    Indexes slide text or schedules the deck upload, depending on the mode.
+
+    Записывает review/config.json сессии.
+
+    В зависимости от режима индексирует текст слайдов или планирует загрузку
+    презентации.
+    """
+    session_dir = DATA_DIR / session_id
+    review_dir = _review_dir(session_id)
+    cfg = {
+        "mode": mode,
+        "extraInfo": extra_info or "",
+        "includePdf": include_pdf,
+    }
+
+    # Per-slide context: each review gets only its slide's text instead of the whole PDF
+    if include_pdf and PDF_CONTEXT_MODE != "file":
+        slides_dir = session_dir / "slides"
+        if slide_context.load_index(slides_dir) is None:
+            # Sessions uploaded before the index existed
+            pdfs = sorted((session_dir / "upload").glob("*.pdf"))
+            if pdfs:
+                _build_slide_context(pdfs[0], slides_dir)
+        cfg["slideContext"] = slide_context.load_index(slides_dir) is not None
+
+    # Whole-PDF mode: reuse the deck's Gemini file by content hash; a missing or stale
+    # copy is uploaded in the background so /review/start does not wait for it
+    if include_pdf and PDF_CONTEXT_MODE == "file":
         try:
-            # try to find a PDF in upload subdir
-            upload_dir = session_dir / "upload"
-            pdf_candidates = list(upload_dir.glob("*.pdf")) if upload_dir.exists() else []
-            if not pdf_candidates:
-                # sometimes LibreOffice produced PDF used for images
-                # also look for any PDF under session
-                pdf_candidates = list(session_dir.rglob("*.pdf"))
-            if pdf_candidates:
-                from google import genai
-                from mimetypes import guess_type
-                client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
-                pdf_path = pdf_candidates[0]
-                up = client.files.upload(file=str(pdf_path))
-                # Some versions expose uri/mime_type attributes
-                file_uri = getattr(up, "uri", None) or getattr(up, "file_uri", None)
-                mime_type = getattr(up, "mime_type", None) or guess_type(str(pdf_path))[0] or "application/pdf"
-                if file_uri:
-                    cfg["gemini_pdf"] = {
-                        "file_uri": file_uri,
-                        "mime_type": mime_type,
-                        "name": pdf_path.name,
-                    }
+            pdf_ref = _session_pdf_ref(session_dir)
+            if pdf_ref:
+                entry = gemini_files.lookup(pdf_ref["sha256"])
+                if entry is None:
+                    gemini_files.ensure(
+                        session_dir / pdf_ref["path"],
+                        pdf_ref["sha256"],
+                        pdf_ref["mime_type"],
+                    )
+                    timing.annotate(gemini_uploads_scheduled=1)
+                else:
+                    pdf_ref.update(
+                        file_uri=entry["file_uri"], mime_type=entry["mime_type"]
+                    )
+                    timing.annotate(gemini_files_reused=1)
+                cfg["gemini_pdf"] = pdf_ref
         except Exception:
             # PDF upload is optional; ignore failures
             pass
     with open(review_dir / "config.json", "w", encoding="utf-8") as f:
         json.dump(cfg, f, ensure_ascii=False, indent=2)
-    return {"ok": True}
+    return cfg
 
 
-def _load_transcript(session_id: str, slide_index: int) -> str:
-    session_dir = DATA_DIR / session_id
-    audio_dir = session_dir / "audio"
-    tpath = audio_dir / f"slide-{int(slide_index)}.json"
-    if tpath.exists():
-        try:
-            with open(tpath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            text = (data.get("polished") or data.get("raw") or "").strip()
-            # If previous bug saved JSON feedback into polished, fall back to raw
-            if isinstance(text, str) and text.startswith("{") and ("feedback" in text and "tips" in text):
-                text = (data.get("raw") or "").strip()
-            return text
-        except Exception:
-            pass
-    # On-demand transcribe if JSON absent or broken. Wait a bit for audio to appear.
-    mp3_path = audio_dir / f"slide-{int(slide_index)}.mp3"
-    audio_path = None
-    for _ in range(40):  # ~10s with 0.25s steps
-        if mp3_path.exists():
-            audio_path = mp3_path
-            break
-        cand = list(audio_dir.glob(f"slide-{int(slide_index)}.*"))
-        if cand:
-            audio_path = cand[0]
-            break
-        time.sleep(0.25)
-    if not audio_path:
-        raise HTTPException(status_code=404, detail="Аудио для транскрибации не найдено")
+def _session_pdf_ref(session_dir: Path) -> Optional[Dict[str, Any]]:
+    """Locate the session PDF and its content hash for the Gemini file registry.
 
-    if DISABLE_TRANSCRIPTION:
-        return ""
-    at = AudioToText(
-        audio_file_path=str(audio_path),
-        language=SupportedLanguagesCodesEnum.RU,
-        whisper_model=WhisperModelsENUM.TINY,
-        gemini_model=GeminiModelsEnum.gemini_2_5_flash,
-    )
-    raw_text = at.transcribe_file()
-    polished = at.restore_transcribed_text_with_gemini()
-    # persist for next time
+    Находит PDF сессии и его хеш содержимого для реестра файлов Gemini.
+    """
+    # try to find a PDF in upload subdir
+    upload_dir = session_dir / "upload"
+    pdf_candidates = sorted(upload_dir.glob("*.pdf")) if upload_dir.exists() else []
+    if not pdf_candidates:
+        # sometimes LibreOffice produced PDF used for images
+        # also look for any PDF under session
+        pdf_candidates = sorted(session_dir.rglob("*.pdf"))
+    if not pdf_candidates:
+        return None
+    pdf_path = pdf_candidates[0]
+    sha256 = None
     try:
-        with open(tpath, "w", encoding="utf-8") as f:
-            json.dump({"raw": raw_text, "polished": polished, "lang": str(SupportedLanguagesCodesEnum.RU)}, f, ensure_ascii=False, indent=2)
-    except Exception:
+        # The upload manifest already has the hash when the original file was a PDF
+        with open(upload_dir / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("filename") == pdf_path.name:
+            sha256 = manifest.get("sha256")
+    except (OSError, ValueError):
         pass
-    return polished or raw_text or ""
+    return {
+        "sha256": sha256 or file_sha256(pdf_path),
+        "path": str(pdf_path.relative_to(session_dir)),
+        "mime_type": "application/pdf",
+        "name": pdf_path.name,
+    }
 
 
-@app.post("/review/slide")
-async def review_slide(
-    sessionId: str = Form(...),
-    slideIndex: int = Form(...),
-):
-    session_dir = DATA_DIR / sessionId
-    if not session_dir.exists():
-        raise HTTPException(status_code=404, detail="Сессия не найдена")
+def _load_review_config(review_dir: Path) -> Tuple[Dict[str, Any], str, list]:
+    """Read review/config.json into (config, extra info, Gemini file parts).
 
-    review_dir = _review_dir(sessionId)
-    cfg_path = review_dir / "config.json"
+    Читает review/config.json в (конфиг, доп. информация, файлы Gemini).
+
+    Blocks up to GEMINI_FILE_WAIT_S while the deck upload is still running, so call
+    it from a worker thread.
+    Ждёт до GEMINI_FILE_WAIT_S, пока идёт загрузка презентации, поэтому вызывайте
+    из рабочего потока.
+    """
+    cfg: Dict[str, Any] = {}
     extra = ""
     file_parts = []
+    cfg_path = review_dir / "config.json"
     if cfg_path.exists():
         try:
             with open(cfg_path, "r", encoding="utf-8") as f:
@@ -383,37 +1139,597 @@ async def review_slide(
                 if pdf_meta and isinstance(pdf_meta, dict):
                     uri = pdf_meta.get("file_uri")
                     mt = pdf_meta.get("mime_type")
+                    if pdf_meta.get("sha256") and pdf_meta.get("path"):
+                        # The registry has the current URI; the one in config may
+                        # have expired
+                        entry = gemini_files.lookup(pdf_meta["sha256"])
+                        if entry is None:
+                            with timing.stage("gemini_file_wait"):
+                                entry = gemini_files.get(
+                                    review_dir.parent / pdf_meta["path"],
+                                    pdf_meta["sha256"],
+                                    mt,
+                                    wait_s=GEMINI_FILE_WAIT_S,
+                                )
+                        uri, mt = (
+                            (entry["file_uri"], entry["mime_type"])
+                            if entry
+                            else (None, None)
+                        )
                     if uri and mt:
                         file_parts.append({"file_uri": uri, "mime_type": mt})
         except Exception:
             pass
+    return cfg, extra, file_parts
+
+
+def _review_error(e: Exception, detail: str) -> HTTPException:
+    """Map a failed Gemini call to 503 + Retry-After when quota ran out, else 500.
+
+    Превращает ошибку Gemini в 503 + Retry-After при исчерпании квоты, иначе в 500.
+    """
+    if isinstance(e, LLMUnavailable):
+        retry_after = str(max(1, int(e.retry_after + 0.999)))
+        return HTTPException(
+            status_code=503,
+            detail="Сервис оценки перегружен, попробуйте позже",
+            headers={"Retry-After": retry_after},
+        )
+    return HTTPException(status_code=500, detail=detail)
+
 
-    polished_text = _load_transcript(sessionId, int(slideIndex))
+def _read_json(path: Path) -> Optional[Dict[str, Any]]:
+    """Read a JSON artifact (transcript, review), or None when missing or unreadable.
 
-    system_prompt = "Оцени подачу и содержание доклада по слайду. Конкретика приветствуется."
-    ag = AskGemini(system_prompt=system_prompt, user_context=extra, file_parts=file_parts)
+    Читает JSON-артефакт (транскрипт, оценку) или None, если его нет или он битый.
+    """
     try:
-        data = ag.review_slide(int(slideIndex), polished_text)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка оценки слайда: {e}")
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: Path, data: Any) -> None:
+    """Write a JSON artifact atomically so concurrent readers never see half a file.
 
-    out_path = review_dir / f"slide-{int(slideIndex)}-review.json"
-    with open(out_path, "w", encoding="utf-8") as f:
+    Атомарно пишет JSON-артефакт, чтобы параллельные читатели не видели половину файла.
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
-    return data
+    os.replace(tmp, path)
 
 
-@app.get("/review/summary")
-async def review_summary(sessionId: str):
-    session_dir = DATA_DIR / sessionId
-    if not session_dir.exists():
+def _slide_files(directory: Path, pattern: str) -> List[Path]:
+    """Files whose whole name matches ``pattern``, in slide order.
+
+    The slide number is captured by group 1 of ``pattern``.
+
+    Файлы, имя которых целиком совпадает с ``pattern``, по порядку слайдов.
+
+    Номер слайда берётся из группы 1 шаблона ``pattern``.
+    """
+    found = []
+    for p in directory.glob("slide-*") if directory.exists() else []:
+        m = re.fullmatch(pattern, p.name)
+        if m:
+            found.append((int(m.group(1)), p))
+    return [p for _, p in sorted(found)]
+
+
+def _read_delivery(session_dir: Path, slide_index: int) -> Optional[Dict[str, Any]]:
+    """Delivery metrics measured for a slide recording, if any.
+
+    Метрики подачи, измеренные для записи слайда, если есть.
+    """
+    return _read_json(session_dir / "audio" / f"slide-{int(slide_index)}.delivery.json")
+
+
+def _audio_fingerprint(audio_path: Optional[Path]) -> Optional[Dict[str, Any]]:
+    """Name, size and mtime of a recording, to tell a re-recorded take from the old one.
+
+    Имя, размер и время изменения записи, чтобы отличить перезаписанный дубль от
+    старого.
+    """
+    try:
+        st = Path(audio_path).stat()
+    except (OSError, TypeError):
+        return None
+    return {"name": Path(audio_path).name, "bytes": st.st_size, "mtime": st.st_mtime_ns}
+
+
+def _ensure_transcript(
+    session_id: str, slide_index: int, audio_path: Path, clip_s: Optional[float] = None
+) -> Dict[str, Any]:
+    """Transcribe a slide once; concurrent callers wait and share the result.
+
+    Транскрибирует слайд один раз; параллельные вызовы ждут и получают тот же результат.
+    """
+    session_dir = DATA_DIR / session_id
+    tpath = session_dir / "audio" / f"slide-{int(slide_index)}.json"
+
+    def ready() -> Optional[Dict[str, Any]]:
+        data = _read_json(tpath)
+        if data is None:
+            return None
+        # A transcript of the previous take may land after the new audio replaced it;
+        # ones written before the fingerprint existed are taken as they are
+        if "audio" in data and data["audio"] != _audio_fingerprint(audio_path):
+            return None
+        return data
+
+    def compute() -> Dict[str, Any]:
+        source = _audio_fingerprint(audio_path)
+        # Model size follows current load; the choice is kept with the transcript
+        duration = clip_s or _probe_duration(audio_path)
+        choice = whisper_policy.choose(duration, loaded_whisper_models())
+        model = WhisperModelsENUM(choice["model"])
+        at = AudioToText(
+            audio_file_path=str(audio_path),
+            language=SupportedLanguagesCodesEnum.RU,
+            whisper_model=model,
+            gemini_model=GeminiModelsEnum.gemini_2_5_flash,
+            duration_s=duration,
+        )
+        # The model loads inside transcribe_file's memory reservation; its load time
+        # is kept out of the measured realtime factor
+        # Short clips share a batched pass with other requests; AudioToText leases
+        # the cores
+        with whisper_policy.job(choice["model"], duration) as measured:
+            raw_text = at.transcribe_file()
+            measured["load_s"] = round(at.load_s, 2)
+        measured["threads"] = at.threads
+        measured["batch"] = at.batch_size
+        measured["chunks"] = at.chunks
+        polished_text = at.restore_transcribed_text_with_gemini()
+        payload = {
+            "raw": raw_text,
+            "polished": polished_text,
+            "lang": str(SupportedLanguagesCodesEnum.RU),
+            "whisper": {**choice, **measured},
+            "audio": source,
+        }
+        if _audio_fingerprint(audio_path) != source:
+            # Re-recorded meanwhile: the caller gets its take, the new one stays intact
+            return payload
+        # Pace, pauses, fillers and loudness from the same decode, no model call
+        if DELIVERY_METRICS:
+            dpath = tpath.with_name(f"slide-{int(slide_index)}.delivery.json")
+            _write_json(dpath, at.delivery_metrics())
+        # Written atomically so waiting requests never read a half-written file
+        _write_json(tpath, payload)
+        _record_node(session_id, f"transcript:{int(slide_index)}")
+        return payload
+
+    return singleflight.run_once(
+        session_dir, f"transcript-slide-{int(slide_index)}", ready, compute
+    )
+
+
+def _transcript_text(data: Dict[str, Any]) -> str:
+    """Text a review is based on: the polished transcript, else the raw one.
+
+    Текст, по которому строится оценка: исправленный транскрипт, иначе исходный.
+    """
+    text = (data.get("polished") or data.get("raw") or "").strip()
+    # If previous bug saved JSON feedback into polished, fall back to raw
+    if (
+        isinstance(text, str)
+        and text.startswith("{")
+        and ("feedback" in text and "tips" in text)
+    ):
+        text = (data.get("raw") or "").strip()
+    return text
+
+
+def _load_transcript(session_id: str, slide_index: int) -> str:
+    session_dir = DATA_DIR / session_id
+    audio_dir = session_dir / "audio"
+    tpath = audio_dir / f"slide-{int(slide_index)}.json"
+    data = _read_json(tpath)
+    if data is not None:
+        return _transcript_text(data)
+    # On-demand transcribe if JSON absent or broken. Wait a bit for audio to appear.
+    audio_path = None
+    for _ in range(40):  # ~10s with 0.25s steps
+        audio_path = _slide_audio(audio_dir, slide_index)
+        if audio_path:
+            break
+        time.sleep(0.25)
+    if not audio_path:
+        raise HTTPException(
+            status_code=404, detail="Аудио для транскрибации не найдено"
+        )
+
+    if DISABLE_TRANSCRIPTION:
+        return ""
+    data = _ensure_transcript(session_id, slide_index, audio_path)
+    return data.get("polished") or data.get("raw") or ""
+
+
+REVIEW_SLIDE_PROMPT = (
+    "Оцени подачу и содержание доклада по слайду. Конкретика приветствуется."
+)
+
+
+def _review_key(
+    cfg: Dict[str, Any],
+    file_parts: list,
+    text: str,
+    delivery: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Fingerprint of everything a slide review depends on.
+
+    Отпечаток всего, от чего зависит оценка слайда.
+    """
+    inputs = {
+        "text": text,
+        "mode": cfg.get("mode"),
+        "extraInfo": cfg.get("extraInfo") or "",
+        "includePdf": bool(cfg.get("includePdf")),
+        "slideContext": bool(cfg.get("slideContext")),
+        # The deck by content, not by its Gemini URI, which changes on re-upload
+        "pdf": (cfg.get("gemini_pdf") or {}).get("sha256") if file_parts else None,
+        "delivery": delivery,
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _cached_review(
+    review_dir: Path, slide_index: int, key: str
+) -> Optional[Dict[str, Any]]:
+    """Stored review of a slide if it was made from the same inputs, else None.
+
+    Сохранённая оценка слайда, если она сделана по тем же входным данным, иначе None.
+    """
+    try:
+        stored = (
+            (review_dir / f"slide-{int(slide_index)}-review.key")
+            .read_text(encoding="utf-8")
+            .strip()
+        )
+    except OSError:
+        return None
+    if stored != key:
+        return None
+    return _read_json(review_dir / f"slide-{int(slide_index)}-review.json")
+
+
+def _store_review(
+    review_dir: Path, slide_index: int, data: Dict[str, Any], key: str
+) -> None:
+    """Publish a slide review and its input fingerprint, each atomically.
+
+    Публикует оценку слайда и отпечаток её входных данных, каждый атомарно.
+    """
+    out_path = review_dir / f"slide-{int(slide_index)}-review.json"
+    key_path = review_dir / f"slide-{int(slide_index)}-review.key"
+    # Drop the old fingerprint first so a reader never pairs it with the new review
+    key_path.unlink(missing_ok=True)
+    _write_json(out_path, data)
+    tmp = key_path.with_name(
+        f".{key_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    tmp.write_text(key, encoding="utf-8")
+    os.replace(tmp, key_path)
+    _record_node(review_dir.parent.name, f"review:{int(slide_index)}")
+
+
+def _review_job_key(session_id: str, slide_index: int) -> str:
+    return f"{session_id}/review-slide-{int(slide_index)}"
+
+
+def _speculate_review(session_id: str, slide_index: int) -> bool:
+    """Queue a background review of a transcribed slide once review mode is on.
+
+    Ставит в очередь фоновую оценку транскрибированного слайда, если режим оценки
+    включён.
+    """
+    session_dir = DATA_DIR / session_id
+    review_dir = session_dir / "review"
+    tpath = session_dir / "audio" / f"slide-{int(slide_index)}.json"
+    if not (review_dir / "config.json").exists() or not tpath.exists():
+        return False
+
+    def job(stale) -> bool:
+        cfg, extra, file_parts = _load_review_config(review_dir)
+        data = _read_json(tpath)
+        if data is None or stale():
+            return False
+        text = _transcript_text(data)
+        delivery = _read_delivery(session_dir, slide_index)
+        key = _review_key(cfg, file_parts, text, delivery)
+        if _cached_review(review_dir, slide_index, key) is not None:
+            return False
+        ctx = (
+            slide_context.load_slide_context(session_dir / "slides", int(slide_index))
+            if cfg.get("slideContext")
+            else None
+        )
+        ag = AskGemini(
+            system_prompt=REVIEW_SLIDE_PROMPT, user_context=extra, file_parts=file_parts
+        )
+        review = ag.review_slide(
+            int(slide_index),
+            text,
+            slide_context=ctx,
+            priority=Priority.SPECULATIVE,
+            delivery=delivery,
+        )
+        # Audio re-recorded or review restarted while the model was answering
+        current = _read_json(tpath)
+        if stale() or current is None or _transcript_text(current) != text:
+            return False
+        with singleflight.key_lock(session_dir, f"review-slide-{int(slide_index)}"):
+            _store_review(review_dir, slide_index, review, key)
+        return True
+
+    return speculator.submit(_review_job_key(session_id, slide_index), job)
+
+
+async def _slide_review_inputs(session_id: str, slide_index: int) -> Dict[str, Any]:
+    """Gather everything a slide review needs: config, files, slide context, transcript.
+
+    Собирает всё нужное для оценки слайда: конфиг, файлы, контекст слайда, транскрипт.
+    """
+    if not (DATA_DIR / session_id).exists():
         raise HTTPException(status_code=404, detail="Сессия не найдена")
-    review_dir = _review_dir(sessionId)
+    timing.annotate(session_id=session_id)
+    # Off the event loop: may wait for the deck upload or transcribe on demand
+    return await run_in_threadpool(
+        _gather_slide_review_inputs, session_id, int(slide_index)
+    )
+
+
+def _gather_slide_review_inputs(session_id: str, slide_index: int) -> Dict[str, Any]:
+    """Blocking part of _slide_review_inputs, also used by the batch CLI.
+
+    Блокирующая часть _slide_review_inputs, используется и пакетным CLI.
+    """
+    session_dir = DATA_DIR / session_id
+    review_dir = _review_dir(session_id)
+    cfg, extra, file_parts = _load_review_config(review_dir)
+    ctx = None
+    if cfg.get("slideContext"):
+        ctx = slide_context.load_slide_context(session_dir / "slides", int(slide_index))
+
+    with timing.stage("transcript"):
+        polished_text = _load_transcript(session_id, int(slide_index))
+    delivery = _read_delivery(session_dir, slide_index)
+    return {
+        "session_dir": session_dir,
+        "review_dir": review_dir,
+        "extra": extra,
+        "file_parts": file_parts,
+        "ctx": ctx,
+        "text": polished_text,
+        "delivery": delivery,
+        "key": _review_key(cfg, file_parts, polished_text, delivery),
+    }
 
+
+@app.post("/review/slide")
+async def review_slide(
+    sessionId: str = Form(...),
+    slideIndex: int = Form(...),
+):
+    inputs = await _slide_review_inputs(sessionId, int(slideIndex))
+    session_dir, review_dir = inputs["session_dir"], inputs["review_dir"]
+    key = inputs["key"]
+    extra, file_parts, ctx = inputs["extra"], inputs["file_parts"], inputs["ctx"]
+    polished_text = inputs["text"]
+    # Reviewed in the background already (or by a double click) with the same inputs
+    cached = _cached_review(review_dir, int(slideIndex), key)
+    if cached is not None:
+        timing.annotate(review_cached=1)
+        return cached
+
+    def ready() -> Optional[Dict[str, Any]]:
+        return _cached_review(review_dir, int(slideIndex), key)
+
+    def compute() -> Dict[str, Any]:
+        # The user is waiting now: a queued guess would only duplicate this call
+        speculator.cancel(_review_job_key(sessionId, int(slideIndex)))
+        ag = AskGemini(
+            system_prompt=REVIEW_SLIDE_PROMPT, user_context=extra, file_parts=file_parts
+        )
+        data = ag.review_slide(
+            int(slideIndex),
+            polished_text,
+            slide_context=ctx,
+            delivery=inputs["delivery"],
+        )
+        _store_review(review_dir, int(slideIndex), data, key)
+        return data
+
+    try:
+        # Off the event loop: the call may wait in the Gemini scheduler queue
+        return await run_in_threadpool(
+            singleflight.run_once,
+            session_dir,
+            f"review-slide-{int(slideIndex)}",
+            ready,
+            compute,
+        )
+    except Exception as e:
+        raise _review_error(e, f"Ошибка оценки слайда: {e}")
+
+
+def _review_slide_now(
+    session_id: str, slide_index: int, priority: Priority = Priority.INTERACTIVE
+) -> Dict[str, Any]:
+    """Review one slide synchronously.
+
+    A stored review made from the same inputs is reused.
+
+    Оценивает один слайд синхронно.
+
+    Сохранённая оценка с теми же входными данными используется повторно.
+    """
+    inputs = _gather_slide_review_inputs(session_id, int(slide_index))
+    review_dir, key = inputs["review_dir"], inputs["key"]
+
+    def ready() -> Optional[Dict[str, Any]]:
+        return _cached_review(review_dir, int(slide_index), key)
+
+    def compute() -> Dict[str, Any]:
+        ag = AskGemini(
+            system_prompt=REVIEW_SLIDE_PROMPT,
+            user_context=inputs["extra"],
+            file_parts=inputs["file_parts"],
+        )
+        data = ag.review_slide(
+            int(slide_index),
+            inputs["text"],
+            slide_context=inputs["ctx"],
+            priority=priority,
+            delivery=inputs["delivery"],
+        )
+        _store_review(review_dir, int(slide_index), data, key)
+        return data
+
+    return singleflight.run_once(
+        inputs["session_dir"], f"review-slide-{int(slide_index)}", ready, compute
+    )
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse(event: str, data: Any) -> bytes:
+    """Encode one Server-Sent Events message.
+
+    Кодирует одно сообщение Server-Sent Events.
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+
+async def _sse_stream(
+    events: Iterator[Tuple[str, Any]], on_done, detail: str
+) -> AsyncIterator[bytes]:
+    """Relay (event, data) pairs as SSE.
+
+    The final result is persisted and errors are reported in-band. ``events``
+    runs in the threadpool and is closed when the stream ends, also when the
+    client disconnects, so the locks and scheduler slot it holds are released.
+
+    Передаёт пары (событие, данные) как SSE.
+
+    Итог сохраняется, а об ошибках сообщается в самом потоке. ``events``
+    выполняется в пуле потоков и закрывается по окончании потока, в том числе
+    при отключении клиента, поэтому удерживаемые им блокировки и слот
+    планировщика освобождаются.
+    """
+    try:
+        while True:
+            item = await run_in_threadpool(next, events, None)
+            if item is None:
+                break
+            event, data = item
+            if event == "done":
+                await run_in_threadpool(on_done, data)
+            yield _sse(event, data)
+    except Exception as e:
+        # Headers are already sent, so the status travels inside the stream
+        err = _review_error(e, f"{detail}: {e}")
+        yield _sse(
+            "error",
+            {
+                "status": err.status_code,
+                "detail": err.detail,
+                "retryAfter": (err.headers or {}).get("Retry-After"),
+            },
+        )
+    finally:
+        # Starlette drops a response whose client left without closing its
+        # iterator; the close still runs when the request is cancelled
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(events.close)
+
+
+def _replay(result: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    """Events of an already finished result, in the same shape as a live stream.
+
+    События уже готового результата в том же виде, что и живой поток.
+    """
+    for field, value in result.items():
+        yield "field", {"field": field, "value": value}
+    yield "done", result
+
+
+@app.post("/review/slide/stream")
+async def review_slide_stream(
+    sessionId: str = Form(...),
+    slideIndex: int = Form(...),
+):
+    """Slide review as Server-Sent Events.
+
+    Feedback text is sent while it is written, then each field.
+
+    Оценка слайда как Server-Sent Events.
+
+    Текст отзыва передаётся по мере написания, затем каждое поле.
+    """
+    inputs = await _slide_review_inputs(sessionId, int(slideIndex))
+    review_dir, key = inputs["review_dir"], inputs["key"]
+    cached = _cached_review(review_dir, int(slideIndex), key)
+    if cached is not None:
+        timing.annotate(review_cached=1)
+        return StreamingResponse(
+            _sse_stream(_replay(cached), lambda data: None, "Ошибка оценки слайда"),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
+    def events() -> Iterator[Tuple[str, Any]]:
+        # Same lock as /review/slide: a double click or a second tab waits for this
+        # stream and replays its result. _sse_stream stores the review on "done",
+        # while the generator is still inside the lock
+        lock_key = f"review-slide-{int(slideIndex)}"
+        with singleflight.key_lock(inputs["session_dir"], lock_key):
+            cached = _cached_review(review_dir, int(slideIndex), key)
+            if cached is not None:
+                timing.annotate(singleflight_shared=1)
+                yield from _replay(cached)
+                return
+            speculator.cancel(_review_job_key(sessionId, int(slideIndex)))
+            ag = AskGemini(
+                system_prompt=REVIEW_SLIDE_PROMPT,
+                user_context=inputs["extra"],
+                file_parts=inputs["file_parts"],
+            )
+            yield from ag.review_slide_stream(
+                int(slideIndex), inputs["text"], slide_context=inputs["ctx"],
+                delivery=inputs["delivery"],
+            )
+
+    def store(data: Dict[str, Any]) -> None:
+        # A replayed review is already stored
+        if _cached_review(review_dir, int(slideIndex), key) is None:
+            _store_review(review_dir, int(slideIndex), data, key)
+
+    return StreamingResponse(
+        _sse_stream(events(), store, "Ошибка оценки слайда"),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+def _summary_inputs(
+    session_dir: Path, review_dir: Path
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Per-slide reviews and transcripts the summary is built from.
+
+    Оценки слайдов и транскрипты, из которых строится итоговая оценка.
+    """
     per_slide: List[Dict[str, Any]] = []
     # load all per-slide review results in order of slide number
-    slide_files = sorted(review_dir.glob("slide-*-review.json"), key=lambda p: p.name)
-    for p in slide_files:
+    for p in _slide_files(review_dir, r"slide-(\d+)-review\.json"):
         try:
             with open(p, "r", encoding="utf-8") as f:
                 per_slide.append(json.load(f))
@@ -423,48 +1739,134 @@ async def review_summary(sessionId: str):
     # also collect transcripts as optional context
     transcripts: List[str] = []
     audio_dir = session_dir / "audio"
-    for tfile in sorted(audio_dir.glob("slide-*.json")):
+    # Only slide-N.json: delivery metrics and other sidecars live next to them
+    for tfile in _slide_files(audio_dir, r"slide-(\d+)\.json"):
         try:
             with open(tfile, "r", encoding="utf-8") as f:
                 td = json.load(f)
                 transcripts.append((td.get("polished") or td.get("raw") or "").strip())
         except Exception:
             continue
+    return per_slide, transcripts
+
+
+SUMMARY_PROMPT = (
+    "Сделай итоговую оценку всей презентации: "
+    "сильные и слабые стороны, ясность и структура."
+)
+
+
+async def _summary_request(sessionId: str) -> Tuple[Path, AskGemini, Dict[str, Any]]:
+    """Prepare the summary call: review dir, Gemini client and summarize() arguments.
+
+    Готовит итоговый вызов: каталог оценки, клиент Gemini и аргументы summarize().
+    """
+    if not (DATA_DIR / sessionId).exists():
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    timing.annotate(session_id=sessionId)
+    return await run_in_threadpool(_prepare_summary, sessionId)
+
+
+def _prepare_summary(session_id: str) -> Tuple[Path, AskGemini, Dict[str, Any]]:
+    """Blocking part of _summary_request, also used by the batch CLI.
+
+    Блокирующая часть _summary_request, используется и пакетным CLI.
+    """
+    session_dir = DATA_DIR / session_id
+    review_dir = _review_dir(session_id)
+    per_slide, transcripts = _summary_inputs(session_dir, review_dir)
+    cfg, extra, file_parts = _load_review_config(review_dir)
+    outline = (
+        slide_context.outline(session_dir / "slides")
+        if cfg.get("slideContext")
+        else None
+    )
+
+    ag = AskGemini(
+        system_prompt=SUMMARY_PROMPT, user_context=extra, file_parts=file_parts
+    )
+    kwargs = {
+        "per_slide_findings": per_slide,
+        "transcripts": transcripts if transcripts else None,
+        "deck_outline": outline,
+    }
+    return review_dir, ag, kwargs
 
-    cfg_path = review_dir / "config.json"
-    extra = ""
-    file_parts = []
-    if cfg_path.exists():
-        try:
-            with open(cfg_path, "r", encoding="utf-8") as f:
-                cfg = json.load(f)
-                extra = cfg.get("extraInfo") or ""
-                pdf_meta = cfg.get("gemini_pdf")
-                if pdf_meta and isinstance(pdf_meta, dict):
-                    uri = pdf_meta.get("file_uri")
-                    mt = pdf_meta.get("mime_type")
-                    if uri and mt:
-                        file_parts.append({"file_uri": uri, "mime_type": mt})
-        except Exception:
-            pass
 
-    system_prompt = "Сделай итоговую оценку всей презентации: сильные и слабые стороны, ясность и структура."
-    ag = AskGemini(system_prompt=system_prompt, user_context=extra, file_parts=file_parts)
+def _store_summary(review_dir: Path, data: Dict[str, Any]) -> None:
+    _write_json(review_dir / "summary.json", data)
+    _record_node(review_dir.parent.name, "summary")
+
+
+def _fresh_summary(session_id: str) -> Optional[Dict[str, Any]]:
+    """Stored summary if no slide review changed since it was written, else None.
+
+    Сохранённая итоговая оценка, если ни одна оценка слайда не менялась с её записи,
+    иначе None.
+    """
+    try:
+        node = _session_graph(session_id).status()["summary"]
+    except Exception:
+        return None
+    # Adopted summaries of older sessions were never checked against their reviews
+    if node["status"] != "fresh" or node["ranAt"] is None:
+        return None
+    return _read_json(DATA_DIR / session_id / "review" / "summary.json")
+
+
+@app.get("/review/summary")
+async def review_summary(sessionId: str):
+    if (DATA_DIR / sessionId).exists():
+        cached = await run_in_threadpool(_fresh_summary, sessionId)
+        if cached is not None:
+            timing.annotate(summary_cached=1)
+            return cached
+    review_dir, ag, kwargs = await _summary_request(sessionId)
     try:
-        data = ag.summarize(per_slide_findings=per_slide, transcripts=transcripts if transcripts else None)
+        data = await run_in_threadpool(ag.summarize, **kwargs)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка итоговой оценки: {e}")
+        raise _review_error(e, f"Ошибка итоговой оценки: {e}")
 
-    with open(review_dir / "summary.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    _store_summary(review_dir, data)
     return data
 
 
+@app.get("/review/summary/stream")
+async def review_summary_stream(sessionId: str):
+    """Overall summary as Server-Sent Events, in the format of /review/slide/stream.
+
+    Итоговая оценка как Server-Sent Events в формате /review/slide/stream.
+    """
+    if (DATA_DIR / sessionId).exists():
+        cached = await run_in_threadpool(_fresh_summary, sessionId)
+        if cached is not None:
+            timing.annotate(summary_cached=1)
+            return StreamingResponse(
+                _sse_stream(
+                    _replay(cached), lambda data: None, "Ошибка итоговой оценки"
+                ),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS,
+            )
+    review_dir, ag, kwargs = await _summary_request(sessionId)
+    events = ag.summarize_stream(**kwargs)
+    return StreamingResponse(
+        _sse_stream(
+            events,
+            lambda data: _store_summary(review_dir, data),
+            "Ошибка итоговой оценки",
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 @app.get("/transcript")
 async def get_transcript(sessionId: str, slideIndex: int):
     session_dir = DATA_DIR / sessionId
     if not session_dir.exists():
         raise HTTPException(status_code=404, detail="Сессия не найдена")
+    timing.annotate(session_id=sessionId)
     audio_dir = session_dir / "audio"
     transcript_json = audio_dir / f"slide-{int(slideIndex)}.json"
     if transcript_json.exists():
@@ -473,42 +1875,208 @@ async def get_transcript(sessionId: str, slideIndex: int):
             with open(transcript_json, "r", encoding="utf-8") as f:
                 data = json.load(f)
             # Sanitize legacy records where polished accidentally contains JSON feedback
-            polished = (data.get("polished") or "").strip() if isinstance(data.get("polished"), str) else ""
-            if polished.startswith("{") and ("feedback" in polished and "tips" in polished):
+            polished = data.get("polished")
+            polished = polished.strip() if isinstance(polished, str) else ""
+            if polished.startswith("{") and (
+                "feedback" in polished and "tips" in polished
+            ):
                 data["polished"] = ""
             # Add dev flag so client can decide how to render
             data["devMode"] = DEV_MODE
+            data["delivery"] = _read_delivery(session_dir, int(slideIndex))
             return data
         except Exception:
-            raise HTTPException(status_code=500, detail="Не удалось прочитать транскрипт")
+            raise HTTPException(
+                status_code=500, detail="Не удалось прочитать транскрипт"
+            )
 
     # Optional: if JSON is absent but audio exists, try to transcribe on-demand
-    mp3_path = audio_dir / f"slide-{int(slideIndex)}.mp3"
-    raw_candidates = list(audio_dir.glob(f"slide-{int(slideIndex)}.*"))
-    audio_path = mp3_path if mp3_path.exists() else (raw_candidates[0] if raw_candidates else None)
-    if not audio_path or not audio_path.exists():
+    audio_path = _slide_audio(audio_dir, int(slideIndex))
+    if not audio_path:
         raise HTTPException(status_code=404, detail="Аудио для этого слайда не найдено")
 
     if DISABLE_TRANSCRIPTION:
-        raise HTTPException(status_code=404, detail="Транскрибация отключена на сервере")
+        raise HTTPException(
+            status_code=404, detail="Транскрибация отключена на сервере"
+        )
     try:
-        at = AudioToText(
-            audio_file_path=str(audio_path),
-            language=SupportedLanguagesCodesEnum.RU,
-            whisper_model=WhisperModelsENUM.TINY,
-            gemini_model=GeminiModelsEnum.gemini_2_5_flash,
+        payload = dict(
+            await run_in_threadpool(
+                _ensure_transcript, sessionId, int(slideIndex), audio_path
+            )
         )
-        raw_text = at.transcribe_file()
-        polished_text = at.restore_transcribed_text_with_gemini()
-        payload = {
-            "raw": raw_text,
-            "polished": polished_text,
-            "lang": str(SupportedLanguagesCodesEnum.RU),
-            "devMode": DEV_MODE,
-        }
-        import json
-        with open(transcript_json, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
+        payload["devMode"] = DEV_MODE
+        payload["delivery"] = _read_delivery(session_dir, int(slideIndex))
         return payload
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка транскрибации: {e}")
+
+
+# ---- Artifact graph ----
+
+def _session_graph(session_id: str) -> ArtifactGraph:
+    """Artifact graph of a session.
+
+    deck -> slides, audio:N -> transcript:N -> review:N -> summary.
+
+    Граф артефактов сессии.
+
+    deck -> slides, audio:N -> transcript:N -> review:N -> summary.
+    """
+    session_dir = DATA_DIR / session_id
+    upload_dir = session_dir / "upload"
+    slides_dir = session_dir / "slides"
+    audio_dir = session_dir / "audio"
+    review_dir = session_dir / "review"
+
+    def deck_files() -> List[Path]:
+        manifest = _read_json(upload_dir / "manifest.json") or {}
+        return [upload_dir / manifest["filename"]] if manifest.get("filename") else []
+
+    def slides_files() -> List[Path]:
+        # Lazy sessions are described by pages.json; PNGs appear there on demand
+        if (slides_dir / page_cache.MANIFEST_NAME).exists():
+            files = [slides_dir / page_cache.MANIFEST_NAME]
+        else:
+            files = _slide_files(slides_dir, r"slide-(\d+)\.png")
+        context = slides_dir / slide_context.CONTEXT_NAME
+        return files + [context] if files and context.exists() else files
+
+    def rebuild_slides() -> None:
+        manifest = _read_json(upload_dir / "manifest.json") or {}
+        shutil.rmtree(slides_dir, ignore_errors=True)
+        _process_deck(
+            session_id,
+            upload_dir / manifest["filename"],
+            int(manifest.get("bytes") or 0),
+            manifest.get("sha256") or "",
+        )
+
+    nodes = [
+        Node("deck", [], deck_files),
+        Node("slides", ["deck"], slides_files, rebuild_slides),
+        Node(
+            "review-config",
+            [],
+            lambda: (
+                [review_dir / "config.json"]
+                if (review_dir / "config.json").exists()
+                else []
+            ),
+        ),
+    ]
+
+    indexes = set()
+    for p in audio_dir.glob("slide-*") if audio_dir.exists() else []:
+        m = re.fullmatch(r"slide-(\d+)\.[^.]+", p.name)
+        if m and p.suffix.lower() in AUDIO_EXTENSIONS | {".mp3"}:
+            indexes.add(int(m.group(1)))
+
+    def slide_nodes(n: int) -> List[Node]:
+        tpath = audio_dir / f"slide-{n}.json"
+        dpath = audio_dir / f"slide-{n}.delivery.json"
+        rpath = review_dir / f"slide-{n}-review.json"
+
+        def audio_files() -> List[Path]:
+            path = _slide_audio(audio_dir, n)
+            return [path] if path else []
+
+        def transcript_files() -> List[Path]:
+            # Delivery metrics come from the same decode and feed the review
+            return [tpath, dpath] if dpath.exists() else [tpath]
+
+        def retranscribe() -> None:
+            tpath.unlink(missing_ok=True)
+            dpath.unlink(missing_ok=True)
+            _ensure_transcript(session_id, n, _slide_audio(audio_dir, n))
+
+        return [
+            Node(f"audio:{n}", [], audio_files),
+            Node(
+                f"transcript:{n}",
+                [f"audio:{n}"],
+                transcript_files,
+                None if DISABLE_TRANSCRIPTION else retranscribe,
+            ),
+            Node(
+                f"review:{n}",
+                [f"transcript:{n}", "review-config", "slides"],
+                lambda: [rpath],
+                lambda: _review_slide_now(session_id, n, Priority.BACKGROUND),
+            ),
+        ]
+
+    for n in sorted(indexes):
+        nodes += slide_nodes(n)
+
+    def summarize() -> None:
+        review_dir_, ag, kwargs = _prepare_summary(session_id)
+        _store_summary(review_dir_, ag.summarize(**kwargs))
+
+    nodes.append(
+        Node(
+            "summary",
+            [f"review:{n}" for n in sorted(indexes)],
+            lambda: [review_dir / "summary.json"],
+            summarize,
+        )
+    )
+    return ArtifactGraph(session_dir, nodes)
+
+
+def _record_node(session_id: str, name: str) -> None:
+    """Mark a graph node as rebuilt by a regular handler; never fails the handler.
+
+    Отмечает узел графа как пересобранный обычным обработчиком; не ломает обработчик.
+    """
+    try:
+        _session_graph(session_id).record(name)
+    except Exception:
+        pass
+
+
+@app.get("/pipeline/{session_id}")
+async def get_pipeline(session_id: str):
+    """Nodes of the session's artifact graph with their dependencies and status.
+
+    Узлы графа артефактов сессии с зависимостями и состоянием.
+    """
+    session_dir = DATA_DIR / session_id
+    if not session_id.isalnum() or not session_dir.exists():
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    timing.annotate(session_id=session_id)
+    nodes = await run_in_threadpool(lambda: _session_graph(session_id).status())
+    return {"sessionId": session_id, "nodes": nodes}
+
+
+@app.post("/pipeline/{session_id}/run")
+async def run_pipeline(session_id: str, target: Optional[str] = Form(None)):
+    """Rebuild stale nodes of the session (or only what ``target`` needs).
+
+    Пересобирает устаревшие узлы сессии (или только нужные для ``target``).
+    """
+    session_dir = DATA_DIR / session_id
+    if not session_id.isalnum() or not session_dir.exists():
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    timing.annotate(session_id=session_id)
+    graph = await run_in_threadpool(_session_graph, session_id)
+    if target and target not in graph.nodes:
+        raise HTTPException(status_code=404, detail="Узел не найден")
+    result = await run_in_threadpool(
+        graph.run, [target] if target else None, PIPELINE_WORKERS
+    )
+    timing.annotate(pipeline_ran=len(result["ran"]))
+    return {
+        "sessionId": session_id,
+        **result,
+        "nodes": await run_in_threadpool(graph.status),
+    }
+
+
+@app.get("/timing/{session_id}")
+async def get_timing(session_id: str):
+    session_dir = DATA_DIR / session_id
+    if not session_id.isalnum() or not session_dir.exists():
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    entries = await run_in_threadpool(timing.read_ledger, session_dir)
+    return {"sessionId": session_id, "entries": entries}
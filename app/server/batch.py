@@ -0,0 +1,409 @@
+"""Grade folders of decks and per-slide recordings without the HTTP API.
+
+Оценивает папки с презентациями и записями по слайдам без HTTP API.
+
+Usage / Использование (from ``app/server``):
+
+    python -m batch /path/to/course --data-dir data --include-pdf
+
+Every directory with one deck (``.pdf`` or ``.pptx``) is a talk. Its recordings
+are the audio files next to the deck or in its ``audio/`` subdirectory whose
+name ends with the slide number (``slide-3.webm``, ``03.m4a``). Each talk gets
+the same ``data/<session>`` layout and review JSON as the web flow, through the
+same helpers (``_process_deck``, ``_ingest_audio``, review and summary), and
+talks run in a process pool sized to the cores and memory of the machine.
+
+Каждый каталог с одной презентацией (``.pdf`` или ``.pptx``) — это доклад.
+Его записи — аудиофайлы рядом с презентацией или в подкаталоге ``audio/``, имя
+которых заканчивается номером слайда (``slide-3.webm``, ``03.m4a``). Каждый
+доклад получает ту же структуру ``data/<сессия>`` и JSON оценок, что и
+веб-сценарий, через те же функции (``_process_deck``, ``_ingest_audio``,
+оценка и итог), а доклады обрабатываются в пуле процессов по числу ядер и
+объёму памяти машины.
+
+The session id is derived from the talk's path and every finished step is
+recorded in ``data/<session>/batch.json`` with the content hashes it used, so
+running the same command again after a crash skips completed work and redoes
+only steps whose inputs changed.
+
+Идентификатор сессии выводится из пути доклада, а каждый завершённый шаг
+записывается в ``data/<сессия>/batch.json`` вместе с хешами содержимого, поэтому
+повторный запуск той же команды после сбоя пропускает готовое и повторяет
+только шаги с изменившимися входными данными.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SERVER_DIR = Path(__file__).resolve().parent
+DECK_SUFFIXES = {".pdf", ".pptx"}
+AUDIO_SUFFIXES = {".webm", ".ogg", ".opus", ".mp3", ".m4a", ".mp4", ".aac",
+                  ".wav", ".flac"}
+STATE_NAME = "batch.json"
+# Trailing slide number of a recording, номер слайда в конце имени записи
+_SLIDE_NUMBER = re.compile(r"(?:^|\D)0*(\d{1,4})$")
+# Resident megabytes of one talk besides Whisper: LibreOffice, pdftoppm, ffmpeg,
+# резидентные мегабайты доклада помимо Whisper: LibreOffice, pdftoppm, ffmpeg
+TALK_OVERHEAD_MB = 400
+
+# Per-process handle of the imported server module,
+# импортированный модуль сервера в процессе
+_app: Any = None
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def find_talks(root: Path) -> List[Dict[str, Any]]:
+    """Find talks under ``root``: one deck per directory plus its recordings.
+
+    Находит доклады в ``root``: одна презентация на каталог и её записи.
+
+    Args:
+
+        root (Path):
+            Directory tree to scan.
+            Сканируемое дерево каталогов.
+
+    Returns:
+
+        List[Dict[str, Any]]:
+            ``{"talk", "deck", "recordings": {slide: path}, "error"}`` sorted by
+            path; ``error`` is set for directories with several decks.
+            ``{"talk", "deck", "recordings": {слайд: путь}, "error"}`` по
+            порядку путей; ``error`` задан для каталогов с несколькими
+            презентациями.
+    """
+
+    talks: List[Dict[str, Any]] = []
+    for directory, _, files in sorted(os.walk(root)):
+        decks = sorted(f for f in files if Path(f).suffix.lower() in DECK_SUFFIXES
+                       and not f.startswith("."))
+        if not decks:
+            continue
+        here = Path(directory)
+        talk: Dict[str, Any] = {
+            "talk": str(here.relative_to(root)) if here != root else ".",
+            "deck": str(here / decks[0]),
+            "recordings": {},
+            "error": None,
+        }
+        if len(decks) > 1:
+            talk["error"] = f"several decks in one directory: {', '.join(decks)}"
+        for folder in (here, here / "audio"):
+            for p in sorted(folder.iterdir()) if folder.is_dir() else []:
+                m = _SLIDE_NUMBER.search(p.stem)
+                if p.is_file() and p.suffix.lower() in AUDIO_SUFFIXES and m:
+                    talk["recordings"].setdefault(int(m.group(1)), str(p))
+        talks.append(talk)
+    return talks
+
+
+def session_id_for(talk: str, salt: str = "") -> str:
+    """Stable session id of a talk, so a rerun resumes the same session.
+
+    Стабильный идентификатор сессии доклада, чтобы повторный запуск продолжал
+    ту же сессию.
+    """
+
+    return hashlib.sha256(f"{salt}\0{talk}".encode("utf-8")).hexdigest()[:32]
+
+
+def default_jobs() -> int:
+    """Talks processed at once: cores, bounded by memory for one Whisper each.
+
+    Сколько докладов обрабатывать одновременно: по ядрам, но не больше, чем
+    помещается в память по одному Whisper на каждый.
+    """
+
+    sys.path.insert(0, str(SERVER_DIR))
+    from AI.AudioToText import WHISPER_ACTIVATIONS_MB, WHISPER_WEIGHTS_MB
+    from utilities.consts import WHISPER_MAX_MODEL
+    from utilities.cpu_budget import detect_cores
+    from utilities.memory import memory_usage
+
+    used, limit = memory_usage()
+    per_talk = (WHISPER_WEIGHTS_MB.get(WHISPER_MAX_MODEL, 1000)
+                + WHISPER_ACTIVATIONS_MB.get(WHISPER_MAX_MODEL, 500)
+                + TALK_OVERHEAD_MB)
+    by_memory = int((limit - used) / 2**20 // per_talk) if limit else detect_cores()
+    return max(1, min(detect_cores(), by_memory))
+
+
+def _init_worker(data_dir: str, jobs: int) -> None:
+    """Configure a pool process and import the server once.
+
+    Настраивает процесс пула и один раз импортирует сервер.
+    """
+
+    global _app
+    os.environ["DATA_DIR"] = data_dir
+    # Cores are split between the pool's processes like between server workers,
+    # ядра делятся между процессами пула так же, как между воркерами сервера
+    os.environ["WEB_CONCURRENCY"] = str(jobs)
+    # Every slide is reviewed explicitly; pages are rendered up front,
+    # каждый слайд оценивается явно, страницы рендерятся сразу
+    os.environ["SPECULATIVE_REVIEW"] = "false"
+    os.environ["LAZY_RENDER"] = "false"
+    if jobs > 1:
+        # Talks already share the cores; a chunk pool per talk would add a model
+        # per core that default_jobs does not size for, доклады уже делят ядра;
+        # пул кусков в каждом добавил бы по модели на ядро, не учтённой в default_jobs
+        os.environ["WHISPER_CHUNKING"] = "false"
+    sys.path.insert(0, str(SERVER_DIR))
+    import app
+
+    _app = app
+
+
+def _load_state(path: Path) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def process_talk(talk: Dict[str, Any], session_id: str, options: Dict[str, Any]
+                 ) -> Dict[str, Any]:
+    """Run one talk through deck, transcripts, slide reviews and summary.
+
+    Проводит один доклад через презентацию, транскрипты, оценки слайдов и итог.
+
+    Pipeline:
+
+        1. Copy and render the deck unless ``batch.json`` has the same hash.
+           Копируем и рендерим презентацию, если в ``batch.json`` другой хеш.
+
+        2. Ingest every recording whose hash changed (remux or transcode, then
+           Whisper and delivery metrics).
+           Принимаем каждую запись с изменившимся хешем (перепаковка или
+           транскодирование, затем Whisper и метрики подачи).
+
+        3. Review transcribed slides in a few threads; reviews made from the
+           same inputs are reused.
+           Оцениваем транскрибированные слайды в несколько потоков; оценки с
+           теми же входными данными переиспользуются.
+
+        4. Summarize when any review changed or no summary exists.
+           Строим итог, если изменилась какая-либо оценка или итога нет.
+
+    Returns:
+
+        Dict[str, Any]:
+            The final ``batch.json`` state of the session.
+            Итоговое состояние ``batch.json`` сессии.
+    """
+
+    app = _app
+    session_dir = app.DATA_DIR / session_id
+    session_dir.mkdir(parents=True, exist_ok=True)
+    state_path = session_dir / STATE_NAME
+    state = _load_state(state_path)
+    state.update(talk=talk["talk"], sessionId=session_id, error=None)
+    state.setdefault("audio", {})
+    state.setdefault("reviews", {})
+
+    def save(**changes: Any) -> None:
+        state.update(changes, updated=time.time())
+        app._write_json(state_path, state)
+
+    try:
+        # Step 1: Deck
+        # Шаг 1: Презентация
+        deck = Path(talk["deck"])
+        deck_sha = _sha256(deck)
+        if state.get("deck") != deck_sha:
+            upload_dir = session_dir / "upload"
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            shutil.rmtree(session_dir / "slides", ignore_errors=True)
+            upload_dir.mkdir(parents=True)
+            saved = upload_dir / deck.name
+            shutil.copyfile(deck, saved)
+            app._process_deck(session_id, saved, saved.stat().st_size, deck_sha)
+            pages = len(list((session_dir / "slides").glob("slide-*.png")))
+            save(deck=deck_sha, pages=pages)
+
+        # Step 2: Recordings
+        # Шаг 2: Записи
+        for slide, path in sorted(talk["recordings"].items()):
+            src = Path(path)
+            sha = _sha256(src)
+            tpath = session_dir / "audio" / f"slide-{slide}.json"
+            # Without transcription there is no transcript to check, the hash decides,
+            # без транскрибации проверять нечего, решает хеш
+            done = app.DISABLE_TRANSCRIPTION or tpath.exists()
+            if state["audio"].get(str(slide)) == sha and done:
+                continue
+            # _ingest_audio moves its input, so it gets a staged copy,
+            # _ingest_audio перемещает вход, поэтому ему передаётся копия
+            app.UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+            staged = app.UPLOADS_DIR / f"batch-{uuid.uuid4().hex}{src.suffix.lower()}"
+            shutil.copyfile(src, staged)
+            try:
+                app._ingest_audio(session_id, slide, staged, src.name, sha)
+            finally:
+                staged.unlink(missing_ok=True)
+            if not app.DISABLE_TRANSCRIPTION and not tpath.exists():
+                # The upload hides transcription errors, the retry raises them,
+                # загрузка скрывает ошибки транскрибации, повтор их пробрасывает
+                audio = app._slide_audio(session_dir / "audio", slide)
+                if audio is None:
+                    raise RuntimeError(f"slide {slide}: recording was not saved")
+                app._ensure_transcript(session_id, slide, audio)
+            state["audio"][str(slide)] = sha
+            save()
+
+        # Step 3: Slide reviews
+        # Шаг 3: Оценки слайдов
+        transcribed = [s for s in sorted(talk["recordings"])
+                       if (session_dir / "audio" / f"slide-{s}.json").exists()]
+        if options["review"] and transcribed:
+            app._write_review_config(session_id, "per-slide", options["extra_info"],
+                                     options["include_pdf"])
+            changed = False
+            with ThreadPoolExecutor(options["review_threads"]) as pool:
+                futures = {pool.submit(app._review_slide_now, session_id, s): s
+                           for s in transcribed}
+                for future in as_completed(futures):
+                    slide = futures[future]
+                    review = future.result()
+                    digest = hashlib.sha256(json.dumps(
+                        review, ensure_ascii=False, sort_keys=True).encode("utf-8")
+                    ).hexdigest()
+                    changed |= state["reviews"].get(str(slide)) != digest
+                    state["reviews"][str(slide)] = digest
+            save()
+
+            # Step 4: Summary
+            # Шаг 4: Итог
+            review_dir = session_dir / "review"
+            if changed or not (review_dir / "summary.json").exists():
+                review_dir, ag, kwargs = app._prepare_summary(session_id)
+                app._store_summary(review_dir, ag.summarize(**kwargs))
+        save(done=True)
+    except Exception as e:
+        save(done=False, error=f"{type(e).__name__}: {getattr(e, 'detail', e)}")
+    return state
+
+
+def _run_one(talk: Dict[str, Any], session_id: str, options: Dict[str, Any]
+             ) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    state = process_talk(talk, session_id, options)
+    return {
+        "talk": talk["talk"],
+        "sessionId": session_id,
+        "slides": state.get("pages"),
+        "recordings": len(talk["recordings"]),
+        "reviews": len(state.get("reviews") or {}),
+        "ok": bool(state.get("done")),
+        "error": state.get("error"),
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command-line entry point.
+
+    Точка входа командной строки.
+
+    Returns:
+
+        int:
+            ``0`` when every talk finished, ``1`` otherwise.
+            ``0``, если все доклады обработаны, иначе ``1``.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("root", type=Path, help="directory tree of talks")
+    parser.add_argument("--data-dir", type=Path,
+                        default=Path(os.getenv("DATA_DIR") or SERVER_DIR / "data"))
+    parser.add_argument("--jobs", type=int, default=0,
+                        help="talks at once (0 = by cores and memory)")
+    parser.add_argument("--review-threads", type=int, default=4,
+                        help="concurrent Gemini slide reviews per talk")
+    parser.add_argument("--extra-info", default="",
+                        help="context for the reviewer, as in the web form")
+    parser.add_argument("--include-pdf", action="store_true",
+                        help="give the reviewer the slide content")
+    parser.add_argument("--no-review", action="store_true",
+                        help="only render decks and transcribe")
+    parser.add_argument("--report", type=Path, help="write the run report JSON here")
+    args = parser.parse_args(argv)
+
+    root = args.root.resolve()
+    talks = find_talks(root)
+    if not talks:
+        print(f"no decks under {root}", file=sys.stderr)
+        return 1
+    jobs = args.jobs if args.jobs > 0 else default_jobs()
+    jobs = min(jobs, len(talks))
+    options = {
+        "review": not args.no_review,
+        "review_threads": max(1, args.review_threads),
+        "extra_info": args.extra_info,
+        "include_pdf": args.include_pdf,
+    }
+    data_dir = str(args.data_dir.resolve())
+    print(f"{len(talks)} talks, {jobs} processes, data in {data_dir}", file=sys.stderr)
+
+    results: List[Dict[str, Any]] = []
+    # Spawned, so each process reads the environment set in _init_worker,
+    # порождаются заново, чтобы каждый процесс прочитал окружение из _init_worker
+    with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker,
+                             initargs=(data_dir, jobs)) as pool:
+        futures = {}
+        for talk in talks:
+            sid = session_id_for(talk["talk"], str(root))
+            if talk["error"]:
+                results.append({"talk": talk["talk"], "sessionId": sid, "ok": False,
+                                "error": talk["error"]})
+                print(f"skipped {talk['talk']}: {talk['error']}", file=sys.stderr)
+                continue
+            futures[pool.submit(_run_one, talk, sid, options)] = talk
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The process died (OOM, crash); rerunning resumes the talk,
+                # процесс упал (OOM, сбой); повторный запуск продолжит доклад
+                talk = futures[future]
+                result = {"talk": talk["talk"], "ok": False,
+                          "sessionId": session_id_for(talk["talk"], str(root)),
+                          "error": f"{type(e).__name__}: {e}"}
+            results.append(result)
+            status = "ok" if result["ok"] else f"failed: {result['error']}"
+            print(f"[{len(results)}/{len(talks)}] {result['talk']} -> "
+                  f"{result['sessionId']} {status}", file=sys.stderr)
+
+    results.sort(key=lambda r: r["talk"])
+    report = {"root": str(root), "dataDir": data_dir, "jobs": jobs, "talks": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.report:
+        args.report.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
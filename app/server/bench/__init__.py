@@ -0,0 +1,4 @@
+"""Offline benchmarks for the slide-and-speech pipeline.
+
+Офлайн-бенчмарки конвейера слайдов и речи.
+"""
@@ -0,0 +1,73 @@
+"""Compare two benchmark reports and flag median regressions.
+
+Сравнивает два отчёта бенчмарков и отмечает регрессии медиан.
+
+Usage / Использование:
+
+    python -m bench.compare base.json head.json --threshold 0.15
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _key(row: Dict[str, Any]) -> Tuple[str, str]:
+    """Return a stable identity for a result row.
+
+    Возвращает стабильный идентификатор строки результата.
+    """
+
+    return row["name"], json.dumps(row.get("params", {}), sort_keys=True)
+
+
+def _load(path: str) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """Load measured rows of a report keyed by identity.
+
+    Загружает измеренные строки отчёта по идентификатору.
+    """
+
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return {_key(r): r for r in report.get("results", []) if "stats_ms" in r}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print a comparison table and fail on regressions above the threshold.
+
+    Печатает таблицу сравнения и завершается ошибкой при регрессиях выше порога.
+
+    Returns:
+
+        int:
+            ``1`` if any median regressed beyond the threshold, else ``0``.
+            ``1``, если какая-либо медиана ухудшилась сверх порога, иначе ``0``.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="relative median slowdown treated as regression")
+    args = parser.parse_args(argv)
+
+    base, head = _load(args.base), _load(args.head)
+    regressed = False
+    print(f"{'benchmark':<60} {'base ms':>10} {'head ms':>10} {'delta':>8}")
+    for key in sorted(set(base) | set(head)):
+        label = f"{key[0]} {key[1]}"[:60]
+        b = base.get(key, {}).get("stats_ms", {}).get("median")
+        h = head.get(key, {}).get("stats_ms", {}).get("median")
+        if b is None or h is None:
+            print(f"{label:<60} {str(b):>10} {str(h):>10} {'n/a':>8}")
+            continue
+        delta = (h - b) / b if b else 0.0
+        flag = " !" if delta > args.threshold else ""
+        regressed = regressed or bool(flag)
+        print(f"{label:<60} {b:>10.1f} {h:>10.1f} {delta:>+7.1%}{flag}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
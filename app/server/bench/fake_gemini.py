@@ -0,0 +1,305 @@
+"""Deterministic offline stand-in for the Gemini client used by ``AskGemini``.
+
+Детерминированная офлайн-замена клиента Gemini, используемого ``AskGemini``.
+"""
+
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Size of one streamed chunk, размер одной части потокового ответа
+STREAM_CHUNK_CHARS = 24
+
+
+def _digest(text: str) -> int:
+    """Return a stable integer derived from text.
+
+    Возвращает стабильное целое число, полученное из текста.
+
+    Args:
+
+        text (str):
+            Source text.
+            Исходный текст.
+
+    Returns:
+
+        int:
+            Non-negative integer seed.
+            Неотрицательное целое зерно.
+    """
+
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:12], 16)
+
+
+def payload_for_schema(
+        schema: Dict[str, Any], seed: int = 0, path: str = "") -> Any:
+    """Build a deterministic value that satisfies a structured-output schema.
+
+    Строит детерминированное значение, удовлетворяющее схеме структурированного
+    вывода.
+
+    Args:
+
+        schema (Dict[str, Any]):
+            Subset of OpenAPI schema used by ``AskGemini``.
+            Подмножество схемы OpenAPI, используемое ``AskGemini``.
+
+        seed (int):
+            Seed derived from the prompt.
+            Зерно, полученное из запроса.
+
+        path (str):
+            Dotted path of the value, used in generated strings.
+            Путь значения через точку, используется в строках.
+
+    Returns:
+
+        Any:
+            Value of the schema type.
+            Значение типа схемы.
+    """
+
+    kind = str(schema.get("type", "string")).lower()
+    local = _digest(f"{seed}:{path}")
+    if kind == "object":
+        props = schema.get("properties") or {}
+        return {
+            key: payload_for_schema(sub, seed, f"{path}.{key}".lstrip("."))
+            for key, sub in props.items()
+        }
+    if kind == "array":
+        count = max(int(schema.get("minItems", 0) or 0), 1 + local % 3)
+        if schema.get("maxItems") is not None:
+            count = min(count, int(schema["maxItems"]))
+        items = schema.get("items") or {"type": "string"}
+        return [
+            payload_for_schema(items, seed, f"{path}[{i}]") for i in range(count)
+        ]
+    if kind in {"integer", "number"}:
+        low = int(schema.get("minimum", 0))
+        high = int(schema.get("maximum", 100))
+        return low + local % (high - low + 1)
+    if kind == "boolean":
+        return bool(local % 2)
+    return f"Синтетический ответ {path or 'text'} #{local % 1000}"
+
+
+def _prompt_texts(contents: Any) -> List[str]:
+    """Collect text parts of a ``generate_content`` request.
+
+    Собирает текстовые части запроса ``generate_content``.
+
+    Args:
+
+        contents (Any):
+            Contents as passed by ``AskGemini._gen``.
+            Содержимое в формате ``AskGemini._gen``.
+
+    Returns:
+
+        List[str]:
+            Text parts in request order.
+            Текстовые части в порядке запроса.
+    """
+
+    texts: List[str] = []
+    for msg in contents if isinstance(contents, list) else [contents]:
+        if isinstance(msg, str):
+            texts.append(msg)
+            continue
+        for part in (msg or {}).get("parts") or []:
+            if isinstance(part, dict) and part.get("text"):
+                texts.append(str(part["text"]))
+    return texts
+
+
+def fake_response_text(contents: Any, config: Optional[Dict[str, Any]]) -> str:
+    """Produce the text a model would return for a request.
+
+    Формирует текст, который вернула бы модель на запрос.
+
+    Args:
+
+        contents (Any):
+            Request contents.
+            Содержимое запроса.
+
+        config (Optional[Dict[str, Any]]):
+            Generation config with optional ``response_schema``.
+            Конфигурация генерации с необязательной ``response_schema``.
+
+    Returns:
+
+        str:
+            JSON for structured requests, otherwise echoed plain text.
+            JSON для структурированных запросов, иначе повторённый текст.
+    """
+
+    texts = _prompt_texts(contents)
+    prompt = "\n".join(texts)
+    schema = (config or {}).get("response_schema")
+    if schema:
+        payload = payload_for_schema(schema, seed=_digest(prompt))
+        return json.dumps(payload, ensure_ascii=False)
+    # Restore requests: echo the transcript part, which is the last text part,
+    # запросы восстановления: возвращаем транскрипт, это последняя часть
+    return texts[-1].strip() if texts else ""
+
+
+class _Response:
+    """Minimal ``GenerateContentResponse`` look-alike.
+
+    Минимальный аналог ``GenerateContentResponse``.
+    """
+
+    def __init__(self, text: str, structured: bool):
+        self.text = text
+        self.parsed = json.loads(text) if structured else None
+
+
+class _Models:
+    """Fake ``client.models`` namespace.
+
+    Поддельное пространство имён ``client.models``.
+    """
+
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+        self.calls = 0
+
+    def generate_content(
+            self, model: str, contents: Any, config: Optional[dict] = None):
+        """Return a deterministic response after the configured latency.
+
+        Возвращает детерминированный ответ после заданной задержки.
+        """
+
+        self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        text = fake_response_text(contents, config)
+        structured = bool((config or {}).get("response_schema"))
+        return _Response(text, structured=structured)
+
+    def generate_content_stream(
+            self, model: str, contents: Any, config: Optional[dict] = None):
+        """Yield the same response in small chunks spread over the latency.
+
+        Выдаёт тот же ответ небольшими частями, распределёнными по задержке.
+        """
+
+        self.calls += 1
+        text = fake_response_text(contents, config)
+        pieces = [text[i:i + STREAM_CHUNK_CHARS]
+                  for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        for piece in pieces:
+            if self.latency_s:
+                time.sleep(self.latency_s / len(pieces))
+            yield _Response(piece, structured=False)
+
+
+class _UploadedFile:
+    """Fake uploaded file descriptor.
+
+    Поддельное описание загруженного файла.
+    """
+
+    def __init__(self, path: str):
+        digest = hashlib.sha256(Path(path).read_bytes()).hexdigest()[:16]
+        self.name = f"files/{digest}"
+        self.uri = f"https://fake.local/v1beta/files/{digest}"
+        self.mime_type = "application/pdf"
+        self.expiration_time = datetime.now(timezone.utc) + timedelta(hours=48)
+
+
+class _Files:
+    """Fake ``client.files`` namespace.
+
+    Поддельное пространство имён ``client.files``.
+    """
+
+    def __init__(self):
+        self.uploads = 0
+
+    def upload(self, file: str, **_: Any) -> _UploadedFile:
+        """Pretend to upload a file.
+
+        Имитирует загрузку файла.
+        """
+
+        self.uploads += 1
+        return _UploadedFile(str(file))
+
+
+class FakeGeminiClient:
+    """Offline replacement for ``genai.Client``.
+
+    Офлайн-замена ``genai.Client``.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        """Create the fake client.
+
+        Создаёт поддельного клиента.
+
+        Args:
+
+            latency_ms (float):
+                Artificial latency per ``generate_content`` call.
+                Искусственная задержка на вызов ``generate_content``.
+        """
+
+        self.models = _Models(latency_ms / 1000.0)
+        self.files = _Files()
+
+
+def install(latency_ms: float = 0.0, *modules: Any) -> FakeGeminiClient:
+    """Route every ``make_client`` call to one shared fake client.
+
+    Перенаправляет все вызовы ``make_client`` на общий поддельный клиент.
+
+    Pipeline:
+
+        1. Create the shared fake client.
+           Создаём общий поддельный клиент.
+
+        2. Patch ``AI.AskGemini.make_client`` and re-exports in given modules.
+           Подменяем ``AI.AskGemini.make_client`` и его импорты в модулях.
+
+    Args:
+
+        latency_ms (float):
+            Artificial latency per model call.
+            Искусственная задержка на вызов модели.
+
+        *modules (Any):
+            Modules that imported ``make_client`` by name (e.g. ``app``).
+            Модули, импортировавшие ``make_client`` по имени (например ``app``).
+
+    Returns:
+
+        FakeGeminiClient:
+            The installed client, useful for call counters.
+            Установленный клиент, полезен для счётчиков вызовов.
+    """
+
+    # Step 1: Create shared client
+    # Шаг 1: Создаём общий клиент
+    from AI import AskGemini as ask_gemini_module
+
+    client = FakeGeminiClient(latency_ms=latency_ms)
+
+    # Step 2: Patch factories
+    # Шаг 2: Подменяем фабрики
+    def make_client() -> FakeGeminiClient:
+        return client
+
+    ask_gemini_module.make_client = make_client
+    for module in modules:
+        if hasattr(module, "make_client"):
+            module.make_client = make_client
+    return client
@@ -0,0 +1,474 @@
+"""Local HTTP stand-in for the Gemini REST surface used by the server.
+
+Локальная HTTP-замена REST-интерфейса Gemini, используемого сервером.
+
+Implements ``models/*:generateContent``, ``models/*:streamGenerateContent``,
+the resumable ``files.upload`` protocol and ``files.get`` with configurable
+latency, error rate and token-bucket rate limits. Point the server at it with
+``GEMINI_BASE_URL=http://127.0.0.1:8765``.
+
+Реализует ``models/*:generateContent``, ``models/*:streamGenerateContent``,
+протокол возобновляемой ``files.upload`` и ``files.get`` с настраиваемой
+задержкой, долей ошибок и ограничением по token bucket. Подключите сервер через
+``GEMINI_BASE_URL=http://127.0.0.1:8765``.
+
+Usage / Использование (from ``app/server``):
+
+    python -m bench.gemini_stub --port 8765 --latency-ms 900 --jitter-ms 300 \\
+        --error-rate 0.02 --rpm 300 --tpm 400000
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from bench.fake_gemini import fake_response_text
+
+_GENERATE_RE = re.compile(
+    r"^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)$"
+)
+_FILE_RE = re.compile(r"^/v1beta/(files/[^/]+)$")
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously per minute.
+
+    Потокобезопасное ведро токенов с непрерывным пополнением за минуту.
+    """
+
+    def __init__(self, per_minute: float):
+        """Create a bucket.
+
+        Создаёт ведро.
+
+        Args:
+
+            per_minute (float):
+                Capacity and refill per minute; ``0`` disables the limit.
+                Ёмкость и пополнение в минуту; ``0`` отключает лимит.
+        """
+
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount: float) -> Tuple[bool, float]:
+        """Try to take tokens.
+
+        Пытается взять токены.
+
+        Args:
+
+            amount (float):
+                Tokens requested.
+                Запрошенные токены.
+
+        Returns:
+
+            Tuple[bool, float]:
+                Whether tokens were taken and seconds until enough refill.
+                Удалось ли взять токены и секунды до достаточного пополнения.
+        """
+
+        if self.capacity <= 0:
+            return True, 0.0
+        with self._lock:
+            now = time.monotonic()
+            rate = self.capacity / 60.0
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            amount = min(amount, self.capacity)
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True, 0.0
+            return False, (amount - self.tokens) / rate
+
+
+class StubState:
+    """Shared configuration, limits, uploaded files and counters.
+
+    Общие настройки, лимиты, загруженные файлы и счётчики.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        """Build state from command-line options.
+
+        Строит состояние из параметров командной строки.
+        """
+
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.rng_lock = threading.Lock()
+        self.requests = TokenBucket(args.rpm)
+        self.tokens = TokenBucket(args.tpm)
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def count(self, key: str) -> None:
+        """Increment a named counter.
+
+        Увеличивает именованный счётчик.
+        """
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def roll(self) -> float:
+        """Return a reproducible random number in ``[0, 1)``.
+
+        Возвращает воспроизводимое случайное число в ``[0, 1)``.
+        """
+
+        with self.rng_lock:
+            return self.rng.random()
+
+    def delay(self, output_chars: int = 0) -> float:
+        """Return simulated model latency in seconds.
+
+        Возвращает имитируемую задержку модели в секундах.
+        """
+
+        jitter = (self.roll() * 2 - 1) * self.args.jitter_ms
+        per_token = self.args.ms_per_output_token * output_chars / 4.0
+        return max(0.0, self.args.latency_ms + jitter + per_token) / 1000.0
+
+
+def _error_body(code: int, status: str, message: str) -> bytes:
+    """Build a Google API style error document.
+
+    Формирует документ ошибки в стиле Google API.
+    """
+
+    return json.dumps(
+        {"error": {"code": code, "status": status, "message": message}}
+    ).encode("utf-8")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler emulating the Gemini REST endpoints.
+
+    Обработчик запросов, эмулирующий REST-эндпоинты Gemini.
+    """
+
+    server_version = "GeminiStub/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self) -> StubState:
+        """Return the shared state attached to the server.
+
+        Возвращает общее состояние, привязанное к серверу.
+        """
+
+        return self.server.state  # type: ignore[attr-defined]
+
+    def log_message(self, fmt: str, *args: Any) -> None:
+        """Silence per-request logging unless verbose.
+
+        Отключает журнал запросов, если не включён подробный режим.
+        """
+
+        if self.state.args.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, code: int, body: bytes = b"",
+              headers: Optional[Dict[str, str]] = None,
+              content_type: str = "application/json") -> None:
+        """Send a complete response.
+
+        Отправляет полный ответ.
+        """
+
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        """Read the request body.
+
+        Читает тело запроса.
+        """
+
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _admit(self, est_tokens: float) -> bool:
+        """Apply rate limits and error injection; reply on rejection.
+
+        Применяет лимиты и внедрение ошибок; отвечает при отказе.
+
+        Returns:
+
+            bool:
+                ``True`` if the request may proceed.
+                ``True``, если запрос можно выполнять.
+        """
+
+        st = self.state
+        ok, wait = st.requests.take(1)
+        if ok:
+            ok, wait = st.tokens.take(est_tokens)
+        if not ok:
+            st.count("429")
+            self._send(429, _error_body(429, "RESOURCE_EXHAUSTED",
+                                        "Quota exceeded (stub)"),
+                       {"Retry-After": str(max(1, int(wait + 0.999)))})
+            return False
+        if st.roll() < st.args.error_rate:
+            unavailable = st.roll() < 0.5
+            code, status = (503, "UNAVAILABLE") if unavailable else (500, "INTERNAL")
+            st.count(str(code))
+            time.sleep(st.delay() / 4)
+            self._send(code, _error_body(code, status, "Injected failure (stub)"))
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        """Serve ``files.get`` and ``/_stats``.
+
+        Обслуживает ``files.get`` и ``/_stats``.
+        """
+
+        path = urlparse(self.path).path
+        if path == "/_stats":
+            with self.state.lock:
+                body = json.dumps(self.state.counters).encode("utf-8")
+            self._send(200, body)
+            return
+        match = _FILE_RE.match(path)
+        meta = self.state.files.get(match.group(1)) if match else None
+        if meta is None:
+            self._send(404, _error_body(404, "NOT_FOUND", "File not found (stub)"))
+            return
+        self.state.count("files.get")
+        self._send(200, json.dumps(meta).encode("utf-8"))
+
+    def do_POST(self) -> None:
+        """Dispatch generation and upload requests.
+
+        Распределяет запросы генерации и загрузки.
+        """
+
+        parsed = urlparse(self.path)
+        if parsed.path == "/upload/v1beta/files":
+            self._upload(parse_qs(parsed.query))
+            return
+        match = _GENERATE_RE.match(parsed.path)
+        if not match:
+            self._body()
+            self._send(404, _error_body(404, "NOT_FOUND", "Unknown route (stub)"))
+            return
+        self._generate(stream=match.group(2) == "streamGenerateContent")
+
+    def _generate(self, stream: bool) -> None:
+        """Answer ``generateContent`` or its SSE streaming variant.
+
+        Отвечает на ``generateContent`` или его потоковый SSE-вариант.
+        """
+
+        st = self.state
+        request = json.loads(self._body() or b"{}")
+        contents = request.get("contents") or []
+        gen_cfg = request.get("generationConfig") or {}
+        config = {"response_schema": gen_cfg.get("responseSchema")}
+        text_in = json.dumps(contents, ensure_ascii=False)
+        if not self._admit(len(text_in) / 4.0):
+            return
+        st.count("streamGenerateContent" if stream else "generateContent")
+        text = fake_response_text(contents, config)
+        usage = {
+            "promptTokenCount": len(text_in) // 4,
+            "candidatesTokenCount": len(text) // 4,
+            "totalTokenCount": (len(text_in) + len(text)) // 4,
+        }
+        if not stream:
+            time.sleep(st.delay(len(text)))
+            body = {
+                "candidates": [{
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                    "finishReason": "STOP",
+                }],
+                "usageMetadata": usage,
+            }
+            self._send(200, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+            return
+
+        # Streaming: first chunk after base latency, then per-token pacing,
+        # поток: первый фрагмент после базовой задержки, далее по токенам
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(st.delay())
+        step = max(1, st.args.stream_chunk_chars)
+        pieces = [text[i:i + step] for i in range(0, len(text), step)] or [""]
+        for idx, piece in enumerate(pieces):
+            content = {"role": "model", "parts": [{"text": piece}]}
+            chunk: Dict[str, Any] = {"candidates": [{"content": content}]}
+            if idx == len(pieces) - 1:
+                chunk["candidates"][0]["finishReason"] = "STOP"
+                chunk["usageMetadata"] = usage
+            data = f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode()
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            time.sleep(st.args.ms_per_output_token * len(piece) / 4.0 / 1000.0)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _upload(self, query: Dict[str, Any]) -> None:
+        """Implement the resumable upload protocol used by ``files.upload``.
+
+        Реализует протокол возобновляемой загрузки ``files.upload``.
+
+        Pipeline:
+
+            1. ``start`` registers an upload and returns its URL.
+               ``start`` регистрирует загрузку и возвращает её URL.
+
+            2. ``upload`` appends bytes; ``finalize`` returns file metadata.
+               ``upload`` дописывает байты; ``finalize`` возвращает метаданные.
+        """
+
+        st = self.state
+        command = (self.headers.get("X-Goog-Upload-Command") or "").lower()
+        body = self._body()
+
+        # Step 1: Start a session
+        # Шаг 1: Начинаем сессию
+        if command == "start":
+            if not self._admit(1):
+                return
+            upload_id = uuid.uuid4().hex
+            st.uploads[upload_id] = {
+                "mime": self.headers.get("X-Goog-Upload-Header-Content-Type")
+                or "application/octet-stream",
+                "name": self.headers.get("X-Goog-Upload-File-Name") or "file",
+                "hash": hashlib.sha256(),
+                "size": 0,
+            }
+            host = self.headers.get("Host") or "127.0.0.1"
+            url = f"http://{host}/upload/v1beta/files?upload_id={upload_id}"
+            self._send(200, b"", {"X-Goog-Upload-URL": url,
+                                  "X-Goog-Upload-Status": "active"})
+            return
+
+        # Step 2: Append and finalize
+        # Шаг 2: Дописываем и завершаем
+        upload = st.uploads.get((query.get("upload_id") or [""])[0])
+        if upload is None:
+            self._send(404, _error_body(404, "NOT_FOUND", "Unknown upload (stub)"))
+            return
+        upload["hash"].update(body)
+        upload["size"] += len(body)
+        if "finalize" not in command:
+            self._send(200, b"", {"X-Goog-Upload-Status": "active"})
+            return
+        time.sleep(st.delay() / 2 + upload["size"] / st.args.upload_bytes_per_s)
+        digest = upload["hash"].hexdigest()[:16]
+        name = f"files/{digest}"
+        now = datetime.now(timezone.utc)
+        meta = {
+            "name": name,
+            "displayName": upload["name"],
+            "mimeType": upload["mime"],
+            "sizeBytes": str(upload["size"]),
+            "createTime": now.isoformat().replace("+00:00", "Z"),
+            "expirationTime": (now + timedelta(hours=st.args.file_ttl_hours))
+            .isoformat().replace("+00:00", "Z"),
+            "sha256Hash": digest,
+            "uri": f"http://{self.headers.get('Host')}/v1beta/{name}",
+            "state": "ACTIVE",
+        }
+        st.files[name] = meta
+        st.count("files.upload")
+        self._send(200, json.dumps({"file": meta}).encode("utf-8"),
+                   {"X-Goog-Upload-Status": "final"})
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Return the command-line parser of the stub.
+
+    Возвращает парсер командной строки заглушки.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800.0,
+                        help="base latency before the first byte")
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--ms-per-output-token", type=float, default=5.0)
+    parser.add_argument("--stream-chunk-chars", type=int, default=48)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests failing with 500/503")
+    parser.add_argument("--rpm", type=float, default=0.0,
+                        help="requests per minute, 0 = unlimited")
+    parser.add_argument("--tpm", type=float, default=0.0,
+                        help="input tokens per minute, 0 = unlimited")
+    parser.add_argument("--upload-bytes-per-s", type=float, default=20e6)
+    parser.add_argument("--file-ttl-hours", type=float, default=48.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+def serve(args: argparse.Namespace) -> ThreadingHTTPServer:
+    """Create the stub server without starting its loop.
+
+    Создаёт сервер-заглушку без запуска цикла.
+
+    Args:
+
+        args (argparse.Namespace):
+            Options from ``build_parser``.
+            Параметры из ``build_parser``.
+
+    Returns:
+
+        ThreadingHTTPServer:
+            Bound server with ``state`` attached.
+            Привязанный сервер с прикреплённым ``state``.
+    """
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(args)  # type: ignore[attr-defined]
+    return server
+
+
+def main() -> int:
+    """Run the stub until interrupted.
+
+    Запускает заглушку до прерывания.
+    """
+
+    args = build_parser().parse_args()
+    server = serve(args)
+    host, port = server.server_address[:2]
+    print(f"[gemini-stub] listening on http://{host}:{port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Measure cold import time and idle memory of the ``app`` module.
+
+Замеряет время холодного импорта и память простоя модуля ``app``.
+
+Each measurement runs in a fresh interpreter so nothing is cached in-process.
+
+Каждый замер выполняется в новом интерпретаторе, чтобы ничего не кешировалось.
+
+Usage / Использование (from ``app/server``):
+
+    python -m bench.import_time --repeat 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SERVER_DIR = Path(__file__).resolve().parents[1]
+
+# Runs inside the child interpreter and prints one JSON line,
+# выполняется в дочернем интерпретаторе и печатает одну строку JSON
+_PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+import app
+elapsed = time.perf_counter() - t0
+heavy = ["torch", "whisper", "google.genai", "pdf2image", "numpy"]
+print(json.dumps({
+    "import_ms": elapsed * 1000.0,
+    "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    "loaded": [m for m in heavy if m in sys.modules],
+}))
+"""
+
+
+def measure_import(
+        repeat: int = 3, env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Import ``app`` in fresh interpreters and report time and memory.
+
+    Импортирует ``app`` в новых интерпретаторах и сообщает время и память.
+
+    Args:
+
+        repeat (int):
+            Number of fresh interpreters.
+            Количество новых интерпретаторов.
+
+        env (Optional[Dict[str, str]]):
+            Extra environment variables for the child.
+            Дополнительные переменные окружения для дочернего процесса.
+
+    Returns:
+
+        Dict[str, Any]:
+            Samples of import milliseconds, max RSS and loaded heavy modules.
+            Выборки миллисекунд импорта, максимального RSS и тяжёлых модулей.
+    """
+
+    child_env = dict(os.environ, **(env or {}))
+    samples: List[Dict[str, Any]] = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE], cwd=SERVER_DIR, env=child_env,
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        samples.append(json.loads(out.stdout.decode().strip().splitlines()[-1]))
+    return {
+        "import_ms": [round(s["import_ms"], 2) for s in samples],
+        "maxrss_mb": round(max(s["maxrss_mb"] for s in samples), 1),
+        "loaded": samples[-1]["loaded"],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print the import measurement as JSON.
+
+    Печатает замер импорта в формате JSON.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    print(json.dumps(measure_import(args.repeat), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Replay realistic session flows against a running server at a target concurrency.
+
+Воспроизводит реалистичные сценарии сессий против работающего сервера с заданной
+конкурентностью.
+
+Each virtual user uploads a deck, posts one recording per slide, starts the
+review, reviews every slide and requests the summary. Start the server with
+``GEMINI_BASE_URL`` pointing at ``bench.gemini_stub`` to avoid real quota.
+
+Каждый виртуальный пользователь загружает презентацию, отправляет запись на
+каждый слайд, запускает рецензию, оценивает все слайды и запрашивает итог.
+Запускайте сервер с ``GEMINI_BASE_URL``, указывающим на ``bench.gemini_stub``.
+
+Usage / Использование (from ``app/server``):
+
+    python -m bench.loadtest --base-url http://127.0.0.1:5000 \\
+        --sessions 60 --concurrency 30 --slides 5 --out load.json
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench import synthetic
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """Return the nearest-rank percentile of sorted values.
+
+    Возвращает перцентиль по ближайшему рангу для отсортированных значений.
+    """
+
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[idx]
+
+
+class Recorder:
+    """Collect per-endpoint latencies and failures.
+
+    Собирает задержки и ошибки по эндпоинтам.
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.sessions_ms: List[float] = []
+
+    def add(self, name: str, ms: float, status: Optional[int]) -> None:
+        """Record one request outcome.
+
+        Записывает результат одного запроса.
+
+        Args:
+
+            name (str):
+                Endpoint label.
+                Метка эндпоинта.
+
+            ms (float):
+                Latency in milliseconds.
+                Задержка в миллисекундах.
+
+            status (Optional[int]):
+                HTTP status or ``None`` on transport errors.
+                HTTP-статус или ``None`` при ошибке соединения.
+        """
+
+        if status is not None and status < 400:
+            self.latencies.setdefault(name, []).append(ms)
+            return
+        bucket = self.errors.setdefault(name, {})
+        key = str(status) if status is not None else "transport"
+        bucket[key] = bucket.get(key, 0) + 1
+
+    def report(self, wall_s: float) -> Dict[str, Any]:
+        """Summarize latencies and throughput.
+
+        Сводит задержки и пропускную способность.
+
+        Args:
+
+            wall_s (float):
+                Wall-clock duration of the run.
+                Длительность прогона по настенным часам.
+
+        Returns:
+
+            Dict[str, Any]:
+                Per-endpoint p50/p95/p99, throughput and error counts.
+                p50/p95/p99, пропускная способность и ошибки по эндпоинтам.
+        """
+
+        endpoints: Dict[str, Any] = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            ordered = sorted(self.latencies.get(name, []))
+            errors = self.errors.get(name, {})
+            endpoints[name] = {
+                "ok": len(ordered),
+                "errors": errors,
+                "p50_ms": round(_percentile(ordered, 0.50), 1),
+                "p95_ms": round(_percentile(ordered, 0.95), 1),
+                "p99_ms": round(_percentile(ordered, 0.99), 1),
+                "throughput_rps": round(len(ordered) / wall_s, 3) if wall_s else 0.0,
+            }
+        sessions = sorted(self.sessions_ms)
+        return {
+            "wall_s": round(wall_s, 2),
+            "sessions_completed": len(sessions),
+            "session_p50_ms": round(_percentile(sessions, 0.50), 1),
+            "session_p95_ms": round(_percentile(sessions, 0.95), 1),
+            "endpoints": endpoints,
+        }
+
+
+async def _call(client: httpx.AsyncClient, rec: Recorder, name: str,
+                method: str, url: str, **kwargs: Any) -> Optional[httpx.Response]:
+    """Send one request and record its latency.
+
+    Отправляет один запрос и записывает его задержку.
+    """
+
+    t0 = time.perf_counter()
+    try:
+        res = await client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        rec.add(name, (time.perf_counter() - t0) * 1000.0, None)
+        return None
+    rec.add(name, (time.perf_counter() - t0) * 1000.0, res.status_code)
+    return res
+
+
+async def session_flow(client: httpx.AsyncClient, rec: Recorder,
+                       args: argparse.Namespace, deck: Path, audio: Path) -> None:
+    """Run one user session end to end.
+
+    Выполняет одну пользовательскую сессию от начала до конца.
+
+    Pipeline:
+
+        1. Upload the deck.
+           Загружаем презентацию.
+
+        2. Post one recording per slide with optional think time.
+           Отправляем запись на каждый слайд с необязательной паузой.
+
+        3. Start the review, review each slide and fetch the summary.
+           Запускаем рецензию, оцениваем слайды и получаем итог.
+    """
+
+    t0 = time.perf_counter()
+
+    # Step 1: Upload
+    # Шаг 1: Загрузка
+    res = await _call(client, rec, "POST /upload", "POST", "/upload",
+                      files={"file": (deck.name, deck.read_bytes(), "application/pdf")})
+    if res is None or res.status_code >= 400:
+        return
+    sid = res.json()["sessionId"]
+    slides = len(res.json().get("slides") or []) or args.slides
+
+    # Step 2: Audio per slide
+    # Шаг 2: Аудио по слайдам
+    payload = audio.read_bytes()
+    for idx in range(1, slides + 1):
+        await asyncio.sleep(args.think_ms / 1000.0)
+        await _call(client, rec, "POST /audio", "POST", "/audio",
+                    data={"sessionId": sid, "slideIndex": str(idx)},
+                    files={"file": (f"slide-{idx}{audio.suffix}", payload,
+                                    "audio/webm")})
+
+    # Step 3: Review flow
+    # Шаг 3: Сценарий рецензии
+    await _call(client, rec, "POST /review/start", "POST", "/review/start",
+                data={"sessionId": sid, "includePdf": str(args.include_pdf).lower()})
+    for idx in range(1, slides + 1):
+        await _call(client, rec, "POST /review/slide", "POST", "/review/slide",
+                    data={"sessionId": sid, "slideIndex": str(idx)})
+    res = await _call(client, rec, "GET /review/summary", "GET", "/review/summary",
+                      params={"sessionId": sid})
+    if res is not None and res.status_code < 400:
+        rec.sessions_ms.append((time.perf_counter() - t0) * 1000.0)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Drive ``args.sessions`` flows with at most ``args.concurrency`` in flight.
+
+    Запускает ``args.sessions`` сценариев, не более ``args.concurrency`` сразу.
+
+    Returns:
+
+        Dict[str, Any]:
+            Report with run parameters and per-endpoint statistics.
+            Отчёт с параметрами прогона и статистикой по эндпоинтам.
+    """
+
+    with tempfile.TemporaryDirectory(prefix="slides-load-") as tmp:
+        work = Path(tmp)
+        deck = synthetic.make_pdf(work / "deck.pdf", args.slides)
+        wav = synthetic.make_speech(work / "speech.wav", args.audio_seconds)
+        audio = synthetic.encode_browser_audio(wav, work / "speech.webm") or wav
+
+        rec = Recorder()
+        gate = asyncio.Semaphore(args.concurrency)
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        timeout = httpx.Timeout(args.timeout_s)
+
+        async def one(i: int) -> None:
+            # Spread session starts over the ramp-up window,
+            # распределяем старты сессий по окну разгона
+            await asyncio.sleep(args.ramp_s * i / max(1, args.sessions))
+            async with gate:
+                await session_flow(client, rec, args, deck, audio)
+
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits,
+                                     timeout=timeout) as client:
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.sessions)))
+            wall = time.perf_counter() - t0
+
+    report = rec.report(wall)
+    report["params"] = {
+        "base_url": args.base_url,
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "slides": args.slides,
+        "audio_seconds": args.audio_seconds,
+        "think_ms": args.think_ms,
+        "include_pdf": args.include_pdf,
+    }
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Parse options, run the load and print/write the report.
+
+    Разбирает параметры, запускает нагрузку и печатает/записывает отчёт.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--slides", type=int, default=5)
+    parser.add_argument("--audio-seconds", type=int, default=10)
+    parser.add_argument("--think-ms", type=float, default=0.0,
+                        help="pause before each audio post (speaking time)")
+    parser.add_argument("--ramp-s", type=float, default=0.0)
+    parser.add_argument("--include-pdf", action="store_true")
+    parser.add_argument("--timeout-s", type=float, default=600.0)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print(f"{'endpoint':<22} {'ok':>6} {'err':>5} {'p50':>9} {'p95':>9} "
+          f"{'p99':>9} {'rps':>8}")
+    for name, row in report["endpoints"].items():
+        print(f"{name:<22} {row['ok']:>6} {sum(row['errors'].values()):>5} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} "
+              f"{row['throughput_rps']:>8.2f}")
+    print(f"sessions: {report['sessions_completed']}/{args.sessions} in "
+          f"{report['wall_s']} s, p50 {report['session_p50_ms']} ms")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,534 @@
+"""Run the offline pipeline benchmarks and write machine-readable JSON.
+
+Запускает офлайн-бенчмарки конвейера и записывает машиночитаемый JSON.
+
+Usage / Использование (from ``app/server``):
+
+    python -m bench.run --out bench-results.json
+    python -m bench.compare old.json new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+SERVER_DIR = Path(__file__).resolve().parents[1]
+BENCHES = (
+    "import_app", "pdf_to_png", "pptx_to_pdf", "transcode", "transcribe",
+    "whisper_batch", "endpoints",
+)
+
+
+def _int_list(value: str) -> List[int]:
+    """Parse a comma-separated list of integers.
+
+    Разбирает список целых чисел через запятую.
+    """
+
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _stats(samples_ms: List[float]) -> Dict[str, float]:
+    """Summarize latency samples.
+
+    Сводит выборку задержек.
+
+    Args:
+
+        samples_ms (List[float]):
+            Durations in milliseconds.
+            Длительности в миллисекундах.
+
+    Returns:
+
+        Dict[str, float]:
+            Count, min, median, mean, p95 and max.
+            Количество, минимум, медиана, среднее, p95 и максимум.
+    """
+
+    ordered = sorted(samples_ms)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "n": len(ordered),
+        "min": round(ordered[0], 2),
+        "median": round(statistics.median(ordered), 2),
+        "mean": round(statistics.fmean(ordered), 2),
+        "p95": round(p95, 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+def _time_ms(fn: Callable[[], Any]) -> float:
+    """Run a callable once and return its wall time in milliseconds.
+
+    Выполняет функцию один раз и возвращает время в миллисекундах.
+    """
+
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def _git_commit() -> Optional[str]:
+    """Return the current git commit, if the tree is a checkout.
+
+    Возвращает текущий коммит git, если дерево является checkout.
+    """
+
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=SERVER_DIR, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        return out.stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Suite:
+    """Benchmark runner that accumulates JSON-ready results.
+
+    Запускатель бенчмарков, накапливающий результаты для JSON.
+    """
+
+    def __init__(self, args: argparse.Namespace, workdir: Path):
+        """Prepare the environment and import the server modules.
+
+        Подготавливает окружение и импортирует модули сервера.
+
+        Pipeline:
+
+            1. Point ``DATA_DIR`` at a scratch directory.
+               Направляем ``DATA_DIR`` во временный каталог.
+
+            2. Import ``app`` and install the fake Gemini client.
+               Импортируем ``app`` и устанавливаем поддельный клиент Gemini.
+
+        Args:
+
+            args (argparse.Namespace):
+                Parsed command-line options.
+                Разобранные параметры командной строки.
+
+            workdir (Path):
+                Scratch directory for fixtures and session data.
+                Временный каталог для данных и сессий.
+        """
+
+        self.args = args
+        self.workdir = workdir
+        self.results: List[Dict[str, Any]] = []
+
+        # Step 1: Isolate session data
+        # Шаг 1: Изолируем данные сессий
+        os.environ["DATA_DIR"] = str(workdir / "data")
+
+        # Step 2: Import server and fake Gemini
+        # Шаг 2: Импортируем сервер и поддельный Gemini
+        import app as app_module
+        from AI import GeminiFiles
+        from bench import fake_gemini
+
+        self.app = app_module
+        self.gemini = fake_gemini.install(
+            args.gemini_latency_ms, app_module, GeminiFiles
+        )
+
+    def record(self, name: str, params: Dict[str, Any],
+               samples_ms: Optional[List[float]] = None,
+               skipped: Optional[str] = None, **extra: Any) -> None:
+        """Append one result row.
+
+        Добавляет одну строку результата.
+
+        Args:
+
+            name (str):
+                Benchmark name.
+                Имя бенчмарка.
+
+            params (Dict[str, Any]):
+                Input parameters (pages, seconds, model).
+                Входные параметры (страницы, секунды, модель).
+
+            samples_ms (Optional[List[float]]):
+                Measured durations.
+                Измеренные длительности.
+
+            skipped (Optional[str]):
+                Reason the benchmark did not run.
+                Причина, по которой бенчмарк не запускался.
+
+            **extra (Any):
+                Additional metrics.
+                Дополнительные метрики.
+        """
+
+        row: Dict[str, Any] = {"name": name, "params": params}
+        if skipped:
+            row["skipped"] = skipped
+        if samples_ms:
+            row["stats_ms"] = _stats(samples_ms)
+        row.update(extra)
+        self.results.append(row)
+        status = skipped or f"median {row['stats_ms']['median']} ms"
+        print(f"[bench] {name} {params}: {status}", file=sys.stderr)
+
+    def _pdf(self, pages: int) -> Path:
+        """Return a cached synthetic PDF with the given page count.
+
+        Возвращает закешированный синтетический PDF с заданным числом страниц.
+        """
+
+        from bench import synthetic
+
+        path = self.workdir / "fixtures" / f"deck-{pages}.pdf"
+        return path if path.exists() else synthetic.make_pdf(path, pages)
+
+    def _speech(self, seconds: int, browser: bool) -> Path:
+        """Return a cached synthetic recording of the given length.
+
+        Возвращает закешированную синтетическую запись заданной длины.
+        """
+
+        from bench import synthetic
+
+        wav = self.workdir / "fixtures" / f"speech-{seconds}.wav"
+        if not wav.exists():
+            synthetic.make_speech(wav, seconds, seed=seconds)
+        if not browser:
+            return wav
+        webm = wav.with_suffix(".webm")
+        if webm.exists():
+            return webm
+        return synthetic.encode_browser_audio(wav, webm) or wav
+
+    def bench_import_app(self) -> None:
+        """Measure cold ``import app`` time and idle RSS in fresh interpreters.
+
+        Замеряет время холодного ``import app`` и RSS простоя в новых процессах.
+        """
+
+        from bench.import_time import measure_import
+
+        env = {"DATA_DIR": str(self.workdir / "data")}
+        try:
+            res = measure_import(self.args.repeat, env=env)
+        except Exception as e:
+            self.record("import_app", {}, skipped=f"error: {e}")
+            return
+        self.record("import_app", {}, res["import_ms"],
+                    maxrss_mb=res["maxrss_mb"], heavy_modules_loaded=res["loaded"])
+
+    def bench_pdf_to_png(self) -> None:
+        """Measure ``_convert_pdf_to_pngs`` per page count.
+
+        Замеряет ``_convert_pdf_to_pngs`` для каждого числа страниц.
+        """
+
+        if not shutil.which("pdftoppm"):
+            self.record("pdf_to_png", {}, skipped="poppler (pdftoppm) not installed")
+            return
+        for pages in self.args.pages:
+            pdf = self._pdf(pages)
+            out_dir = self.workdir / "render" / str(pages)
+            samples = []
+            for _ in range(self.args.repeat):
+                shutil.rmtree(out_dir, ignore_errors=True)
+                samples.append(_time_ms(
+                    lambda: self.app._convert_pdf_to_pngs(pdf, out_dir)))
+            self.record("pdf_to_png", {"pages": pages}, samples,
+                        per_page_ms=round(statistics.median(samples) / pages, 2))
+
+    def bench_pptx_to_pdf(self) -> None:
+        """Measure ``_convert_pptx_to_pdf`` per slide count.
+
+        Замеряет ``_convert_pptx_to_pdf`` для каждого числа слайдов.
+        """
+
+        from bench import synthetic
+
+        if not (shutil.which("libreoffice") or shutil.which("soffice")):
+            self.record("pptx_to_pdf", {}, skipped="LibreOffice not installed")
+            return
+        for pages in self.args.pages:
+            pptx = self.workdir / "fixtures" / f"deck-{pages}.pptx"
+            if not pptx.exists() and synthetic.make_pptx(pptx, pages) is None:
+                self.record("pptx_to_pdf", {"pages": pages},
+                            skipped="python-pptx not installed")
+                return
+            out_dir = self.workdir / "pptx" / str(pages)
+            samples = []
+            for _ in range(self.args.repeat):
+                shutil.rmtree(out_dir, ignore_errors=True)
+                samples.append(_time_ms(
+                    lambda: self.app._convert_pptx_to_pdf(pptx, out_dir)))
+            self.record("pptx_to_pdf", {"pages": pages}, samples)
+
+    def bench_transcode(self) -> None:
+        """Measure the ffmpeg transcode of browser-like recordings.
+
+        Замеряет транскодирование ffmpeg записей, похожих на браузерные.
+        """
+
+        if not shutil.which("ffmpeg"):
+            self.record("transcode", {}, skipped="ffmpeg not installed")
+            return
+        for seconds in self.args.audio_seconds:
+            src = self._speech(seconds, browser=True)
+            dst = self.workdir / "transcode" / f"speech-{seconds}.mp3"
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            samples = [
+                _time_ms(lambda: self.app._transcode_to_mp3(src, dst))
+                for _ in range(self.args.repeat)
+            ]
+            self.record("transcode", {"seconds": seconds, "input": src.suffix},
+                        samples)
+
+    def bench_transcribe(self) -> None:
+        """Measure ``AudioToText.transcribe_file`` per Whisper model size.
+
+        Замеряет ``AudioToText.transcribe_file`` для каждого размера Whisper.
+        """
+
+        from AI.AudioToText import AudioToText
+
+        for model in self.args.whisper_models:
+            for seconds in self.args.audio_seconds:
+                audio = self._speech(seconds, browser=False)
+                params = {"model": model, "seconds": seconds}
+                try:
+                    at = AudioToText(audio_file_path=str(audio), whisper_model=model)
+                    cold_ms = _time_ms(at.transcribe_file)
+                    samples = [_time_ms(at.transcribe_file)
+                               for _ in range(self.args.repeat)]
+                except Exception as e:
+                    self.record("transcribe", params, skipped=f"error: {e}")
+                    continue
+                rtf = statistics.median(samples) / 1000.0 / seconds
+                self.record("transcribe", params, samples,
+                            cold_ms=round(cold_ms, 2), realtime_factor=round(rtf, 4))
+
+    def bench_whisper_batch(self) -> None:
+        """Compare sequential and micro-batched Whisper on concurrent short clips.
+
+        Сравнивает последовательный и микропакетный Whisper на параллельных
+        коротких клипах.
+
+        Throughput is audio seconds per CPU second of the whole process, so
+        torch's worker threads count too.
+        Пропускная способность — секунды аудио на секунду CPU всего процесса,
+        поэтому потоки torch тоже учитываются.
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        from AI.AudioToText import load_whisper_model, whisper_decode_lock
+        from AI.WhisperBatcher import CHUNK_S, WhisperBatcher
+        from utilities.cpu_budget import get_budget
+
+        seconds = min(self.args.audio_seconds[0], CHUNK_S)
+        clips = self.args.batch_clips
+        for model in self.args.whisper_models:
+            params = {"model": model, "seconds": seconds, "clips": clips}
+            try:
+                import whisper
+
+                net = load_whisper_model(model)
+                audio = whisper.load_audio(str(self._speech(seconds, browser=False)))
+            except Exception as e:
+                self.record("whisper_batch", params, skipped=f"error: {e}")
+                continue
+            batcher = WhisperBatcher(self.args.batch_window_ms, clips)
+
+            def sequential() -> None:
+                for _ in range(clips):
+                    # Same lease and torch threads the batcher uses per batch,
+                    # та же аренда и потоки torch, что у пакетировщика на пакет
+                    with get_budget().torch_lease("whisper"):
+                        net.transcribe(audio, language="ru", fp16=False)
+
+            def batched() -> None:
+                with ThreadPoolExecutor(clips) as pool:
+                    lock = whisper_decode_lock(model)
+                    futures = [pool.submit(batcher.transcribe, net, audio, "ru",
+                                           False, lock)
+                               for _ in range(clips)]
+                # A failed clip fails the run, упавший клип проваливает замер
+                for future in futures:
+                    future.result()
+
+            for mode, fn in (("sequential", sequential), ("batched", batched)):
+                samples, cpu_s = [], 0.0
+                try:
+                    for _ in range(self.args.repeat):
+                        c0 = time.process_time()
+                        samples.append(_time_ms(fn))
+                        cpu_s += time.process_time() - c0
+                except Exception as e:
+                    self.record("whisper_batch", {**params, "mode": mode},
+                                skipped=f"error: {e}")
+                    continue
+                audio_s = seconds * clips * self.args.repeat
+                self.record("whisper_batch", {**params, "mode": mode}, samples,
+                            audio_s_per_cpu_s=round(audio_s / max(cpu_s, 1e-9), 3),
+                            audio_s_per_wall_s=round(
+                                audio_s / (sum(samples) / 1000.0), 3),
+                            batches=batcher.snapshot()["batches"])
+
+    def bench_endpoints(self) -> None:
+        """Measure end-to-end latency of every API endpoint of a session flow.
+
+        Замеряет сквозную задержку каждого эндпоинта API в сценарии сессии.
+        """
+
+        from fastapi.testclient import TestClient
+
+        client = TestClient(self.app.app)
+        slides = self.args.e2e_slides
+        pdf = self._pdf(slides)
+        audio = self._speech(self.args.audio_seconds[0], browser=True)
+        samples: Dict[str, List[float]] = {}
+        stages: Dict[str, str] = {}
+
+        def call(name: str, method: str, url: str, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            res = client.request(method, url, **kwargs)
+            samples.setdefault(name, []).append((time.perf_counter() - t0) * 1000.0)
+            stages[name] = res.headers.get("server-timing", "")
+            if res.status_code >= 400:
+                raise RuntimeError(f"{name}: HTTP {res.status_code} {res.text[:200]}")
+            return res
+
+        try:
+            for _ in range(self.args.repeat):
+                with open(pdf, "rb") as f:
+                    res = call("POST /upload", "POST", "/upload",
+                               files={"file": (pdf.name, f, "application/pdf")})
+                sid = res.json()["sessionId"]
+                for idx in range(1, slides + 1):
+                    with open(audio, "rb") as f:
+                        call("POST /audio", "POST", "/audio",
+                             data={"sessionId": sid, "slideIndex": str(idx)},
+                             files={"file": (audio.name, f, "audio/webm")})
+                call("POST /review/start", "POST", "/review/start",
+                     data={"sessionId": sid, "includePdf": "true"})
+                for idx in range(1, slides + 1):
+                    call("POST /review/slide", "POST", "/review/slide",
+                         data={"sessionId": sid, "slideIndex": str(idx)})
+                call("GET /review/summary", "GET", "/review/summary",
+                     params={"sessionId": sid})
+        except Exception as e:
+            self.record("endpoints", {"slides": slides}, skipped=f"error: {e}")
+            return
+        for name, values in samples.items():
+            self.record("endpoint", {"endpoint": name, "slides": slides}, values,
+                        server_timing=stages.get(name, ""))
+
+    def run(self, only: List[str]) -> Dict[str, Any]:
+        """Run selected benchmarks and return the JSON document.
+
+        Запускает выбранные бенчмарки и возвращает JSON-документ.
+
+        Args:
+
+            only (List[str]):
+                Benchmark names to run.
+                Имена запускаемых бенчмарков.
+
+        Returns:
+
+            Dict[str, Any]:
+                Metadata and result rows.
+                Метаданные и строки результатов.
+        """
+
+        for name in BENCHES:
+            if name in only:
+                getattr(self, f"bench_{name}")()
+        return {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "gemini": "fake",
+                "gemini_latency_ms": self.args.gemini_latency_ms,
+                "gemini_calls": self.gemini.models.calls,
+                "repeat": self.args.repeat,
+            },
+            "results": self.results,
+        }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Parse options, run the suite and write the JSON report.
+
+    Разбирает параметры, запускает набор и записывает JSON-отчёт.
+
+    Returns:
+
+        int:
+            Process exit code.
+            Код завершения процесса.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default="bench-results.json")
+    parser.add_argument("--only", default=",".join(BENCHES),
+                        help="comma-separated subset of: " + ", ".join(BENCHES))
+    parser.add_argument("--pages", type=_int_list, default=[1, 10, 30])
+    parser.add_argument("--audio-seconds", type=_int_list, default=[5, 30, 120])
+    parser.add_argument("--whisper-models", default="tiny,base",
+                        help="comma-separated WhisperModelsENUM values or 'all'")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-clips", type=int, default=8,
+                        help="concurrent clips for whisper_batch")
+    parser.add_argument("--batch-window-ms", type=float, default=20.0)
+    parser.add_argument("--e2e-slides", type=int, default=3)
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0)
+    parser.add_argument("--no-transcription", action="store_true",
+                        help="set DISABLE_TRANSCRIPTION for the endpoint flow")
+    parser.add_argument("--workdir", default=None,
+                        help="keep fixtures here instead of a temp directory")
+    args = parser.parse_args(argv)
+
+    # Settings are read once when utilities.consts is first imported,
+    # настройки читаются один раз при первом импорте utilities.consts
+    if args.no_transcription:
+        os.environ["DISABLE_TRANSCRIPTION"] = "true"
+    sys.path.insert(0, str(SERVER_DIR))
+    from utilities.consts import WhisperModelsENUM
+
+    if args.whisper_models.strip() == "all":
+        args.whisper_models = [str(m) for m in WhisperModelsENUM]
+    else:
+        args.whisper_models = [
+            str(WhisperModelsENUM(m.strip()))
+            for m in args.whisper_models.split(",") if m.strip()
+        ]
+    only = [b.strip() for b in args.only.split(",") if b.strip()]
+
+    with tempfile.TemporaryDirectory(prefix="slides-bench-") as tmp:
+        workdir = Path(args.workdir or tmp).resolve()
+        workdir.mkdir(parents=True, exist_ok=True)
+        report = Suite(args, workdir).run(only)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[bench] wrote {args.out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
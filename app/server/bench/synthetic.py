@@ -0,0 +1,278 @@
+"""Generate synthetic decks and recordings for offline benchmarks.
+
+Генерирует синтетические презентации и записи для офлайн-бенчмарков.
+"""
+
+import math
+import random
+import shutil
+import struct
+import subprocess
+import wave
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageDraw
+
+SAMPLE_RATE = 16000
+SLIDE_SIZE = (1280, 720)
+
+
+def make_pdf(path: Path, pages: int) -> Path:
+    """Write a PDF with the given number of text-and-shape slides.
+
+    Записывает PDF с заданным числом слайдов с текстом и фигурами.
+
+    Args:
+
+        path (Path):
+            Output PDF path.
+            Путь к выходному PDF.
+
+        pages (int):
+            Number of pages.
+            Количество страниц.
+
+    Returns:
+
+        Path:
+            The written file.
+            Записанный файл.
+    """
+
+    images = []
+    for idx in range(1, pages + 1):
+        img = Image.new("RGB", SLIDE_SIZE, (250, 250, 250))
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([40, 40, SLIDE_SIZE[0] - 40, 140], fill=(30, 60, 120))
+        draw.text((60, 70), f"Slide {idx}: synthetic benchmark deck", fill="white")
+        for line in range(8):
+            y = 180 + line * 56
+            draw.text((80, y), f"- bullet {line + 1} of slide {idx}", fill="black")
+            draw.rectangle([900, y, 900 + (idx * 37 + line * 53) % 300, y + 30],
+                           fill=(200, 80 + line * 15, 60))
+        images.append(img)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    images[0].save(path, "PDF", save_all=True, append_images=images[1:],
+                   resolution=96.0)
+    return path
+
+
+def make_pptx(path: Path, pages: int) -> Optional[Path]:
+    """Write a PPTX deck with ``python-pptx`` when it is installed.
+
+    Записывает PPTX через ``python-pptx``, если он установлен.
+
+    Args:
+
+        path (Path):
+            Output PPTX path.
+            Путь к выходному PPTX.
+
+        pages (int):
+            Number of slides.
+            Количество слайдов.
+
+    Returns:
+
+        Optional[Path]:
+            The written file or ``None`` when ``python-pptx`` is missing.
+            Записанный файл или ``None``, если ``python-pptx`` отсутствует.
+    """
+
+    try:
+        from pptx import Presentation
+    except ImportError:
+        return None
+
+    prs = Presentation()
+    layout = prs.slide_layouts[1]
+    for idx in range(1, pages + 1):
+        slide = prs.slides.add_slide(layout)
+        slide.shapes.title.text = f"Slide {idx}: synthetic benchmark deck"
+        body = slide.placeholders[1].text_frame
+        body.text = f"Bullet 1 of slide {idx}"
+        for line in range(2, 7):
+            body.add_paragraph().text = f"Bullet {line} of slide {idx}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    prs.save(str(path))
+    return path
+
+
+def _write_wav(path: Path, samples: list) -> Path:
+    """Write 16-bit mono PCM samples in range -1..1 to a WAV file.
+
+    Записывает 16-битные моно PCM-сэмплы в диапазоне -1..1 в WAV-файл.
+
+    Args:
+
+        path (Path):
+            Output WAV path.
+            Путь к выходному WAV.
+
+        samples (list):
+            Float samples.
+            Сэмплы с плавающей точкой.
+
+    Returns:
+
+        Path:
+            The written file.
+            Записанный файл.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    frames = b"".join(
+        struct.pack("<h", int(max(-1.0, min(1.0, s)) * 32000)) for s in samples
+    )
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(frames)
+    return path
+
+
+def make_tone(path: Path, seconds: float, freq: float = 440.0) -> Path:
+    """Write a pure sine tone.
+
+    Записывает чистый синусоидальный тон.
+
+    Args:
+
+        path (Path):
+            Output WAV path.
+            Путь к выходному WAV.
+
+        seconds (float):
+            Duration.
+            Длительность.
+
+        freq (float):
+            Tone frequency in Hz.
+            Частота тона в Гц.
+
+    Returns:
+
+        Path:
+            The written file.
+            Записанный файл.
+    """
+
+    n = int(seconds * SAMPLE_RATE)
+    step = 2 * math.pi * freq / SAMPLE_RATE
+    return _write_wav(path, [0.4 * math.sin(step * i) for i in range(n)])
+
+
+def make_speech(path: Path, seconds: float, seed: int = 0) -> Path:
+    """Write speech-like audio, using ``espeak-ng`` when it is available.
+
+    Записывает речеподобное аудио, используя ``espeak-ng`` при наличии.
+
+    Pipeline:
+
+        1. Synthesize Russian text with ``espeak-ng`` and pad or trim it.
+           Синтезируем русский текст через ``espeak-ng`` и подгоняем длину.
+
+        2. Otherwise build syllable-like formant bursts separated by pauses.
+           Иначе строим слогоподобные форманты, разделённые паузами.
+
+    Args:
+
+        path (Path):
+            Output WAV path.
+            Путь к выходному WAV.
+
+        seconds (float):
+            Target duration.
+            Целевая длительность.
+
+        seed (int):
+            Random seed for reproducible output.
+            Зерно случайности для воспроизводимости.
+
+    Returns:
+
+        Path:
+            The written file.
+            Записанный файл.
+    """
+
+    # Step 1: Real TTS if installed
+    # Шаг 1: Настоящий TTS при наличии
+    espeak = shutil.which("espeak-ng") or shutil.which("espeak")
+    ffmpeg = shutil.which("ffmpeg")
+    if espeak and ffmpeg:
+        words = int(seconds * 2.5) + 1
+        text = " ".join(
+            f"слайд номер {i % 10} показывает рост" for i in range(words // 4 + 1)
+        )
+        raw = path.with_suffix(".tts.wav")
+        subprocess.run([espeak, "-v", "ru", "-w", str(raw), text], check=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        subprocess.run(
+            [ffmpeg, "-y", "-i", str(raw), "-af", f"apad,atrim=0:{seconds}",
+             "-ac", "1", "-ar", str(SAMPLE_RATE), str(path)],
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        raw.unlink(missing_ok=True)
+        return path
+
+    # Step 2: Formant bursts with pauses
+    # Шаг 2: Форманты с паузами
+    rng = random.Random(seed)
+    n = int(seconds * SAMPLE_RATE)
+    out = [0.0] * n
+    pos = 0
+    while pos < n:
+        syl = int(rng.uniform(0.12, 0.3) * SAMPLE_RATE)
+        f0 = rng.uniform(100, 220)
+        f1 = rng.uniform(300, 900)
+        f2 = rng.uniform(900, 2500)
+        for i in range(min(syl, n - pos)):
+            env = math.sin(math.pi * i / syl)
+            t = i / SAMPLE_RATE
+            out[pos + i] = env * (
+                0.3 * math.sin(2 * math.pi * f0 * t)
+                + 0.2 * math.sin(2 * math.pi * f1 * t)
+                + 0.1 * math.sin(2 * math.pi * f2 * t)
+            )
+        pos += syl
+        # short gap between syllables, longer pause between phrases,
+        # короткий промежуток между слогами, длинная пауза между фразами
+        pos += int((rng.uniform(0.4, 0.9) if rng.random() < 0.12 else 0.04)
+                   * SAMPLE_RATE)
+    return _write_wav(path, out)
+
+
+def encode_browser_audio(wav_path: Path, out_path: Path) -> Optional[Path]:
+    """Encode WAV as Opus in WebM, like ``MediaRecorder`` uploads.
+
+    Кодирует WAV в Opus внутри WebM, как загрузки ``MediaRecorder``.
+
+    Args:
+
+        wav_path (Path):
+            Source WAV.
+            Исходный WAV.
+
+        out_path (Path):
+            Destination ``.webm`` path.
+            Путь к итоговому ``.webm``.
+
+    Returns:
+
+        Optional[Path]:
+            Encoded file or ``None`` when ffmpeg is unavailable.
+            Закодированный файл или ``None``, если ffmpeg недоступен.
+    """
+
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    subprocess.run(
+        [ffmpeg, "-y", "-i", str(wav_path), "-c:a", "libopus", "-b:a", "48k",
+         str(out_path)],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    return out_path
@@ -0,0 +1,125 @@
+"""Report RSS, PSS and private memory of a server master and its workers.
+
+Сообщает RSS, PSS и приватную память мастер-процесса сервера и его воркеров.
+
+RSS counts shared pages in every process, so it overstates multi-worker usage;
+PSS splits shared pages between the processes that map them and USS (private
+pages) is what each extra worker really costs. Linux only (``smaps_rollup``).
+
+RSS учитывает общие страницы в каждом процессе и завышает расход при нескольких
+воркерах; PSS делит общие страницы между процессами, а USS (приватные страницы)
+показывает реальную стоимость каждого дополнительного воркера. Только Linux
+(``smaps_rollup``).
+
+Usage / Использование (from ``app/server``):
+
+    python -m bench.worker_memory <master-pid> [--out mem.json]
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean",
+           "Private_Dirty", "Swap")
+
+
+def smaps_rollup(pid: int) -> Dict[str, float]:
+    """Read memory counters of one process in megabytes.
+
+    Считывает счётчики памяти одного процесса в мегабайтах.
+
+    Args:
+
+        pid (int):
+            Process id.
+            Идентификатор процесса.
+
+    Returns:
+
+        Dict[str, float]:
+            ``smaps_rollup`` fields plus ``Uss`` (private clean + dirty).
+            Поля ``smaps_rollup`` и ``Uss`` (приватные чистые + грязные).
+    """
+
+    out: Dict[str, float] = {}
+    for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+        key, _, rest = line.partition(":")
+        if key in _FIELDS:
+            out[key] = round(int(rest.split()[0]) / 1024.0, 1)
+    out["Uss"] = round(out.get("Private_Clean", 0.0) + out.get("Private_Dirty", 0.0), 1)
+    return out
+
+
+def children(pid: int) -> List[int]:
+    """List direct child processes of ``pid``.
+
+    Перечисляет прямые дочерние процессы ``pid``.
+    """
+
+    found: List[int] = []
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        text = (task / "children").read_text().split()
+        found.extend(int(x) for x in text)
+    return sorted(set(found))
+
+
+def measure(master: int) -> Dict[str, Any]:
+    """Collect counters for the master and every worker plus totals.
+
+    Собирает счётчики мастера и каждого воркера, а также итоги.
+
+    Args:
+
+        master (int):
+            Pid of the gunicorn/uvicorn master.
+            Pid мастер-процесса gunicorn/uvicorn.
+
+    Returns:
+
+        Dict[str, Any]:
+            Per-process counters, totals and the mean worker cost.
+            Счётчики по процессам, итоги и средняя стоимость воркера.
+    """
+
+    procs = {"master": smaps_rollup(master)}
+    workers = children(master)
+    for pid in workers:
+        procs[str(pid)] = smaps_rollup(pid)
+    totals = {k: round(sum(p.get(k, 0.0) for p in procs.values()), 1)
+              for k in ("Rss", "Pss", "Uss")}
+    per_worker = {
+        k: round(sum(procs[str(p)].get(k, 0.0) for p in workers) / len(workers), 1)
+        for k in ("Rss", "Pss", "Uss")
+    } if workers else {}
+    return {"workers": len(workers), "processes": procs, "total_mb": totals,
+            "per_worker_mb": per_worker}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print a table and optionally write the measurement as JSON.
+
+    Печатает таблицу и при необходимости записывает замер в JSON.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pid", type=int)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    report = measure(args.pid)
+    print(f"{'process':<10} {'rss_mb':>9} {'pss_mb':>9} {'uss_mb':>9}")
+    for name, row in report["processes"].items():
+        print(f"{name:<10} {row['Rss']:>9.1f} {row['Pss']:>9.1f} {row['Uss']:>9.1f}")
+    t = report["total_mb"]
+    print(f"{'total':<10} {t['Rss']:>9.1f} {t['Pss']:>9.1f} {t['Uss']:>9.1f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
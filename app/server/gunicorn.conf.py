@@ -0,0 +1,75 @@
+"""Gunicorn settings for multi-worker deployments with a pre-fork Whisper model.
+
+Настройки Gunicorn для многопроцессного запуска с моделью Whisper, загруженной
+до fork.
+
+The master imports ``app`` once (``preload_app``) and loads the Whisper model
+before forking, so every Uvicorn worker inherits the weights copy-on-write
+instead of loading its own copy.
+
+Мастер один раз импортирует ``app`` (``preload_app``) и загружает модель Whisper
+до fork, поэтому каждый воркер Uvicorn наследует веса по copy-on-write, а не
+загружает свою копию.
+
+Usage / Использование (from ``app/server``):
+
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+from utilities.consts import DISABLE_TRANSCRIPTION, WHISPER_PRELOAD_MODEL
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Per-process limits (e.g. the Gemini quota share) divide by the worker count,
+# лимиты на процесс (например, доля квоты Gemini) делятся на число воркеров
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Long uploads and transcriptions must not be killed as hung workers,
+# долгие загрузки и транскрибации не должны считаться зависшими воркерами
+timeout = int(os.getenv("WORKER_TIMEOUT", "600"))
+graceful_timeout = 30
+
+# Load the model in the master unless transcription is off or preload is disabled,
+# загружаем модель в мастере, если транскрибация включена и предзагрузка не отключена
+_PREFORK_WHISPER = (
+    not DISABLE_TRANSCRIPTION
+    and os.getenv("PREFORK_WHISPER", "true").strip().lower()
+    in {"1", "true", "yes", "y"}
+)
+
+
+def when_ready(server):
+    """Load Whisper in the master right before the first workers are forked.
+
+    Загружает Whisper в мастере непосредственно перед fork первых воркеров.
+    """
+
+    if not _PREFORK_WHISPER:
+        return
+    from AI.AudioToText import preload_for_fork
+    from utilities.consts import WhisperModelsENUM
+
+    preload_for_fork(WhisperModelsENUM(WHISPER_PRELOAD_MODEL))
+    server.log.info("Whisper '%s' loaded before fork", WHISPER_PRELOAD_MODEL)
+
+
+def post_fork(server, worker):
+    """Give each worker its share of CPU threads for torch.
+
+    Выдаёт каждому воркеру его долю потоков CPU для torch.
+    """
+
+    if not _PREFORK_WHISPER:
+        return
+    import torch
+
+    from utilities.cpu_budget import get_budget
+
+    # Starting value; each Whisper job then takes its allowance from the budget,
+    # начальное значение; дальше каждая задача Whisper берёт допуск из бюджета
+    per_worker = os.getenv("TORCH_THREADS_PER_WORKER")
+    threads = int(per_worker) if per_worker else get_budget().cores
+    torch.set_num_threads(threads)
@@ -0,0 +1,11 @@
+"""Make the server packages (``AI``, ``utilities``) importable from the tests.
+
+Делает пакеты сервера (``AI``, ``utilities``) импортируемыми из тестов.
+"""
+
+import sys
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+if str(SERVER_DIR) not in sys.path:
+    sys.path.insert(0, str(SERVER_DIR))
@@ -0,0 +1,160 @@
+"""Stage gates, 429 answers and Retry-After estimates of admission control.
+
+Шлюзы этапов, ответы 429 и оценки Retry-After контроля допуска.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from utilities.admission import (AdmissionController, AdmissionMiddleware,
+                                 Overloaded, StageGate, parse_limits)
+
+
+class FakeProbe:
+    """Memory pressure set by the test, давление памяти, заданное тестом."""
+
+    def __init__(self, pressure: float = 0.0):
+        self.value = pressure
+
+    def pressure(self) -> float:
+        return self.value
+
+    def snapshot(self):
+        return {"pressure": self.value}
+
+
+def test_parse_limits_over_defaults():
+    limits = parse_limits("transcript=3:5, review=4,bogus,deck=x")
+    assert limits["transcript"] == (3, 5)
+    # Missing queue keeps the default one, без очереди остаётся значение по умолчанию
+    assert limits["review"] == (4, 32)
+    assert limits["deck"] == (2, 4)
+    assert "bogus" not in limits
+
+
+def test_routes_map_to_stages():
+    controller = AdmissionController(parse_limits(""), probe=FakeProbe())
+    assert controller.gate_for("POST", "/audio").name == "audio"
+    assert controller.gate_for("GET", "/audio") is None
+    assert controller.gate_for("POST", "/review/slide/stream").name == "review"
+    assert controller.gate_for("POST", "/pipeline/abc").name == "transcript"
+    assert controller.gate_for("GET", "/ready") is None
+    controller.enabled = False
+    assert controller.gate_for("POST", "/audio") is None
+
+
+def test_retry_after_from_queue_and_service_time():
+    gate = StageGate("transcript", limit=2, queue=8, service_s=10.0)
+    # One slot-length wait per limit-sized group ahead, ожидание по группам
+    assert gate.retry_after(120) == 5
+    gate.service_s = 1000.0
+    assert gate.retry_after(120) == 120
+    gate.service_s = 0.01
+    assert gate.retry_after(120) == 1
+
+
+def test_gate_admits_queues_and_refuses():
+    async def scenario():
+        gate = StageGate("review", limit=1, queue=1, service_s=4.0)
+        await gate.acquire(60)
+        waiter = asyncio.ensure_future(gate.acquire(60))
+        await asyncio.sleep(0)
+        assert gate.waiting == 1
+        with pytest.raises(Overloaded) as refused:
+            await gate.acquire(60)
+        # Service 4 s, one waiting, one slot: (1 + 1) * 4 / 1,
+        # обслуживание 4 с, один ждёт, один слот: (1 + 1) * 4 / 1
+        assert refused.value.retry_after == 8
+        gate.release(2.0)
+        await waiter
+        assert gate.active == 1
+        # The measured time moves the average, замер сдвигает среднее
+        assert gate.service_s == pytest.approx(3.6)
+        gate.release(None)
+        assert gate.active == 0
+        assert gate.stats == {"admitted": 2, "queued": 1, "rejected": 1}
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    async def scenario():
+        gate = StageGate("audio", limit=1, queue=2, service_s=1.0)
+        await gate.acquire(60)
+        first = asyncio.ensure_future(gate.acquire(60))
+        second = asyncio.ensure_future(gate.acquire(60))
+        await asyncio.sleep(0)
+        first.cancel()
+        gate.release(None)
+        await second
+        assert gate.active == 1 and gate.waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_memory_watermarks_by_stage():
+    probe = FakeProbe(0.9)
+    controller = AdmissionController(parse_limits(""), high_watermark=0.85,
+                                     critical_watermark=0.95, probe=probe)
+    with pytest.raises(Overloaded):
+        controller.check_memory(controller.gates["transcript"])
+    # Reviews only stop at the critical watermark, оценки — только у критического
+    controller.check_memory(controller.gates["review"])
+    probe.value = 0.96
+    with pytest.raises(Overloaded) as refused:
+        controller.check_memory(controller.gates["review"])
+    assert refused.value.retry_after == 5
+
+
+def test_middleware_answers_429_with_retry_after():
+    async def scenario():
+        controller = AdmissionController({"audio": (1, 0)}, probe=FakeProbe())
+        started, finish = asyncio.Event(), asyncio.Event()
+
+        async def app(scope, receive, send):
+            started.set()
+            await finish.wait()
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        middleware = AdmissionMiddleware(app, controller)
+        scope = {"type": "http", "method": "POST", "path": "/audio"}
+        first_sent, second_sent = [], []
+
+        def sender(box):
+            async def send(message):
+                box.append(message)
+            return send
+
+        running = asyncio.ensure_future(middleware(scope, None, sender(first_sent)))
+        await started.wait()
+        await middleware(scope, None, sender(second_sent))
+        start, body = second_sent
+        assert start["status"] == 429
+        headers = dict(start["headers"])
+        assert headers[b"retry-after"] == b"10"
+        assert json.loads(body["body"])["stage"] == "audio"
+        finish.set()
+        await running
+        assert first_sent[0]["status"] == 200
+        assert controller.gates["audio"].active == 0
+
+    asyncio.run(scenario())
+
+
+def test_hold_gates_work_without_a_route():
+    async def scenario():
+        controller = AdmissionController({"deck": (1, 0)}, probe=FakeProbe())
+        async with controller.hold("deck"):
+            with pytest.raises(Overloaded):
+                async with controller.hold("deck"):
+                    pass
+            # Ungated stages pass through, неконтролируемые этапы проходят
+            async with controller.hold("audio"):
+                pass
+        assert controller.gates["deck"].active == 0
+
+    asyncio.run(scenario())
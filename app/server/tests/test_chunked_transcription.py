@@ -0,0 +1,115 @@
+"""Cutting long clips at pauses and stitching chunk results back together.
+
+Нарезка длинных клипов по паузам и сшивка результатов кусков.
+"""
+
+import numpy as np
+import pytest
+
+from AI.ChunkedTranscription import (SAMPLE_RATE, Chunk, ChunkPool, _drop_repeated,
+                                     find_cuts, plan_chunks, stitch)
+
+
+def _speech(seconds: float, pauses=(), seed: int = 0) -> np.ndarray:
+    # Noise as speech with silent gaps (start, length) in seconds,
+    # шум как речь с тихими промежутками (начало, длина) в секундах
+    rng = np.random.default_rng(seed)
+    samples = rng.uniform(-0.5, 0.5, int(seconds * SAMPLE_RATE)).astype(np.float32)
+    for start, length in pauses:
+        samples[int(start * SAMPLE_RATE):int((start + length) * SAMPLE_RATE)] = 0.0
+    return samples
+
+
+def test_find_cuts_lands_in_pauses_near_boundaries():
+    samples = _speech(100, pauses=[(31.0, 0.6), (58.0, 0.6)])
+    cuts = [c / SAMPLE_RATE for c in find_cuts(samples, 30)]
+    assert len(cuts) == 2
+    assert 31.0 <= cuts[0] <= 31.6
+    assert 58.0 <= cuts[1] <= 58.6
+
+
+def test_find_cuts_keeps_short_clips_whole():
+    assert find_cuts(_speech(40), 30) == []
+    assert find_cuts(np.zeros(10, dtype=np.float32), 30) == []
+
+
+def test_plan_chunks_overlap_and_ownership():
+    samples = _speech(100, pauses=[(31.0, 0.6), (58.0, 0.6)])
+    chunks = plan_chunks(samples, 30, 1.0)
+    pad = SAMPLE_RATE
+    assert len(chunks) == 3
+    assert chunks[0].start == 0 and chunks[0].own_start == 0
+    assert chunks[-1].end == len(samples) and chunks[-1].own_end == len(samples)
+    for a, b in zip(chunks, chunks[1:]):
+        # Owned parts tile the clip, audio overlaps by the pad on each side,
+        # свои части покрывают клип, звук перекрывается на отступ с каждой стороны
+        assert a.own_end == b.own_start
+        assert a.end == a.own_end + pad
+        assert b.start == b.own_start - pad
+
+
+@pytest.mark.parametrize("previous, text, expected", [
+    ("we talk about the results", " about the results and plans", " and plans"),
+    ("Итак, мы закончили", " Мы закончили. Дальше", " Дальше"),
+    # One shared word is not a repeat, одно общее слово — не повтор
+    ("and then results", " results were good", " results were good"),
+    ("nothing in common", " something else", " something else"),
+])
+def test_drop_repeated(previous, text, expected):
+    assert _drop_repeated(previous, text) == expected
+
+
+def _two_chunks() -> list:
+    # Cut at 30 s with 1 s of shared audio, разрез на 30 с и 1 с общего звука
+    cut, pad = 30 * SAMPLE_RATE, SAMPLE_RATE
+    return [Chunk(0, cut + pad, 0, cut),
+            Chunk(cut - pad, 60 * SAMPLE_RATE, cut, 60 * SAMPLE_RATE)]
+
+
+def test_stitch_segments_drops_seam_repeat_and_shifts_time():
+    results = [
+        {"segments": [{"start": 0.0, "end": 10.0, "text": " one two three"},
+                      {"start": 28.0, "end": 31.0, "text": " seam words here"}]},
+        # Times relative to the chunk start at 29 s, время от начала куска в 29 с
+        {"segments": [{"start": 0.0, "end": 2.0, "text": " seam words here"},
+                      {"start": 5.0, "end": 8.0, "text": " next part"}]},
+    ]
+    out = stitch(_two_chunks(), results)
+    assert [s["text"] for s in out["segments"]] == [
+        " one two three", " seam words here", " next part"]
+    assert [s["id"] for s in out["segments"]] == [0, 1, 2]
+    assert out["segments"][2]["start"] == pytest.approx(34.0)
+    assert out["text"] == " one two three seam words here next part"
+
+
+def test_stitch_words_by_midpoint_and_monotonic():
+    results = [
+        {"segments": [{"start": 27.0, "end": 31.0, "text": "", "words": [
+            {"word": " before", "start": 27.0, "end": 28.0},
+            {"word": " across", "start": 29.5, "end": 30.8},
+        ]}]},
+        {"segments": [{"start": 0.0, "end": 3.0, "text": "", "words": [
+            {"word": " across", "start": 0.2, "end": 1.8},
+            {"word": " after", "start": 1.5, "end": 2.5},
+        ]}]},
+    ]
+    out = stitch(_two_chunks(), results)
+    words = [w for s in out["segments"] for w in s["words"]]
+    # "across" (midpoint 30.15 s) belongs to the second chunk only,
+    # "across" (середина 30,15 с) принадлежит только второму куску
+    assert [w["word"] for w in words] == [" before", " across", " after"]
+    starts = [w["start"] for w in words]
+    assert starts == sorted(starts)
+    assert all(w["end"] >= w["start"] for w in words)
+    assert words[1]["start"] == pytest.approx(29.2)
+
+
+def test_pool_stops_with_the_last_reservation():
+    pool = ChunkPool(2)
+    with pool.reserve(1.0):
+        pool._executor()
+        with pool.reserve(1.0):
+            pass
+        # Another clip still holds the pool, другой клип ещё держит пул
+        assert pool.snapshot()["running"]
+    assert not pool.snapshot()["running"]
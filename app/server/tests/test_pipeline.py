@@ -0,0 +1,137 @@
+"""Staleness, hash propagation and incremental runs of the artifact graph.
+
+Устаревание, распространение хешей и инкрементальные прогоны графа артефактов.
+"""
+
+import json
+
+from utilities.pipeline import (BLOCKED, FRESH, MISSING, STALE, STATE_NAME,
+                                ArtifactGraph, Node)
+
+
+def _session(root):
+    """audio -> transcript -> review -> summary, plus a config source.
+
+    audio -> transcript -> review -> summary и источник настроек.
+    """
+
+    runs = []
+
+    def builder(name, src, dst):
+        def run():
+            runs.append(name)
+            text = (root / src).read_text() if (root / src).exists() else ""
+            # Each build writes new content, каждая сборка пишет новое содержимое
+            (root / dst).write_text(f"{name}#{len(runs)}({text})")
+        return run
+
+    def files(name):
+        return lambda: [root / name]
+
+    def present(name):
+        return lambda: [root / name] if (root / name).exists() else []
+
+    nodes = [
+        Node("audio", [], present("audio.wav")),
+        Node("config", [], present("config.json")),
+        Node("transcript", ["audio"], files("transcript.json"),
+             builder("transcript", "audio.wav", "transcript.json")),
+        Node("review", ["transcript", "config"], files("review.json"),
+             builder("review", "transcript.json", "review.json")),
+        Node("summary", ["review"], files("summary.json"),
+             builder("summary", "review.json", "summary.json")),
+    ]
+    return ArtifactGraph(root, nodes), runs
+
+
+def _statuses(graph):
+    return {name: info["status"] for name, info in graph.status().items()}
+
+
+def test_missing_sources_block_their_dependants(tmp_path):
+    graph, _ = _session(tmp_path)
+    assert _statuses(graph) == {"audio": MISSING, "config": MISSING,
+                                "transcript": BLOCKED, "review": BLOCKED,
+                                "summary": BLOCKED}
+
+
+def test_run_builds_in_order_then_is_a_no_op(tmp_path):
+    graph, runs = _session(tmp_path)
+    (tmp_path / "audio.wav").write_text("a1")
+    (tmp_path / "config.json").write_text("{}")
+    result = graph.run()
+    assert result["ran"] == ["transcript", "review", "summary"]
+    assert result["failed"] == {} and result["blocked"] == []
+    assert set(_statuses(graph).values()) == {FRESH}
+    assert graph.run()["ran"] == []
+    assert runs == ["transcript", "review", "summary"]
+
+
+def test_changed_input_marks_only_descendants_stale(tmp_path):
+    graph, runs = _session(tmp_path)
+    (tmp_path / "audio.wav").write_text("a1")
+    (tmp_path / "config.json").write_text("{}")
+    graph.run()
+    (tmp_path / "config.json").write_text('{"tips": 2}')
+    statuses = _statuses(graph)
+    assert statuses["transcript"] == FRESH
+    # Staleness reaches the summary through the review,
+    # устаревание доходит до итога через оценку
+    assert statuses["review"] == STALE and statuses["summary"] == STALE
+    runs.clear()
+    assert graph.run(["review"])["ran"] == ["review"]
+    assert _statuses(graph)["summary"] == STALE
+    assert graph.run()["ran"] == ["summary"]
+
+
+def test_record_hashes_the_written_node_and_its_inputs(tmp_path):
+    graph, _ = _session(tmp_path)
+    (tmp_path / "audio.wav").write_text("a1")
+    (tmp_path / "config.json").write_text("{}")
+    graph.run()
+    # A handler rewrites the transcript outside ``run``,
+    # обработчик перезаписывает транскрипт вне ``run``
+    (tmp_path / "transcript.json").write_text("edited")
+    assert _statuses(graph)["transcript"] == STALE
+    outputs_calls = []
+    summary = graph.nodes["summary"]
+    summary_outputs = summary.outputs
+    summary.outputs = lambda: outputs_calls.append(1) or summary_outputs()
+    # Recording hashes one node and its inputs, not the whole graph,
+    # запись хеширует один узел и его входы, а не весь граф
+    graph.record("transcript", seconds=1.23456)
+    assert outputs_calls == []
+    state = json.loads((tmp_path / STATE_NAME).read_text())
+    record = state["nodes"]["transcript"]
+    assert record["seconds"] == 1.235
+    assert record["outputs"] == graph.status()["transcript"]["outputs"]
+    statuses = _statuses(graph)
+    assert statuses["transcript"] == FRESH
+    assert statuses["review"] == STALE and statuses["summary"] == STALE
+
+
+def test_artifacts_made_before_the_graph_are_adopted(tmp_path):
+    graph, runs = _session(tmp_path)
+    for name in ("audio.wav", "transcript.json", "review.json", "summary.json"):
+        (tmp_path / name).write_text(name)
+    (tmp_path / "config.json").write_text("{}")
+    assert set(_statuses(graph).values()) == {FRESH}
+    state = json.loads((tmp_path / STATE_NAME).read_text())
+    assert state["nodes"]["review"]["adopted"] is True
+    assert graph.run()["ran"] == [] and runs == []
+
+
+def test_failure_is_recorded_and_blocks_dependants(tmp_path):
+    graph, _ = _session(tmp_path)
+    (tmp_path / "audio.wav").write_text("a1")
+    (tmp_path / "config.json").write_text("{}")
+
+    def broken():
+        raise RuntimeError("model down")
+
+    graph.nodes["review"].run = broken
+    result = graph.run()
+    assert result["ran"] == ["transcript"]
+    assert result["failed"] == {"review": "RuntimeError: model down"}
+    assert result["blocked"] == ["summary"]
+    assert graph.status()["review"]["error"] == "RuntimeError: model down"
@@ -0,0 +1,105 @@
+"""Local repair of model reviews and the follow-up request for the rest.
+
+Локальное восстановление оценок модели и дополнительный запрос для остального.
+"""
+
+import pytest
+
+from AI import ReviewRepair
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('```json\n{"a": 1}\n```', {"a": 1}),
+    ('Here you go: {"a": {"b": 2}} hope it helps', {"a": {"b": 2}}),
+    ("no json at all", None),
+    ("", None),
+    (None, None),
+])
+def test_parse_lenient(text, expected):
+    assert ReviewRepair.parse_lenient(text) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    (85, 85),
+    (85.6, 86),
+    ("85%", 85),
+    ("8/10", 80),
+    ("4 из 5", 80),
+    ("7,5", 8),
+    (140, 100),
+    (-3, 0),
+    ("n/a", None),
+    (True, None),
+    (None, None),
+])
+def test_coerce_score(value, expected):
+    assert ReviewRepair.coerce_score(value) == expected
+
+
+def test_coerce_field_fixes_formatting_slips():
+    assert ReviewRepair.coerce_field("feedback", ["Хорошо.", {"text": "Ясно."}]) \
+        == "Хорошо.\nЯсно."
+    assert ReviewRepair.coerce_field("tips", "Говорите медленнее") == [
+        {"title": "", "text": "Говорите медленнее"}]
+    tips = [{"title": f"t{i}", "text": ""} for i in range(5)]
+    assert ReviewRepair.coerce_field("tips", tips, tips_limit=2) == [
+        {"title": "t0", "text": "t0"}, {"title": "t1", "text": "t1"}]
+    assert ReviewRepair.coerce_field("mains", "- one\n- two\n- one") == ["one", "two"]
+    assert ReviewRepair.coerce_field("tips", None) == []
+
+
+@pytest.mark.parametrize("key, value, kwargs", [
+    ("feedback", "   ", {}),
+    ("mains", [], {}),
+    ("negative", ["only one"], {"min_negative": 2}),
+    ("scores", {"overall": 50}, {}),
+])
+def test_coerce_field_reports_what_needs_the_model(key, value, kwargs):
+    with pytest.raises(ValueError):
+        ReviewRepair.coerce_field(key, value, **kwargs)
+
+
+def test_coerce_scores_derives_overall_and_uses_measured_delivery():
+    scores, missing = ReviewRepair.coerce_scores(
+        {"goal": "80", "structure": 70, "clarity": "9/10", "delivery": 10},
+        measured={"delivery": 60},
+    )
+    assert scores == {"overall": 75, "goal": 80, "structure": 70, "clarity": 90,
+                      "delivery": 60}
+    assert missing == []
+    _, missing = ReviewRepair.coerce_scores({"goal": 80, "clarity": 90})
+    assert missing == ["overall", "structure", "delivery"]
+
+
+def test_repair_review_lists_only_underivable_fields():
+    review, missing = ReviewRepair.repair_review(
+        {"feedback": "Неплохо", "tips": "Сократите слайд", "mains": [],
+         "negative": ["a"], "scores": {"overall": "70", "goal": 60}},
+        tips_limit=3, min_negative=2,
+    )
+    assert review["feedback"] == "Неплохо"
+    assert review["tips"] == [{"title": "", "text": "Сократите слайд"}]
+    assert missing == ["mains", "negative", "scores.structure", "scores.clarity",
+                       "scores.delivery"]
+    _, missing = ReviewRepair.repair_review("not a dict")
+    assert "feedback" in missing and "mains" in missing
+
+
+def test_followup_asks_for_missing_fields_and_merges():
+    missing = ["mains", "scores.clarity"]
+    schema = ReviewRepair.followup_schema(missing, min_negative=1)
+    assert schema["required"] == ["mains", "scores"]
+    assert schema["properties"]["scores"]["required"] == ["clarity"]
+    prompt = ReviewRepair.followup_prompt({"feedback": "Ок", "mains": []}, missing, 1)
+    assert '"feedback": "Ок"' in prompt and "mains" in prompt
+    assert "scores.clarity" in prompt
+
+    partial = {"feedback": "Ок", "scores": {"goal": 60}}
+    merged = ReviewRepair.merge_followup(
+        partial, {"mains": ["идея"], "scores": {"clarity": 70, "goal": 10},
+                  "extra": "ignored"})
+    # Scores already repaired locally win, локально восстановленные баллы главнее
+    assert merged == {"feedback": "Ок", "mains": ["идея"],
+                      "scores": {"clarity": 70, "goal": 60}}
+    assert ReviewRepair.merge_followup(partial, None) == partial
@@ -0,0 +1,88 @@
+"""One computation per artifact key across threads.
+
+Одно вычисление на ключ артефакта между потоками.
+"""
+
+import threading
+import time
+
+import pytest
+
+from utilities import singleflight
+
+
+def test_lock_files_are_keyed_and_sanitised(tmp_path):
+    with singleflight.key_lock(tmp_path, "review-slide-3"):
+        pass
+    with singleflight.key_lock(tmp_path, "../odd key/1"):
+        pass
+    names = sorted(p.name for p in (tmp_path / ".locks").iterdir())
+    assert names == [".._odd_key_1.lock", "review-slide-3.lock"]
+
+
+def test_run_once_computes_once_for_concurrent_callers(tmp_path):
+    store = {}
+    calls = []
+
+    def ready():
+        return store.get("value")
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        store["value"] = "done"
+        return "done"
+
+    barrier = threading.Barrier(5)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(singleflight.run_once(tmp_path, "transcript-slide-1",
+                                             ready, compute))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == ["done"] * 5
+
+
+def test_run_once_returns_ready_artifact_without_computing(tmp_path):
+    def compute():
+        raise AssertionError("must not run")
+
+    assert singleflight.run_once(tmp_path, "k", lambda: {"ok": 1}, compute) == {"ok": 1}
+
+
+def test_failed_compute_releases_the_lock(tmp_path):
+    def boom():
+        raise RuntimeError("model failed")
+
+    with pytest.raises(RuntimeError):
+        singleflight.run_once(tmp_path, "k", lambda: None, boom)
+    assert singleflight.run_once(tmp_path, "k", lambda: None, lambda: 7) == 7
+
+
+def test_different_keys_do_not_wait_for_each_other(tmp_path):
+    entered = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with singleflight.key_lock(tmp_path, "review-slide-1"):
+            entered.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait(5)
+    try:
+        t0 = time.monotonic()
+        with singleflight.key_lock(tmp_path, "review-slide-2"):
+            pass
+        assert time.monotonic() - t0 < 1.0
+    finally:
+        release.set()
+        holder.join()
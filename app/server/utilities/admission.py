@@ -0,0 +1,478 @@
+"""Admission control: per-stage concurrency, bounded queues and memory watermarks.
+
+Контроль допуска: параллелизм по этапам, ограниченные очереди и пороги памяти.
+
+Heavy routes are mapped to stages (``audio``, ``transcript``, ``review``,
+``deck``). Each stage runs at most ``limit`` requests at once and lets at most
+``queue`` more wait; the next one is refused at once with ``429`` and a
+``Retry-After`` computed from the queue length and the stage's measured service
+time, instead of hanging behind the proxy timeout. Above the high memory
+watermark stages that load Whisper or decode images are refused, above the
+critical one every gated stage is.
+
+Тяжёлые маршруты сопоставлены этапам (``audio``, ``transcript``, ``review``,
+``deck``). Каждый этап выполняет не более ``limit`` запросов одновременно и
+держит в ожидании не более ``queue``; следующий сразу получает ``429`` и
+``Retry-After``, вычисленный по длине очереди и измеренному времени
+обслуживания этапа, а не висит до таймаута прокси. Выше верхнего порога памяти
+отклоняются этапы, загружающие Whisper или декодирующие изображения, выше
+критического — все контролируемые этапы.
+"""
+
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from utilities import timing
+from utilities.memory import MemoryProbe
+
+# stage -> (running at once, waiting), этап -> (одновременно, в ожидании)
+DEFAULT_STAGE_LIMITS: Dict[str, Tuple[int, int]] = {
+    "audio": (4, 16),
+    "transcript": (2, 8),
+    "review": (8, 32),
+    "deck": (2, 4),
+}
+
+# Service time assumed before the first request of a stage finishes,
+# время обслуживания до завершения первого запроса этапа
+DEFAULT_SERVICE_S: Dict[str, float] = {
+    "audio": 10.0,
+    "transcript": 20.0,
+    "review": 15.0,
+    "deck": 30.0,
+}
+
+# (method or None for any, path prefix, exact match, stage),
+# (метод или None для любого, префикс пути, точное совпадение, этап)
+DEFAULT_ROUTES: List[Tuple[Optional[str], str, bool, str]] = [
+    ("POST", "/audio", True, "audio"),
+    ("GET", "/transcript", True, "transcript"),
+    (None, "/review/", False, "review"),
+    ("POST", "/upload", True, "deck"),
+    # Rebuilding a session re-runs Whisper, пересборка сессии снова запускает Whisper
+    ("POST", "/pipeline/", False, "transcript"),
+]
+
+# Stages refused above the high watermark: Whisper, ffmpeg and PIL buffers,
+# этапы, отклоняемые выше верхнего порога: Whisper, ffmpeg и буферы PIL
+MEMORY_HEAVY_STAGES = {"audio", "transcript", "deck"}
+
+# Weight of the newest sample in the service time average,
+# вес последнего замера в среднем времени обслуживания
+EWMA_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """Raised when a request is refused; carries ``retry_after`` seconds.
+
+    Возбуждается при отказе в допуске; содержит ``retry_after`` в секундах.
+    """
+
+    def __init__(self, stage: str, reason: str, retry_after: int):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """Parse ``"transcript=2:8,review=4"`` over the defaults.
+
+    Разбирает ``"transcript=2:8,review=4"`` поверх значений по умолчанию.
+
+    A missing queue length keeps the default one.
+    Без длины очереди остаётся длина по умолчанию.
+    """
+
+    limits = dict(DEFAULT_STAGE_LIMITS)
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        name = name.strip().lower()
+        running, _, waiting = value.strip().partition(":")
+        if not name or not running.isdigit():
+            continue
+        queue = int(waiting) if waiting.isdigit() else limits.get(name, (0, 0))[1]
+        limits[name] = (max(1, int(running)), max(0, queue))
+    return limits
+
+
+class StageGate:
+    """FIFO concurrency gate of one stage, used from the event loop only.
+
+    FIFO-шлюз параллелизма одного этапа, используется только из цикла событий.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int, service_s: float):
+        """Create the gate.
+
+        Создаёт шлюз.
+
+        Args:
+
+            name (str):
+                Stage name.
+                Имя этапа.
+
+            limit (int):
+                Requests running at once.
+                Одновременно выполняемых запросов.
+
+            queue (int):
+                Requests allowed to wait for a slot.
+                Запросов, которым разрешено ждать слот.
+
+            service_s (float):
+                Initial estimate of one request's duration.
+                Начальная оценка длительности одного запроса.
+        """
+
+        self.name = name
+        self.limit = max(1, int(limit))
+        self.queue = max(0, int(queue))
+        self.service_s = float(service_s)
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for w in self._waiters if not w.done())
+
+    def full(self) -> bool:
+        """Whether the next request would be refused.
+
+        Будет ли следующий запрос отклонён.
+        """
+
+        return self.active >= self.limit and self.waiting >= self.queue
+
+    def retry_after(self, cap_s: float) -> int:
+        """Seconds until a slot is likely free for a new request.
+
+        Через сколько секунд для нового запроса вероятно освободится слот.
+        """
+
+        estimate = self.service_s * (self.waiting + 1) / self.limit
+        return max(1, min(int(cap_s), math.ceil(estimate)))
+
+    async def acquire(self, cap_s: float) -> None:
+        """Take a slot, wait in line for one, or raise ``Overloaded``.
+
+        Занимает слот, ждёт его в очереди или возбуждает ``Overloaded``.
+        """
+
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            self.stats["admitted"] += 1
+            return
+        if self.waiting >= self.queue:
+            self.stats["rejected"] += 1
+            raise Overloaded(self.name, "queue full", self.retry_after(cap_s))
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        try:
+            with timing.stage("admission"):
+                await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the cancel, pass it on,
+                # слот передан прямо перед отменой — передаём его дальше
+                self.release(None)
+            raise
+        self.stats["admitted"] += 1
+
+    def release(self, elapsed_s: Optional[float]) -> None:
+        """Free a slot and hand it to the oldest waiter.
+
+        Освобождает слот и передаёт его самому старому ожидающему.
+        """
+
+        if elapsed_s is not None:
+            self.service_s += EWMA_ALPHA * (elapsed_s - self.service_s)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "serviceS": round(self.service_s, 2),
+            **self.stats,
+        }
+
+
+class AdmissionController:
+    """Stage gates, route mapping and memory watermarks of one worker.
+
+    Шлюзы этапов, сопоставление маршрутов и пороги памяти одного воркера.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]],
+                 high_watermark: float = 0.85, critical_watermark: float = 0.95,
+                 retry_cap_s: float = 120.0, enabled: bool = True,
+                 probe: Optional[MemoryProbe] = None):
+        """Create the controller.
+
+        Создаёт контроллер.
+
+        Args:
+
+            limits (Dict[str, Tuple[int, int]]):
+                Stage -> (running at once, waiting).
+                Этап -> (одновременно, в ожидании).
+
+            high_watermark (float):
+                Memory fraction above which heavy stages are refused.
+                Доля памяти, выше которой отклоняются тяжёлые этапы.
+
+            critical_watermark (float):
+                Memory fraction above which every gated stage is refused.
+                Доля памяти, выше которой отклоняются все этапы.
+
+            retry_cap_s (float):
+                Largest ``Retry-After`` ever returned.
+                Наибольший возвращаемый ``Retry-After``.
+
+            enabled (bool):
+                When false every request is let through.
+                Если false, все запросы пропускаются.
+
+            probe (Optional[MemoryProbe]):
+                Memory reader, a fresh one by default.
+                Датчик памяти, по умолчанию новый.
+        """
+
+        self.enabled = enabled
+        self.high = high_watermark
+        self.critical = critical_watermark
+        self.retry_cap_s = retry_cap_s
+        self.memory = probe or MemoryProbe()
+        self.gates = {
+            name: StageGate(name, running, waiting,
+                            DEFAULT_SERVICE_S.get(name, 10.0))
+            for name, (running, waiting) in limits.items()
+        }
+        self.routes = [r for r in DEFAULT_ROUTES if r[3] in self.gates]
+
+    def gate_for(self, method: str, path: str) -> Optional[StageGate]:
+        """Gate of the stage a request belongs to, ``None`` if ungated.
+
+        Шлюз этапа, к которому относится запрос, ``None`` если он не ограничен.
+        """
+
+        if not self.enabled:
+            return None
+        for route_method, prefix, exact, stage in self.routes:
+            if route_method and route_method != method:
+                continue
+            if (path == prefix) if exact else path.startswith(prefix):
+                return self.gates[stage]
+        return None
+
+    def _memory_retry_after(self) -> int:
+        # Memory comes back when the quickest running stage finishes,
+        # память освободится, когда завершится самый быстрый работающий этап
+        running = [g.service_s for g in self.gates.values() if g.active]
+        estimate = min(running) if running else 5.0
+        return max(1, min(int(self.retry_cap_s), math.ceil(estimate)))
+
+    def check_memory(self, gate: StageGate) -> None:
+        """Raise ``Overloaded`` when memory is above the stage's watermark.
+
+        Возбуждает ``Overloaded``, если память выше порога для этапа.
+        """
+
+        pressure = self.memory.pressure()
+        threshold = self.high if gate.name in MEMORY_HEAVY_STAGES else self.critical
+        if pressure >= threshold:
+            gate.stats["rejected"] += 1
+            raise Overloaded(gate.name, f"memory {pressure:.0%}",
+                             self._memory_retry_after())
+
+    async def admit(self, gate: StageGate) -> None:
+        """Check memory, then take or wait for a slot of ``gate``.
+
+        Проверяет память, затем занимает слот ``gate`` или ждёт его.
+        """
+
+        self.check_memory(gate)
+        await gate.acquire(self.retry_cap_s)
+
+    @asynccontextmanager
+    async def hold(self, stage: str) -> AsyncIterator[None]:
+        """Admit a block of work of ``stage`` that no route maps to.
+
+        Допускает блок работы этапа ``stage``, которому не сопоставлен маршрут.
+
+        Used where a route only sometimes does the heavy work, such as the last
+        chunk of a resumable upload.
+        Используется там, где маршрут лишь иногда выполняет тяжёлую работу,
+        например последняя часть возобновляемой загрузки.
+
+        Raises:
+
+            Overloaded:
+                The stage is full or memory is above its watermark.
+                Этап заполнен или память выше его порога.
+        """
+
+        gate = self.gates.get(stage) if self.enabled else None
+        if gate is None:
+            yield
+            return
+        await self.admit(gate)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            gate.release(time.perf_counter() - t0)
+
+    def saturation(self) -> List[str]:
+        """Reasons this worker should not get new heavy traffic, empty if none.
+
+        Причины, по которым воркеру не стоит давать новую тяжёлую нагрузку.
+        """
+
+        if not self.enabled:
+            return []
+        reasons = [f"{g.name} queue full" for g in self.gates.values() if g.full()]
+        pressure = self.memory.pressure()
+        if pressure >= self.high:
+            reasons.append(f"memory {pressure:.0%}")
+        return reasons
+
+    def retry_after(self) -> int:
+        """Seconds until this worker likely stops being saturated.
+
+        Через сколько секунд воркер, вероятно, перестанет быть насыщенным.
+        """
+
+        waits = [g.retry_after(self.retry_cap_s) for g in self.gates.values()
+                 if g.full()]
+        if self.memory.pressure() >= self.high:
+            waits.append(self._memory_retry_after())
+        return max(waits) if waits else 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stage gates, memory and watermarks for diagnostics.
+
+        Шлюзы этапов, память и пороги для диагностики.
+        """
+
+        return {
+            "enabled": self.enabled,
+            "stages": {name: g.snapshot() for name, g in self.gates.items()},
+            "memory": self.memory.snapshot(),
+            "watermarks": {"high": self.high, "critical": self.critical},
+            "saturated": self.saturation(),
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware refusing gated requests with ``429`` under overload.
+
+    ASGI-middleware, отклоняющее контролируемые запросы с ``429`` при перегрузке.
+    """
+
+    def __init__(self, app: Any, controller: AdmissionController):
+        """Wrap an ASGI application.
+
+        Оборачивает ASGI-приложение.
+
+        Args:
+
+            app (Any):
+                Downstream ASGI application.
+                Нижележащее ASGI-приложение.
+
+            controller (AdmissionController):
+                Gates and watermarks to enforce.
+                Применяемые шлюзы и пороги.
+        """
+
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        """Admit, queue or refuse the request before its body is read.
+
+        Допускает, ставит в очередь или отклоняет запрос до чтения тела.
+
+        Pipeline:
+
+            1. Find the stage of the route; ungated routes pass through.
+               Определяем этап маршрута; неконтролируемые проходят сразу.
+
+            2. Check memory and take a slot, or answer ``429`` right away.
+               Проверяем память и занимаем слот либо сразу отвечаем ``429``.
+
+            3. Run the request and feed its duration into the service time.
+               Выполняем запрос и учитываем его длительность.
+        """
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Step 1: Stage of the route
+        # Шаг 1: Этап маршрута
+        gate = self.controller.gate_for(scope.get("method", ""), scope.get("path", ""))
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Step 2: Admission
+        # Шаг 2: Допуск
+        try:
+            await self.controller.admit(gate)
+        except Overloaded as e:
+            await _reject(send, e)
+            return
+
+        # Step 3: Run and measure
+        # Шаг 3: Выполняем и замеряем
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(time.perf_counter() - t0)
+
+
+def overloaded_body(error: Overloaded) -> Dict[str, Any]:
+    """JSON body of a ``429`` answer.
+
+    JSON-тело ответа ``429``.
+    """
+
+    return {
+        "detail": "Сервер перегружен, попробуйте позже",
+        "stage": error.stage,
+        "reason": error.reason,
+        "retryAfter": error.retry_after,
+    }
+
+
+async def _reject(send, error: Overloaded) -> None:
+    body = json.dumps(overloaded_body(error), ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(error.retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -32,12 +32,150 @@ class GeminiModelsEnum(StrEnum):
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Optional override of the Gemini API endpoint, e.g. a local stand-in for load tests
+GEMINI_BASE_URL = (os.getenv("GEMINI_BASE_URL") or "").strip() or None
+
 # If true, attach the source PDF to Gemini at review start
 ANALIZE_PDF = (os.getenv("AnalizePDF", "false").strip().lower() in {"1", "true", "yes", "y"})
 
 # If true, do NOT run Whisper transcription (helps on low‑RAM hosts)
 DISABLE_TRANSCRIPTION = (os.getenv("DISABLE_TRANSCRIPTION", "false").strip().lower() in {"1", "true", "yes", "y"})
 
+# If true, import heavy dependencies and load the Whisper model in the background
+# right after startup instead of on the first request that needs them
+PRELOAD_MODELS = (os.getenv("PRELOAD_MODELS", "false").strip().lower() in {"1", "true", "yes", "y"})
+
+# Whisper model warmed up by the preload
+WHISPER_PRELOAD_MODEL = (os.getenv("WHISPER_PRELOAD_MODEL") or "tiny").strip().lower()
+
+# Optional directory with FP32 checkpoints exported by ``python -m AI.WhisperWeights``;
+# when set, weights are memory-mapped so every worker shares the same page cache
+WHISPER_WEIGHTS_DIR = (os.getenv("WHISPER_WEIGHTS_DIR") or "").strip() or None
+
+# Adaptive Whisper size: quality bounds and the target seconds from job start to
+# transcript; the largest model in bounds expected to meet the target is used
+WHISPER_MIN_MODEL = (os.getenv("WHISPER_MIN_MODEL") or "tiny").strip().lower()
+WHISPER_MAX_MODEL = (os.getenv("WHISPER_MAX_MODEL") or "small").strip().lower()
+WHISPER_LATENCY_BUDGET_S = float(os.getenv("WHISPER_LATENCY_BUDGET_S") or "20")
+
+# Clips of up to one 30 s window from all sessions are collected for a few
+# milliseconds and decoded in one batched Whisper pass (per worker); longer clips
+# and clips the greedy pass gets wrong still go through whisper.transcribe
+WHISPER_BATCHING = (os.getenv("WHISPER_BATCHING", "true").strip().lower() in {"1", "true", "yes", "y"})
+WHISPER_BATCH_WINDOW_MS = float(os.getenv("WHISPER_BATCH_WINDOW_MS") or "20")
+WHISPER_MAX_BATCH = int(os.getenv("WHISPER_MAX_BATCH") or "8")
+
+# Keep Whisper word timestamps and measure pace, pauses, fillers, speaking time and
+# loudness locally (audio/slide-N.delivery.json); the review gets them as facts and
+# scores.delivery comes from them instead of the model
+DELIVERY_METRICS = (os.getenv("DELIVERY_METRICS", "true").strip().lower() in {"1", "true", "yes", "y"})
+
+# Slide reviews the model got partly wrong are coerced locally (scores as text, bare
+# tips, fenced JSON, a missing overall); fields that cannot be derived are requested
+# in one small follow-up call instead of failing the review
+REVIEW_REPAIR = (os.getenv("REVIEW_REPAIR", "true").strip().lower() in {"1", "true", "yes", "y"})
+
+# Admission control per worker: "stage=running:waiting" for the audio, transcript,
+# review and deck stages; a request beyond both is refused at once with 429 and a
+# Retry-After from the stage's measured service time
+ADMISSION_CONTROL = (os.getenv("ADMISSION_CONTROL", "true").strip().lower() in {"1", "true", "yes", "y"})
+ADMISSION_LIMITS = (os.getenv("ADMISSION_LIMITS") or "").strip()
+ADMISSION_RETRY_MAX_S = float(os.getenv("ADMISSION_RETRY_MAX_S") or "120")
+
+# Memory watermarks as a fraction of the container (cgroup) or host memory: above the
+# high one Whisper, ffmpeg and image-heavy requests are refused, above the critical
+# one every gated request is, and /health/ready reports the worker as saturated
+MEMORY_HIGH_WATERMARK = float(os.getenv("MEMORY_HIGH_WATERMARK") or "0.85")
+MEMORY_CRITICAL_WATERMARK = float(os.getenv("MEMORY_CRITICAL_WATERMARK") or "0.95")
+
+# Low-memory mode: Whisper, page renders and LibreOffice reserve their estimated peak
+# before starting and wait (heaviest first) while it does not fit MEMORY_BUDGET_MB per
+# worker (0 = only the high watermark); Whisper models are unloaded after
+# WHISPER_IDLE_UNLOAD_S idle seconds and an eager deck render keeps at most
+# RENDER_MEMORY_MB of page bitmaps in flight, writing PNGs straight to disk
+LOW_MEMORY_MODE = (os.getenv("LOW_MEMORY_MODE", "false").strip().lower() in {"1", "true", "yes", "y"})
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB") or "0")
+WHISPER_IDLE_UNLOAD_S = float(os.getenv("WHISPER_IDLE_UNLOAD_S") or ("300" if LOW_MEMORY_MODE else "0"))
+RENDER_MEMORY_MB = float(os.getenv("RENDER_MEMORY_MB") or ("256" if LOW_MEMORY_MODE else "0"))
+
+# Recordings of at least WHISPER_CHUNK_MIN_S are cut at pauses into about one chunk
+# per free core (each at least WHISPER_CHUNK_S long, overlapping by
+# WHISPER_CHUNK_OVERLAP_S) and transcribed in parallel by a pool of up to
+# WHISPER_CHUNK_WORKERS processes (0 = CPU budget cores), each with its own model;
+# off by default in low-memory mode
+WHISPER_CHUNKING = (os.getenv("WHISPER_CHUNKING", "false" if LOW_MEMORY_MODE else "true").strip().lower() in {"1", "true", "yes", "y"})
+WHISPER_CHUNK_MIN_S = float(os.getenv("WHISPER_CHUNK_MIN_S") or "90")
+WHISPER_CHUNK_S = float(os.getenv("WHISPER_CHUNK_S") or "30")
+WHISPER_CHUNK_OVERLAP_S = float(os.getenv("WHISPER_CHUNK_OVERLAP_S") or "1.0")
+WHISPER_CHUNK_WORKERS = int(os.getenv("WHISPER_CHUNK_WORKERS") or "0")
+
+# Upload size limits in megabytes (the deck limit matches nginx client_max_body_size)
+MAX_DECK_BYTES = int(os.getenv("MAX_DECK_MB") or "100") * 1024 * 1024
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_MB") or "50") * 1024 * 1024
+
+# Unfinished resumable uploads are removed after this many hours of inactivity
+UPLOAD_TTL_HOURS = float(os.getenv("UPLOAD_TTL_HOURS") or "24")
+
+# Recordings in these codecs play in browsers as they are, so /audio only rewrites
+# the container (ffmpeg -c copy); anything else is transcoded to MP3
+AUDIO_REMUX = (os.getenv("AUDIO_REMUX", "true").strip().lower() in {"1", "true", "yes", "y"})
+AUDIO_REMUX_CODECS = {
+    c.strip().lower()
+    for c in (os.getenv("AUDIO_REMUX_CODECS") or "opus,aac,mp3").split(",")
+    if c.strip()
+}
+
+# Internal nginx location that maps to DATA_DIR (e.g. "/_artifacts/"): /images/...
+# then only checks the session file exists and answers with X-Accel-Redirect so nginx
+# sends it with sendfile; empty serves the bytes from Python
+ACCEL_REDIRECT_PREFIX = (os.getenv("ACCEL_REDIRECT_PREFIX") or "").strip()
+if ACCEL_REDIRECT_PREFIX and not ACCEL_REDIRECT_PREFIX.endswith("/"):
+    ACCEL_REDIRECT_PREFIX += "/"
+
+# If true, upload only counts pages; slide PNGs are rendered on first request
+LAZY_RENDER = (os.getenv("LAZY_RENDER", "false").strip().lower() in {"1", "true", "yes", "y"})
+
+# Pages rendered in the background after the requested one, render DPI and pool size
+RENDER_AHEAD = int(os.getenv("RENDER_AHEAD") or "2")
+RENDER_DPI = int(os.getenv("RENDER_DPI") or "200")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS") or "2")
+
+# CPU budget per worker (0 = the host's or cgroup's cores split across workers) and
+# per-stage thread caps, e.g. "whisper=4,render=2,ffmpeg=2,office=2"
+CPU_BUDGET_CORES = int(os.getenv("CPU_BUDGET_CORES") or "0")
+CPU_STAGE_CAPS = (os.getenv("CPU_STAGE_CAPS") or "").strip()
+
+# How includePdf feeds the deck to Gemini: "slides" sends each review only its own
+# slide text (and thumbnail), "file" uploads the whole PDF once and attaches it to
+# every call
+PDF_CONTEXT_MODE = (os.getenv("PDF_CONTEXT_MODE") or "slides").strip().lower()
+
+# "file" mode: how long a review waits for a background PDF upload before going
+# without the file, and how early a remote copy is re-uploaded before it expires
+GEMINI_FILE_WAIT_S = float(os.getenv("GEMINI_FILE_WAIT_S") or "20")
+GEMINI_FILE_REFRESH_HOURS = float(os.getenv("GEMINI_FILE_REFRESH_HOURS") or "6")
+
+# Gemini quota for the whole server (split across gunicorn workers), calls in flight
+# per worker, retries per call and the time budget of one call including queueing
+GEMINI_RPM = float(os.getenv("GEMINI_RPM") or "60")
+GEMINI_TPM = float(os.getenv("GEMINI_TPM") or "1000000")
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY") or "8")
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES") or "4")
+GEMINI_DEADLINE_S = float(os.getenv("GEMINI_DEADLINE_S") or "120")
+
+# After /review/start, review each slide in the background as soon as its transcript
+# is ready, so /review/slide usually returns the stored result at once; the
+# background calls queue behind interactive ones in the Gemini scheduler
+SPECULATIVE_REVIEW = (os.getenv("SPECULATIVE_REVIEW", "true").strip().lower() in {"1", "true", "yes", "y"})
+SPECULATIVE_REVIEW_WORKERS = int(os.getenv("SPECULATIVE_REVIEW_WORKERS") or "2")
+
+# Nodes of a session's artifact graph rebuilt at once by POST /pipeline/{id}/run
+# (independent transcripts and reviews); Whisper and Gemini keep their own limits
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS") or "4")
+
+# If true, the per-slide context also gets a small JPEG thumbnail of each slide
+SLIDE_THUMBNAILS = (os.getenv("SLIDE_THUMBNAILS", "false").strip().lower() in {"1", "true", "yes", "y"})
+
 # Developer mode: when true, APIs may expose additional debugging data
 # Supports either DevMode or DEV_MODE env variable names
 DEV_MODE = (
@@ -0,0 +1,232 @@
+"""Shared CPU budget for co-located ffmpeg, LibreOffice, poppler and torch.
+
+Общий бюджет CPU для ffmpeg, LibreOffice, poppler и torch в одном контейнере.
+
+Every CPU-heavy stage leases a thread allowance before it starts and returns it
+when done. The allowance shrinks as more stages run at once and grows back when
+the worker is idle, and when every core is leased new stages wait, so a burst
+of requests queues instead of oversubscribing the cores.
+
+Каждый тяжёлый по CPU этап перед запуском берёт в аренду допустимое число
+потоков и возвращает его по завершении. Допуск уменьшается, когда одновременно
+работает больше этапов, и растёт, когда воркер простаивает, а если все ядра
+заняты, новые этапы ждут — всплеск запросов встаёт в очередь, а не перегружает
+ядра.
+"""
+
+import math
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from utilities import timing
+
+# Most threads a single stage may use even when the worker is idle,
+# наибольшее число потоков одного этапа даже при простое воркера
+DEFAULT_STAGE_CAPS: Dict[str, int] = {
+    "whisper": 8,
+    "render": 4,
+    "ffmpeg": 2,
+    "office": 2,
+}
+
+
+def detect_cores() -> int:
+    """Usable cores: cgroup quota if set, else the affinity mask.
+
+    Доступные ядра: квота cgroup, если задана, иначе маска привязки.
+    """
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") \
+        else (os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r", encoding="utf-8") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cores = min(cores, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cores)
+
+
+def parse_caps(spec: str) -> Dict[str, int]:
+    """Parse ``"whisper=4,render=2"`` over the defaults.
+
+    Разбирает ``"whisper=4,render=2"`` поверх значений по умолчанию.
+    """
+
+    caps = dict(DEFAULT_STAGE_CAPS)
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            caps[name.strip().lower()] = max(1, int(value))
+    return caps
+
+
+class CpuBudget:
+    """Thread allowances for CPU-heavy stages of one worker process.
+
+    Допуски потоков для тяжёлых по CPU этапов одного процесса воркера.
+    """
+
+    def __init__(self, cores: int, caps: Optional[Dict[str, int]] = None):
+        """Create the budget.
+
+        Создаёт бюджет.
+
+        Args:
+
+            cores (int):
+                Cores this worker may keep busy.
+                Ядра, которые может занимать этот воркер.
+
+            caps (Optional[Dict[str, int]]):
+                Per-stage thread caps.
+                Предельное число потоков по этапам.
+        """
+
+        self.cores = max(1, int(cores))
+        self.caps = dict(caps or DEFAULT_STAGE_CAPS)
+        self._used = 0
+        self._active: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    def allowance(self, stage: str) -> int:
+        """Threads a new ``stage`` would get right now.
+
+        Сколько потоков получил бы новый ``stage`` прямо сейчас.
+        """
+
+        with self._cond:
+            return self._allowance(stage)
+
+    def _allowance(self, stage: str) -> int:
+        running = sum(self._active.values())
+        # Fair share among running stages plus the new one, within free cores,
+        # справедливая доля среди работающих этапов и нового в пределах свободных ядер
+        share = math.ceil(self.cores / (running + 1))
+        free = self.cores - self._used
+        return max(1, min(self.caps.get(stage, 1), share, free))
+
+    @contextmanager
+    def lease(self, stage: str, want: Optional[int] = None) -> Iterator[int]:
+        """Wait for free cores and hold a thread allowance for ``stage``.
+
+        Ждёт свободные ядра и удерживает допуск потоков для ``stage``.
+
+        Args:
+
+            stage (str):
+                ``whisper``, ``render``, ``ffmpeg`` or ``office``.
+                ``whisper``, ``render``, ``ffmpeg`` или ``office``.
+
+            want (Optional[int]):
+                Upper bound for stages that cannot use more threads.
+                Верхняя граница для этапов, которым больше потоков не нужно.
+
+        Yields:
+
+            int:
+                Threads the stage may use.
+                Сколько потоков может использовать этап.
+        """
+
+        with self._cond:
+            if self._used >= self.cores:
+                with timing.stage("cpu_wait"):
+                    while self._used >= self.cores:
+                        self._cond.wait()
+            threads = self._allowance(stage)
+            if want:
+                threads = max(1, min(threads, int(want)))
+            self._used += threads
+            self._active[stage] = self._active.get(stage, 0) + 1
+        try:
+            yield threads
+        finally:
+            with self._cond:
+                self._used -= threads
+                self._active[stage] -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def torch_lease(self, stage: str = "whisper") -> Iterator[int]:
+        """Lease threads for in-process torch work, one such job at a time.
+
+        Арендует потоки для работы torch в процессе, по одной такой задаче за раз.
+
+        ``torch.set_num_threads`` is process-wide, so overlapping torch jobs
+        would overwrite each other's allowance. The job waits for the torch
+        lock before leasing, so a waiting job holds no cores, and sets the
+        thread count while it is the only one.
+        ``torch.set_num_threads`` действует на весь процесс, поэтому
+        пересекающиеся задачи torch перезаписывали бы допуск друг друга. Задача
+        ждёт блокировку torch до аренды, чтобы ожидающая не держала ядра, и
+        задаёт число потоков, пока она единственная.
+
+        Yields:
+
+            int:
+                Threads torch now uses.
+                Сколько потоков сейчас использует torch.
+        """
+
+        with _torch_lock, self.lease(stage) as threads:
+            apply_torch_threads(threads)
+            yield threads
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cores, caps, leased threads and running stages for diagnostics.
+
+        Ядра, пределы, занятые потоки и работающие этапы для диагностики.
+        """
+
+        with self._cond:
+            return {
+                "cores": self.cores,
+                "caps": dict(self.caps),
+                "used": self._used,
+                "active": {k: v for k, v in self._active.items() if v},
+                "next": {stage: self._allowance(stage) for stage in self.caps},
+            }
+
+
+def apply_torch_threads(threads: int) -> None:
+    """Set torch intra-op threads when torch is already imported.
+
+    Задаёт число внутренних потоков torch, если torch уже импортирован.
+
+    The setting is process-wide: call it inside ``CpuBudget.torch_lease`` or in
+    a process that runs one torch job at a time.
+    Настройка общая для процесса: вызывайте её внутри
+    ``CpuBudget.torch_lease`` или в процессе, выполняющем по одной задаче torch.
+    """
+
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(max(1, int(threads)))
+
+
+_budget: Optional[CpuBudget] = None
+_budget_lock = threading.Lock()
+# In-process torch jobs of this worker, задачи torch в процессе этого воркера
+_torch_lock = threading.Lock()
+
+
+def get_budget() -> CpuBudget:
+    """Return this process's budget: ``CPU_BUDGET_CORES`` or its share of the host.
+
+    Возвращает бюджет процесса: ``CPU_BUDGET_CORES`` или его долю ядер хоста.
+    """
+
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            from utilities.consts import CPU_BUDGET_CORES, CPU_STAGE_CAPS
+
+            workers = max(1, int(os.getenv("WEB_CONCURRENCY") or "1"))
+            cores = CPU_BUDGET_CORES or max(1, detect_cores() // workers)
+            _budget = CpuBudget(cores, parse_caps(CPU_STAGE_CAPS))
+        return _budget
@@ -0,0 +1,205 @@
+"""Incremental reader of a JSON object that arrives in chunks.
+
+Инкрементальное чтение JSON-объекта, приходящего частями.
+
+Structured model output streams as fragments of one JSON object. The reader
+reports each top-level field as soon as its value is complete, and for chosen
+string fields (``feedback``) also reports the decoded text as it grows, so the
+client can render them before the closing brace arrives.
+
+Структурированный ответ модели приходит фрагментами одного JSON-объекта.
+Читатель сообщает о каждом поле верхнего уровня, как только его значение
+завершено, а для выбранных строковых полей (``feedback``) ещё и о растущем
+декодированном тексте, чтобы клиент показывал их до закрывающей скобки.
+"""
+
+import json
+import re
+from typing import Any, Iterable, List, Optional, Tuple
+
+# ("delta", key, text) or ("field", key, value),
+# ("delta", ключ, текст) или ("field", ключ, значение)
+Event = Tuple[str, str, Any]
+
+_PARTIAL_UNICODE = re.compile(r"\\u[0-9a-fA-F]{0,3}$")
+
+
+def decode_partial_string(raw: str) -> str:
+    """Decode the body of an unfinished JSON string up to its last full character.
+
+    Декодирует тело незавершённой JSON-строки до последнего полного символа.
+
+    Args:
+
+        raw (str):
+            Characters after the opening quote.
+            Символы после открывающей кавычки.
+
+    Returns:
+
+        str:
+            Decoded text without a trailing half escape or lone high surrogate.
+            Декодированный текст без оборванного escape и одиночного старшего
+            суррогата в конце.
+    """
+
+    cut = len(raw)
+    match = _PARTIAL_UNICODE.search(raw)
+    if match and _escaped_at(raw, match.start()):
+        cut = match.start()
+    elif (len(raw) - len(raw.rstrip("\\"))) % 2:
+        cut -= 1
+    text = json.loads('"' + raw[:cut] + '"', strict=False)
+    if text and "\ud800" <= text[-1] <= "\udbff":
+        # The low half of the surrogate pair is still on its way,
+        # вторая половина суррогатной пары ещё не пришла
+        text = text[:-1]
+    return text
+
+
+def _escaped_at(raw: str, pos: int) -> bool:
+    # A backslash at pos starts an escape when an even number precede it,
+    # обратная косая черта начинает escape, если перед ней их чётное число
+    run = len(raw[:pos]) - len(raw[:pos].rstrip("\\"))
+    return run % 2 == 0
+
+
+class JsonObjectStream:
+    """Feed chunks of one top-level JSON object and collect field events.
+
+    Принимает части одного JSON-объекта верхнего уровня и выдаёт события полей.
+    """
+
+    def __init__(self, stream_fields: Iterable[str] = ()):
+        """Create the reader.
+
+        Создаёт читателя.
+
+        Args:
+
+            stream_fields (Iterable[str]):
+                String fields whose text is reported while it grows.
+                Строковые поля, о растущем тексте которых нужно сообщать.
+        """
+
+        self.stream_fields = set(stream_fields)
+        self.done = False
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        # key -> colon -> value -> (comma) key,
+        # ключ -> двоеточие -> значение -> (запятая) ключ
+        self._state = "key"
+        self._key: Optional[str] = None
+        self._key_start = 0
+        self._value_start: Optional[int] = None
+        self._emitted = 0
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far.
+
+        Всё, что было передано до сих пор.
+        """
+
+        return self._buf
+
+    def feed(self, chunk: str) -> List[Event]:
+        """Consume a chunk and return the events it completed.
+
+        Принимает часть и возвращает завершённые ею события.
+
+        Args:
+
+            chunk (str):
+                Next fragment of the model output.
+                Следующий фрагмент ответа модели.
+
+        Returns:
+
+            List[Event]:
+                ``("delta", key, text)`` for new text of a streamed field and
+                ``("field", key, value)`` for each completed field.
+                ``("delta", ключ, текст)`` для нового текста потокового поля и
+                ``("field", ключ, значение)`` для каждого завершённого поля.
+        """
+
+        events: List[Event] = []
+        self._buf += chunk
+        buf = self._buf
+        for i in range(self._pos, len(buf)):
+            if self.done:
+                break
+            c = buf[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                    if self._depth == 1 and self._state == "key":
+                        self._key = json.loads(buf[self._key_start:i + 1])
+                        self._state = "colon"
+                    elif self._depth == 1 and self._value_start is not None:
+                        self._finish(i + 1, events)
+                continue
+            if c == '"':
+                self._in_str = True
+                if self._depth == 1 and self._state == "key":
+                    self._key_start = i
+                elif self._depth == 1 and self._state == "value" \
+                        and self._value_start is None:
+                    self._value_start = i
+                    self._emitted = 0
+            elif c in "{[":
+                self._depth += 1
+                if self._depth == 2 and self._state == "value" \
+                        and self._value_start is None:
+                    self._value_start = i
+            elif c in "}]":
+                if self._depth == 1 and self._value_start is not None:
+                    self._finish(i, events)
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None:
+                    self._finish(i + 1, events)
+                elif self._depth == 0:
+                    self.done = True
+            elif self._depth == 1:
+                if c == ":" and self._state == "colon":
+                    self._state = "value"
+                    self._value_start = None
+                elif c == ",":
+                    if self._value_start is not None:
+                        self._finish(i, events)
+                    self._state = "key"
+                elif not c.isspace() and self._state == "value" \
+                        and self._value_start is None:
+                    # Number, true, false or null,
+                    # число, true, false или null
+                    self._value_start = i
+        self._pos = len(buf)
+        self._stream_partial(events)
+        return events
+
+    def _finish(self, end: int, events: List[Event]) -> None:
+        raw = self._buf[self._value_start:end].strip()
+        value = json.loads(raw, strict=False)
+        if self._key in self.stream_fields and isinstance(value, str):
+            if len(value) > self._emitted:
+                events.append(("delta", self._key, value[self._emitted:]))
+        events.append(("field", self._key, value))
+        self._value_start = None
+        self._state = "done"
+
+    def _stream_partial(self, events: List[Event]) -> None:
+        if not (self._in_str and self._depth == 1 and self._state == "value"
+                and self._value_start is not None
+                and self._key in self.stream_fields):
+            return
+        text = decode_partial_string(self._buf[self._value_start + 1:])
+        if len(text) > self._emitted:
+            events.append(("delta", self._key, text[self._emitted:]))
+            self._emitted = len(text)
@@ -0,0 +1,435 @@
+"""Memory usage of this process and of the container, and a memory governor.
+
+Потребление памяти процессом и контейнером и регулятор памяти.
+
+The OOM killer acts on the container's cgroup, not on one worker, so pressure
+is measured against the cgroup limit (v2 or v1) and falls back to the host's
+``/proc/meminfo`` when no limit is set. Reclaimable page cache is not counted
+as used, the same way ``docker stats`` reports the working set.
+
+The governor keeps heavy stages (Whisper, page rendering, LibreOffice) within a
+fixed budget: each reserves its estimated peak before it starts, and when the
+budget or the container watermark is reached lighter stages go first while the
+heaviest one waits. It also unloads idle Whisper models.
+
+OOM killer действует на cgroup контейнера, а не на отдельный воркер, поэтому
+давление считается относительно лимита cgroup (v2 или v1), а без лимита — по
+``/proc/meminfo`` хоста. Освобождаемый страничный кэш не считается занятым,
+так же как рабочий набор в ``docker stats``.
+
+Регулятор держит тяжёлые этапы (Whisper, рендеринг страниц, LibreOffice) в
+фиксированном бюджете: каждый перед запуском резервирует оценку пикового
+потребления, а при достижении бюджета или порога контейнера сначала идут более
+лёгкие этапы, а самый тяжёлый ждёт. Он же выгружает простаивающие модели
+Whisper.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utilities import timing
+
+logger = logging.getLogger(__name__)
+
+CGROUP_V2 = "/sys/fs/cgroup"
+CGROUP_V1 = "/sys/fs/cgroup/memory"
+# Limits above this mean "unlimited" in cgroup v1,
+# лимиты выше этого в cgroup v1 означают «без ограничения»
+_UNLIMITED = 1 << 60
+
+# Estimated peak megabytes of stages reserved without a better estimate,
+# оценка пикового потребления в мегабайтах для этапов без точной оценки
+DEFAULT_STAGE_MB: Dict[str, float] = {
+    "whisper": 500.0,
+    "render": 32.0,
+    "office": 300.0,
+}
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = f.read().strip()
+    except OSError:
+        return None
+    return int(raw) if raw.isdigit() else None
+
+
+def _read_stat(path: str, key: str) -> int:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                name, _, value = line.partition(" ")
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process.
+
+    Резидентная память этого процесса.
+    """
+
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _meminfo() -> Tuple[int, int]:
+    values: Dict[str, int] = {}
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                values[name] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return 0, 0
+    total = values.get("MemTotal", 0)
+    return total - values.get("MemAvailable", total), total
+
+
+def memory_usage() -> Tuple[int, int]:
+    """Used and total bytes of the container, or of the host without a limit.
+
+    Занятые и всего байт контейнера, а без лимита — хоста.
+
+    Returns:
+
+        Tuple[int, int]:
+            ``(used, limit)``; ``(0, 0)`` when nothing can be read.
+            ``(занято, лимит)``; ``(0, 0)``, если ничего прочитать не удалось.
+    """
+
+    used, total = _meminfo()
+    limit = _read_int(f"{CGROUP_V2}/memory.max")
+    if limit is not None:
+        current = _read_int(f"{CGROUP_V2}/memory.current") or 0
+        cache = _read_stat(f"{CGROUP_V2}/memory.stat", "inactive_file")
+        return max(0, current - cache), min(limit, total or limit)
+    limit = _read_int(f"{CGROUP_V1}/memory.limit_in_bytes")
+    if limit is not None and limit < _UNLIMITED:
+        current = _read_int(f"{CGROUP_V1}/memory.usage_in_bytes") or 0
+        cache = _read_stat(f"{CGROUP_V1}/memory.stat", "total_inactive_file")
+        return max(0, current - cache), min(limit, total or limit)
+    return used, total
+
+
+class MemoryProbe:
+    """Memory pressure read at most every ``interval_s`` seconds.
+
+    Давление на память, читаемое не чаще раза в ``interval_s`` секунд.
+    """
+
+    def __init__(self, interval_s: float = 0.5):
+        """Create the probe.
+
+        Создаёт датчик.
+
+        Args:
+
+            interval_s (float):
+                How long a reading stays fresh.
+                Сколько секунд показание считается свежим.
+        """
+
+        self.interval_s = interval_s
+        self._at = 0.0
+        self._reading = (0, 0)
+        self._lock = threading.Lock()
+
+    def usage(self) -> Tuple[int, int]:
+        """Cached ``memory_usage()``.
+
+        Кэшированное ``memory_usage()``.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            if now - self._at >= self.interval_s:
+                self._reading = memory_usage()
+                self._at = now
+            return self._reading
+
+    def pressure(self) -> float:
+        """Used fraction of the memory limit, 0 when unknown.
+
+        Занятая доля лимита памяти, 0 если неизвестно.
+        """
+
+        used, limit = self.usage()
+        return used / limit if limit else 0.0
+
+    def snapshot(self) -> Dict[str, float]:
+        """Used, limit, pressure and this process's RSS in megabytes.
+
+        Занято, лимит, давление и RSS этого процесса в мегабайтах.
+        """
+
+        used, limit = self.usage()
+        return {
+            "usedMb": round(used / 2**20, 1),
+            "limitMb": round(limit / 2**20, 1),
+            "pressure": round(used / limit, 3) if limit else 0.0,
+            "rssMb": round(rss_bytes() / 2**20, 1),
+        }
+
+
+class _Ticket:
+    def __init__(self, seq: int, stage: str, mb: float, defer_until: float):
+        self.seq = seq
+        self.stage = stage
+        self.mb = mb
+        self.defer_until = defer_until
+
+
+class MemoryGovernor:
+    """Memory reservations of heavy stages and idle Whisper unloading.
+
+    Резервирование памяти тяжёлыми этапами и выгрузка простаивающего Whisper.
+    """
+
+    def __init__(self, budget_mb: float = 0.0, high_watermark: float = 0.85,
+                 idle_unload_s: float = 0.0, max_defer_s: float = 60.0,
+                 probe: Optional[MemoryProbe] = None):
+        """Create the governor.
+
+        Создаёт регулятор.
+
+        Args:
+
+            budget_mb (float):
+                Megabytes this worker may use (RSS plus reservations), 0 for
+                no fixed budget.
+                Сколько мегабайт может занимать воркер (RSS плюс резервы), 0 —
+                без фиксированного бюджета.
+
+            high_watermark (float):
+                Container memory fraction treated as full.
+                Доля памяти контейнера, считающаяся заполненной.
+
+            idle_unload_s (float):
+                Unload Whisper after this many idle seconds, 0 to keep it.
+                Выгружать Whisper после стольких секунд простоя, 0 — не
+                выгружать.
+
+            max_defer_s (float):
+                After this long a deferred stage stops yielding to lighter ones.
+                Спустя столько секунд отложенный этап перестаёт уступать лёгким.
+
+            probe (Optional[MemoryProbe]):
+                Container memory reader, a fresh one by default.
+                Датчик памяти контейнера, по умолчанию новый.
+        """
+
+        self.budget_mb = max(0.0, float(budget_mb))
+        self.high = high_watermark
+        self.idle_unload_s = max(0.0, float(idle_unload_s))
+        self.max_defer_s = max_defer_s
+        self.memory = probe or MemoryProbe()
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._reserved: Dict[str, float] = {}
+        self._active: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
+        self._stats = {"deferred": 0, "deferredS": 0.0, "unloads": 0}
+        self._reaper: Optional[threading.Thread] = None
+
+    def headroom_mb(self) -> float:
+        """Megabytes a new stage may reserve now under every limit.
+
+        Сколько мегабайт новый этап может зарезервировать сейчас по всем
+        ограничениям.
+        """
+
+        with self._cond:
+            return self._headroom()
+
+    def _headroom(self) -> float:
+        reserved = sum(self._reserved.values())
+        room = float("inf")
+        if self.budget_mb:
+            # Reservations count on top of RSS: subprocesses are not in it and
+            # a stage that just started has not grown yet,
+            # резервы считаются поверх RSS: подпроцессов в нём нет, а только что
+            # запущенный этап ещё не вырос
+            room = self.budget_mb - rss_bytes() / 2**20 - reserved
+        used, limit = self.memory.usage()
+        if limit:
+            room = min(room, (self.high * limit - used) / 2**20 - reserved)
+        return room
+
+    def _may_start(self, ticket: _Ticket) -> bool:
+        if not any(self._active.values()):
+            # Alone in the worker: always make progress,
+            # один в воркере: всегда продвигаемся
+            return True
+        room = self._headroom()
+        now = time.monotonic()
+        starving = [t for t in self._waiting if t.defer_until <= now]
+        if starving:
+            return ticket is min(starving, key=lambda t: t.seq) and ticket.mb <= room
+        # Lighter waiters go first, so the heaviest stage is the one deferred,
+        # сначала идут более лёгкие, поэтому откладывается самый тяжёлый этап
+        ahead = sum(t.mb for t in self._waiting
+                    if (t.mb, t.seq) < (ticket.mb, ticket.seq))
+        return ticket.mb + ahead <= room
+
+    @contextmanager
+    def reserve(self, stage: str, mb: Optional[float] = None) -> Iterator[float]:
+        """Wait until ``mb`` fits, then hold it for the duration of ``stage``.
+
+        Ждёт, пока ``mb`` поместится, и удерживает резерв на время ``stage``.
+
+        Args:
+
+            stage (str):
+                ``whisper``, ``render`` or ``office``.
+                ``whisper``, ``render`` или ``office``.
+
+            mb (Optional[float]):
+                Estimated peak, ``DEFAULT_STAGE_MB`` by default.
+                Оценка пика, по умолчанию из ``DEFAULT_STAGE_MB``.
+
+        Yields:
+
+            float:
+                The reserved megabytes.
+                Зарезервированные мегабайты.
+        """
+
+        mb = float(mb if mb is not None else DEFAULT_STAGE_MB.get(stage, 100.0))
+        ticket = _Ticket(next(self._seq), stage, mb,
+                         time.monotonic() + self.max_defer_s)
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                if not self._may_start(ticket):
+                    self._stats["deferred"] += 1
+                    t0 = time.monotonic()
+                    with timing.stage("memory_wait"):
+                        while not self._may_start(ticket):
+                            # Memory also frees outside reservations, poll it,
+                            # память освобождается и вне резервов, опрашиваем
+                            self._cond.wait(0.5)
+                    self._stats["deferredS"] += time.monotonic() - t0
+            finally:
+                self._waiting.remove(ticket)
+            self._reserved[stage] = self._reserved.get(stage, 0.0) + mb
+            self._active[stage] = self._active.get(stage, 0) + 1
+            self._last_used[stage] = time.monotonic()
+        try:
+            yield mb
+        finally:
+            with self._cond:
+                self._reserved[stage] -= mb
+                self._active[stage] -= 1
+                self._last_used[stage] = time.monotonic()
+                self._cond.notify_all()
+
+    def idle_s(self, stage: str) -> Optional[float]:
+        """Seconds since ``stage`` last ran, ``None`` while it runs or waits.
+
+        Секунд с последнего запуска ``stage``, ``None``, пока он идёт или ждёт.
+        """
+
+        with self._cond:
+            if self._active.get(stage) or any(t.stage == stage for t in self._waiting):
+                return None
+            return time.monotonic() - self._last_used.get(stage, time.monotonic())
+
+    def start_reaper(self, unload: Callable[[], List[str]],
+                     stage: str = "whisper") -> None:
+        """Unload models of ``stage`` once it has been idle for ``idle_unload_s``.
+
+        Выгружает модели ``stage`` после ``idle_unload_s`` секунд простоя.
+
+        Args:
+
+            unload (Callable[[], List[str]]):
+                Drops the models and returns their names.
+                Выгружает модели и возвращает их имена.
+
+            stage (str):
+                Stage whose idleness is watched.
+                Этап, простой которого отслеживается.
+        """
+
+        if not self.idle_unload_s or self._reaper is not None:
+            return
+        with self._cond:
+            self._last_used.setdefault(stage, time.monotonic())
+
+        def loop() -> None:
+            while True:
+                time.sleep(max(1.0, self.idle_unload_s / 4))
+                idle = self.idle_s(stage)
+                if idle is None or idle < self.idle_unload_s:
+                    continue
+                try:
+                    names = unload()
+                except Exception:
+                    logger.exception("unloading %s failed", stage)
+                    continue
+                with self._cond:
+                    # Idle time restarts so nothing is retried every tick,
+                    # простой отсчитывается заново, чтобы не повторять каждый тик
+                    self._last_used[stage] = time.monotonic()
+                    if names:
+                        self._stats["unloads"] += 1
+
+        self._reaper = threading.Thread(target=loop, name=f"{stage}-reaper",
+                                        daemon=True)
+        self._reaper.start()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Budget, headroom, reservations and deferral counters.
+
+        Бюджет, запас, резервы и счётчики откладываний.
+        """
+
+        with self._cond:
+            headroom = self._headroom()
+            return {
+                "budgetMb": self.budget_mb or None,
+                "headroomMb": round(headroom, 1) if headroom != float("inf") else None,
+                "reservedMb": {k: round(v, 1) for k, v in self._reserved.items() if v},
+                "waiting": [{"stage": t.stage, "mb": round(t.mb, 1)}
+                            for t in self._waiting],
+                "idleUnloadS": self.idle_unload_s or None,
+                **{k: round(v, 2) if isinstance(v, float) else v
+                   for k, v in self._stats.items()},
+                **self.memory.snapshot(),
+            }
+
+
+_governor: Optional[MemoryGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> MemoryGovernor:
+    """Return this process's governor configured from ``utilities.consts``.
+
+    Возвращает регулятор процесса с настройками из ``utilities.consts``.
+    """
+
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            from utilities.consts import (MEMORY_BUDGET_MB, MEMORY_HIGH_WATERMARK,
+                                          WHISPER_IDLE_UNLOAD_S)
+
+            _governor = MemoryGovernor(MEMORY_BUDGET_MB, MEMORY_HIGH_WATERMARK,
+                                       WHISPER_IDLE_UNLOAD_S)
+        return _governor
@@ -0,0 +1,288 @@
+"""Lazy, cached rendering of deck pages to PNG with render-ahead.
+
+Ленивый кешируемый рендеринг страниц презентации в PNG с упреждением.
+
+In lazy mode ``upload`` only counts pages and records the PDF in
+``slides/pages.json``; each ``slide-N.png`` is rendered on its first request
+and then served as a plain file.
+
+В ленивом режиме ``upload`` только считает страницы и записывает PDF в
+``slides/pages.json``; каждый ``slide-N.png`` рендерится при первом запросе,
+а дальше отдаётся как обычный файл.
+"""
+
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows dev hosts, на Windows блокируем только потоки
+    fcntl = None
+
+from utilities import timing
+from utilities.cpu_budget import get_budget
+from utilities.memory import DEFAULT_STAGE_MB, get_governor
+
+MANIFEST_NAME = "pages.json"
+
+_THREAD_LOCKS: Dict[str, threading.Lock] = {}
+_THREAD_LOCKS_GUARD = threading.Lock()
+_AHEAD_PENDING: Set[str] = set()
+_AHEAD_GUARD = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def slide_path(slides_dir: Path, page: int) -> Path:
+    """Return the PNG path of a 1-based page.
+
+    Возвращает путь к PNG страницы с нумерацией с 1.
+    """
+
+    return Path(slides_dir) / f"slide-{int(page)}.png"
+
+
+def count_pages(pdf_path: Path) -> int:
+    """Count PDF pages with ``pdfinfo`` without rendering anything.
+
+    Считает страницы PDF через ``pdfinfo`` без рендеринга.
+    """
+
+    from pdf2image import pdfinfo_from_path
+
+    return int(pdfinfo_from_path(str(pdf_path))["Pages"])
+
+
+def page_memory_mb(pdf_path: Path, dpi: int) -> float:
+    """Estimate megabytes one ``pdftoppm`` page render needs at ``dpi``.
+
+    Оценивает, сколько мегабайт нужно ``pdftoppm`` на рендер одной страницы при
+    ``dpi``.
+
+    The RGB bitmap is counted twice, for the rasterizer and the PNG encoder.
+    Растр RGB учитывается дважды: для растеризатора и для кодировщика PNG.
+    """
+
+    from pdf2image import pdfinfo_from_path
+
+    try:
+        size = pdfinfo_from_path(str(pdf_path)).get("Page size", "")
+    except Exception:
+        size = ""
+    # "595.276 x 841.89 pts (A4)": points are 1/72 inch,
+    # точки — это 1/72 дюйма
+    found = re.match(r"\s*([\d.]+)\s*x\s*([\d.]+)", str(size))
+    if not found:
+        return DEFAULT_STAGE_MB["render"]
+    w, h = (float(v) * dpi / 72.0 for v in found.groups())
+    return max(8.0, 2 * w * h * 3 / 2**20)
+
+
+def write_manifest(slides_dir: Path, pdf_path: Path, pages: int, dpi: int,
+                   page_mb: Optional[float] = None) -> None:
+    """Record the source PDF, page count and DPI for later lazy renders.
+
+    Записывает исходный PDF, число страниц и DPI для последующего рендеринга.
+
+    Args:
+
+        slides_dir (Path):
+            Session ``slides`` directory.
+            Каталог ``slides`` сессии.
+
+        pdf_path (Path):
+            Source PDF inside the session.
+            Исходный PDF внутри сессии.
+
+        pages (int):
+            Number of pages.
+            Количество страниц.
+
+        dpi (int):
+            Render resolution.
+            Разрешение рендеринга.
+
+        page_mb (Optional[float]):
+            ``page_memory_mb`` of the deck, reserved by each page render.
+            ``page_memory_mb`` презентации, резервируется каждым рендером.
+    """
+
+    slides_dir = Path(slides_dir)
+    slides_dir.mkdir(parents=True, exist_ok=True)
+    data = {
+        "pdf": os.path.relpath(pdf_path, slides_dir.parent),
+        "pages": int(pages),
+        "dpi": int(dpi),
+    }
+    if page_mb is not None:
+        data["pageMb"] = round(float(page_mb), 1)
+    tmp = slides_dir / f".{MANIFEST_NAME}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, slides_dir / MANIFEST_NAME)
+
+
+def load_manifest(slides_dir: Path) -> Optional[Dict[str, Any]]:
+    """Read ``pages.json`` or return ``None`` for eagerly rendered sessions.
+
+    Читает ``pages.json`` или возвращает ``None`` для сессий, отрендеренных сразу.
+    """
+
+    try:
+        with open(Path(slides_dir) / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _thread_lock(key: str) -> threading.Lock:
+    with _THREAD_LOCKS_GUARD:
+        return _THREAD_LOCKS.setdefault(key, threading.Lock())
+
+
+def render_page(slides_dir: Path, page: int) -> Path:
+    """Render one page exactly once, even with concurrent requests and workers.
+
+    Рендерит одну страницу ровно один раз даже при параллельных запросах и
+    воркерах.
+
+    Pipeline:
+
+        1. Return the cached PNG when it exists.
+           Возвращаем закешированный PNG, если он есть.
+
+        2. Take a per-page thread lock and ``flock`` on a lock file.
+           Берём блокировку потока и ``flock`` на файл блокировки страницы.
+
+        3. Re-check, render the single page within the memory budget and
+           publish it atomically.
+           Проверяем повторно, рендерим одну страницу в бюджете памяти и
+           публикуем её атомарно.
+
+    Args:
+
+        slides_dir (Path):
+            Session ``slides`` directory with ``pages.json``.
+            Каталог ``slides`` сессии с ``pages.json``.
+
+        page (int):
+            1-based page number.
+            Номер страницы с 1.
+
+    Returns:
+
+        Path:
+            Rendered PNG.
+            Отрендеренный PNG.
+
+    Raises:
+
+        FileNotFoundError:
+            When the manifest is missing or the page is out of range.
+            Если манифеста нет или страница вне диапазона.
+    """
+
+    # Step 1: Fast path
+    # Шаг 1: Быстрый путь
+    slides_dir = Path(slides_dir)
+    out = slide_path(slides_dir, page)
+    if out.exists():
+        return out
+    manifest = load_manifest(slides_dir)
+    if manifest is None or not 1 <= int(page) <= int(manifest["pages"]):
+        raise FileNotFoundError(str(out))
+
+    # Step 2: Single flight per page
+    # Шаг 2: Один рендер на страницу
+    lock_path = slides_dir / f".slide-{int(page)}.lock"
+    with _thread_lock(str(lock_path)), open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Step 3: Another worker may have finished meanwhile
+            # Шаг 3: Другой воркер мог уже закончить
+            if not out.exists():
+                from pdf2image import convert_from_path
+
+                pdf_path = slides_dir.parent / manifest["pdf"]
+                # One page is one pdftoppm thread, одна страница — один поток
+                page_mb = manifest.get("pageMb")
+                with get_governor().reserve("render", page_mb), \
+                        get_budget().lease("render", want=1), \
+                        timing.stage("render_page"):
+                    images = convert_from_path(
+                        str(pdf_path), dpi=int(manifest.get("dpi") or 200),
+                        first_page=int(page), last_page=int(page),
+                    )
+                    tmp = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+                    images[0].save(tmp, "PNG")
+                    os.replace(tmp, out)
+            # The PNG exists from here on, so the lock file is no longer needed,
+            # PNG уже существует, поэтому файл блокировки больше не нужен
+            lock_path.unlink(missing_ok=True)
+            return out
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _render_quietly(slides_dir: Path, page: int, key: str) -> None:
+    try:
+        render_page(slides_dir, page)
+    except Exception:
+        # Render-ahead is best effort; the request path will retry and report,
+        # упреждение — по возможности; путь запроса повторит и сообщит ошибку
+        pass
+    finally:
+        with _AHEAD_GUARD:
+            _AHEAD_PENDING.discard(key)
+
+
+def render_ahead(slides_dir: Path, page: int, ahead: int, workers: int = 2) -> None:
+    """Queue background renders for the ``ahead`` pages following ``page``.
+
+    Ставит в фон рендеринг ``ahead`` страниц, следующих за ``page``.
+
+    Args:
+
+        slides_dir (Path):
+            Session ``slides`` directory.
+            Каталог ``slides`` сессии.
+
+        page (int):
+            Page just requested (0 to start from the first page).
+            Только что запрошенная страница (0, чтобы начать с первой).
+
+        ahead (int):
+            Number of following pages to prepare.
+            Сколько следующих страниц подготовить.
+
+        workers (int):
+            Size of the shared render pool, fixed on first use.
+            Размер общего пула рендеринга, задаётся при первом вызове.
+    """
+
+    global _executor
+    if ahead <= 0:
+        return
+    manifest = load_manifest(slides_dir)
+    if manifest is None:
+        return
+    last = min(int(manifest["pages"]), int(page) + ahead)
+    for nxt in range(int(page) + 1, last + 1):
+        if slide_path(slides_dir, nxt).exists():
+            continue
+        key = str(slide_path(slides_dir, nxt))
+        with _AHEAD_GUARD:
+            if key in _AHEAD_PENDING:
+                continue
+            _AHEAD_PENDING.add(key)
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max(1, workers), thread_name_prefix="render"
+                )
+        _executor.submit(_render_quietly, Path(slides_dir), nxt, key)
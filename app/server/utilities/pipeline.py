@@ -0,0 +1,436 @@
+"""Artifact graph of a session: content hashes, staleness and incremental runs.
+
+Граф артефактов сессии: хеши содержимого, устаревание и инкрементальные прогоны.
+
+Each node names its output files and the nodes it is computed from. When a
+node is produced, ``pipeline.json`` records the SHA-256 of its outputs and a
+hash of its dependencies' outputs. A node is stale when that input hash no
+longer matches the files on disk or when any ancestor is stale, so replacing
+the recording of slide 4 marks only its transcript, its review and the summary.
+``run`` re-executes stale nodes in dependency order, independent ones in
+parallel. Sources (the deck, recordings, the review settings) have no run
+function and are only hashed. Recording a build hashes only that node and its
+direct inputs; staleness of the rest is worked out when ``status`` or ``run``
+asks for it.
+
+Каждый узел называет свои выходные файлы и узлы, из которых он вычисляется.
+Когда узел построен, в ``pipeline.json`` записываются SHA-256 его выходов и хеш
+выходов его зависимостей. Узел устарел, если этот входной хеш больше не
+совпадает с файлами на диске или устарел кто-то из предков, поэтому замена
+записи слайда 4 помечает только его транскрипт, его оценку и итог. ``run``
+перезапускает устаревшие узлы в порядке зависимостей, независимые — параллельно.
+Источники (презентация, записи, настройки оценки) не имеют функции запуска и
+только хешируются. Запись сборки хеширует только этот узел и его прямые входы;
+устаревание остальных вычисляется, когда его запрашивают ``status`` или ``run``.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from utilities import singleflight
+
+STATE_NAME = "pipeline.json"
+
+# Node states, состояния узлов
+FRESH = "fresh"
+STALE = "stale"
+MISSING = "missing"
+BLOCKED = "blocked"
+
+
+class Node:
+    """One artifact: its outputs, dependencies and how to rebuild it.
+
+    Один артефакт: его выходы, зависимости и способ пересборки.
+    """
+
+    def __init__(self, name: str, deps: Iterable[str],
+                 outputs: Callable[[], List[Path]],
+                 run: Optional[Callable[[], Any]] = None):
+        """Create the node.
+
+        Создаёт узел.
+
+        Args:
+
+            name (str):
+                Unique name such as ``transcript:4``.
+                Уникальное имя, например ``transcript:4``.
+
+            deps (Iterable[str]):
+                Names of the nodes it is computed from.
+                Имена узлов, из которых он вычисляется.
+
+            outputs (Callable[[], List[Path]]):
+                Current output files; empty or a missing path means the
+                artifact does not exist.
+                Текущие выходные файлы; пустой список или отсутствующий путь
+                означает, что артефакта нет.
+
+            run (Optional[Callable[[], Any]]):
+                Rebuilds the outputs, ``None`` for sources.
+                Пересобирает выходы, ``None`` для источников.
+        """
+
+        self.name = name
+        self.deps = tuple(deps)
+        self.outputs = outputs
+        self.run = run
+
+
+class ArtifactGraph:
+    """Staleness tracking and incremental execution of one session's nodes.
+
+    Отслеживание устаревания и инкрементальное выполнение узлов одной сессии.
+    """
+
+    def __init__(self, root: Path, nodes: Iterable[Node]):
+        """Create the graph.
+
+        Создаёт граф.
+
+        Args:
+
+            root (Path):
+                Session directory; output paths are recorded relative to it.
+                Каталог сессии; пути выходов записываются относительно него.
+
+            nodes (Iterable[Node]):
+                Nodes in any order; unknown dependencies count as missing.
+                Узлы в любом порядке; неизвестные зависимости считаются
+                отсутствующими.
+        """
+
+        self.root = Path(root)
+        self.nodes: Dict[str, Node] = {n.name: n for n in nodes}
+        self._lock = threading.Lock()
+
+    # State file, файл состояния
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.root / STATE_NAME, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("nodes", {})
+        state.setdefault("files", {})
+        return state
+
+    def _save(self, state: Dict[str, Any]) -> None:
+        path = self.root / STATE_NAME
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def _merge(self, files: Dict[str, Any], records: Dict[str, Any],
+               adopt: bool = False) -> None:
+        """Write hashed files and node records into the current state.
+
+        Записывает хешированные файлы и записи узлов в текущее состояние.
+
+        Hashing happens before this, outside the cross-process lock, so the
+        lock only covers one read and one write of ``pipeline.json``.
+        Хеширование выполняется заранее, вне межпроцессной блокировки, поэтому
+        она покрывает только одно чтение и одну запись ``pipeline.json``.
+
+        Args:
+
+            files (Dict[str, Any]):
+                File hash cache entries to add.
+                Добавляемые записи кэша хешей файлов.
+
+            records (Dict[str, Any]):
+                Node records to write.
+                Записываемые записи узлов.
+
+            adopt (bool):
+                Keep records another worker wrote meanwhile, for adopted nodes.
+                Сохранять записи, которые другой процесс успел сделать, — для
+                принимаемых узлов.
+        """
+
+        if not files and not records:
+            return
+        with self._lock, singleflight.key_lock(self.root, "pipeline-state"):
+            state = self._load()
+            state["files"].update(files)
+            for name, record in records.items():
+                if adopt:
+                    state["nodes"].setdefault(name, record)
+                else:
+                    state["nodes"][name] = record
+            self._save(state)
+
+    # Hashing, хеширование
+
+    def _file_hash(self, path: Path, files: Dict[str, Any]) -> str:
+        # Cached by size and mtime so unchanged slides are not re-read,
+        # кэш по размеру и mtime, чтобы не перечитывать неизменные слайды
+        rel = os.path.relpath(path, self.root)
+        st = path.stat()
+        cached = files.get(rel)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        files[rel] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def _outputs(self, node: Node, files: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        paths = node.outputs()
+        if not paths or not all(p.is_file() for p in paths):
+            return None
+        return {os.path.relpath(p, self.root): self._file_hash(p, files)
+                for p in sorted(paths)}
+
+    @staticmethod
+    def _digest(value: Any) -> str:
+        raw = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _evaluate(self, state: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Outputs, input hash and status of every node, in dependency order.
+
+        Выходы, входной хеш и состояние каждого узла в порядке зависимостей.
+        """
+
+        files = state["files"]
+        result: Dict[str, Dict[str, Any]] = {}
+
+        def visit(name: str, path: Set[str]) -> Dict[str, Any]:
+            if name in result:
+                return result[name]
+            node = self.nodes.get(name)
+            if node is None or name in path:
+                return {"status": MISSING, "outputs": None}
+            deps = {d: visit(d, path | {name}) for d in node.deps}
+            outputs = self._outputs(node, files)
+            inputs = self._digest({d: info["outputs"] for d, info in deps.items()})
+            record = state["nodes"].get(name) or {}
+            if any(info["status"] in (MISSING, BLOCKED) for info in deps.values()):
+                status = BLOCKED if node.run else (FRESH if outputs else MISSING)
+            elif outputs is None:
+                status = MISSING
+            elif node.run is None:
+                status = FRESH
+            elif not record:
+                # Made before the graph existed: adopted as built from the
+                # current inputs, создан до появления графа: принимается как
+                # построенный из текущих входов
+                record.update(inputs=inputs, outputs=outputs, adopted=True)
+                state["nodes"][name] = record
+                status = FRESH
+            elif record.get("inputs") != inputs or record.get("outputs") != outputs:
+                status = STALE
+            elif any(info["status"] == STALE for info in deps.values()):
+                status = STALE
+            else:
+                status = FRESH
+            result[name] = {"status": status, "outputs": outputs, "inputs": inputs}
+            return result[name]
+
+        for name in self.nodes:
+            visit(name, set())
+        return result
+
+    # Public API, публичный интерфейс
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Current status of every node.
+
+        Текущее состояние каждого узла.
+
+        Returns:
+
+            Dict[str, Dict[str, Any]]:
+                ``{name: {"status", "deps", "outputs", "ranAt", "seconds",
+                "error"}}``; status is ``fresh``, ``stale``, ``missing`` or
+                ``blocked`` (a dependency is missing).
+                ``{имя: {"status", "deps", "outputs", "ranAt", "seconds",
+                "error"}}``; состояние ``fresh``, ``stale``, ``missing`` или
+                ``blocked`` (нет зависимости).
+        """
+
+        # Staleness is only worked out here, on a snapshot of the state,
+        # устаревание вычисляется только здесь, на снимке состояния
+        state = self._load()
+        known_files = dict(state["files"])
+        known_nodes = set(state["nodes"])
+        evaluated = self._evaluate(state)
+        files = state["files"]
+        self._merge({k: v for k, v in files.items() if known_files.get(k) != v},
+                    {k: v for k, v in state["nodes"].items() if k not in known_nodes},
+                    adopt=True)
+        out: Dict[str, Dict[str, Any]] = {}
+        for name, info in evaluated.items():
+            record = state["nodes"].get(name) or {}
+            out[name] = {
+                "status": info["status"],
+                "deps": list(self.nodes[name].deps),
+                "source": self.nodes[name].run is None,
+                "outputs": info["outputs"],
+                "ranAt": record.get("ranAt"),
+                "seconds": record.get("seconds"),
+                "error": record.get("error"),
+            }
+        return out
+
+    def record(self, name: str, seconds: Optional[float] = None,
+               error: Optional[str] = None) -> None:
+        """Mark ``name`` as built from the current inputs (or as failed).
+
+        Отмечает ``name`` как построенный из текущих входов (или как упавший).
+
+        Handlers that write an artifact outside ``run`` call this, so the web
+        flow and the graph agree on what is fresh.
+        Обработчики, пишущие артефакт вне ``run``, вызывают это, чтобы
+        веб-сценарий и граф одинаково понимали, что актуально.
+        """
+
+        if name not in self.nodes:
+            return
+        if error is not None:
+            with self._lock, singleflight.key_lock(self.root, "pipeline-state"):
+                state = self._load()
+                state["nodes"].setdefault(name, {})["error"] = error
+                self._save(state)
+            return
+        node = self.nodes[name]
+        state = self._load()
+        # Only this node and its direct inputs are hashed; whether anything
+        # else went stale is left to the next ``status``,
+        # хешируются только этот узел и его прямые входы; устарело ли что-то
+        # ещё, выяснит следующий ``status``
+        files = state["files"]
+        known_files = dict(files)
+        deps = {d: self._outputs(self.nodes[d], files) if d in self.nodes else None
+                for d in node.deps}
+        record = {"inputs": self._digest(deps), "outputs": self._outputs(node, files),
+                  "ranAt": time.time()}
+        if seconds is not None:
+            record["seconds"] = round(seconds, 3)
+        self._merge({k: v for k, v in files.items() if known_files.get(k) != v},
+                    {name: record})
+
+    def closure(self, targets: Iterable[str]) -> Set[str]:
+        """Targets and everything they depend on.
+
+        Цели и всё, от чего они зависят.
+        """
+
+        seen: Set[str] = set()
+        stack = [t for t in targets if t in self.nodes]
+        while stack:
+            name = stack.pop()
+            if name not in seen:
+                seen.add(name)
+                stack += [d for d in self.nodes[name].deps if d in self.nodes]
+        return seen
+
+    def run(self, targets: Optional[Iterable[str]] = None,
+            workers: int = 4) -> Dict[str, Any]:
+        """Rebuild stale and missing nodes, independent ones in parallel.
+
+        Пересобирает устаревшие и отсутствующие узлы, независимые — параллельно.
+
+        Pipeline:
+
+            1. Evaluate the graph and pick runnable nodes whose dependencies
+               are all fresh.
+               Оцениваем граф и выбираем узлы, все зависимости которых актуальны.
+
+            2. Run them in a thread pool, each under its own lock, re-checking
+               staleness after taking it.
+               Запускаем их в пуле потоков, каждый под своей блокировкой,
+               повторно проверяя устаревание после её получения.
+
+            3. Record each result and repeat until nothing more can run.
+               Записываем каждый результат и повторяем, пока есть что запускать.
+
+        Args:
+
+            targets (Optional[Iterable[str]]):
+                Nodes to bring up to date with their ancestors, all by default.
+                Узлы, которые нужно актуализировать вместе с предками, по
+                умолчанию все.
+
+            workers (int):
+                Nodes running at once.
+                Сколько узлов выполняется одновременно.
+
+        Returns:
+
+            Dict[str, Any]:
+                ``ran`` (names in completion order), ``failed`` (name to error)
+                and ``blocked`` (stale nodes left waiting on a failed or
+                missing dependency).
+                ``ran`` (имена в порядке завершения), ``failed`` (имя → ошибка)
+                и ``blocked`` (устаревшие узлы, ждущие упавшую или
+                отсутствующую зависимость).
+        """
+
+        wanted = self.closure(targets) if targets is not None else set(self.nodes)
+        ran: List[str] = []
+        failed: Dict[str, str] = {}
+        running: Dict[Future, str] = {}
+
+        def build(name: str) -> float:
+            node = self.nodes[name]
+            with singleflight.key_lock(self.root, f"pipeline-{name}"):
+                # Another request may have rebuilt it meanwhile,
+                # другой запрос мог уже пересобрать его
+                if self.status()[name]["status"] == FRESH:
+                    return -1.0
+                t0 = time.perf_counter()
+                node.run()
+                return time.perf_counter() - t0
+
+        with ThreadPoolExecutor(max(1, workers), thread_name_prefix="pipeline") as pool:
+            while True:
+                # Step 1: Runnable nodes
+                # Шаг 1: Готовые к запуску узлы
+                current = self.status()
+                busy = set(running.values())
+                for name in sorted(wanted):
+                    info = current[name]
+                    node = self.nodes[name]
+                    if (node.run is None or name in busy or name in failed
+                            or name in ran or info["status"] not in (STALE, MISSING)):
+                        continue
+                    if all(current[d]["status"] == FRESH for d in node.deps
+                           if d in current):
+                        # Step 2: Run
+                        # Шаг 2: Запуск
+                        running[pool.submit(build, name)] = name
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+                # Step 3: Record
+                # Шаг 3: Запись
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        seconds = future.result()
+                    except Exception as e:
+                        failed[name] = f"{type(e).__name__}: {getattr(e, 'detail', e)}"
+                        self.record(name, error=failed[name])
+                        continue
+                    if seconds >= 0:
+                        self.record(name, seconds=seconds)
+                    ran.append(name)
+
+        final = self.status()
+        blocked = sorted(n for n in wanted if final[n]["status"] != FRESH
+                         and n not in failed and self.nodes[n].run is not None)
+        return {"ran": ran, "failed": failed, "blocked": blocked}
@@ -12,6 +12,8 @@ PROMPTS = {
         "Ты выступаешь в роли критика презентаций. На вход даётся улучшенная транскрибация речи для одного слайда. "
         "Сформируй короткий фидбек (2–4 предложения), выдели 1–5 основных мыслей слайда (краткие пункты) и 0–5 неудачных формулировок/буллетов, "
         "а также предложи до 3 конкретных подсказок по улучшению. "
+        "Если передан блок SLIDE_CONTENT (текст и, возможно, миниатюра самого слайда), сопоставь речь с содержимым слайда. "
+        "Если передан блок DELIVERY_METRICS (измеренные темп, паузы, слова-паразиты, доля времени речи и громкость), опирайся на эти факты, когда пишешь о подаче, и не противоречь им. "
         "Строгий JSON: {\"feedback\": string, \"mains\": string[], \"negative\": string[], \"scores\": {\"overall\": number, \"goal\": number, \"structure\": number, \"clarity\": number, \"delivery\": number}, \"tips\": [{\"title\": string, \"text\": string}]}. "
         "Где mains — это основные мысли слайда (минимум 1), negative — неудачные формулировки (минимум определяется настройкой сервера). Поля scores — целые числа от 0 до 100: overall (общая оценка), goal (ясная цель), structure (структура и логика), clarity (понятность), delivery (подача). Если недостаточно материала — сформулируй обобщённые варианты по контексту. Не добавляй других полей и не объясняй формат."
     ,
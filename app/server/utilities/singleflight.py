@@ -0,0 +1,139 @@
+"""Keyed single-flight coordination across threads and worker processes.
+
+Координация «один вычислитель на ключ» между потоками и процессами воркеров.
+
+Concurrent requests for the same artifact (a slide transcript, a slide review)
+take one lock per key: the first computes and writes the artifact, the others
+wait and then read what it wrote instead of repeating the work. Locks are a
+thread lock plus ``flock`` on a per-key file, so they also hold across gunicorn
+workers.
+
+Параллельные запросы одного артефакта (транскрипт слайда, оценка слайда) берут
+одну блокировку на ключ: первый вычисляет и записывает артефакт, остальные ждут
+и читают записанное, а не повторяют работу. Блокировка — это блокировка потока
+плюс ``flock`` на файл ключа, поэтому она действует и между воркерами gunicorn.
+"""
+
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows dev hosts, на Windows блокируем только потоки
+    fcntl = None
+
+from utilities import timing
+
+T = TypeVar("T")
+
+_THREAD_LOCKS: Dict[str, threading.Lock] = {}
+_THREAD_LOCKS_GUARD = threading.Lock()
+
+
+def _thread_lock(key: str) -> threading.Lock:
+    with _THREAD_LOCKS_GUARD:
+        return _THREAD_LOCKS.setdefault(key, threading.Lock())
+
+
+@contextmanager
+def key_lock(lock_dir: Path, key: str) -> Iterator[None]:
+    """Hold the exclusive lock of ``key`` for this thread and process.
+
+    Удерживает эксклюзивную блокировку ``key`` для потока и процесса.
+
+    Args:
+
+        lock_dir (Path):
+            Directory for lock files, usually the session directory.
+            Каталог файлов блокировки, обычно каталог сессии.
+
+        key (str):
+            Artifact key such as ``transcript-slide-3``.
+            Ключ артефакта, например ``transcript-slide-3``.
+    """
+
+    lock_dir = Path(lock_dir) / ".locks"
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    lock_path = lock_dir / f"{re.sub(r'[^A-Za-z0-9_.-]', '_', key)}.lock"
+    thread_lock = _thread_lock(str(lock_path))
+    # Time spent waiting for another request's computation,
+    # время ожидания вычисления другого запроса
+    with timing.stage("singleflight_wait"):
+        thread_lock.acquire()
+        try:
+            lock_file = open(lock_path, "a")
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except BaseException:
+            thread_lock.release()
+            raise
+    try:
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+        thread_lock.release()
+
+
+def run_once(lock_dir: Path, key: str, ready: Callable[[], Optional[T]],
+             compute: Callable[[], T]) -> T:
+    """Return an existing artifact or compute it once per key.
+
+    Возвращает готовый артефакт или вычисляет его один раз на ключ.
+
+    Pipeline:
+
+        1. Return ``ready()`` when the artifact is already there.
+           Возвращаем ``ready()``, если артефакт уже есть.
+
+        2. Take the key lock; a concurrent leader finishes first.
+           Берём блокировку ключа; параллельный лидер заканчивает первым.
+
+        3. Re-check ``ready()`` and only then run ``compute()``.
+           Повторно проверяем ``ready()`` и только затем запускаем ``compute()``.
+
+    Args:
+
+        lock_dir (Path):
+            Directory for lock files.
+            Каталог файлов блокировки.
+
+        key (str):
+            Artifact key.
+            Ключ артефакта.
+
+        ready (Callable[[], Optional[T]]):
+            Reads the artifact, ``None`` when it is missing or stale.
+            Читает артефакт; ``None``, если его нет или он устарел.
+
+        compute (Callable[[], T]):
+            Produces and persists the artifact.
+            Создаёт и сохраняет артефакт.
+
+    Returns:
+
+        T:
+            The artifact.
+            Артефакт.
+    """
+
+    # Step 1: Fast path
+    # Шаг 1: Быстрый путь
+    result = ready()
+    if result is not None:
+        return result
+
+    # Step 2: Wait for any computation already in flight
+    # Шаг 2: Ждём уже идущее вычисление
+    with key_lock(lock_dir, key):
+        # Step 3: The leader may have produced it meanwhile
+        # Шаг 3: Лидер мог уже создать артефакт
+        result = ready()
+        if result is not None:
+            timing.annotate(singleflight_shared=1)
+            return result
+        return compute()
@@ -0,0 +1,204 @@
+"""Per-slide text and thumbnail index used as compact review context.
+
+Индекс текста и миниатюр по слайдам — компактный контекст для рецензии.
+
+Built once per deck: ``pdftotext`` runs over the whole PDF and its output is
+split on form feeds, so each ``review_slide`` call sends only its own slide
+instead of the full document.
+
+Строится один раз на презентацию: ``pdftotext`` обрабатывает весь PDF, а вывод
+делится по символам перевода страницы, поэтому каждый вызов ``review_slide``
+отправляет только свой слайд, а не весь документ.
+"""
+
+import json
+import os
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utilities.cpu_budget import get_budget
+
+CONTEXT_NAME = "context.json"
+# Longer slide texts are cut; a slide rarely carries more than this,
+# более длинные тексты слайда обрезаются; на слайде редко бывает больше
+MAX_SLIDE_CHARS = 4000
+THUMB_WIDTH = 320
+
+
+def extract_page_texts(pdf_path: Path) -> List[str]:
+    """Extract text of every page with a single ``pdftotext`` run.
+
+    Извлекает текст каждой страницы одним запуском ``pdftotext``.
+
+    Args:
+
+        pdf_path (Path):
+            Source PDF.
+            Исходный PDF.
+
+    Returns:
+
+        List[str]:
+            Text per page, in page order.
+            Текст по страницам в порядке следования.
+
+    Raises:
+
+        FileNotFoundError / subprocess.CalledProcessError:
+            When poppler is missing or fails.
+            Если poppler отсутствует или завершился с ошибкой.
+    """
+
+    proc = subprocess.run(
+        ["pdftotext", "-layout", "-enc", "UTF-8", str(pdf_path), "-"],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    pages = proc.stdout.decode("utf-8", errors="replace").split("\f")
+    # pdftotext terminates every page with \f, so the last chunk is empty,
+    # pdftotext завершает каждую страницу символом \f, последний кусок пустой
+    if pages and not pages[-1].strip():
+        pages = pages[:-1]
+    return [_compact(p) for p in pages]
+
+
+def _compact(text: str) -> str:
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return "\n".join(line for line in lines if line)[:MAX_SLIDE_CHARS]
+
+
+def build_context(
+        pdf_path: Path, slides_dir: Path, thumbnails: bool = False) -> Dict[str, Any]:
+    """Write ``slides/context.json`` and, optionally, small JPEG thumbnails.
+
+    Записывает ``slides/context.json`` и, при необходимости, маленькие миниатюры
+    JPEG.
+
+    Pipeline:
+
+        1. Extract per-page text with ``pdftotext``.
+           Извлекаем текст страниц через ``pdftotext``.
+
+        2. Render ``thumb-N.jpg`` at low resolution when enabled.
+           Рендерим ``thumb-N.jpg`` в низком разрешении, если включено.
+
+        3. Persist the index atomically.
+           Атомарно сохраняем индекс.
+
+    Args:
+
+        pdf_path (Path):
+            Source PDF.
+            Исходный PDF.
+
+        slides_dir (Path):
+            Session ``slides`` directory.
+            Каталог ``slides`` сессии.
+
+        thumbnails (bool):
+            Whether to render thumbnails.
+            Рендерить ли миниатюры.
+
+    Returns:
+
+        Dict[str, Any]:
+            The written index.
+            Записанный индекс.
+    """
+
+    # Step 1: Text per page
+    # Шаг 1: Текст по страницам
+    slides_dir = Path(slides_dir)
+    slides_dir.mkdir(parents=True, exist_ok=True)
+    texts = extract_page_texts(pdf_path)
+    entries: List[Dict[str, Any]] = [
+        {"index": i, "text": text} for i, text in enumerate(texts, start=1)
+    ]
+
+    # Step 2: Thumbnails
+    # Шаг 2: Миниатюры
+    if thumbnails:
+        from pdf2image import convert_from_path
+
+        with get_budget().lease("render") as threads:
+            images = convert_from_path(
+                str(pdf_path), size=(THUMB_WIDTH, None), thread_count=threads
+            )
+        for entry, img in zip(entries, images):
+            name = f"thumb-{entry['index']}.jpg"
+            img.convert("RGB").save(slides_dir / name, "JPEG", quality=70)
+            entry["thumbnail"] = name
+
+    # Step 3: Persist
+    # Шаг 3: Сохраняем
+    data = {"pages": len(entries), "slides": entries}
+    tmp = slides_dir / f".{CONTEXT_NAME}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, slides_dir / CONTEXT_NAME)
+    return data
+
+
+def load_slide_context(slides_dir: Path, slide_index: int) -> Optional[Dict[str, Any]]:
+    """Return the text and thumbnail bytes of one slide, if indexed.
+
+    Возвращает текст и байты миниатюры одного слайда, если он проиндексирован.
+
+    Args:
+
+        slides_dir (Path):
+            Session ``slides`` directory.
+            Каталог ``slides`` сессии.
+
+        slide_index (int):
+            1-based slide number.
+            Номер слайда с 1.
+
+    Returns:
+
+        Optional[Dict[str, Any]]:
+            ``{"text": str, "image": bytes | None}`` or ``None``.
+            ``{"text": str, "image": bytes | None}`` или ``None``.
+    """
+
+    index = load_index(slides_dir)
+    if index is None:
+        return None
+    for entry in index.get("slides") or []:
+        if int(entry.get("index", 0)) != int(slide_index):
+            continue
+        image = None
+        thumb = entry.get("thumbnail")
+        if thumb and (Path(slides_dir) / thumb).exists():
+            image = (Path(slides_dir) / thumb).read_bytes()
+        return {"text": entry.get("text") or "", "image": image}
+    return None
+
+
+def load_index(slides_dir: Path) -> Optional[Dict[str, Any]]:
+    """Read ``context.json`` or return ``None`` when it was never built.
+
+    Читает ``context.json`` или возвращает ``None``, если он не строился.
+    """
+
+    try:
+        with open(Path(slides_dir) / CONTEXT_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def outline(slides_dir: Path, chars: int = 200) -> List[str]:
+    """Return the beginning of every slide's text for deck-level prompts.
+
+    Возвращает начало текста каждого слайда для запросов по всей презентации.
+    """
+
+    index = load_index(slides_dir) or {}
+    return [
+        f"Slide {entry.get('index')}: {(entry.get('text') or '')[:chars]}"
+        for entry in index.get("slides") or []
+        if entry.get("text")
+    ]
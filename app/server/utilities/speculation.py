@@ -0,0 +1,151 @@
+"""Background jobs that compute artifacts before anyone asks for them.
+
+Фоновые задачи, вычисляющие артефакты до того, как их запросят.
+
+A job is keyed by the artifact it produces (``<session>/review-slide-3``).
+Submitting a key again replaces the queued job, and cancelling a key drops the
+queued job and bumps the key's generation, so a job already running can see
+that its inputs changed and discard its result instead of publishing it.
+
+Задача привязана к ключу создаваемого артефакта (``<session>/review-slide-3``).
+Повторная постановка ключа заменяет ожидающую задачу, а отмена ключа снимает
+ожидающую задачу и увеличивает поколение ключа, поэтому уже запущенная задача
+видит, что её входные данные изменились, и отбрасывает результат, а не
+публикует его.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class Speculator:
+    """Keyed, cancellable background jobs on a small thread pool.
+
+    Отменяемые фоновые задачи по ключам на небольшом пуле потоков.
+    """
+
+    def __init__(self, workers: int = 2, enabled: bool = True):
+        """Create the pool.
+
+        Создаёт пул.
+
+        Args:
+
+            workers (int):
+                Jobs running at once.
+                Одновременно выполняемых задач.
+
+            enabled (bool):
+                When false ``submit`` does nothing.
+                Если false, ``submit`` ничего не делает.
+        """
+
+        self.enabled = enabled
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)),
+                                        thread_name_prefix="speculate")
+        self._jobs: Dict[str, Future] = {}
+        self._generations: Dict[str, int] = {}
+        self._stats = {"submitted": 0, "cancelled": 0, "completed": 0,
+                       "discarded": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def generation(self, key: str) -> int:
+        """Current generation of ``key``; it grows on every cancel.
+
+        Текущее поколение ``key``; растёт при каждой отмене.
+        """
+
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def submit(self, key: str, fn: Callable[[Callable[[], bool]], bool]) -> bool:
+        """Queue ``fn`` for ``key``, replacing a job still waiting for a thread.
+
+        Ставит ``fn`` в очередь для ``key``, заменяя задачу, ещё ждущую поток.
+
+        A job already running is left alone; the job itself checks whether its
+        artifact is still missing.
+        Уже запущенная задача не трогается; задача сама проверяет, что её
+        артефакта всё ещё нет.
+
+        Args:
+
+            key (str):
+                Artifact key.
+                Ключ артефакта.
+
+            fn (Callable[[Callable[[], bool]], bool]):
+                The job. It receives ``stale()``, true once the key was
+                cancelled after submission, and returns whether it published.
+                Задача. Получает ``stale()``, истинную после отмены ключа, и
+                возвращает, опубликовала ли она результат.
+
+        Returns:
+
+            bool:
+                Whether the job was queued.
+                Поставлена ли задача в очередь.
+        """
+
+        if not self.enabled:
+            return False
+        with self._lock:
+            previous = self._jobs.get(key)
+            if previous is not None and previous.cancel():
+                self._stats["cancelled"] += 1
+            generation = self._generations.get(key, 0)
+            future = self._pool.submit(self._run, key, generation, fn)
+            self._jobs[key] = future
+            self._stats["submitted"] += 1
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return True
+
+    def cancel(self, key: str) -> None:
+        """Drop the queued job of ``key`` and mark a running one stale.
+
+        Снимает ожидающую задачу ``key`` и помечает запущенную устаревшей.
+        """
+
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            future = self._jobs.pop(key, None)
+            if future is not None and future.cancel():
+                self._stats["cancelled"] += 1
+
+    def _run(self, key: str, generation: int,
+             fn: Callable[[Callable[[], bool]], bool]) -> None:
+        def stale() -> bool:
+            return self.generation(key) != generation
+
+        try:
+            published = fn(stale)
+            outcome = "completed" if published else "discarded"
+        except Exception:
+            # A failed guess costs nothing: the user's request computes it again,
+            # неудачная попытка ничего не стоит: запрос пользователя вычислит заново
+            logger.exception("speculation %s failed", key)
+            outcome = "failed"
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def _forget(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._jobs.get(key) is future:
+                del self._jobs[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and pending jobs for diagnostics.
+
+        Счётчики и ожидающие задачи для диагностики.
+        """
+
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending": sum(1 for f in self._jobs.values() if not f.done()),
+                **self._stats,
+            }
@@ -0,0 +1,380 @@
+"""Per-request stage timing, Server-Timing headers and session timing ledger.
+
+Поэтапные замеры запросов, заголовки Server-Timing и журнал таймингов сессии.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import anyio
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+
+LEDGER_FILE_NAME = "timing.jsonl"
+
+_CURRENT: ContextVar[Optional["RequestTiming"]] = ContextVar(
+    "request_timing", default=None
+)
+_LEDGER_LOCK = threading.Lock()
+
+
+class RequestTiming:
+    """Collect stage durations, input sizes and models of one request.
+
+    Собирает длительности этапов, размеры входных данных и модели одного запроса.
+    """
+
+    def __init__(self, endpoint: str):
+        """Start timing a request.
+
+        Начинает замер запроса.
+
+        Args:
+
+            endpoint (str):
+                Method and path of the request.
+                Метод и путь запроса.
+        """
+
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.status: Optional[int] = None
+        self.session_id: Optional[str] = None
+        # stage name -> [total ms, count], insertion order is execution order
+        self.stages: Dict[str, List[float]] = {}
+        self.sizes: Dict[str, float] = {}
+        self.models: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, duration_ms: float) -> None:
+        """Accumulate a stage duration.
+
+        Накапливает длительность этапа.
+
+        Args:
+
+            name (str):
+                Stage token, e.g. ``pdf_to_png``.
+                Имя этапа, например ``pdf_to_png``.
+
+            duration_ms (float):
+                Duration in milliseconds.
+                Длительность в миллисекундах.
+        """
+
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += duration_ms
+            entry[1] += 1
+
+    def add_size(self, key: str, value: float) -> None:
+        """Accumulate an input size counter.
+
+        Накапливает счётчик размера входных данных.
+
+        Args:
+
+            key (str):
+                Counter name, e.g. ``prompt_chars``.
+                Имя счётчика, например ``prompt_chars``.
+
+            value (float):
+                Amount to add.
+                Добавляемое значение.
+        """
+
+        with self._lock:
+            self.sizes[key] = self.sizes.get(key, 0) + value
+
+    def elapsed_ms(self) -> float:
+        """Return milliseconds since the request started.
+
+        Возвращает миллисекунды с начала запроса.
+
+        Returns:
+
+            float:
+                Elapsed time.
+                Прошедшее время.
+        """
+
+        return (time.perf_counter() - self._t0) * 1000.0
+
+    def server_timing_header(self) -> str:
+        """Render stages as a ``Server-Timing`` header value.
+
+        Формирует значение заголовка ``Server-Timing`` из этапов.
+
+        Returns:
+
+            str:
+                Header value with one metric per stage and a ``total``.
+                Значение заголовка с метрикой на этап и итоговым ``total``.
+        """
+
+        with self._lock:
+            items = list(self.stages.items())
+        metrics = []
+        for name, (dur, count) in items:
+            metric = f"{name};dur={dur:.1f}"
+            if count > 1:
+                metric += f';desc="x{int(count)}"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(metrics)
+
+    def to_ledger_entry(self) -> Dict[str, Any]:
+        """Build a JSON-serializable ledger record.
+
+        Формирует JSON-совместимую запись журнала.
+
+        Returns:
+
+            Dict[str, Any]:
+                Endpoint, status, stage durations, sizes and models.
+                Эндпоинт, статус, длительности этапов, размеры и модели.
+        """
+
+        with self._lock:
+            stages = {k: round(v[0], 1) for k, v in self.stages.items()}
+            sizes = dict(self.sizes)
+            models = dict(self.models)
+        return {
+            "ts": round(self.started_at, 3),
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "totalMs": round(self.elapsed_ms(), 1),
+            "stages": stages,
+            "sizes": sizes,
+            "models": models,
+        }
+
+
+def current() -> Optional[RequestTiming]:
+    """Return the timing collector of the running request, if any.
+
+    Возвращает сборщик таймингов текущего запроса, если он есть.
+
+    Returns:
+
+        Optional[RequestTiming]:
+            Active collector or ``None`` outside of a request.
+            Активный сборщик или ``None`` вне запроса.
+    """
+
+    return _CURRENT.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block of code as a named stage of the current request.
+
+    Замеряет блок кода как именованный этап текущего запроса.
+
+    Args:
+
+        name (str):
+            Stage token used in ``Server-Timing``.
+            Имя этапа для ``Server-Timing``.
+    """
+
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing = _CURRENT.get()
+        if timing is not None:
+            timing.add_stage(name, (time.perf_counter() - t0) * 1000.0)
+
+
+def annotate(session_id: Optional[str] = None, **sizes: float) -> None:
+    """Attach the session id and input sizes to the current request.
+
+    Привязывает идентификатор сессии и размеры входных данных к текущему запросу.
+
+    Args:
+
+        session_id (Optional[str]):
+            Session whose ledger receives the record.
+            Сессия, в журнал которой попадёт запись.
+
+        **sizes (float):
+            Counters to accumulate (pages, audio_seconds, prompt_chars).
+            Накапливаемые счётчики (pages, audio_seconds, prompt_chars).
+    """
+
+    timing = _CURRENT.get()
+    if timing is None:
+        return
+    if session_id:
+        timing.session_id = session_id
+    for key, value in sizes.items():
+        if value is not None:
+            timing.add_size(key, value)
+
+
+def record_model(kind: str, name: str) -> None:
+    """Remember which model served a stage of the current request.
+
+    Запоминает, какая модель обслужила этап текущего запроса.
+
+    Args:
+
+        kind (str):
+            Model family, e.g. ``whisper`` or ``gemini``.
+            Семейство модели, например ``whisper`` или ``gemini``.
+
+        name (str):
+            Model name.
+            Имя модели.
+    """
+
+    timing = _CURRENT.get()
+    if timing is not None:
+        timing.models[kind] = str(name)
+
+
+def append_ledger(session_dir: Path, entry: Dict[str, Any]) -> None:
+    """Append one record to the session timing ledger.
+
+    Дописывает одну запись в журнал таймингов сессии.
+
+    Args:
+
+        session_dir (Path):
+            Session directory under the data root.
+            Каталог сессии в корне данных.
+
+        entry (Dict[str, Any]):
+            Ledger record.
+            Запись журнала.
+    """
+
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _LEDGER_LOCK:
+        # Single append-mode write keeps lines whole across processes,
+        # одна запись в режиме дозаписи сохраняет строки целыми между процессами
+        with open(session_dir / LEDGER_FILE_NAME, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def read_ledger(session_dir: Path) -> List[Dict[str, Any]]:
+    """Read all records of the session timing ledger.
+
+    Читает все записи журнала таймингов сессии.
+
+    Args:
+
+        session_dir (Path):
+            Session directory under the data root.
+            Каталог сессии в корне данных.
+
+    Returns:
+
+        List[Dict[str, Any]]:
+            Records in append order; broken lines are skipped.
+            Записи в порядке добавления; повреждённые строки пропускаются.
+    """
+
+    path = session_dir / LEDGER_FILE_NAME
+    if not path.exists():
+        return []
+    entries: List[Dict[str, Any]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding ``Server-Timing`` and writing the session ledger.
+
+    ASGI-middleware, добавляющее ``Server-Timing`` и пишущее журнал сессии.
+    """
+
+    def __init__(self, app: Any, data_dir: Path):
+        """Wrap an ASGI application.
+
+        Оборачивает ASGI-приложение.
+
+        Args:
+
+            app (Any):
+                Downstream ASGI application.
+                Нижележащее ASGI-приложение.
+
+            data_dir (Path):
+                Root directory with session folders.
+                Корневой каталог с папками сессий.
+        """
+
+        self.app = app
+        self.data_dir = data_dir
+
+    async def __call__(self, scope, receive, send):
+        """Time the request and decorate the response headers.
+
+        Замеряет запрос и дополняет заголовки ответа.
+
+        Pipeline:
+
+            1. Install a fresh collector for the request context.
+               Устанавливаем новый сборщик в контекст запроса.
+
+            2. Inject ``Server-Timing`` when the response starts.
+               Добавляем ``Server-Timing`` при старте ответа.
+
+            3. Append a ledger record if a session was annotated, in the
+               threadpool so the event loop never waits on the disk.
+               Дописываем запись в журнал, если указана сессия, в пуле
+               потоков, чтобы цикл событий не ждал диск.
+        """
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Step 1: Install collector
+        # Шаг 1: Устанавливаем сборщик
+        timing = RequestTiming(f"{scope.get('method', '')} {scope.get('path', '')}")
+        token = _CURRENT.set(timing)
+
+        # Step 2: Decorate response start
+        # Шаг 2: Дополняем начало ответа
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timing.status = message.get("status")
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timing.server_timing_header())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _CURRENT.reset(token)
+            # Step 3: Persist ledger record for the session
+            # Шаг 3: Сохраняем запись журнала для сессии
+            sid = timing.session_id
+            if sid and sid.isalnum():
+                # Written even when the request was cancelled,
+                # пишется, даже если запрос отменён
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(self._persist, self.data_dir / sid,
+                                            timing.to_ledger_entry())
+
+    @staticmethod
+    def _persist(session_dir: Path, entry: Dict[str, Any]) -> None:
+        if session_dir.is_dir():
+            try:
+                append_ledger(session_dir, entry)
+            except OSError:
+                pass
@@ -0,0 +1,549 @@
+"""Streaming multipart and resumable uploads with on-the-fly SHA-256.
+
+Потоковые multipart- и возобновляемые загрузки с вычислением SHA-256 на лету.
+
+Request bodies are written chunk by chunk with ``aiofiles`` into a ``.part``
+file on the same filesystem as the destination, so the final step is a rename
+instead of a second copy.
+
+Тела запросов пишутся по частям через ``aiofiles`` в файл ``.part`` на той же
+файловой системе, что и место назначения, поэтому последний шаг — переименование,
+а не повторное копирование.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List,
+                    Optional, Tuple)
+
+try:
+    import fcntl
+except ImportError:  # Windows dev hosts, на Windows блокируем только процесс
+    fcntl = None
+
+import aiofiles
+from multipart.multipart import MultipartParser, parse_options_header
+
+# Text form fields are small; anything larger is rejected,
+# текстовые поля формы маленькие, всё, что больше, отклоняется
+MAX_FIELD_BYTES = 64 * 1024
+HASH_BLOCK = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """Upload rejected by a limit or validation, carrying an HTTP status.
+
+    Загрузка отклонена из-за лимита или проверки, содержит HTTP-статус.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class StreamedFile:
+    """File part written to disk while the request was read.
+
+    Файловая часть, записанная на диск во время чтения запроса.
+    """
+
+    path: Path
+    filename: str
+    size: int
+    sha256: str
+
+
+def _too_large(limit: int) -> UploadError:
+    return UploadError(413, f"Файл слишком большой (лимит {limit // (1024 * 1024)} МБ)")
+
+
+def check_content_length(headers: Any, limit: int) -> None:
+    """Reject a request before reading it when ``Content-Length`` exceeds the limit.
+
+    Отклоняет запрос до чтения, если ``Content-Length`` превышает лимит.
+
+    Raises:
+
+        UploadError:
+            413 when the declared body is too large.
+            413, если заявленное тело слишком большое.
+    """
+
+    raw = headers.get("content-length")
+    if raw and raw.isdigit() and int(raw) > limit:
+        raise _too_large(limit)
+
+
+def rehash(path: Path) -> "hashlib._Hash":
+    """Rebuild a SHA-256 state from the bytes already on disk.
+
+    Восстанавливает состояние SHA-256 по байтам, уже записанным на диск.
+    """
+
+    hasher = hashlib.sha256()
+    if path.exists():
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                hasher.update(block)
+    return hasher
+
+
+async def append_stream(
+        chunks: AsyncIterator[bytes], path: Path, limit: int,
+        hasher: "hashlib._Hash") -> int:
+    """Append an async byte stream to a file, hashing and enforcing a size limit.
+
+    Дописывает асинхронный поток байт в файл, хешируя и соблюдая лимит размера.
+
+    Args:
+
+        chunks (AsyncIterator[bytes]):
+            Request body chunks.
+            Части тела запроса.
+
+        path (Path):
+            File to append to.
+            Файл для дописывания.
+
+        limit (int):
+            Maximum size of the file after appending.
+            Максимальный размер файла после дописывания.
+
+        hasher (hashlib._Hash):
+            SHA-256 state updated with every chunk.
+            Состояние SHA-256, обновляемое каждой частью.
+
+    Returns:
+
+        int:
+            New file size.
+            Новый размер файла.
+
+    Raises:
+
+        UploadError:
+            413 when the limit is exceeded; written bytes are kept.
+            413 при превышении лимита; записанные байты сохраняются.
+    """
+
+    size = path.stat().st_size if path.exists() else 0
+    async with aiofiles.open(path, "ab") as f:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if size + len(chunk) > limit:
+                raise UploadError(413, "Загрузка превышает заявленный размер")
+            hasher.update(chunk)
+            await f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+class _PartEvents:
+    """Collect python-multipart callbacks as a list of events.
+
+    Собирает колбэки python-multipart в список событий.
+    """
+
+    def __init__(self):
+        self.events: List[Tuple[str, Any]] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._field = b""
+        self._value = b""
+
+    def callbacks(self) -> Dict[str, Callable]:
+        """Return the callback mapping for ``MultipartParser``.
+
+        Возвращает словарь колбэков для ``MultipartParser``.
+        """
+
+        def on_part_begin() -> None:
+            self._headers = {}
+
+        def on_header_field(data: bytes, start: int, end: int) -> None:
+            self._field += data[start:end]
+
+        def on_header_value(data: bytes, start: int, end: int) -> None:
+            self._value += data[start:end]
+
+        def on_header_end() -> None:
+            self._headers[self._field.lower()] = self._value
+            self._field = self._value = b""
+
+        def on_headers_finished() -> None:
+            self.events.append(("headers", self._headers))
+
+        def on_part_data(data: bytes, start: int, end: int) -> None:
+            self.events.append(("data", data[start:end]))
+
+        def on_part_end() -> None:
+            self.events.append(("end", None))
+
+        return {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        }
+
+    def drain(self) -> List[Tuple[str, Any]]:
+        """Return and clear pending events.
+
+        Возвращает и очищает накопленные события.
+        """
+
+        events, self.events = self.events, []
+        return events
+
+
+async def receive_multipart(
+        request: Any, staging_dir: Path, limit: int,
+        suffixes: Optional[Iterable[str]] = None,
+        before_file: Optional[Callable[[Dict[str, str]], None]] = None,
+) -> Tuple[Dict[str, str], Optional[StreamedFile]]:
+    """Stream a ``multipart/form-data`` body, writing its file part straight to disk.
+
+    Читает тело ``multipart/form-data`` потоком, записывая файловую часть сразу на
+    диск.
+
+    Pipeline:
+
+        1. Feed request chunks to ``MultipartParser`` without spooling.
+           Передаём части запроса в ``MultipartParser`` без буферизации.
+
+        2. Validate the file name and fields as soon as the file part starts.
+           Проверяем имя файла и поля сразу при начале файловой части.
+
+        3. Write file bytes to ``<staging_dir>/<uuid>.part`` and hash them.
+           Пишем байты файла в ``<staging_dir>/<uuid>.part`` и хешируем их.
+
+    Args:
+
+        request (starlette.requests.Request):
+            Incoming request.
+            Входящий запрос.
+
+        staging_dir (Path):
+            Directory on the same filesystem as the final location.
+            Каталог на той же файловой системе, что и конечное место.
+
+        limit (int):
+            Maximum file size in bytes.
+            Максимальный размер файла в байтах.
+
+        suffixes (Optional[Iterable[str]]):
+            Allowed lower-case file extensions.
+            Разрешённые расширения файла в нижнем регистре.
+
+        before_file (Optional[Callable[[Dict[str, str]], None]]):
+            Called with the fields seen so far before the file is written.
+            Вызывается с уже полученными полями перед записью файла.
+
+    Returns:
+
+        Tuple[Dict[str, str], Optional[StreamedFile]]:
+            Text fields and the first file part, if any.
+            Текстовые поля и первая файловая часть, если она есть.
+
+    Raises:
+
+        UploadError:
+            400/413 on malformed bodies, bad extensions or size limits.
+            400/413 при некорректном теле, расширении или лимите размера.
+    """
+
+    # Step 1: Parser setup
+    # Шаг 1: Настройка парсера
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise UploadError(400, "Ожидается multipart/form-data")
+    sink = _PartEvents()
+    parser = MultipartParser(boundary, sink.callbacks())
+
+    fields: Dict[str, str] = {}
+    streamed: Optional[StreamedFile] = None
+    out = None
+    hasher = None
+    name: Optional[str] = None
+    value = bytearray()
+    part_path = Path(staging_dir) / f"{uuid.uuid4().hex}.part"
+    size = 0
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, payload in sink.drain():
+                if kind == "headers":
+                    # Step 2: New part; open the file only for the first file part
+                    # Шаг 2: Новая часть; файл открываем только для первой
+                    _, disp = parse_options_header(
+                        payload.get(b"content-disposition", b"")
+                    )
+                    name = disp.get(b"name", b"").decode(errors="ignore")
+                    filename = disp.get(b"filename")
+                    value = bytearray()
+                    if filename is not None and streamed is None and out is None:
+                        fname = Path(filename.decode(errors="ignore")).name
+                        suffix = Path(fname).suffix.lower()
+                        if suffixes is not None and suffix not in suffixes:
+                            allowed = " и ".join(sorted(suffixes))
+                            raise UploadError(
+                                400, f"Поддерживаются только файлы {allowed}"
+                            )
+                        if before_file is not None:
+                            before_file(fields)
+                        Path(staging_dir).mkdir(parents=True, exist_ok=True)
+                        out = await aiofiles.open(part_path, "wb")
+                        hasher = hashlib.sha256()
+                        streamed = StreamedFile(part_path, fname, 0, "")
+                    elif filename is not None:
+                        name = None  # ignore extra files, лишние файлы игнорируем
+                elif kind == "data":
+                    # Step 3: File bytes go to disk, field bytes to memory
+                    # Шаг 3: Байты файла — на диск, байты поля — в память
+                    if out is not None:
+                        size += len(payload)
+                        if size > limit:
+                            raise _too_large(limit)
+                        hasher.update(payload)
+                        await out.write(payload)
+                    elif name:
+                        value.extend(payload)
+                        if len(value) > MAX_FIELD_BYTES:
+                            raise UploadError(413, "Поле формы слишком большое")
+                elif kind == "end":
+                    if out is not None:
+                        await out.close()
+                        out = None
+                        streamed.size = size
+                        streamed.sha256 = hasher.hexdigest()
+                    elif name:
+                        fields[name] = value.decode("utf-8", errors="replace")
+                    name = None
+        parser.finalize()
+    except BaseException:
+        if out is not None:
+            await out.close()
+        part_path.unlink(missing_ok=True)
+        raise
+    if out is not None:
+        # Body ended inside the file part, тело оборвалось внутри файла
+        await out.close()
+        part_path.unlink(missing_ok=True)
+        raise UploadError(400, "Неполное тело запроса")
+    return fields, streamed
+
+
+class ResumableStore:
+    """Manifests and ``.part`` files of resumable uploads under one directory.
+
+    Манифесты и файлы ``.part`` возобновляемых загрузок в одном каталоге.
+
+    The offset of an upload is always the size of its ``.part`` file, so it
+    survives restarts; the in-memory hash state is rebuilt from disk if lost.
+
+    Смещение загрузки всегда равно размеру её файла ``.part``, поэтому оно
+    переживает перезапуск; состояние хеша в памяти при потере восстанавливается
+    с диска.
+    """
+
+    def __init__(self, root: Path, ttl_seconds: float):
+        """Bind the store to a directory.
+
+        Привязывает хранилище к каталогу.
+
+        Args:
+
+            root (Path):
+                Directory for manifests and partial files.
+                Каталог для манифестов и частичных файлов.
+
+            ttl_seconds (float):
+                Idle time after which unfinished uploads are removed.
+                Время простоя, после которого незавершённые загрузки удаляются.
+        """
+
+        self.root = Path(root)
+        self.ttl_seconds = ttl_seconds
+        # upload id -> (offset, sha256 state) for the bytes seen by this process
+        self._hashers: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+        # Ids written by a request of this process right now,
+        # id, в которые сейчас пишет запрос этого процесса
+        self._busy: set = set()
+        self._busy_guard = threading.Lock()
+
+    def part_path(self, upload_id: str) -> Path:
+        """Return the partial data file of an upload.
+
+        Возвращает частичный файл данных загрузки.
+        """
+
+        return self.root / f"{upload_id}.part"
+
+    def _manifest_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.json"
+
+    def create(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Register a new upload and return its manifest.
+
+        Регистрирует новую загрузку и возвращает её манифест.
+
+        Args:
+
+            meta (Dict[str, Any]):
+                Kind, file name, declared length and target fields.
+                Тип, имя файла, заявленная длина и поля назначения.
+
+        Returns:
+
+            Dict[str, Any]:
+                Manifest including the generated ``uploadId``.
+                Манифест со сгенерированным ``uploadId``.
+        """
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.cleanup()
+        upload_id = uuid.uuid4().hex
+        manifest = dict(meta, uploadId=upload_id, createdAt=time.time())
+        self.part_path(upload_id).touch()
+        self._write(upload_id, manifest)
+        self._hashers[upload_id] = (0, hashlib.sha256())
+        return manifest
+
+    def load(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Read a manifest, or ``None`` for unknown ids.
+
+        Читает манифест или возвращает ``None`` для неизвестных id.
+        """
+
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self._manifest_path(upload_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def offset(self, upload_id: str) -> int:
+        """Return the number of bytes received so far.
+
+        Возвращает количество уже полученных байт.
+        """
+
+        path = self.part_path(upload_id)
+        return path.stat().st_size if path.exists() else 0
+
+    @contextmanager
+    def lock(self, upload_id: str) -> Iterator[None]:
+        """Hold an upload exclusively across threads and worker processes.
+
+        Удерживает загрузку монопольно между потоками и процессами воркеров.
+
+        The lock is ``flock`` on the ``.part`` file and is never waited for:
+        a second writer of the same upload is refused at once.
+        Блокировка — ``flock`` на файл ``.part``, её никогда не ждут: второй
+        писатель той же загрузки сразу получает отказ.
+
+        Raises:
+
+            UploadError:
+                409 when another request is writing this upload, 404 when its
+                data file is gone.
+                409, если в эту загрузку пишет другой запрос, 404, если её
+                файла данных больше нет.
+        """
+
+        busy = UploadError(409, "Загрузка уже принимает другую часть")
+        with self._busy_guard:
+            if upload_id in self._busy:
+                raise busy
+            self._busy.add(upload_id)
+        part = None
+        try:
+            if fcntl is not None:
+                try:
+                    part = open(self.part_path(upload_id), "rb")
+                except FileNotFoundError:
+                    raise UploadError(404, "Загрузка не найдена") from None
+                try:
+                    fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise busy from None
+            yield
+        finally:
+            if part is not None:
+                part.close()
+            with self._busy_guard:
+                self._busy.discard(upload_id)
+
+    def hasher(self, upload_id: str) -> "hashlib._Hash":
+        """Return a SHA-256 state matching the current offset.
+
+        Возвращает состояние SHA-256, соответствующее текущему смещению.
+
+        Rebuilding the state reads the whole ``.part`` file, so call it from a
+        worker thread.
+        Восстановление состояния читает весь файл ``.part``, поэтому вызывайте
+        из рабочего потока.
+        """
+
+        offset = self.offset(upload_id)
+        cached = self._hashers.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        return rehash(self.part_path(upload_id))
+
+    def remember(self, upload_id: str, offset: int, hasher: "hashlib._Hash") -> None:
+        """Keep the hash state for the next chunk of this upload.
+
+        Сохраняет состояние хеша для следующей части этой загрузки.
+        """
+
+        self._hashers[upload_id] = (offset, hasher)
+
+    def finish(self, upload_id: str) -> None:
+        """Forget a completed upload and remove its leftovers.
+
+        Забывает завершённую загрузку и удаляет её остатки.
+        """
+
+        self._hashers.pop(upload_id, None)
+        self._manifest_path(upload_id).unlink(missing_ok=True)
+        self.part_path(upload_id).unlink(missing_ok=True)
+
+    def _write(self, upload_id: str, manifest: Dict[str, Any]) -> None:
+        tmp = self._manifest_path(upload_id).with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, self._manifest_path(upload_id))
+
+    def cleanup(self) -> None:
+        """Remove uploads idle for longer than the TTL.
+
+        Удаляет загрузки, простаивающие дольше TTL.
+        """
+
+        cutoff = time.time() - self.ttl_seconds
+        for path in self.root.glob("*.json"):
+            part = path.with_suffix(".part")
+            try:
+                last = max(path.stat().st_mtime,
+                           part.stat().st_mtime if part.exists() else 0)
+            except OSError:
+                continue
+            if last < cutoff:
+                path.unlink(missing_ok=True)
+                part.unlink(missing_ok=True)
+                self._hashers.pop(path.stem, None)